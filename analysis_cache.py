@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+影像分析結果快取
+以影像位元組的雜湊值為鍵，結合記憶體 LRU 與 SQLite 磁碟快取
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = '.analysis_cache.sqlite3'
+
+class AnalysisCache:
+    """兩層式 (記憶體 + 磁碟) 影像分析結果快取"""
+
+    def __init__(self, path: Optional[str] = DEFAULT_CACHE_PATH, ttl: float = 7 * 24 * 3600,
+                 memory_entries: int = 256, disk_entries: int = 50000):
+        """
+        初始化快取
+
+        Args:
+            path: SQLite 快取檔案路徑 (None 表示只使用記憶體快取)
+            ttl: 快取有效秒數 (0 表示永不過期)
+            memory_entries: 記憶體快取的最大項目數
+            disk_entries: 磁碟快取的最大項目數
+        """
+        self.path = path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+        # 統計資訊
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS analysis_cache ('
+                'key TEXT PRIMARY KEY, created_at REAL NOT NULL, '
+                'accessed_at REAL NOT NULL, payload BLOB NOT NULL)'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_analysis_cache_accessed ON analysis_cache (accessed_at)'
+            )
+            self._conn.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional['AnalysisCache']:
+        """根據 ANALYSIS_CACHE_PATH 環境變數建立快取，未設定時回傳 None"""
+        path = os.getenv('ANALYSIS_CACHE_PATH')
+        if not path:
+            return None
+        return cls(
+            path=path,
+            ttl=float(os.getenv('ANALYSIS_CACHE_TTL', 7 * 24 * 3600)),
+            disk_entries=int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', 50000))
+        )
+
+    @staticmethod
+    def make_key(image_data: bytes, params: Optional[Dict] = None) -> str:
+        """
+        產生快取鍵
+
+        Args:
+            image_data: 影像位元組資料
+            params: API 分析參數 (不同參數的結果分開快取)
+
+        Returns:
+            快取鍵
+        """
+        digest = hashlib.sha256(image_data).hexdigest()
+        if not params:
+            return digest
+        namespace = '&'.join(f"{k}={v}" for k, v in sorted(params.items()))
+        return f"{namespace}:{digest}"
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        讀取快取
+
+        Args:
+            key: 快取鍵
+
+        Returns:
+            快取的分析結果，找不到或已過期時回傳 None
+        """
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    'SELECT created_at, payload FROM analysis_cache WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None:
+                    created_at, payload = row
+                    if not self._expired(created_at, now):
+                        try:
+                            value = json.loads(zlib.decompress(payload).decode('utf-8'))
+                        except (zlib.error, ValueError) as e:
+                            logger.warning(f"快取項目損毀，已忽略: {e}")
+                        else:
+                            self._conn.execute(
+                                'UPDATE analysis_cache SET accessed_at = ? WHERE key = ?', (now, key)
+                            )
+                            self._conn.commit()
+                            self._remember(key, created_at, value)
+                            self.disk_hits += 1
+                            return value
+                    self._conn.execute('DELETE FROM analysis_cache WHERE key = ?', (key,))
+                    self._conn.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Dict):
+        """
+        寫入快取
+
+        Args:
+            key: 快取鍵
+            value: 可序列化為 JSON 的分析結果
+        """
+        now = time.time()
+
+        with self._lock:
+            self._remember(key, now, value)
+
+            if self._conn is not None:
+                payload = zlib.compress(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO analysis_cache (key, created_at, accessed_at, payload) '
+                    'VALUES (?, ?, ?, ?)', (key, now, now, payload)
+                )
+                self._evict_disk()
+                self._conn.commit()
+
+    def _remember(self, key: str, created_at: float, value: Dict):
+        """放入記憶體 LRU，超過上限時淘汰最久未使用的項目"""
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _evict_disk(self):
+        """磁碟快取超過上限時淘汰最久未使用的項目"""
+        count = self._conn.execute('SELECT COUNT(*) FROM analysis_cache').fetchone()[0]
+        overflow = count - self.disk_entries
+        if overflow > 0:
+            self._conn.execute(
+                'DELETE FROM analysis_cache WHERE key IN ('
+                'SELECT key FROM analysis_cache ORDER BY accessed_at ASC, rowid ASC LIMIT ?)', (overflow,)
+            )
+            self.evictions += overflow
+
+    def purge_expired(self) -> int:
+        """
+        清除所有過期項目
+
+        Returns:
+            清除的磁碟項目數
+        """
+        if self.ttl <= 0:
+            return 0
+
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for key in [k for k, (created_at, _) in self._memory.items() if created_at < cutoff]:
+                del self._memory[key]
+
+            if self._conn is None:
+                return 0
+            cursor = self._conn.execute('DELETE FROM analysis_cache WHERE created_at < ?', (cutoff,))
+            self._conn.commit()
+            return cursor.rowcount
+
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute('DELETE FROM analysis_cache')
+                self._conn.commit()
+
+    def get_statistics(self) -> Dict:
+        """獲取快取統計資訊"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            'memory_entries': len(self._memory)
+        }
+
+    def close(self):
+        """關閉磁碟快取"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -16,6 +16,8 @@ import plotly.express as px
 
 # 導入自定義模組
 from food_recognition import FoodRecognition
+from analysis_cache import AnalysisCache
+from image_preprocess import download_image
 
 # 設定頁面配置
 st.set_page_config(
@@ -77,6 +79,11 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource
+def get_analysis_cache():
+    """所有工作階段共用同一個分析結果快取"""
+    return AnalysisCache()
+
 def main():
     """主應用程式函數"""
     
@@ -156,7 +163,7 @@ def main():
     if analyze_button and (uploaded_file or image_url):
         try:
             # 初始化食物辨識器
-            food_recognizer = FoodRecognition()
+            food_recognizer = FoodRecognition(cache=get_analysis_cache())
             
             # 處理影像
             if uploaded_file:
@@ -168,15 +175,12 @@ def main():
                 st.image(uploaded_file, caption="上傳的影像", use_column_width=True)
                 
             elif image_url:
-                # 從URL處理
-                import requests
-                response = requests.get(image_url)
-                response.raise_for_status()
-                image_data = response.content
+                # 從URL處理 (串流下載並限制大小)
+                image_data = download_image(image_url)
                 result = food_recognizer.analyze_image_from_bytes(image_data)
                 
-                # 顯示URL影像
-                st.image(image_url, caption="URL影像", use_column_width=True)
+                # 顯示URL影像 (使用已下載的資料，不重複下載)
+                st.image(image_data, caption="URL影像", use_column_width=True)
             
             # 顯示分析結果
             display_analysis_results(result, analysis_type, confidence_threshold)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+ASP.NET WebForms 分頁工作階段
+每次 POST 回應都帶有新的 __VIEWSTATE / __EVENTVALIDATION，直接沿用到下一頁的請求，
+主頁面每個工作階段只下載一次 (原本每頁都要先 GET 主頁面，請求數加倍)；
+隱藏欄位以正規表示式擷取，不需要完整解析整個頁面，伺服器拒絕舊狀態時自動重新開始；
+主頁面不使用快取，快取的 postback 回應只取內容，不沿用其中的狀態
+"""
+
+import re
+import html
+from dataclasses import replace
+from typing import Dict, Optional, Tuple
+import logging
+
+import requests
+
+from rate_limiter import RateLimitedAdapter
+
+logger = logging.getLogger(__name__)
+
+# 每次 postback 都要送回的隱藏欄位
+STATE_FIELDS = ('__VIEWSTATE', '__VIEWSTATEGENERATOR', '__EVENTVALIDATION')
+
+_INPUT_PATTERN = re.compile(r'<input\b[^>]*>', re.IGNORECASE)
+_ATTRIBUTE_PATTERN = re.compile(r'''(?<![\w-])(name|value)\s*=\s*(?:"([^"]*)"|'([^']*)')''', re.IGNORECASE)
+
+def extract_hidden_fields(page: str) -> Dict[str, str]:
+    """
+    擷取頁面中的 ASP.NET 狀態欄位
+
+    Args:
+        page: HTML 內容
+
+    Returns:
+        {欄位名稱: 值}，只包含 STATE_FIELDS 中存在的欄位
+    """
+    fields = {}
+    for tag in _INPUT_PATTERN.findall(page):
+        if '__' not in tag:
+            continue
+        attributes = {}
+        for match in _ATTRIBUTE_PATTERN.finditer(tag):
+            double, single = match.group(2), match.group(3)
+            attributes[match.group(1).lower()] = double if double is not None else single
+        name = attributes.get('name')
+        if name in STATE_FIELDS:
+            fields[name] = html.unescape(attributes.get('value') or '')
+    return fields
+
+class StateExpiredError(Exception):
+    """伺服器不接受目前的頁面狀態"""
+    pass
+
+class AspNetPager:
+    """沿用 postback 回應狀態的 ASP.NET 分頁工作階段"""
+
+    def __init__(self, session: requests.Session, url: str, params: Optional[Dict] = None,
+                 search_button: Tuple[str, str] = ('ctl00$ContentPlaceHolder1$Button1', '查詢'),
+                 grid_target: str = 'ctl00$ContentPlaceHolder1$GridView1', timeout: Optional[float] = None):
+        """
+        初始化分頁工作階段
+
+        Args:
+            session: 已設定標頭、快取與速率限制的 requests.Session (快取與速率限制須在建立前掛載)
+            url: 表單網址
+            params: 網址參數 (例如 {'nodeID': '178'})
+            search_button: 查詢按鈕的 (欄位名稱, 值)
+            grid_target: 分頁事件的 __EVENTTARGET (GridView 的 UniqueID)
+            timeout: 請求逾時秒數
+        """
+        self.session = session
+        self.url = url
+        self.params = params or {}
+        self.search_button = search_button
+        self.grid_target = grid_target
+        self.timeout = timeout
+
+        self._state: Optional[Dict[str, str]] = None
+        self._query: Optional[Tuple] = None  # 目前狀態對應的查詢條件
+        self._fresh = False  # 重新開始時所有請求都不使用快取
+        self._disable_server_error_retries()
+
+        # 統計資訊
+        self.requests = 0
+        self.recoveries = 0
+
+    def _disable_server_error_retries(self):
+        """
+        表單網址改用不重試 5xx 的配接器
+
+        ViewState 驗證失敗時 ASP.NET 回傳 500，重送同一份狀態不會成功，
+        直接交給 fetch_page 重新取得狀態 (429 仍依原本的策略重試)。
+        """
+        adapter = self.session.get_adapter(self.url)
+        if not isinstance(adapter, RateLimitedAdapter):
+            return
+        statuses = tuple(status for status in adapter.policy.retry_statuses if status < 500)
+        if statuses != adapter.policy.retry_statuses:
+            self.session.mount(self.url, adapter.with_policy(replace(adapter.policy, retry_statuses=statuses)))
+
+    def reset(self):
+        """捨棄目前的狀態 (下一次請求重新下載主頁面)"""
+        self._state = None
+        self._query = None
+
+    def _send(self, method: str, data: Optional[Dict] = None, fresh: bool = False) -> requests.Response:
+        self.requests += 1
+        # 快取中的頁面帶的是舊的狀態
+        headers = {'Cache-Control': 'no-store'} if fresh else None
+        response = self.session.request(method, self.url, params=self.params, data=data,
+                                        headers=headers, timeout=self.timeout)
+        if response.status_code >= 500:
+            # ViewState 驗證失敗時 ASP.NET 回傳 500
+            raise StateExpiredError(f"伺服器回應 {response.status_code}")
+        response.raise_for_status()
+        response.encoding = 'utf-8'
+        return response
+
+    def _postback(self, fields: Dict[str, str]) -> str:
+        """送出 postback 並保存回應中的新狀態"""
+        response = self._send('POST', {**self._state, **fields}, self._fresh)
+        page = response.text
+        state = extract_hidden_fields(page)
+        if '__VIEWSTATE' not in state:
+            raise StateExpiredError("回應中沒有 __VIEWSTATE")
+        if not getattr(response, 'from_cache', False):
+            # 快取的回應不是這個工作階段發出的，沿用原本的狀態
+            self._state = state
+        return page
+
+    def _fetch(self, page: int, query: Dict[str, str]) -> str:
+        if self._state is None:
+            self._state = extract_hidden_fields(self._send('GET', fresh=True).text)
+            self._query = None
+
+        key = tuple(sorted(query.items()))
+        events = {'__EVENTTARGET': '', '__EVENTARGUMENT': ''}
+        if self._query != key:
+            # 查詢條件改變 (或剛開始)，先送出查詢取得第 1 頁
+            name, value = self.search_button
+            result = self._postback({**events, **query, name: value})
+            self._query = key
+            if page == 1:
+                return result
+
+        events = {'__EVENTTARGET': self.grid_target, '__EVENTARGUMENT': f'Page${page}'}
+        return self._postback({**events, **query})
+
+    def fetch_page(self, page: int, query: Optional[Dict[str, str]] = None) -> str:
+        """
+        取得查詢結果的某一頁
+
+        第一次呼叫下載主頁面並送出查詢，之後每一頁只需一次 postback；
+        伺服器不接受狀態時重新下載主頁面再試一次 (這次不使用快取)。
+
+        Args:
+            page: 頁數 (從 1 開始)
+            query: 查詢表單欄位
+
+        Returns:
+            結果頁面的 HTML
+        """
+        query = query or {}
+        try:
+            return self._fetch(page, query)
+        except StateExpiredError as e:
+            logger.warning(f"頁面狀態失效，重新下載主頁面: {e}")
+            self.recoveries += 1
+            self.reset()
+            self._fresh = True
+            try:
+                return self._fetch(page, query)
+            finally:
+                self._fresh = False
+
+    def get_statistics(self) -> Dict:
+        """獲取統計資訊"""
+        return {
+            'requests': self.requests,
+            'recoveries': self.recoveries
+        }
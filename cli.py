@@ -4,10 +4,18 @@ Azure AI 食物影像辨識 - 命令列版本
 """
 
 import argparse
+import glob
 import json
+import math
+import os
 import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from food_recognition import FoodRecognition
+from analysis_cache import AnalysisCache, DEFAULT_CACHE_PATH
+from crawl_checkpoint import open_jsonl_append
 
 def main():
     """主命令列函數"""
@@ -20,12 +28,15 @@ def main():
   python cli.py image.jpg --detailed         # 詳細分析
   python cli.py image.jpg --output result.json  # 輸出到JSON檔案
   python cli.py image.jpg --confidence 0.8   # 設定信心度閾值
+  python cli.py image.jpg --no-cache         # 不使用分析結果快取
+  python cli.py photos/ --batch --jsonl out.jsonl --workers 16  # 批次分析目錄
+  python cli.py "photos/*.jpg" --batch --jsonl out.jsonl       # 批次分析符合的檔案
         """
     )
     
     parser.add_argument(
         'image_path',
-        help='影像檔案路徑'
+        help='影像檔案路徑 (批次模式下為目錄或萬用字元)'
     )
     
     parser.add_argument(
@@ -53,8 +64,43 @@ def main():
         help='輸出格式 (預設: text)'
     )
     
+    parser.add_argument(
+        '--cache-path',
+        default=DEFAULT_CACHE_PATH,
+        help=f'分析結果快取檔案 (預設: {DEFAULT_CACHE_PATH})'
+    )
+    
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='不使用分析結果快取'
+    )
+    
+    parser.add_argument(
+        '--batch',
+        action='store_true',
+        help='批次模式：分析目錄或萬用字元符合的所有影像'
+    )
+    
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=8,
+        help='批次模式的同時分析數量 (預設: 8)'
+    )
+    
+    parser.add_argument(
+        '--jsonl',
+        default='batch_results.jsonl',
+        help='批次模式的輸出檔案，每張影像一行 JSON，已完成的影像會在重新執行時略過 (預設: batch_results.jsonl)'
+    )
+    
     args = parser.parse_args()
     
+    if args.batch:
+        run_batch(args)
+        return
+    
     # 檢查檔案是否存在
     if not Path(args.image_path).exists():
         print(f"❌ 錯誤：找不到影像檔案 '{args.image_path}'")
@@ -63,7 +109,8 @@ def main():
     try:
         # 初始化食物辨識器
         print("🔍 初始化 Azure AI 食物辨識器...")
-        food_recognizer = FoodRecognition()
+        cache = None if args.no_cache else AnalysisCache(args.cache_path)
+        food_recognizer = FoodRecognition(cache=cache)
         
         # 分析影像
         print(f"📸 分析影像: {args.image_path}")
@@ -87,6 +134,127 @@ def main():
         print(f"❌ 錯誤：{str(e)}")
         sys.exit(1)
 
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp'}
+
+def collect_images(pattern):
+    """收集目錄或萬用字元符合的影像檔案"""
+    if os.path.isdir(pattern):
+        paths = [str(path) for path in Path(pattern).rglob('*') if path.suffix.lower() in IMAGE_EXTENSIONS]
+    else:
+        paths = [path for path in glob.glob(pattern, recursive=True) if Path(path).suffix.lower() in IMAGE_EXTENSIONS]
+    return sorted(paths)
+
+def load_completed(jsonl_path):
+    """讀取輸出檔案中已成功分析的影像路徑"""
+    completed = set()
+    if not os.path.exists(jsonl_path):
+        return completed
+    
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 中斷時可能留下不完整的最後一行
+                continue
+            if 'error' not in record:
+                completed.add(record.get('image_path'))
+    
+    return completed
+
+def percentile(values, pct):
+    """計算百分位數 (最近排名法)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+def run_batch(args):
+    """批次分析影像並以 JSONL 格式逐筆輸出"""
+    images = collect_images(args.image_path)
+    if not images:
+        print(f"❌ 錯誤：找不到符合的影像 '{args.image_path}'")
+        sys.exit(1)
+    
+    completed = load_completed(args.jsonl)
+    pending = [path for path in images if path not in completed]
+    print(f"📂 共 {len(images)} 張影像，已完成 {len(images) - len(pending)} 張，待分析 {len(pending)} 張")
+    if not pending:
+        return
+    
+    try:
+        print("🔍 初始化 Azure AI 食物辨識器...")
+        cache = None if args.no_cache else AnalysisCache(args.cache_path)
+        food_recognizer = FoodRecognition(cache=cache)
+    except Exception as e:
+        print(f"❌ 錯誤：{str(e)}")
+        sys.exit(1)
+    
+    def analyze(image_path):
+        start = time.perf_counter()
+        try:
+            if args.detailed:
+                result = food_recognizer.get_detailed_analysis(image_path)
+            else:
+                result = food_recognizer.analyze_image(image_path)
+            record = {'image_path': image_path, 'result': result}
+        except Exception as e:
+            record = {'image_path': image_path, 'error': str(e)}
+        record['latency_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return record
+    
+    latencies = []
+    failures = 0
+    write_lock = threading.Lock()
+    batch_start = time.perf_counter()
+    
+    # 截斷中斷時寫到一半的最後一行，避免新的記錄接在後面
+    with open_jsonl_append(args.jsonl) as output, \
+            ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = [executor.submit(analyze, image_path) for image_path in pending]
+        
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                with write_lock:
+                    output.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    output.flush()
+                
+                if 'error' in record:
+                    failures += 1
+                    print(f"  ❌ [{done}/{len(pending)}] {record['image_path']}: {record['error']}")
+                else:
+                    latencies.append(record['latency_ms'])
+                    print(f"  ✅ [{done}/{len(pending)}] {record['image_path']} ({record['latency_ms']:.0f} ms)")
+        except KeyboardInterrupt:
+            print("\n⏹️ 批次分析被使用者中斷，重新執行相同指令即可繼續")
+            for future in futures:
+                future.cancel()
+            raise
+    
+    elapsed = time.perf_counter() - batch_start
+    processed = len(latencies) + failures
+    
+    print("\n" + "="*50)
+    print("📊 批次分析統計")
+    print("="*50)
+    print(f"  成功: {len(latencies)}  失敗: {failures}")
+    print(f"  總耗時: {elapsed:.1f} 秒")
+    print(f"  吞吐量: {processed / elapsed if elapsed > 0 else 0:.2f} 張/秒")
+    print(f"  延遲 p50: {percentile(latencies, 50):.0f} ms")
+    print(f"  延遲 p90: {percentile(latencies, 90):.0f} ms")
+    print(f"  延遲 p99: {percentile(latencies, 99):.0f} ms")
+    print(f"💾 結果已寫入: {args.jsonl}")
+    
+    if cache is not None:
+        stats = cache.get_statistics()
+        print(f"  快取命中率: {stats['hit_rate']*100:.1f}%")
+    
+    flight_stats = food_recognizer.single_flight.get_statistics()
+    if flight_stats['coalesced']:
+        print(f"  合併的相同請求: {flight_stats['coalesced']}")
+
 def display_text_result(result, confidence_threshold, detailed=False):
     """以文字格式顯示結果"""
     
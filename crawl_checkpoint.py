@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+可中斷續傳的抓取進度
+抓取結果逐筆附加到 JSONL 檔案，進度 (最後完成的頁數與已完成的項目編號) 以原子替換寫入檢查點檔案；
+中斷後重新執行時從檢查點繼續，已寫入的資料不會遺失也不會重複
+"""
+
+import os
+import json
+import tempfile
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, Set, TextIO
+import logging
+
+logger = logging.getLogger(__name__)
+
+def iter_jsonl(path: str) -> Iterator[Dict]:
+    """
+    逐筆讀取 JSONL 檔案 (略過中斷時寫到一半的最後一行)
+
+    Args:
+        path: JSONL 檔案路徑，不存在時不產生任何資料
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logger.warning(f"略過不完整的資料行 ({path})")
+
+def open_jsonl_append(path: str) -> TextIO:
+    """
+    以附加模式開啟 JSONL 檔案
+
+    上次中斷時最後一行可能只寫了一半，先截斷到最後一個換行，避免與新資料接在同一行。
+    """
+    if os.path.exists(path):
+        with open(path, 'rb+') as f:
+            # 由檔尾往前找最後一個換行 (不讀入整個檔案)
+            end = f.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - 65536)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b'\n')
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            f.truncate(end)
+    return open(path, 'a', encoding='utf-8')
+
+def append_jsonl(f: TextIO, record: Dict):
+    """寫入一筆資料並立即寫到磁碟"""
+    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    f.flush()
+
+class CrawlCheckpoint:
+    """抓取進度檢查點"""
+
+    def __init__(self, path: str, save_every: int = 20):
+        """
+        初始化檢查點 (檔案存在時讀取上次的進度)
+
+        Args:
+            path: 檢查點檔案路徑
+            save_every: 每完成幾個項目寫入一次 (頁面完成時一定寫入)
+        """
+        self.path = path
+        self.save_every = max(1, save_every)
+        self.last_page = 0
+        self.done: Set[str] = set()
+        self._unsaved = 0
+
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                self.last_page = int(state.get('last_page', 0))
+                self.done = set(state.get('done', []))
+                logger.info(f"從檢查點繼續: 已完成 {self.last_page} 頁、{len(self.done)} 個項目")
+            except (OSError, ValueError) as e:
+                logger.warning(f"讀取檢查點失敗，重新開始 ({path}): {e}")
+
+    def restore_done(self, keys: Iterable[str]):
+        """加入已寫入資料檔但檢查點尚未記錄的項目 (上次在兩次寫入檢查點之間中斷)"""
+        self.done.update(keys)
+
+    def mark_page(self, page: int):
+        """記錄完成的頁數"""
+        self.last_page = page
+        self.save()
+
+    def mark_done(self, key: str):
+        """記錄完成的項目"""
+        self.done.add(key)
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    def save(self):
+        """以原子替換寫入檢查點 (寫到一半中斷時保留上一版)"""
+        state = {
+            'last_page': self.last_page,
+            'done': sorted(self.done),
+            'updated_at': datetime.now().isoformat()
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix='.checkpoint_', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self._unsaved = 0
+
+    def get_statistics(self) -> Dict:
+        """獲取統計資訊"""
+        return {
+            'last_page': self.last_page,
+            'done': len(self.done)
+        }
@@ -6,9 +6,9 @@
 
 import os
 import json
+import asyncio
 import requests
 import numpy as np
-import cv2
 from typing import List, Dict, Optional, Tuple
 from PIL import Image
 import io
@@ -16,6 +16,16 @@ import base64
 from dotenv import load_dotenv
 from datetime import datetime
 import logging
+from vision_transport import AsyncVisionTransport, TransportSettings, get_shared_transport, run_bounded
+from image_preprocess import PreprocessSettings, encode_frame, prepare_image_bytes
+from rate_limiter import TokenBucket
+from single_flight import shared_flight
+from analysis_cache import AnalysisCache
+from keyword_matcher import get_matcher
+from nutrition_registry import NutritionRegistry, get_registry
+from nutrition_reload import ReloadableDatabase
+from nutrition_batch import score_results
+from recommendation_engine import get_engine
 import re
 
 # 載入環境變數
@@ -25,6 +35,9 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 台灣特色食品關鍵字 (數量很少，直接子字串搜尋)
+TAIWAN_FOOD_KEYWORDS = ('米', '麵', '豆', '茶')
+
 class EnhancedFoodDetectionResult:
     """增強版食物偵測結果類別"""
     
@@ -42,11 +55,14 @@ class EnhancedFoodDetectionResult:
         self.error_message = ""
         self.fda_matches = []  # FDA資料庫匹配結果
         self.local_foods = []  # 本地食品匹配
+        self.fda_generation = 0  # 使用的FDA資料庫版本
 
 class EnhancedFoodDetector:
     """增強版食物偵測器類別"""
     
-    def __init__(self, fda_db_path: Optional[str] = None):
+    def __init__(self, fda_db_path: Optional[str] = None, transport_settings: Optional[TransportSettings] = None,
+                 preprocess_settings: Optional[PreprocessSettings] = None,
+                 rate_limiter: Optional[TokenBucket] = None):
         """初始化增強版食物偵測器"""
         self.endpoint = os.getenv('AZURE_VISION_ENDPOINT')
         self.key = os.getenv('AZURE_VISION_KEY')
@@ -57,57 +73,38 @@ class EnhancedFoodDetector:
         # 移除結尾的斜線
         self.endpoint = self.endpoint.rstrip('/')
         
-        # 載入FDA營養資料庫
-        self.fda_nutrition_db = {}
-        if fda_db_path and os.path.exists(fda_db_path):
-            self.load_fda_database(fda_db_path)
-        
-        # 本地營養資料庫 (原有)
-        self.local_nutrition_db = {
-            'apple': {'calories': 95, 'protein': 0.5, 'carbs': 25, 'fat': 0.3, 'fiber': 4, 'vitamins': ['C', 'K']},
-            'banana': {'calories': 105, 'protein': 1.3, 'carbs': 27, 'fat': 0.4, 'fiber': 3, 'vitamins': ['B6', 'C']},
-            'rice': {'calories': 130, 'protein': 2.7, 'carbs': 28, 'fat': 0.3, 'fiber': 0.4, 'vitamins': ['B1', 'B3']},
-            'chicken': {'calories': 165, 'protein': 31, 'carbs': 0, 'fat': 3.6, 'fiber': 0, 'vitamins': ['B6', 'B12']},
-            'salad': {'calories': 20, 'protein': 2, 'carbs': 4, 'fat': 0.2, 'fiber': 2, 'vitamins': ['A', 'C', 'K']},
-            'pizza': {'calories': 266, 'protein': 11, 'carbs': 33, 'fat': 10, 'fiber': 2, 'vitamins': ['B1', 'B2']},
-            'soup': {'calories': 50, 'protein': 3, 'carbs': 8, 'fat': 1, 'fiber': 2, 'vitamins': ['A', 'C']},
-            'bread': {'calories': 79, 'protein': 3, 'carbs': 15, 'fat': 1, 'fiber': 1, 'vitamins': ['B1', 'B2']},
-            'fish': {'calories': 100, 'protein': 20, 'carbs': 0, 'fat': 2, 'fiber': 0, 'vitamins': ['D', 'B12']},
-            'vegetable': {'calories': 25, 'protein': 2, 'carbs': 5, 'fat': 0.2, 'fiber': 3, 'vitamins': ['A', 'C']},
-            'beef': {'calories': 250, 'protein': 26, 'carbs': 0, 'fat': 15, 'fiber': 0, 'vitamins': ['B12', 'B6']},
-            'pork': {'calories': 242, 'protein': 27, 'carbs': 0, 'fat': 14, 'fiber': 0, 'vitamins': ['B1', 'B6']},
-            'shrimp': {'calories': 85, 'protein': 18, 'carbs': 0, 'fat': 1, 'fiber': 0, 'vitamins': ['B12', 'D']},
-            'salmon': {'calories': 208, 'protein': 25, 'carbs': 0, 'fat': 12, 'fiber': 0, 'vitamins': ['D', 'B12']},
-            'carrot': {'calories': 41, 'protein': 0.9, 'carbs': 10, 'fat': 0.2, 'fiber': 2.8, 'vitamins': ['A', 'K']},
-            'broccoli': {'calories': 34, 'protein': 2.8, 'carbs': 7, 'fat': 0.4, 'fiber': 2.6, 'vitamins': ['C', 'K']},
-            'tomato': {'calories': 22, 'protein': 1.1, 'carbs': 5, 'fat': 0.2, 'fiber': 1.2, 'vitamins': ['C', 'K']},
-            'lettuce': {'calories': 15, 'protein': 1.4, 'carbs': 3, 'fat': 0.1, 'fiber': 1.3, 'vitamins': ['A', 'K']},
-            'onion': {'calories': 40, 'protein': 1.1, 'carbs': 9, 'fat': 0.1, 'fiber': 1.7, 'vitamins': ['C', 'B6']},
-            'potato': {'calories': 77, 'protein': 2, 'carbs': 17, 'fat': 0.1, 'fiber': 2.2, 'vitamins': ['C', 'B6']},
-            'corn': {'calories': 86, 'protein': 3.2, 'carbs': 19, 'fat': 1.2, 'fiber': 2.7, 'vitamins': ['B1', 'B5']},
-            'egg': {'calories': 78, 'protein': 6.3, 'carbs': 0.6, 'fat': 5.3, 'fiber': 0, 'vitamins': ['D', 'B12']},
-            'cheese': {'calories': 113, 'protein': 7, 'carbs': 0.4, 'fat': 9, 'fiber': 0, 'vitamins': ['A', 'B12']},
-            'milk': {'calories': 42, 'protein': 3.4, 'carbs': 5, 'fat': 1, 'fiber': 0, 'vitamins': ['D', 'B12']},
-            'coffee': {'calories': 2, 'protein': 0.3, 'carbs': 0, 'fat': 0, 'fiber': 0, 'vitamins': ['B3']},
-            'tea': {'calories': 1, 'protein': 0, 'carbs': 0, 'fat': 0, 'fiber': 0, 'vitamins': ['C']},
-            'orange': {'calories': 62, 'protein': 1.2, 'carbs': 15, 'fat': 0.2, 'fiber': 3.1, 'vitamins': ['C', 'B9']},
-            'grape': {'calories': 62, 'protein': 0.6, 'carbs': 16, 'fat': 0.2, 'fiber': 0.9, 'vitamins': ['C', 'K']},
-            'strawberry': {'calories': 32, 'protein': 0.7, 'carbs': 8, 'fat': 0.3, 'fiber': 2, 'vitamins': ['C', 'B9']},
-            'watermelon': {'calories': 30, 'protein': 0.6, 'carbs': 8, 'fat': 0.2, 'fiber': 0.4, 'vitamins': ['A', 'C']},
-            'noodle': {'calories': 138, 'protein': 5, 'carbs': 25, 'fat': 2, 'fiber': 1, 'vitamins': ['B1', 'B2']},
-            'pasta': {'calories': 131, 'protein': 5, 'carbs': 25, 'fat': 1, 'fiber': 1, 'vitamins': ['B1', 'B2']},
-            'hamburger': {'calories': 295, 'protein': 12, 'carbs': 30, 'fat': 12, 'fiber': 2, 'vitamins': ['B12', 'B6']},
-            'sandwich': {'calories': 250, 'protein': 15, 'carbs': 30, 'fat': 8, 'fiber': 3, 'vitamins': ['B1', 'B2']},
-            'sushi': {'calories': 150, 'protein': 6, 'carbs': 30, 'fat': 0.5, 'fiber': 0.5, 'vitamins': ['B12', 'D']},
-            'ramen': {'calories': 200, 'protein': 8, 'carbs': 35, 'fat': 3, 'fiber': 2, 'vitamins': ['B1', 'B2']},
-            'curry': {'calories': 180, 'protein': 8, 'carbs': 25, 'fat': 6, 'fiber': 3, 'vitamins': ['A', 'C']},
-            'steak': {'calories': 271, 'protein': 26, 'carbs': 0, 'fat': 18, 'fiber': 0, 'vitamins': ['B12', 'B6']},
-            'seafood': {'calories': 100, 'protein': 20, 'carbs': 0, 'fat': 2, 'fiber': 0, 'vitamins': ['D', 'B12']},
-            'dessert': {'calories': 300, 'protein': 4, 'carbs': 45, 'fat': 12, 'fiber': 1, 'vitamins': ['A']},
-            'cake': {'calories': 257, 'protein': 3, 'carbs': 45, 'fat': 8, 'fiber': 1, 'vitamins': ['A']},
-            'ice cream': {'calories': 207, 'protein': 3.5, 'carbs': 24, 'fat': 11, 'fiber': 0, 'vitamins': ['A']},
-            'chocolate': {'calories': 546, 'protein': 4.9, 'carbs': 61, 'fat': 31, 'fiber': 7, 'vitamins': ['B2']}
-        }
+        # 共用的連線池傳輸層 (建立時預熱連線)
+        self.transport = get_shared_transport(self.endpoint, transport_settings)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else self.transport.rate_limiter
+        self.single_flight = shared_flight  # 相同影像同時只發送一個請求
+        self._async_transport = None
+        
+        # 上傳前影像前處理 (限制尺寸與檔案大小)
+        self.preprocess_settings = preprocess_settings or PreprocessSettings.from_env()
+        
+        # 定期檢查資料檔更新 (秒，0 表示不檢查)；指定檔案時監看該檔案，
+        # 指定資料夾 (或未指定) 時監看資料夾，抓取器每次輸出的新 fda_nutrition_db_<時間>.json 也會被載入
+        watch_interval = float(os.getenv('NUTRITION_DB_WATCH_INTERVAL', '0'))
+        db_source = fda_db_path
+        if watch_interval > 0 and not fda_db_path:
+            db_source = '.'
+        
+        # 載入FDA營養資料庫 (可在執行中重新載入；為資料夾時使用其中最新的資料檔)
+        self.fda_database = ReloadableDatabase(db_source)
+        initial_path = self.fda_database.resolve_path()
+        if initial_path and os.path.exists(initial_path):
+            self.load_fda_database(db_source)
+        
+        # 啟動時還沒有資料庫也開始監看，資料檔出現後自動載入
+        if watch_interval > 0:
+            self.fda_database.start_watching(watch_interval)
+        
+        # 本地營養資料庫 (行程共用，唯讀)
+        self.local_nutrition_db = get_registry()
+        
+        # 模糊匹配參數 (相似度門檻與候選數量)
+        self.fuzzy_min_score = float(os.getenv('FOOD_MATCH_MIN_SCORE', '0.3'))
+        self.fuzzy_top_k = 5
         
         # 食物關鍵字資料庫
         self.food_keywords = [
@@ -141,31 +138,53 @@ class EnhancedFoodDetector:
             '雞肉', '牛肉', '豬肉', '魚肉', '蝦仁', '鮭魚'
         ]
         
+        # 中英文關鍵字編譯成單一自動機 (相同關鍵字在行程中共用)
+        self.food_tag_matcher = get_matcher(
+            tuple((keyword, 'en') for keyword in self.food_keywords) +
+            tuple((keyword, 'zh') for keyword in self.chinese_food_keywords)
+        )
+        
         logger.info(f"增強版食物偵測器初始化完成，FDA資料庫包含 {len(self.fda_nutrition_db)} 種食品")
     
+    @property
+    def fda_nutrition_db(self) -> NutritionRegistry:
+        """目前版本的FDA營養資料庫"""
+        return self.fda_database.registry
+    
     def load_fda_database(self, db_path: str):
-        """載入FDA營養資料庫"""
+        """載入FDA營養資料庫並等待完成 (相同檔案在行程中只解析一次)"""
         try:
-            with open(db_path, 'r', encoding='utf-8') as f:
-                self.fda_nutrition_db = json.load(f)
+            # 載入時建立模糊搜尋索引 (與資料檔快取共用)
+            self.fda_database.reload(db_path).result()
             
             logger.info(f"成功載入FDA營養資料庫: {len(self.fda_nutrition_db)} 種食品")
             
         except Exception as e:
             logger.error(f"載入FDA資料庫失敗: {e}")
     
+    def reload_fda_database(self, db_path: Optional[str] = None):
+        """
+        在背景重新載入FDA營養資料庫，完成後才替換；偵測不會中斷
+        
+        Args:
+            db_path: 新的資料檔或目錄 (None 表示沿用目前的路徑)
+            
+        Returns:
+            完成時結果為新快照的 Future
+        """
+        return self.fda_database.reload(db_path)
+    
+    def get_database_status(self) -> Dict:
+        """FDA資料庫版本、重新載入耗時等資訊"""
+        return self.fda_database.get_statistics()
+    
     def detect_food_from_frame(self, frame: np.ndarray) -> EnhancedFoodDetectionResult:
         """從影像幀偵測食物"""
         result = EnhancedFoodDetectionResult()
         
         try:
-            # 將 numpy array 轉換為 bytes
-            success, buffer = cv2.imencode('.jpg', frame)
-            if not success:
-                result.error_message = "影像編碼失敗"
-                return result
-            
-            image_bytes = buffer.tobytes()
+            # 縮小影像幀並編碼成符合大小預算的 JPEG
+            image_bytes = encode_frame(frame, self.preprocess_settings)
             
             # 分析影像
             analysis_result = self._analyze_image_data(image_bytes)
@@ -180,8 +199,47 @@ class EnhancedFoodDetector:
         
         return result
     
-    def _analyze_image_data(self, image_data: bytes) -> Dict:
-        """使用 Azure Computer Vision API 分析影像資料"""
+    async def analyze_async(self, image_bytes: bytes) -> EnhancedFoodDetectionResult:
+        """從位元組資料偵測食物 (非同步)"""
+        result = EnhancedFoodDetectionResult()
+        
+        try:
+            image_bytes = await asyncio.to_thread(prepare_image_bytes, image_bytes, self.preprocess_settings)
+            analysis_result = await self._analyze_image_data_async(image_bytes)
+            
+            # FDA 資料庫比對與營養計算移到執行緒，不佔用事件迴圈
+            result = await asyncio.to_thread(self._process_analysis_result, analysis_result)
+            result.success = True
+            
+        except Exception as e:
+            result.error_message = str(e)
+            logger.error(f"食物偵測失敗: {e}")
+        
+        return result
+    
+    async def detect_food_from_frame_async(self, frame: np.ndarray) -> EnhancedFoodDetectionResult:
+        """從影像幀偵測食物 (非同步)"""
+        try:
+            image_bytes = await asyncio.to_thread(encode_frame, frame, self.preprocess_settings)
+        except Exception as e:
+            result = EnhancedFoodDetectionResult()
+            result.error_message = str(e)
+            return result
+        
+        return await self.analyze_async(image_bytes)
+    
+    async def analyze_many_async(self, images: List[bytes], concurrency: int = 8) -> List[EnhancedFoodDetectionResult]:
+        """同時偵測多張影像，結果順序與輸入相同"""
+        return await run_bounded(self.analyze_async, images, concurrency)
+    
+    def _get_async_transport(self) -> AsyncVisionTransport:
+        """取得非同步傳輸層"""
+        if self._async_transport is None:
+            self._async_transport = AsyncVisionTransport(self.endpoint, self.transport.settings, self.rate_limiter)
+        return self._async_transport
+    
+    def _build_analyze_request(self) -> Tuple[str, Dict, Dict]:
+        """建立 Azure Computer Vision 分析請求"""
         vision_url = f"{self.endpoint}/vision/v3.2/analyze"
         
         headers = {
@@ -195,16 +253,42 @@ class EnhancedFoodDetector:
             'model-version': 'latest'
         }
         
-        try:
-            response = requests.post(vision_url, headers=headers, params=params, data=image_data)
-            response.raise_for_status()
-            result = response.json()
-            return result
-            
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"API 請求失敗: {str(e)}")
-        except json.JSONDecodeError as e:
-            raise Exception(f"解析 API 回應失敗: {str(e)}")
+        return vision_url, headers, params
+    
+    def _analyze_image_data(self, image_data: bytes) -> Dict:
+        """使用 Azure Computer Vision API 分析影像資料"""
+        vision_url, headers, params = self._build_analyze_request()
+        
+        def fetch() -> Dict:
+            try:
+                response = self.transport.post(vision_url, headers=headers, params=params, data=image_data,
+                                               rate_limiter=self.rate_limiter)
+                response.raise_for_status()
+                return response.json()
+                
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"API 請求失敗: {str(e)}")
+            except json.JSONDecodeError as e:
+                raise Exception(f"解析 API 回應失敗: {str(e)}")
+        
+        return self.single_flight.do((self.endpoint, AnalysisCache.make_key(image_data, params)), fetch)
+    
+    async def _analyze_image_data_async(self, image_data: bytes) -> Dict:
+        """使用 Azure Computer Vision API 分析影像資料 (非同步)"""
+        vision_url, headers, params = self._build_analyze_request()
+        
+        async def fetch() -> Dict:
+            try:
+                response = await self._get_async_transport().post(vision_url, headers=headers, params=params, data=image_data)
+                response.raise_for_status()
+                return response.json()
+                
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"API 請求失敗: {str(e)}")
+            except json.JSONDecodeError as e:
+                raise Exception(f"解析 API 回應失敗: {str(e)}")
+        
+        return await self.single_flight.do_async((self.endpoint, AnalysisCache.make_key(image_data, params)), fetch)
     
     def _process_analysis_result(self, result: Dict) -> EnhancedFoodDetectionResult:
         """處理 Azure Computer Vision API 的分析結果"""
@@ -260,8 +344,10 @@ class EnhancedFoodDetector:
         # 移除重複項目
         detection_result.foods_detected = list(set(detection_result.foods_detected))
         
-        # 匹配FDA資料庫
-        detection_result.fda_matches = self._match_fda_database(detection_result.foods_detected)
+        # 匹配FDA資料庫 (整次偵測使用同一個版本)
+        fda_snapshot = self.fda_database.snapshot
+        detection_result.fda_generation = fda_snapshot.generation
+        detection_result.fda_matches = self._match_registry(detection_result.foods_detected, fda_snapshot.registry, 'fda_match')
         
         # 匹配本地資料庫
         detection_result.local_foods = self._match_local_database(detection_result.foods_detected)
@@ -277,7 +363,8 @@ class EnhancedFoodDetector:
         detection_result.recommendations = self._generate_enhanced_recommendations(
             detection_result.foods_detected,
             detection_result.fda_matches,
-            detection_result.local_foods
+            detection_result.local_foods,
+            detection_result.nutrition_info
         )
         
         # 計算健康評分
@@ -296,80 +383,63 @@ class EnhancedFoodDetector:
         for tag in tags:
             if 'name' not in tag:
                 continue
-            tag_name = tag['name'].lower()
+            
+            # 單次掃描同時檢查英文與中文關鍵字 (中文字不受 lower() 影響)
+            languages = self.food_tag_matcher.matched_labels(tag['name'].lower())
             
             # 檢查英文關鍵字
-            if any(keyword in tag_name for keyword in self.food_keywords):
+            if 'en' in languages:
                 food_tags.append(tag['name'])
             
             # 檢查中文關鍵字
-            if any(keyword in tag['name'] for keyword in self.chinese_food_keywords):
+            if 'zh' in languages:
                 food_tags.append(tag['name'])
         
         return food_tags
     
     def _match_fda_database(self, foods: List[str]) -> List[Dict]:
         """匹配FDA資料庫"""
-        matches = []
-        
-        for food in foods:
-            food_lower = food.lower()
-            
-            # 直接匹配
-            if food_lower in self.fda_nutrition_db:
-                matches.append({
-                    'food_name': food,
-                    'fda_match': food_lower,
-                    'nutrition': self.fda_nutrition_db[food_lower],
-                    'match_type': 'exact',
-                    'confidence': 1.0
-                })
-                continue
-            
-            # 模糊匹配
-            for fda_food, nutrition in self.fda_nutrition_db.items():
-                # 檢查包含關係
-                if food_lower in fda_food or fda_food in food_lower:
-                    matches.append({
-                        'food_name': food,
-                        'fda_match': fda_food,
-                        'nutrition': nutrition,
-                        'match_type': 'partial',
-                        'confidence': 0.8
-                    })
-                    break
-        
-        return matches
+        return self._match_registry(foods, self.fda_nutrition_db, 'fda_match')
     
     def _match_local_database(self, foods: List[str]) -> List[Dict]:
         """匹配本地資料庫"""
+        return self._match_registry(foods, self.local_nutrition_db, 'local_match')
+    
+    def _match_registry(self, foods: List[str], registry: NutritionRegistry, match_key: str) -> List[Dict]:
+        """
+        以名稱匹配營養資料庫
+        
+        先完全比對，否則以 n-gram 索引取相似度最高的項目；
+        相似度同時作為信心分數，候選清單依相似度排序。
+        """
         matches = []
         
         for food in foods:
             food_lower = food.lower()
             
             # 直接匹配
-            if food_lower in self.local_nutrition_db:
+            if food_lower in registry:
                 matches.append({
                     'food_name': food,
-                    'local_match': food_lower,
-                    'nutrition': self.local_nutrition_db[food_lower],
+                    match_key: food_lower,
+                    'nutrition': registry[food_lower],
                     'match_type': 'exact',
                     'confidence': 1.0
                 })
                 continue
             
-            # 模糊匹配
-            for local_food, nutrition in self.local_nutrition_db.items():
-                if food_lower in local_food or local_food in food_lower:
-                    matches.append({
-                        'food_name': food,
-                        'local_match': local_food,
-                        'nutrition': nutrition,
-                        'match_type': 'partial',
-                        'confidence': 0.8
-                    })
-                    break
+            # 模糊匹配 (查詢結果由索引記住，重複出現的標籤不需重新計算)
+            candidates = registry.search(food_lower, self.fuzzy_top_k, self.fuzzy_min_score)
+            if candidates:
+                nutrition, score = candidates[0]
+                matches.append({
+                    'food_name': food,
+                    match_key: nutrition.name,
+                    'nutrition': nutrition,
+                    'match_type': 'partial',
+                    'confidence': score,
+                    'candidates': [(candidate.name, candidate_score) for candidate, candidate_score in candidates]
+                })
         
         return matches
     
@@ -426,115 +496,30 @@ class EnhancedFoodDetector:
         
         return nutrition_info
     
-    def _generate_enhanced_recommendations(self, foods: List[str], fda_matches: List[Dict], local_matches: List[Dict]) -> List[str]:
-        """生成增強版飲食建議"""
-        recommendations = []
-        
-        # 分析食物類型
-        foods_lower = ' '.join(foods).lower()
-        has_protein = any(keyword in foods_lower for keyword in ['chicken', 'beef', 'fish', 'pork', 'meat', 'egg', 'cheese', '肉', '魚', '蛋'])
-        has_vegetables = any(keyword in foods_lower for keyword in ['vegetable', 'salad', 'carrot', 'broccoli', 'tomato', 'lettuce', 'onion', '菜', '胡蘿蔔', '花椰菜', '番茄', '生菜', '洋蔥'])
-        has_fruits = any(keyword in foods_lower for keyword in ['apple', 'banana', 'orange', 'grape', 'strawberry', 'watermelon', 'fruit', '蘋果', '香蕉', '橘子', '葡萄', '草莓', '西瓜'])
-        has_grains = any(keyword in foods_lower for keyword in ['rice', 'bread', 'pasta', 'noodle', '米', '麵', '飯', '麵包'])
-        has_dairy = any(keyword in foods_lower for keyword in ['milk', 'cheese', 'yogurt', '奶', '起司', '優格'])
-        
-        # 基本營養建議
-        if not has_protein:
-            recommendations.append("建議添加蛋白質來源，如雞肉、魚肉、蛋類或豆類")
-        
-        if not has_vegetables:
-            recommendations.append("建議添加蔬菜以增加纖維和維生素攝取")
-        
-        if not has_fruits:
-            recommendations.append("建議添加水果以補充維生素和礦物質")
-        
-        if not has_grains:
-            recommendations.append("建議添加全穀類以提供能量和纖維")
-        
-        if not has_dairy:
-            recommendations.append("建議添加乳製品以補充鈣質和蛋白質")
-        
-        # FDA資料庫特定建議
+    def _generate_enhanced_recommendations(self, foods: List[str], fda_matches: List[Dict], local_matches: List[Dict],
+                                           nutrition_info: Optional[Dict] = None) -> List[str]:
+        """生成增強版飲食建議 (nutrition_info 為已計算好的營養資訊，未提供時重新計算)"""
+        if nutrition_info is None:
+            nutrition_info = self._generate_enhanced_nutrition_info(foods, fda_matches, local_matches)
+        
+        # 資料來源建議
+        source_recommendations = []
         if fda_matches:
-            recommendations.append(f"✅ 已匹配到 {len(fda_matches)} 種台灣本地食品資料")
+            source_recommendations.append(f"✅ 已匹配到 {len(fda_matches)} 種台灣本地食品資料")
             
             # 檢查是否有台灣特色食品
-            taiwan_foods = [match for match in fda_matches if any(keyword in match['fda_match'] for keyword in ['米', '麵', '豆', '茶'])]
-            if taiwan_foods:
-                recommendations.append("🍜 檢測到台灣特色食品，營養資訊更準確")
+            if any(keyword in match['fda_match'] for match in fda_matches for keyword in TAIWAN_FOOD_KEYWORDS):
+                source_recommendations.append("🍜 檢測到台灣特色食品，營養資訊更準確")
         
-        # 本地資料庫建議
         if local_matches:
-            recommendations.append(f"✅ 已匹配到 {len(local_matches)} 種國際食品資料")
-        
-        if len(foods) < 3:
-            recommendations.append("建議增加食物種類以獲得均衡營養")
+            source_recommendations.append(f"✅ 已匹配到 {len(local_matches)} 種國際食品資料")
         
-        # 檢查熱量
-        nutrition = self._generate_enhanced_nutrition_info(foods, fda_matches, local_matches)
-        if nutrition['total_calories'] < 200:
-            recommendations.append("這餐的熱量較低，建議適量增加食物份量")
-        elif nutrition['total_calories'] > 800:
-            recommendations.append("這餐的熱量較高，建議適量減少食物份量")
-        
-        if not recommendations:
-            recommendations.append("這是一頓營養均衡的餐點！")
-        
-        return recommendations
+        return get_engine(enhanced=True).recommend(foods, nutrition_info, source_recommendations)
     
     def _calculate_enhanced_health_score(self, nutrition_info: Dict) -> int:
         """計算增強版健康評分"""
-        score = 50  # 基礎分數
-        
-        calories = nutrition_info['total_calories']
-        protein = nutrition_info['protein']
-        carbs = nutrition_info['carbohydrates']
-        fat = nutrition_info['fat']
-        fiber = nutrition_info['fiber']
-        
-        # 根據營養素調整分數
-        if 200 <= calories <= 800:
-            score += 10
-        elif calories < 200:
-            score += 5
-        else:
-            score -= 10
-        
-        if protein >= 15:
-            score += 10
-        elif protein >= 10:
-            score += 5
-        
-        if carbs <= 50:
-            score += 10
-        elif carbs <= 80:
-            score += 5
-        
-        if fat <= 20:
-            score += 10
-        elif fat <= 30:
-            score += 5
-        
-        if fiber >= 5:
-            score += 10
-        elif fiber >= 3:
-            score += 5
-        
-        # 維生素加分
-        vitamins = nutrition_info.get('vitamins', [])
-        if len(vitamins) >= 3:
-            score += 5
-        elif len(vitamins) >= 1:
-            score += 2
-        
-        # 資料來源加分
-        sources = nutrition_info.get('sources', {})
-        if sources.get('fda', 0) > 0:
-            score += 3  # FDA資料庫加分
-        if sources.get('local', 0) > 0:
-            score += 2  # 本地資料庫加分
-        
-        return max(0, min(100, score))
+        # 評分規則與批次評分 (nutrition_batch) 共用，另加資料來源分數
+        return int(score_results([nutrition_info], enhanced=True).health_scores[0])
     
     def get_detailed_analysis(self, frame: np.ndarray) -> EnhancedFoodDetectionResult:
         """獲取詳細的食物分析報告"""
@@ -556,13 +541,8 @@ def test_enhanced_food_detection():
     
     try:
         # 嘗試載入FDA資料庫
-        fda_db_path = None
-        for file in os.listdir('.'):
-            if file.startswith('fda_nutrition_db_') and file.endswith('.json'):
-                fda_db_path = file
-                break
-        
-        detector = EnhancedFoodDetector(fda_db_path)
+        # 傳入資料夾: 使用其中最新的資料檔，監看時也會載入之後產生的資料檔
+        detector = EnhancedFoodDetector('.')
         print("✅ 增強版食物偵測器初始化成功")
         
         # 創建測試影像
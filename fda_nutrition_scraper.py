@@ -5,25 +5,42 @@
 """
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import json
 import time
 import csv
 import os
 from datetime import datetime
 import logging
-from typing import List, Dict, Optional
+import argparse
+from itertools import islice
+from typing import Container, Iterable, Iterator, List, Dict, Optional, Tuple
 import re
+from aspnet_paging import AspNetPager
+from crawl_checkpoint import CrawlCheckpoint, append_jsonl, iter_jsonl, open_jsonl_append
+from http_cache import install_http_cache
+from polite_fetcher import PoliteFetcher
+from rate_limiter import RetryPolicy, TokenBucket, get_rate_limiter
+from nutrient_matrix import NutrientMatrix
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 搜尋結果表格 (解析時略過頁面其他部分)
+RESULTS_TABLE = SoupStrainer('table', id='ctl00_ContentPlaceHolder1_GridView1')
+
 class FDANutritionScraper:
     """FDA 營養資料庫抓取器"""
     
-    def __init__(self):
-        """初始化抓取器"""
+    def __init__(self, rate_limiter: Optional[TokenBucket] = None, retry_policy: Optional[RetryPolicy] = None):
+        """
+        初始化抓取器
+        
+        Args:
+            rate_limiter: 跨行程共用的速率限制器 (預設依 FDA_RATE_LIMIT 環境變數決定)
+            retry_policy: 429/5xx 的重試策略
+        """
         self.base_url = "https://consumer.fda.gov.tw/Food/TFND.aspx"
         self.session = requests.Session()
         
@@ -37,6 +54,22 @@ class FDANutritionScraper:
             'Upgrade-Insecure-Requests': '1',
         })
         
+        # 速率限制與重試 (設定限制器後以配額上限發送請求，取代固定間隔)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else get_rate_limiter('FDA')
+        self.retry_policy = retry_policy or RetryPolicy()
+        # 設定 HTTP_CACHE_DIR 時，重新執行會直接使用快取的回應
+        install_http_cache(self.session, 'FDA', self.rate_limiter, self.retry_policy)
+        
+        # 分頁沿用上一個回應的 ViewState，主頁面每個工作階段只下載一次
+        self.pager = AspNetPager(self.session, self.base_url, params={'nodeID': '178'})
+        
+        # 詳細頁面並行抓取 (每個主機的同時請求數上限與自適應間隔；設定限制器時由限制器控制速率)
+        self.detail_fetcher = PoliteFetcher(
+            lambda url: self.fetch_food_detail(url),
+            max_per_host=int(os.getenv('FDA_DETAIL_CONCURRENCY', 4)),
+            min_delay=0.0 if self.rate_limiter is not None else float(os.getenv('FDA_DETAIL_DELAY', 0.5))
+        )
+        
         # 食品分類對應
         self.food_categories = {
             '穀物類': 'A',
@@ -98,40 +131,16 @@ class FDANutritionScraper:
         return viewstate_data
     
     def search_foods(self, category: str = '', keyword: str = '', page: int = 1) -> List[Dict]:
-        """搜尋食品資料"""
+        """搜尋食品資料 (同一查詢條件的後續頁面只需一次請求)"""
         try:
-            # 獲取主頁面
-            soup = self.get_main_page()
-            if not soup:
-                return []
-            
-            # 提取 ViewState 參數
-            viewstate_data = self.extract_viewstate(soup)
-            
-            # 準備搜尋參數
-            search_data = {
-                '__VIEWSTATE': viewstate_data.get('__VIEWSTATE', ''),
-                '__VIEWSTATEGENERATOR': viewstate_data.get('__VIEWSTATEGENERATOR', ''),
-                '__EVENTVALIDATION': viewstate_data.get('__EVENTVALIDATION', ''),
-                '__EVENTTARGET': '',
-                '__EVENTARGUMENT': '',
+            query = {
                 'ctl00$ContentPlaceHolder1$DropDownList1': category,
-                'ctl00$ContentPlaceHolder1$TextBox1': keyword,
-                'ctl00$ContentPlaceHolder1$Button1': '查詢'
+                'ctl00$ContentPlaceHolder1$TextBox1': keyword
             }
+            html = self.pager.fetch_page(page, query)
             
-            # 如果是分頁，設定分頁參數
-            if page > 1:
-                search_data['__EVENTTARGET'] = 'ctl00$ContentPlaceHolder1$GridView1'
-                search_data['__EVENTARGUMENT'] = f'Page${page}'
-            
-            # 發送搜尋請求
-            response = self.session.post(self.base_url, data=search_data, params={'nodeID': '178'})
-            response.raise_for_status()
-            response.encoding = 'utf-8'
-            
-            # 解析結果
-            soup = BeautifulSoup(response.text, 'html.parser')
+            # 只解析結果表格
+            soup = BeautifulSoup(html, 'html.parser', parse_only=RESULTS_TABLE)
             return self.parse_search_results(soup)
             
         except Exception as e:
@@ -176,16 +185,19 @@ class FDANutritionScraper:
         
         return results
     
+    def fetch_food_detail(self, detail_url: str) -> Optional[Dict]:
+        """獲取食品詳細營養資訊 (請求失敗時拋出例外，供並行抓取判斷伺服器狀態)"""
+        response = self.session.get(detail_url)
+        response.raise_for_status()
+        response.encoding = 'utf-8'
+        
+        soup = BeautifulSoup(response.text, 'html.parser')
+        return self.parse_food_detail(soup)
+    
     def get_food_detail(self, detail_url: str) -> Optional[Dict]:
         """獲取食品詳細營養資訊"""
         try:
-            response = self.session.get(detail_url)
-            response.raise_for_status()
-            response.encoding = 'utf-8'
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            return self.parse_food_detail(soup)
-            
+            return self.fetch_food_detail(detail_url)
         except Exception as e:
             logger.error(f"獲取食品詳細資訊失敗: {e}")
             return None
@@ -210,9 +222,10 @@ class FDANutritionScraper:
                         if key and value:
                             detail_data[key] = value
             
-            # 提取營養成分
+            # 提取營養成分 (單位另外保存，供 nutrient_matrix 換算)
             nutrition_data = self.extract_nutrition_data(soup)
             detail_data['營養成分'] = nutrition_data
+            detail_data['營養成分單位'] = self.extract_nutrition_units(soup)
             
             return detail_data
             
@@ -252,6 +265,132 @@ class FDANutritionScraper:
         
         return nutrition
     
+    def extract_nutrition_units(self, soup: BeautifulSoup) -> Dict[str, str]:
+        """提取營養成分的單位 (數值後的文字，例如 mg、ug、kcal)"""
+        units = {}
+        
+        for table in soup.find_all('table'):
+            for row in table.find_all('tr'):
+                cells = row.find_all(['td', 'th'])
+                if len(cells) >= 2:
+                    nutrient_name = cells[0].get_text(strip=True)
+                    match = re.search(r'[\d.]+\s*([^\d\s.]+)\s*$', cells[1].get_text(strip=True))
+                    if nutrient_name and match:
+                        units[nutrient_name] = match.group(1)
+        
+        return units
+    
+    @staticmethod
+    def food_key(food: Dict) -> str:
+        """食品的唯一編號 (整合編號，沒有時使用詳細頁面網址)"""
+        return food.get('整合編號') or food.get('詳細頁面URL') or ''
+    
+    def iter_pages(self, max_pages: int = 50, start_page: int = 1) -> Iterator[Tuple[int, List[Dict]]]:
+        """
+        逐頁產生搜尋結果 (某一頁沒有資料時停止)
+        
+        Args:
+            max_pages: 最後一頁
+            start_page: 第一頁 (從檢查點繼續時為上次完成的下一頁)
+        
+        Yields:
+            (頁數, 該頁的食品列表)
+        """
+        for page in range(start_page, max_pages + 1):
+            logger.info(f"正在抓取第 {page} 頁...")
+            
+            foods = self.search_foods(page=page)
+            if not foods:
+                logger.info(f"第 {page} 頁沒有資料，停止抓取")
+                return
+            
+            yield page, foods
+            
+            # 避免請求過於頻繁
+            if self.rate_limiter is None:
+                time.sleep(1)
+    
+    def iter_food_details(self, foods: Iterable[Dict], max_details: int = 100,
+                          skip: Container[str] = ()) -> Iterator[Dict]:
+        """
+        並行抓取食品詳細資訊，依輸入順序產生加上 '詳細資訊' 的食品 (失敗的項目不產生)
+        
+        Args:
+            foods: 食品列表或串流 (只處理前 max_details 筆)
+            max_details: 最多處理的食品數量
+            skip: 已完成的食品編號 (見 food_key)
+        """
+        pending = (food for food in islice(foods, max_details)
+                   if food.get('詳細頁面URL') and self.food_key(food) not in skip)
+        
+        for food, detail in self.detail_fetcher.fetch(pending, url=lambda food: food['詳細頁面URL']):
+            if detail:
+                logger.info(f"已抓取 {food['樣品名稱']} 的詳細資訊")
+                food['詳細資訊'] = detail
+                yield food
+    
+    def crawl(self, output_prefix: str, max_pages: int = 50, max_details: int = 100,
+              resume: bool = True) -> Iterator[Dict]:
+        """
+        可中斷續傳的完整抓取
+        
+        每一頁搜尋結果與每一筆詳細資訊抓到後立即附加到 JSONL，並記錄檢查點；
+        中斷後以相同的 output_prefix 重新執行會從上次完成的頁數與項目繼續。
+        詳細資訊階段從磁碟串流讀取搜尋結果，記憶體用量不隨資料量增加。
+        
+        輸出檔案:
+            <output_prefix>_foods.jsonl: 搜尋結果
+            <output_prefix>_details.jsonl: 含詳細資訊的食品
+            <output_prefix>_checkpoint.json: 最後完成的頁數與已完成的整合編號
+        
+        Args:
+            output_prefix: 輸出檔名前綴
+            max_pages: 搜尋結果的最後一頁
+            max_details: 最多處理的食品數量 (依搜尋結果順序，含已完成的項目)
+            resume: False 表示刪除上次的結果重新開始
+        
+        Yields:
+            本次新抓取的食品詳細資料
+        """
+        foods_path = f"{output_prefix}_foods.jsonl"
+        details_path = f"{output_prefix}_details.jsonl"
+        checkpoint_path = f"{output_prefix}_checkpoint.json"
+        
+        if not resume:
+            for path in (foods_path, details_path, checkpoint_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        
+        checkpoint = CrawlCheckpoint(checkpoint_path)
+        checkpoint.restore_done(self.food_key(food) for food in iter_jsonl(details_path))
+        
+        # 搜尋結果: 每頁寫入後記錄頁數
+        with open_jsonl_append(foods_path) as f:
+            for page, foods in self.iter_pages(max_pages, checkpoint.last_page + 1):
+                for food in foods:
+                    append_jsonl(f, food)
+                checkpoint.mark_page(page)
+        logger.info(f"搜尋結果已抓取至第 {checkpoint.last_page} 頁: {foods_path}")
+        
+        # 詳細資訊: 依搜尋結果順序 (略過重複與已完成的項目)
+        def unique_foods():
+            seen = set()
+            for food in iter_jsonl(foods_path):
+                key = self.food_key(food)
+                if key not in seen:
+                    seen.add(key)
+                    yield food
+        
+        with open_jsonl_append(details_path) as f:
+            try:
+                for food in self.iter_food_details(unique_foods(), max_details, checkpoint.done):
+                    append_jsonl(f, food)
+                    checkpoint.mark_done(self.food_key(food))
+                    yield food
+            finally:
+                checkpoint.save()
+        logger.info(f"已完成 {len(checkpoint.done)} 筆詳細資訊: {details_path}")
+    
     def scrape_all_foods(self, max_pages: int = 50) -> List[Dict]:
         """抓取所有食品資料"""
         all_foods = []
@@ -260,18 +399,8 @@ class FDANutritionScraper:
             logger.info("開始抓取所有食品資料...")
             
             # 逐頁抓取
-            for page in range(1, max_pages + 1):
-                logger.info(f"正在抓取第 {page} 頁...")
-                
-                foods = self.search_foods(page=page)
-                if not foods:
-                    logger.info(f"第 {page} 頁沒有資料，停止抓取")
-                    break
-                
+            for page, foods in self.iter_pages(max_pages):
                 all_foods.extend(foods)
-                
-                # 避免請求過於頻繁
-                time.sleep(1)
             
             logger.info(f"總共抓取到 {len(all_foods)} 筆食品資料")
             return all_foods
@@ -287,17 +416,8 @@ class FDANutritionScraper:
         try:
             logger.info(f"開始抓取 {min(len(foods), max_details)} 筆食品詳細資訊...")
             
-            for i, food in enumerate(foods[:max_details]):
-                if food.get('詳細頁面URL'):
-                    logger.info(f"正在抓取 {food['樣品名稱']} 的詳細資訊...")
-                    
-                    detail = self.get_food_detail(food['詳細頁面URL'])
-                    if detail:
-                        food['詳細資訊'] = detail
-                        detailed_foods.append(food)
-                    
-                    # 避免請求過於頻繁
-                    time.sleep(2)
+            for food in self.iter_food_details(foods, max_details):
+                detailed_foods.append(food)
             
             logger.info(f"成功抓取 {len(detailed_foods)} 筆詳細資訊")
             return detailed_foods
@@ -403,14 +523,30 @@ class FDANutritionScraper:
 
 def main():
     """主函數"""
+    parser = argparse.ArgumentParser(description='抓取台灣FDA食品營養成分資料庫 (中斷後重新執行會從檢查點繼續)')
+    parser.add_argument('--max-pages', type=int, default=10, help='搜尋結果的最後一頁')
+    parser.add_argument('--max-details', type=int, default=50, help='最多抓取詳細資訊的食品數量')
+    parser.add_argument('-o', '--output-prefix', default='fda_crawl', help='JSONL 與檢查點檔名前綴')
+    parser.add_argument('--restart', action='store_true', help='刪除上次的進度重新開始')
+    
+    args = parser.parse_args()
+    
     print("🍽️ 台灣FDA食品營養成分資料庫抓取器")
     print("=" * 50)
     
     scraper = FDANutritionScraper()
     
-    # 抓取基本資料
-    print("📋 抓取食品基本資料...")
-    foods = scraper.scrape_all_foods(max_pages=10)  # 限制頁數避免過度請求
+    # 逐筆寫入 JSONL (限制頁數與數量避免過度請求)
+    print("📋 抓取食品基本資料與詳細營養資訊...")
+    fetched = 0
+    try:
+        for food in scraper.crawl(args.output_prefix, args.max_pages, args.max_details, resume=not args.restart):
+            fetched += 1
+    except KeyboardInterrupt:
+        print(f"\n⏹️ 抓取被使用者中斷，本次已寫入 {fetched} 筆，重新執行即可繼續")
+        return
+    
+    foods = list(iter_jsonl(f"{args.output_prefix}_foods.jsonl"))
     
     if foods:
         # 儲存基本資料
@@ -418,9 +554,9 @@ def main():
         scraper.save_to_json(foods, f"fda_foods_basic_{timestamp}.json")
         scraper.save_to_csv(foods, f"fda_foods_basic_{timestamp}.csv")
         
-        # 抓取詳細資訊
-        print("🔍 抓取食品詳細營養資訊...")
-        detailed_foods = scraper.scrape_food_details(foods, max_details=50)  # 限制數量
+        # 詳細資訊 (包含之前執行時已完成的項目)
+        print(f"🔍 本次新抓取 {fetched} 筆詳細營養資訊")
+        detailed_foods = list(iter_jsonl(f"{args.output_prefix}_details.jsonl"))
         
         if detailed_foods:
             # 儲存詳細資料
@@ -434,6 +570,9 @@ def main():
             if nutrition_db:
                 scraper.save_to_json(nutrition_db, f"fda_nutrition_db_{timestamp}.json")
                 print(f"✅ 成功建立營養資料庫，包含 {len(nutrition_db)} 種食品")
+            
+            # 完整營養素矩陣 (供飲食規劃的向量化查詢)
+            NutrientMatrix.from_fda_foods(detailed_foods).save(f"fda_nutrient_matrix_{timestamp}.npz")
         
         print("🎉 資料抓取完成！")
     else:
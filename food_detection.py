@@ -6,16 +6,26 @@
 
 import os
 import json
+import asyncio
 import requests
 import numpy as np
-import cv2
 from typing import List, Dict, Optional, Tuple
 from PIL import Image
 import io
 import base64
+import copy
 from dotenv import load_dotenv
 from datetime import datetime
 import logging
+from vision_transport import AsyncVisionTransport, TransportSettings, get_shared_transport, run_bounded
+from analysis_cache import AnalysisCache
+from frame_dedup import FrameDeduplicator
+from image_preprocess import PreprocessSettings, encode_frame, prepare_image_bytes
+from rate_limiter import TokenBucket
+from single_flight import shared_flight
+from nutrition_registry import get_registry
+from nutrition_batch import score_results
+from recommendation_engine import get_engine
 
 # 載入環境變數
 load_dotenv()
@@ -39,12 +49,26 @@ class FoodDetectionResult:
         self.timestamp = datetime.now()
         self.success = False
         self.error_message = ""
+        self.reused = False  # 是否沿用近似影像幀的結果
 
 class FoodDetector:
     """食物偵測器類別"""
     
-    def __init__(self):
-        """初始化食物偵測器"""
+    def __init__(self, transport_settings: Optional[TransportSettings] = None,
+                 cache: Optional[AnalysisCache] = None,
+                 frame_deduplicator: Optional[FrameDeduplicator] = None,
+                 preprocess_settings: Optional[PreprocessSettings] = None,
+                 rate_limiter: Optional[TokenBucket] = None):
+        """
+        初始化食物偵測器
+        
+        Args:
+            transport_settings: 連線池與逾時設定 (預設從環境變數讀取)
+            cache: 分析結果快取 (預設依 ANALYSIS_CACHE_PATH 環境變數決定)
+            frame_deduplicator: 近似重複影像幀過濾器 (預設依 FRAME_DEDUP_THRESHOLD 環境變數決定)
+            preprocess_settings: 上傳前縮小與壓縮影像的設定 (預設從環境變數讀取)
+            rate_limiter: 跨行程共用的速率限制器 (預設依 AZURE_VISION_RATE_LIMIT 環境變數決定)
+        """
         self.endpoint = os.getenv('AZURE_VISION_ENDPOINT')
         self.key = os.getenv('AZURE_VISION_KEY')
         
@@ -54,6 +78,25 @@ class FoodDetector:
         # 移除結尾的斜線
         self.endpoint = self.endpoint.rstrip('/')
         
+        # 共用的連線池傳輸層 (建立時預熱連線)
+        self.transport = get_shared_transport(self.endpoint, transport_settings)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else self.transport.rate_limiter
+        
+        # 相同影像同時只發送一個請求 (所有偵測器共用)
+        self.single_flight = shared_flight
+        
+        # 分析結果快取 (以影像雜湊為鍵)
+        self.cache = cache if cache is not None else AnalysisCache.from_env()
+        
+        # 近似重複影像幀過濾 (畫面幾乎不變時沿用上次結果)
+        self.frame_deduplicator = frame_deduplicator if frame_deduplicator is not None else FrameDeduplicator.from_env()
+        
+        # 上傳前影像前處理 (限制尺寸與檔案大小)
+        self.preprocess_settings = preprocess_settings or PreprocessSettings.from_env()
+        
+        # 非同步傳輸層 (第一次呼叫非同步 API 時建立)
+        self._async_transport = None
+        
         # 食物關鍵字資料庫
         self.food_keywords = [
             'food', 'meal', 'dish', 'cuisine', 'restaurant', 'cooking',
@@ -70,52 +113,8 @@ class FoodDetector:
             'peach', 'pear', 'cherry', 'blueberry', 'raspberry', 'blackberry'
         ]
         
-        # 營養資料庫
-        self.nutrition_db = {
-            'apple': {'calories': 95, 'protein': 0.5, 'carbs': 25, 'fat': 0.3, 'fiber': 4, 'vitamins': ['C', 'K']},
-            'banana': {'calories': 105, 'protein': 1.3, 'carbs': 27, 'fat': 0.4, 'fiber': 3, 'vitamins': ['B6', 'C']},
-            'rice': {'calories': 130, 'protein': 2.7, 'carbs': 28, 'fat': 0.3, 'fiber': 0.4, 'vitamins': ['B1', 'B3']},
-            'chicken': {'calories': 165, 'protein': 31, 'carbs': 0, 'fat': 3.6, 'fiber': 0, 'vitamins': ['B6', 'B12']},
-            'salad': {'calories': 20, 'protein': 2, 'carbs': 4, 'fat': 0.2, 'fiber': 2, 'vitamins': ['A', 'C', 'K']},
-            'pizza': {'calories': 266, 'protein': 11, 'carbs': 33, 'fat': 10, 'fiber': 2, 'vitamins': ['B1', 'B2']},
-            'soup': {'calories': 50, 'protein': 3, 'carbs': 8, 'fat': 1, 'fiber': 2, 'vitamins': ['A', 'C']},
-            'bread': {'calories': 79, 'protein': 3, 'carbs': 15, 'fat': 1, 'fiber': 1, 'vitamins': ['B1', 'B2']},
-            'fish': {'calories': 100, 'protein': 20, 'carbs': 0, 'fat': 2, 'fiber': 0, 'vitamins': ['D', 'B12']},
-            'vegetable': {'calories': 25, 'protein': 2, 'carbs': 5, 'fat': 0.2, 'fiber': 3, 'vitamins': ['A', 'C']},
-            'beef': {'calories': 250, 'protein': 26, 'carbs': 0, 'fat': 15, 'fiber': 0, 'vitamins': ['B12', 'B6']},
-            'pork': {'calories': 242, 'protein': 27, 'carbs': 0, 'fat': 14, 'fiber': 0, 'vitamins': ['B1', 'B6']},
-            'shrimp': {'calories': 85, 'protein': 18, 'carbs': 0, 'fat': 1, 'fiber': 0, 'vitamins': ['B12', 'D']},
-            'salmon': {'calories': 208, 'protein': 25, 'carbs': 0, 'fat': 12, 'fiber': 0, 'vitamins': ['D', 'B12']},
-            'carrot': {'calories': 41, 'protein': 0.9, 'carbs': 10, 'fat': 0.2, 'fiber': 2.8, 'vitamins': ['A', 'K']},
-            'broccoli': {'calories': 34, 'protein': 2.8, 'carbs': 7, 'fat': 0.4, 'fiber': 2.6, 'vitamins': ['C', 'K']},
-            'tomato': {'calories': 22, 'protein': 1.1, 'carbs': 5, 'fat': 0.2, 'fiber': 1.2, 'vitamins': ['C', 'K']},
-            'lettuce': {'calories': 15, 'protein': 1.4, 'carbs': 3, 'fat': 0.1, 'fiber': 1.3, 'vitamins': ['A', 'K']},
-            'onion': {'calories': 40, 'protein': 1.1, 'carbs': 9, 'fat': 0.1, 'fiber': 1.7, 'vitamins': ['C', 'B6']},
-            'potato': {'calories': 77, 'protein': 2, 'carbs': 17, 'fat': 0.1, 'fiber': 2.2, 'vitamins': ['C', 'B6']},
-            'corn': {'calories': 86, 'protein': 3.2, 'carbs': 19, 'fat': 1.2, 'fiber': 2.7, 'vitamins': ['B1', 'B5']},
-            'egg': {'calories': 78, 'protein': 6.3, 'carbs': 0.6, 'fat': 5.3, 'fiber': 0, 'vitamins': ['D', 'B12']},
-            'cheese': {'calories': 113, 'protein': 7, 'carbs': 0.4, 'fat': 9, 'fiber': 0, 'vitamins': ['A', 'B12']},
-            'milk': {'calories': 42, 'protein': 3.4, 'carbs': 5, 'fat': 1, 'fiber': 0, 'vitamins': ['D', 'B12']},
-            'coffee': {'calories': 2, 'protein': 0.3, 'carbs': 0, 'fat': 0, 'fiber': 0, 'vitamins': ['B3']},
-            'tea': {'calories': 1, 'protein': 0, 'carbs': 0, 'fat': 0, 'fiber': 0, 'vitamins': ['C']},
-            'orange': {'calories': 62, 'protein': 1.2, 'carbs': 15, 'fat': 0.2, 'fiber': 3.1, 'vitamins': ['C', 'B9']},
-            'grape': {'calories': 62, 'protein': 0.6, 'carbs': 16, 'fat': 0.2, 'fiber': 0.9, 'vitamins': ['C', 'K']},
-            'strawberry': {'calories': 32, 'protein': 0.7, 'carbs': 8, 'fat': 0.3, 'fiber': 2, 'vitamins': ['C', 'B9']},
-            'watermelon': {'calories': 30, 'protein': 0.6, 'carbs': 8, 'fat': 0.2, 'fiber': 0.4, 'vitamins': ['A', 'C']},
-            'noodle': {'calories': 138, 'protein': 5, 'carbs': 25, 'fat': 2, 'fiber': 1, 'vitamins': ['B1', 'B2']},
-            'pasta': {'calories': 131, 'protein': 5, 'carbs': 25, 'fat': 1, 'fiber': 1, 'vitamins': ['B1', 'B2']},
-            'hamburger': {'calories': 295, 'protein': 12, 'carbs': 30, 'fat': 12, 'fiber': 2, 'vitamins': ['B12', 'B6']},
-            'sandwich': {'calories': 250, 'protein': 15, 'carbs': 30, 'fat': 8, 'fiber': 3, 'vitamins': ['B1', 'B2']},
-            'sushi': {'calories': 150, 'protein': 6, 'carbs': 30, 'fat': 0.5, 'fiber': 0.5, 'vitamins': ['B12', 'D']},
-            'ramen': {'calories': 200, 'protein': 8, 'carbs': 35, 'fat': 3, 'fiber': 2, 'vitamins': ['B1', 'B2']},
-            'curry': {'calories': 180, 'protein': 8, 'carbs': 25, 'fat': 6, 'fiber': 3, 'vitamins': ['A', 'C']},
-            'steak': {'calories': 271, 'protein': 26, 'carbs': 0, 'fat': 18, 'fiber': 0, 'vitamins': ['B12', 'B6']},
-            'seafood': {'calories': 100, 'protein': 20, 'carbs': 0, 'fat': 2, 'fiber': 0, 'vitamins': ['D', 'B12']},
-            'dessert': {'calories': 300, 'protein': 4, 'carbs': 45, 'fat': 12, 'fiber': 1, 'vitamins': ['A']},
-            'cake': {'calories': 257, 'protein': 3, 'carbs': 45, 'fat': 8, 'fiber': 1, 'vitamins': ['A']},
-            'ice cream': {'calories': 207, 'protein': 3.5, 'carbs': 24, 'fat': 11, 'fiber': 0, 'vitamins': ['A']},
-            'chocolate': {'calories': 546, 'protein': 4.9, 'carbs': 61, 'fat': 31, 'fiber': 7, 'vitamins': ['B2']}
-        }
+        # 營養資料庫 (行程共用，唯讀)
+        self.nutrition_db = get_registry()
     
     def detect_food_from_frame(self, frame: np.ndarray) -> FoodDetectionResult:
         """
@@ -130,13 +129,19 @@ class FoodDetector:
         result = FoodDetectionResult()
         
         try:
-            # 將 numpy array 轉換為 bytes
-            success, buffer = cv2.imencode('.jpg', frame)
-            if not success:
-                result.error_message = "影像編碼失敗"
-                return result
+            # 畫面與最近的影像幀幾乎相同時，直接沿用先前結果
+            frame_hash = None
+            if self.frame_deduplicator is not None:
+                frame_hash = self.frame_deduplicator.compute_hash(frame)
+                previous = self.frame_deduplicator.lookup(frame_hash)
+                if previous is not None:
+                    reused_result = copy.deepcopy(previous)
+                    reused_result.reused = True
+                    reused_result.timestamp = datetime.now()
+                    return reused_result
             
-            image_bytes = buffer.tobytes()
+            # 縮小影像幀並編碼成符合大小預算的 JPEG
+            image_bytes = encode_frame(frame, self.preprocess_settings)
             
             # 分析影像
             analysis_result = self._analyze_image_data(image_bytes)
@@ -145,6 +150,9 @@ class FoodDetector:
             result = self._process_analysis_result(analysis_result)
             result.success = True
             
+            if frame_hash is not None:
+                self.frame_deduplicator.remember(frame_hash, result)
+            
         except Exception as e:
             result.error_message = str(e)
             logger.error(f"食物偵測失敗: {e}")
@@ -169,7 +177,7 @@ class FoodDetector:
                 image_data = image_file.read()
             
             # 分析影像
-            analysis_result = self._analyze_image_data(image_data)
+            analysis_result = self._analyze_image_data(prepare_image_bytes(image_data, self.preprocess_settings))
             
             # 處理結果
             result = self._process_analysis_result(analysis_result)
@@ -183,15 +191,94 @@ class FoodDetector:
         
         return result
     
-    def _analyze_image_data(self, image_data: bytes) -> Dict:
+    async def analyze_async(self, image_bytes: bytes) -> FoodDetectionResult:
         """
-        使用 Azure Computer Vision API 分析影像資料
+        從位元組資料偵測食物 (非同步)
         
         Args:
-            image_data: 影像位元組資料
+            image_bytes: 影像位元組資料
             
         Returns:
-            API 分析結果
+            食物偵測結果
+        """
+        result = FoodDetectionResult()
+        
+        try:
+            # 分析影像
+            image_bytes = await asyncio.to_thread(prepare_image_bytes, image_bytes, self.preprocess_settings)
+            analysis_result = await self._analyze_image_data_async(image_bytes)
+            
+            # 結果處理移到執行緒，不佔用事件迴圈
+            result = await asyncio.to_thread(self._process_analysis_result, analysis_result)
+            result.success = True
+            
+        except Exception as e:
+            result.error_message = str(e)
+            logger.error(f"食物偵測失敗: {e}")
+        
+        return result
+    
+    async def detect_food_from_frame_async(self, frame: np.ndarray) -> FoodDetectionResult:
+        """
+        detect_food_from_frame 的非同步版本
+        
+        Args:
+            frame: 影像幀 (numpy array)
+            
+        Returns:
+            食物偵測結果
+        """
+        # 畫面與最近的影像幀幾乎相同時，直接沿用先前結果
+        frame_hash = None
+        if self.frame_deduplicator is not None:
+            frame_hash = await asyncio.to_thread(self.frame_deduplicator.compute_hash, frame)
+            previous = self.frame_deduplicator.lookup(frame_hash)
+            if previous is not None:
+                reused_result = copy.deepcopy(previous)
+                reused_result.reused = True
+                reused_result.timestamp = datetime.now()
+                return reused_result
+        
+        # 影像縮小與編碼屬於 CPU 工作，移到執行緒
+        try:
+            image_bytes = await asyncio.to_thread(encode_frame, frame, self.preprocess_settings)
+        except Exception as e:
+            result = FoodDetectionResult()
+            result.error_message = str(e)
+            return result
+        
+        result = await self.analyze_async(image_bytes)
+        
+        if result.success and frame_hash is not None:
+            self.frame_deduplicator.remember(frame_hash, result)
+        
+        return result
+    
+    async def analyze_many_async(self, images: List[bytes], concurrency: int = 8) -> List[FoodDetectionResult]:
+        """
+        同時偵測多張影像
+        
+        Args:
+            images: 影像位元組資料列表
+            concurrency: 最大同時請求數量
+            
+        Returns:
+            食物偵測結果列表 (順序與輸入相同)
+        """
+        return await run_bounded(self.analyze_async, images, concurrency)
+    
+    def _get_async_transport(self) -> AsyncVisionTransport:
+        """取得非同步傳輸層"""
+        if self._async_transport is None:
+            self._async_transport = AsyncVisionTransport(self.endpoint, self.transport.settings, self.rate_limiter)
+        return self._async_transport
+    
+    def _build_analyze_request(self) -> Tuple[str, Dict, Dict]:
+        """
+        建立 Azure Computer Vision 分析請求
+        
+        Returns:
+            (API 端點, 請求標頭, 分析參數)
         """
         # 設定 API 端點
         vision_url = f"{self.endpoint}/vision/v3.2/analyze"
@@ -209,19 +296,85 @@ class FoodDetector:
             'model-version': 'latest'
         }
         
-        try:
-            # 發送請求
-            response = requests.post(vision_url, headers=headers, params=params, data=image_data)
-            response.raise_for_status()
+        return vision_url, headers, params
+    
+    def _analyze_image_data(self, image_data: bytes) -> Dict:
+        """
+        使用 Azure Computer Vision API 分析影像資料
+        
+        Args:
+            image_data: 影像位元組資料
+            
+        Returns:
+            API 分析結果
+        """
+        vision_url, headers, params = self._build_analyze_request()
+        
+        # 查詢快取，相同影像不重複呼叫 API
+        image_key = AnalysisCache.make_key(image_data, params)
+        if self.cache is not None:
+            cached_result = self.cache.get(image_key)
+            if cached_result is not None:
+                return cached_result
+        
+        def fetch() -> Dict:
+            try:
+                # 發送請求
+                response = self.transport.post(vision_url, headers=headers, params=params, data=image_data,
+                                               rate_limiter=self.rate_limiter)
+                response.raise_for_status()
+                
+                # 解析回應
+                result = response.json()
+                
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"API 請求失敗: {str(e)}")
+            except json.JSONDecodeError as e:
+                raise Exception(f"解析 API 回應失敗: {str(e)}")
             
-            # 解析回應
-            result = response.json()
+            # 寫入快取
+            if self.cache is not None:
+                self.cache.set(image_key, result)
             return result
+        
+        # 同時進行的相同影像 (例如串流畫面與手動分析) 只發送一個請求
+        return self.single_flight.do((self.endpoint, image_key), fetch)
+    
+    async def _analyze_image_data_async(self, image_data: bytes) -> Dict:
+        """
+        _analyze_image_data 的非同步版本
+        
+        Args:
+            image_data: 影像位元組資料
             
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"API 請求失敗: {str(e)}")
-        except json.JSONDecodeError as e:
-            raise Exception(f"解析 API 回應失敗: {str(e)}")
+        Returns:
+            API 分析結果
+        """
+        vision_url, headers, params = self._build_analyze_request()
+        
+        # 查詢快取，相同影像不重複呼叫 API
+        image_key = AnalysisCache.make_key(image_data, params)
+        if self.cache is not None:
+            # SQLite 查詢在執行緒中執行，不阻塞事件迴圈
+            cached_result = await asyncio.to_thread(self.cache.get, image_key)
+            if cached_result is not None:
+                return cached_result
+        
+        async def fetch() -> Dict:
+            try:
+                response = await self._get_async_transport().post(vision_url, headers=headers, params=params, data=image_data)
+                response.raise_for_status()
+                result = response.json()
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"API 請求失敗: {str(e)}")
+            except json.JSONDecodeError as e:
+                raise Exception(f"解析 API 回應失敗: {str(e)}")
+            
+            if self.cache is not None:
+                await asyncio.to_thread(self.cache.set, image_key, result)
+            return result
+        
+        return await self.single_flight.do_async((self.endpoint, image_key), fetch)
     
     def _process_analysis_result(self, result: Dict) -> FoodDetectionResult:
         """
@@ -289,7 +442,9 @@ class FoodDetector:
         detection_result.nutrition_info = self._generate_nutrition_info(detection_result.foods_detected)
         
         # 生成飲食建議
-        detection_result.recommendations = self._generate_recommendations(detection_result.foods_detected)
+        detection_result.recommendations = self._generate_recommendations(
+            detection_result.foods_detected, detection_result.nutrition_info
+        )
         
         # 計算健康評分
         detection_result.health_score = self._calculate_health_score(detection_result.nutrition_info)
@@ -342,74 +497,36 @@ class FoodDetector:
         }
         
         for food in foods:
-            food_lower = food.lower()
-            for db_food, nutrition in self.nutrition_db.items():
-                if db_food in food_lower:
-                    nutrition_info['total_calories'] += nutrition['calories']
-                    nutrition_info['protein'] += nutrition['protein']
-                    nutrition_info['carbohydrates'] += nutrition['carbs']
-                    nutrition_info['fat'] += nutrition['fat']
-                    nutrition_info['fiber'] += nutrition['fiber']
-                    
-                    # 添加維生素
-                    if 'vitamins' in nutrition:
-                        nutrition_info['vitamins'].extend(nutrition['vitamins'])
-                    break
+            nutrition = self.nutrition_db.lookup(food)
+            if nutrition is not None:
+                nutrition_info['total_calories'] += nutrition.calories
+                nutrition_info['protein'] += nutrition.protein
+                nutrition_info['carbohydrates'] += nutrition.carbs
+                nutrition_info['fat'] += nutrition.fat
+                nutrition_info['fiber'] += nutrition.fiber
+                
+                # 添加維生素
+                nutrition_info['vitamins'].extend(nutrition.vitamins)
         
         # 移除重複的維生素
         nutrition_info['vitamins'] = list(set(nutrition_info['vitamins']))
         
         return nutrition_info
     
-    def _generate_recommendations(self, foods: List[str]) -> List[str]:
+    def _generate_recommendations(self, foods: List[str], nutrition_info: Optional[Dict] = None) -> List[str]:
         """
         根據檢測到的食物生成飲食建議
         
         Args:
             foods: 檢測到的食物列表
+            nutrition_info: 已計算好的營養資訊 (未提供時重新計算)
             
         Returns:
             建議列表
         """
-        recommendations = []
-        
-        # 分析食物類型
-        foods_lower = ' '.join(foods).lower()
-        has_protein = any(keyword in foods_lower for keyword in ['chicken', 'beef', 'fish', 'pork', 'meat', 'egg', 'cheese'])
-        has_vegetables = any(keyword in foods_lower for keyword in ['vegetable', 'salad', 'carrot', 'broccoli', 'tomato', 'lettuce', 'onion'])
-        has_fruits = any(keyword in foods_lower for keyword in ['apple', 'banana', 'orange', 'grape', 'strawberry', 'watermelon', 'fruit'])
-        has_grains = any(keyword in foods_lower for keyword in ['rice', 'bread', 'pasta', 'noodle'])
-        has_dairy = any(keyword in foods_lower for keyword in ['milk', 'cheese', 'yogurt'])
-        
-        if not has_protein:
-            recommendations.append("建議添加蛋白質來源，如雞肉、魚肉、蛋類或豆類")
-        
-        if not has_vegetables:
-            recommendations.append("建議添加蔬菜以增加纖維和維生素攝取")
-        
-        if not has_fruits:
-            recommendations.append("建議添加水果以補充維生素和礦物質")
-        
-        if not has_grains:
-            recommendations.append("建議添加全穀類以提供能量和纖維")
-        
-        if not has_dairy:
-            recommendations.append("建議添加乳製品以補充鈣質和蛋白質")
-        
-        if len(foods) < 3:
-            recommendations.append("建議增加食物種類以獲得均衡營養")
-        
-        # 檢查熱量
-        nutrition = self._generate_nutrition_info(foods)
-        if nutrition['total_calories'] < 200:
-            recommendations.append("這餐的熱量較低，建議適量增加食物份量")
-        elif nutrition['total_calories'] > 800:
-            recommendations.append("這餐的熱量較高，建議適量減少食物份量")
-        
-        if not recommendations:
-            recommendations.append("這是一頓營養均衡的餐點！")
-        
-        return recommendations
+        if nutrition_info is None:
+            nutrition_info = self._generate_nutrition_info(foods)
+        return get_engine().recommend(foods, nutrition_info)
     
     def _calculate_health_score(self, nutrition_info: Dict) -> int:
         """
@@ -421,50 +538,18 @@ class FoodDetector:
         Returns:
             健康評分
         """
-        score = 50  # 基礎分數
-        
-        calories = nutrition_info['total_calories']
-        protein = nutrition_info['protein']
-        carbs = nutrition_info['carbohydrates']
-        fat = nutrition_info['fat']
-        fiber = nutrition_info['fiber']
+        return int(score_results([nutrition_info]).health_scores[0])
+    
+    def get_dedup_statistics(self) -> Dict:
+        """
+        獲取近似重複影像幀過濾的統計資訊
         
-        # 根據營養素調整分數
-        if 200 <= calories <= 800:
-            score += 10
-        elif calories < 200:
-            score += 5
-        else:
-            score -= 10
-        
-        if protein >= 15:
-            score += 10
-        elif protein >= 10:
-            score += 5
-        
-        if carbs <= 50:
-            score += 10
-        elif carbs <= 80:
-            score += 5
-        
-        if fat <= 20:
-            score += 10
-        elif fat <= 30:
-            score += 5
-        
-        if fiber >= 5:
-            score += 10
-        elif fiber >= 3:
-            score += 5
-        
-        # 維生素加分
-        vitamins = nutrition_info.get('vitamins', [])
-        if len(vitamins) >= 3:
-            score += 5
-        elif len(vitamins) >= 1:
-            score += 2
-        
-        return max(0, min(100, score))
+        Returns:
+            包含已處理影像幀數與節省的 API 呼叫次數
+        """
+        if self.frame_deduplicator is None:
+            return {'frames_seen': 0, 'calls_saved': 0, 'saved_ratio': 0.0}
+        return self.frame_deduplicator.get_statistics()
     
     def get_detailed_analysis(self, frame: np.ndarray) -> FoodDetectionResult:
         """
@@ -5,6 +5,7 @@ Azure AI 食物影像辨識程式
 
 import os
 import json
+import asyncio
 import requests
 from typing import List, Dict, Optional, Tuple
 from PIL import Image
@@ -12,15 +13,45 @@ import io
 import base64
 from dotenv import load_dotenv
 from datetime import datetime
+from vision_transport import AsyncVisionTransport, TransportSettings, get_shared_transport, run_bounded
+from analysis_cache import AnalysisCache
+from image_preprocess import PreprocessSettings, prepare_image_bytes
+from rate_limiter import TokenBucket
+from single_flight import shared_flight
+from nutrition_registry import get_registry
+from nutrition_batch import score_results
 
 # 載入環境變數
 load_dotenv()
 
+# 常見食物關鍵字
+FOOD_TAG_KEYWORDS = [
+    'food', 'meal', 'dish', 'cuisine', 'restaurant', 'cooking',
+    'apple', 'banana', 'orange', 'grape', 'strawberry', 'watermelon',
+    'rice', 'noodle', 'bread', 'pizza', 'hamburger', 'sandwich',
+    'chicken', 'beef', 'pork', 'fish', 'shrimp', 'salmon',
+    'vegetable', 'carrot', 'broccoli', 'tomato', 'lettuce', 'onion',
+    'soup', 'salad', 'dessert', 'cake', 'ice cream', 'chocolate',
+    'drink', 'coffee', 'tea', 'juice', 'milk', 'water',
+    'sushi', 'ramen', 'curry', 'pasta', 'steak', 'seafood'
+]
+
 class FoodRecognition:
     """Azure AI 食物影像辨識類別"""
     
-    def __init__(self):
-        """初始化 Azure Computer Vision 客戶端"""
+    def __init__(self, transport_settings: Optional[TransportSettings] = None,
+                 cache: Optional[AnalysisCache] = None,
+                 preprocess_settings: Optional[PreprocessSettings] = None,
+                 rate_limiter: Optional[TokenBucket] = None):
+        """
+        初始化 Azure Computer Vision 客戶端
+        
+        Args:
+            transport_settings: 連線池與逾時設定 (預設從環境變數讀取)
+            cache: 分析結果快取 (預設依 ANALYSIS_CACHE_PATH 環境變數決定)
+            preprocess_settings: 上傳前縮小與壓縮影像的設定 (預設從環境變數讀取)
+            rate_limiter: 跨行程共用的速率限制器 (預設依 AZURE_VISION_RATE_LIMIT 環境變數決定)
+        """
         self.endpoint = os.getenv('AZURE_VISION_ENDPOINT')
         self.key = os.getenv('AZURE_VISION_KEY')
         
@@ -30,6 +61,22 @@ class FoodRecognition:
         # 移除結尾的斜線
         self.endpoint = self.endpoint.rstrip('/')
         
+        # 共用的連線池傳輸層 (建立時預熱連線)
+        self.transport = get_shared_transport(self.endpoint, transport_settings)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else self.transport.rate_limiter
+        
+        # 相同影像同時只發送一個請求 (所有辨識器共用)
+        self.single_flight = shared_flight
+        
+        # 分析結果快取 (以影像雜湊為鍵)
+        self.cache = cache if cache is not None else AnalysisCache.from_env()
+        
+        # 上傳前影像前處理 (限制尺寸與檔案大小)
+        self.preprocess_settings = preprocess_settings or PreprocessSettings.from_env()
+        
+        # 非同步傳輸層 (第一次呼叫非同步 API 時建立)
+        self._async_transport = None
+        
     def analyze_image(self, image_path: str) -> Dict:
         """
         分析影像中的食物
@@ -45,7 +92,7 @@ class FoodRecognition:
             with open(image_path, 'rb') as image_file:
                 image_data = image_file.read()
             
-            return self._analyze_image_data(image_data)
+            return self._analyze_image_data(prepare_image_bytes(image_data, self.preprocess_settings))
             
         except FileNotFoundError:
             raise FileNotFoundError(f"找不到影像檔案: {image_path}")
@@ -62,17 +109,78 @@ class FoodRecognition:
         Returns:
             包含分析結果的字典
         """
-        return self._analyze_image_data(image_bytes)
+        return self._analyze_image_data(prepare_image_bytes(image_bytes, self.preprocess_settings))
     
-    def _analyze_image_data(self, image_data: bytes) -> Dict:
+    async def analyze_async(self, image_bytes: bytes) -> Dict:
         """
-        使用 Azure Computer Vision API 分析影像資料
+        analyze_image_from_bytes 的非同步版本
         
         Args:
-            image_data: 影像位元組資料
+            image_bytes: 影像位元組資料
             
         Returns:
-            分析結果字典
+            包含分析結果的字典
+        """
+        vision_url, headers, params = self._build_analyze_request()
+        image_bytes = await asyncio.to_thread(prepare_image_bytes, image_bytes, self.preprocess_settings)
+        
+        # 查詢快取，相同影像不重複呼叫 API
+        image_key = AnalysisCache.make_key(image_bytes, params)
+        # SQLite 查詢在執行緒中執行，不阻塞事件迴圈
+        result = await asyncio.to_thread(self.cache.get, image_key) if self.cache is not None else None
+        
+        if result is None:
+            async def fetch() -> Dict:
+                try:
+                    response = await self._get_async_transport().post(vision_url, headers=headers, params=params, data=image_bytes)
+                    response.raise_for_status()
+                    result = response.json()
+                except requests.exceptions.RequestException as e:
+                    raise Exception(f"API 請求失敗: {str(e)}")
+                except json.JSONDecodeError as e:
+                    raise Exception(f"解析 API 回應失敗: {str(e)}")
+                
+                if self.cache is not None:
+                    await asyncio.to_thread(self.cache.set, image_key, result)
+                return result
+            
+            # 同時進行的相同影像只發送一個請求
+            result = await self.single_flight.do_async((self.endpoint, image_key), fetch)
+        
+        # 結果處理移到執行緒，不佔用事件迴圈
+        return await asyncio.to_thread(self._process_analysis_result, result)
+    
+    async def analyze_many_async(self, images: List[bytes], concurrency: int = 8) -> List[Dict]:
+        """
+        同時分析多張影像
+        
+        Args:
+            images: 影像位元組資料列表
+            concurrency: 最大同時請求數量
+            
+        Returns:
+            分析結果列表 (順序與輸入相同，失敗的項目包含 error 欄位)
+        """
+        async def analyze_one(image_bytes: bytes) -> Dict:
+            try:
+                return await self.analyze_async(image_bytes)
+            except Exception as e:
+                return {'success': False, 'error': str(e)}
+        
+        return await run_bounded(analyze_one, images, concurrency)
+    
+    def _get_async_transport(self) -> AsyncVisionTransport:
+        """取得非同步傳輸層"""
+        if self._async_transport is None:
+            self._async_transport = AsyncVisionTransport(self.endpoint, self.transport.settings, self.rate_limiter)
+        return self._async_transport
+    
+    def _build_analyze_request(self) -> Tuple[str, Dict, Dict]:
+        """
+        建立 Azure Computer Vision 分析請求
+        
+        Returns:
+            (API 端點, 請求標頭, 分析參數)
         """
         # 設定 API 端點
         vision_url = f"{self.endpoint}/vision/v3.2/analyze"
@@ -90,21 +198,52 @@ class FoodRecognition:
             'model-version': 'latest'
         }
         
-        try:
-            # 發送請求
-            response = requests.post(vision_url, headers=headers, params=params, data=image_data)
-            response.raise_for_status()
-            
-            # 解析回應
-            result = response.json()
+        return vision_url, headers, params
+    
+    def _analyze_image_data(self, image_data: bytes) -> Dict:
+        """
+        使用 Azure Computer Vision API 分析影像資料
+        
+        Args:
+            image_data: 影像位元組資料
             
-            # 處理結果
-            return self._process_analysis_result(result)
+        Returns:
+            分析結果字典
+        """
+        vision_url, headers, params = self._build_analyze_request()
+        
+        # 查詢快取，相同影像不重複呼叫 API
+        image_key = AnalysisCache.make_key(image_data, params)
+        if self.cache is not None:
+            cached_result = self.cache.get(image_key)
+            if cached_result is not None:
+                return self._process_analysis_result(cached_result)
+        
+        def fetch() -> Dict:
+            try:
+                # 發送請求
+                response = self.transport.post(vision_url, headers=headers, params=params, data=image_data,
+                                               rate_limiter=self.rate_limiter)
+                response.raise_for_status()
+                
+                # 解析回應
+                result = response.json()
+                
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"API 請求失敗: {str(e)}")
+            except json.JSONDecodeError as e:
+                raise Exception(f"解析 API 回應失敗: {str(e)}")
             
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"API 請求失敗: {str(e)}")
-        except json.JSONDecodeError as e:
-            raise Exception(f"解析 API 回應失敗: {str(e)}")
+            # 寫入快取
+            if self.cache is not None:
+                self.cache.set(image_key, result)
+            return result
+        
+        # 同時進行的相同影像只發送一個請求，其餘呼叫者共用結果
+        result = self.single_flight.do((self.endpoint, image_key), fetch)
+        
+        # 處理結果
+        return self._process_analysis_result(result)
     
     def _process_analysis_result(self, result: Dict) -> Dict:
         """
@@ -184,26 +323,14 @@ class FoodRecognition:
         """
         food_tags = []
         
-        # 常見食物關鍵字
-        food_keywords = [
-            'food', 'meal', 'dish', 'cuisine', 'restaurant', 'cooking',
-            'apple', 'banana', 'orange', 'grape', 'strawberry', 'watermelon',
-            'rice', 'noodle', 'bread', 'pizza', 'hamburger', 'sandwich',
-            'chicken', 'beef', 'pork', 'fish', 'shrimp', 'salmon',
-            'vegetable', 'carrot', 'broccoli', 'tomato', 'lettuce', 'onion',
-            'soup', 'salad', 'dessert', 'cake', 'ice cream', 'chocolate',
-            'drink', 'coffee', 'tea', 'juice', 'milk', 'water',
-            'sushi', 'ramen', 'curry', 'pasta', 'steak', 'seafood'
-        ]
-        
         if not tags:
             return food_tags
-            
+        
         for tag in tags:
             if 'name' not in tag:
                 continue
             tag_name = tag['name'].lower()
-            if any(keyword in tag_name for keyword in food_keywords):
+            if any(keyword in tag_name for keyword in FOOD_TAG_KEYWORDS):
                 food_tags.append(tag['name'])
         
         return food_tags
@@ -228,30 +355,17 @@ class FoodRecognition:
             'minerals': []
         }
         
-        # 簡化的營養資料庫
-        nutrition_db = {
-            'apple': {'calories': 95, 'protein': 0.5, 'carbs': 25, 'fat': 0.3, 'fiber': 4},
-            'banana': {'calories': 105, 'protein': 1.3, 'carbs': 27, 'fat': 0.4, 'fiber': 3},
-            'rice': {'calories': 130, 'protein': 2.7, 'carbs': 28, 'fat': 0.3, 'fiber': 0.4},
-            'chicken': {'calories': 165, 'protein': 31, 'carbs': 0, 'fat': 3.6, 'fiber': 0},
-            'salad': {'calories': 20, 'protein': 2, 'carbs': 4, 'fat': 0.2, 'fiber': 2},
-            'pizza': {'calories': 266, 'protein': 11, 'carbs': 33, 'fat': 10, 'fiber': 2},
-            'soup': {'calories': 50, 'protein': 3, 'carbs': 8, 'fat': 1, 'fiber': 2},
-            'bread': {'calories': 79, 'protein': 3, 'carbs': 15, 'fat': 1, 'fiber': 1},
-            'fish': {'calories': 100, 'protein': 20, 'carbs': 0, 'fat': 2, 'fiber': 0},
-            'vegetable': {'calories': 25, 'protein': 2, 'carbs': 5, 'fat': 0.2, 'fiber': 3}
-        }
+        # 行程共用的唯讀營養資料庫
+        nutrition_db = get_registry()
         
         for food in foods:
-            food_lower = food.lower()
-            for db_food, nutrition in nutrition_db.items():
-                if db_food in food_lower:
-                    nutrition_info['total_calories'] += nutrition['calories']
-                    nutrition_info['protein'] += nutrition['protein']
-                    nutrition_info['carbohydrates'] += nutrition['carbs']
-                    nutrition_info['fat'] += nutrition['fat']
-                    nutrition_info['fiber'] += nutrition['fiber']
-                    break
+            nutrition = nutrition_db.lookup(food)
+            if nutrition is not None:
+                nutrition_info['total_calories'] += nutrition.calories
+                nutrition_info['protein'] += nutrition.protein
+                nutrition_info['carbohydrates'] += nutrition.carbs
+                nutrition_info['fat'] += nutrition.fat
+                nutrition_info['fiber'] += nutrition.fiber
         
         return nutrition_info
     
@@ -326,40 +440,4 @@ class FoodRecognition:
         Returns:
             健康評分
         """
-        score = 50  # 基礎分數
-        
-        calories = nutrition_info['total_calories']
-        protein = nutrition_info['protein']
-        carbs = nutrition_info['carbohydrates']
-        fat = nutrition_info['fat']
-        fiber = nutrition_info['fiber']
-        
-        # 根據營養素調整分數
-        if 200 <= calories <= 800:
-            score += 10
-        elif calories < 200:
-            score += 5
-        else:
-            score -= 10
-        
-        if protein >= 15:
-            score += 10
-        elif protein >= 10:
-            score += 5
-        
-        if carbs <= 50:
-            score += 10
-        elif carbs <= 80:
-            score += 5
-        
-        if fat <= 20:
-            score += 10
-        elif fat <= 30:
-            score += 5
-        
-        if fiber >= 5:
-            score += 10
-        elif fiber >= 3:
-            score += 5
-        
-        return max(0, min(100, score)) 
\ No newline at end of file
+        return int(score_results([nutrition_info]).health_scores[0]) 
\ No newline at end of file
@@ -7,26 +7,28 @@ Azure AI 食物影像辨識 - API 腳本
 import sys
 import json
 import argparse
-import requests
 from food_recognition import FoodRecognition
+from analysis_cache import AnalysisCache, DEFAULT_CACHE_PATH
+from image_preprocess import download_image
 
 def main():
     """主函數"""
     parser = argparse.ArgumentParser(description='Azure AI 食物影像辨識 API')
     parser.add_argument('image_path', nargs='?', help='影像檔案路徑')
     parser.add_argument('--url', help='影像URL')
+    parser.add_argument('--cache-path', default=DEFAULT_CACHE_PATH, help='分析結果快取檔案')
+    parser.add_argument('--no-cache', action='store_true', help='不使用分析結果快取')
     
     args = parser.parse_args()
     
     try:
         # 初始化食物辨識器
-        food_recognizer = FoodRecognition()
+        cache = None if args.no_cache else AnalysisCache(args.cache_path)
+        food_recognizer = FoodRecognition(cache=cache)
         
         if args.url:
-            # 從URL處理影像
-            response = requests.get(args.url)
-            response.raise_for_status()
-            image_data = response.content
+            # 從URL處理影像 (串流下載並限制大小)
+            image_data = download_image(args.url)
             result = food_recognizer.analyze_image_from_bytes(image_data)
         elif args.image_path:
             # 從檔案路徑處理影像
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+影像幀近似重複偵測
+使用差異雜湊 (dHash) 判斷連續影像幀是否幾乎相同，避免重複呼叫 API
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+import logging
+
+import numpy as np
+import cv2
+
+logger = logging.getLogger(__name__)
+
+def dhash(frame: np.ndarray, hash_size: int = 8) -> int:
+    """
+    計算影像幀的差異雜湊
+
+    Args:
+        frame: 影像幀 (BGR 或灰階 numpy array)
+        hash_size: 雜湊邊長，產生 hash_size * hash_size 位元
+
+    Returns:
+        整數形式的雜湊值
+    """
+    if frame.ndim == 3:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = frame
+
+    # 縮小成 (hash_size + 1) x hash_size，比較相鄰像素亮度
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    diff = small[:, 1:] > small[:, :-1]
+
+    return int.from_bytes(np.packbits(diff.flatten()).tobytes(), 'big')
+
+def hamming_distance(a: int, b: int) -> int:
+    """計算兩個雜湊值的漢明距離"""
+    return bin(a ^ b).count('1')
+
+class FrameDeduplicator:
+    """近似重複影像幀過濾器"""
+
+    def __init__(self, threshold: int = 5, window: int = 8, max_age: float = 30.0, hash_size: int = 8):
+        """
+        初始化過濾器
+
+        Args:
+            threshold: 漢明距離閾值，小於等於此值視為相同畫面
+            window: 保留最近幾個影像幀的結果
+            max_age: 結果可重複使用的最長秒數 (0 表示不限)
+            hash_size: dHash 邊長
+        """
+        self.threshold = threshold
+        self.max_age = max_age
+        self.hash_size = hash_size
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+        # 統計資訊
+        self.frames_seen = 0
+        self.calls_saved = 0
+
+    @classmethod
+    def from_env(cls) -> Optional['FrameDeduplicator']:
+        """根據 FRAME_DEDUP_THRESHOLD 環境變數建立過濾器，設為負數時停用"""
+        threshold = int(os.getenv('FRAME_DEDUP_THRESHOLD', 5))
+        if threshold < 0:
+            return None
+        return cls(
+            threshold=threshold,
+            max_age=float(os.getenv('FRAME_DEDUP_MAX_AGE', 30.0))
+        )
+
+    def compute_hash(self, frame: np.ndarray) -> int:
+        """計算影像幀雜湊"""
+        return dhash(frame, self.hash_size)
+
+    def lookup(self, frame_hash: int) -> Optional[Any]:
+        """
+        尋找近似影像幀的先前結果
+
+        Args:
+            frame_hash: 影像幀雜湊
+
+        Returns:
+            先前的結果，找不到時回傳 None
+        """
+        now = time.time()
+
+        with self._lock:
+            self.frames_seen += 1
+            best = None
+            best_distance = self.threshold + 1
+
+            for previous_hash, result, created_at in self._recent:
+                if self.max_age > 0 and now - created_at > self.max_age:
+                    continue
+                distance = hamming_distance(frame_hash, previous_hash)
+                if distance < best_distance:
+                    best, best_distance = result, distance
+
+            if best is not None:
+                self.calls_saved += 1
+            return best
+
+    def remember(self, frame_hash: int, result: Any):
+        """記錄影像幀的結果"""
+        with self._lock:
+            self._recent.append((frame_hash, result, time.time()))
+
+    def reset(self):
+        """清除記錄 (例如切換相機或場景時)"""
+        with self._lock:
+            self._recent.clear()
+
+    def get_statistics(self) -> Dict:
+        """獲取統計資訊"""
+        return {
+            'frames_seen': self.frames_seen,
+            'calls_saved': self.calls_saved,
+            'saved_ratio': self.calls_saved / self.frames_seen if self.frames_seen else 0.0
+        }
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+食品名稱模糊搜尋索引
+以字元 n-gram (二字元與三字元) 建立倒排索引，查詢時只計算共享 n-gram 的候選項目，
+依相似度 (Jaccard) 排序回傳前 k 名；中文短名稱 (例如「白飯」) 也能比對
+
+候選項目以 prefix filtering 產生：相似度要達到門檻 t，查詢的 n-gram 中
+至少要有 |Q| - ceil(t|Q|) + 1 個裡的一個是共享的，因此只需掃描最少見的那幾個 n-gram 的倒排串列；
+其餘 n-gram 只用來補足候選的共享數量
+
+查詢結果記在記憶體 LRU 中；設定 FUZZY_MEMO_PATH 時也寫入 SQLite，
+以資料庫內容的版本區分，行程重新啟動後看過的影像標籤不需重新搜尋
+"""
+
+import os
+import json
+import math
+import heapq
+import sqlite3
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+def ngrams(text: str) -> FrozenSet[str]:
+    """
+    取得文字的二字元與三字元 n-gram (前後補空白，讓字首字尾也有權重)
+
+    Args:
+        text: 食品名稱
+
+    Returns:
+        n-gram 集合
+    """
+    padded = f" {' '.join(text.lower().split())} "
+    grams = set()
+    for size in (2, 3):
+        for start in range(len(padded) - size + 1):
+            grams.add(padded[start:start + size])
+    return frozenset(grams)
+
+class SearchMemoStore:
+    """以 SQLite 保存的模糊搜尋結果 (鍵為資料庫版本與查詢參數)"""
+
+    def __init__(self, path: str):
+        """
+        開啟結果檔案
+
+        Args:
+            path: SQLite 檔案路徑
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # 只是快取，不需要每次寫入都同步到磁碟
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS fuzzy_memo ('
+            'version TEXT NOT NULL, query TEXT NOT NULL, k INTEGER NOT NULL, min_score REAL NOT NULL, '
+            'result TEXT NOT NULL, PRIMARY KEY (version, query, k, min_score))'
+        )
+        self._conn.commit()
+
+    def get(self, version: str, key: Tuple[str, int, float]) -> Optional[Tuple[Tuple[str, float], ...]]:
+        """讀取結果，找不到時回傳 None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT result FROM fuzzy_memo WHERE version = ? AND query = ? AND k = ? AND min_score = ?',
+                (version,) + key
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            return tuple((name, score) for name, score in json.loads(row[0]))
+        except ValueError as e:
+            logger.warning(f"模糊搜尋結果損毀，已忽略: {e}")
+            return None
+
+    def set(self, version: str, key: Tuple[str, int, float], result: Tuple[Tuple[str, float], ...]):
+        """寫入結果"""
+        payload = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO fuzzy_memo (version, query, k, min_score, result) VALUES (?, ?, ?, ?, ?)',
+                (version,) + key + (payload,)
+            )
+            self._conn.commit()
+
+    def close(self):
+        """關閉檔案"""
+        with self._lock:
+            self._conn.close()
+
+_shared_store: Optional[SearchMemoStore] = None
+_shared_store_lock = threading.Lock()
+
+def get_memo_store() -> Optional[SearchMemoStore]:
+    """依 FUZZY_MEMO_PATH 環境變數取得共用的結果檔案，未設定時回傳 None"""
+    global _shared_store
+    path = os.getenv('FUZZY_MEMO_PATH')
+    if not path:
+        return None
+    with _shared_store_lock:
+        if _shared_store is None or _shared_store.path != path:
+            _shared_store = SearchMemoStore(path)
+        return _shared_store
+
+class TrigramIndex:
+    """n-gram 倒排索引"""
+
+    def __init__(self, names: Iterable[str], memo_size: int = 4096, store: Optional[SearchMemoStore] = None):
+        """
+        建立索引
+
+        Args:
+            names: 食品名稱列表
+            memo_size: 記住最近查詢結果的數量 (相同影像標籤大量重複，最近最少使用者先移除)
+            store: 保存查詢結果的檔案 (None 表示使用 FUZZY_MEMO_PATH 設定的檔案，未設定時只記在記憶體)
+        """
+        self.names: List[str] = []
+        self._sizes: List[int] = []
+        self._postings: Dict[str, List[int]] = {}
+
+        for name in names:
+            index = len(self.names)
+            grams = ngrams(name)
+            self.names.append(name)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(index)
+
+        self._init_memo(memo_size, store)
+
+    def _init_memo(self, memo_size: int, store: Optional[SearchMemoStore] = None):
+        self.memo_size = memo_size
+        self._memo: 'OrderedDict[Tuple[str, int, float], Tuple[Tuple[str, float], ...]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._store = store if store is not None else get_memo_store()
+        self._version: Optional[str] = None
+
+        # 統計資訊
+        self.queries = 0
+        self.memo_hits = 0
+        self.store_hits = 0
+
+    def version(self) -> str:
+        """
+        索引內容的版本 (所有名稱的雜湊值)
+
+        名稱相同的資料庫搜尋結果相同，資料檔更新後版本改變，舊的保存結果不會被使用。
+        """
+        if self._version is None:
+            digest = hashlib.sha256()
+            for index in range(len(self)):
+                digest.update(self._name(index).encode('utf-8'))
+                digest.update(b'\n')
+            self._version = digest.hexdigest()
+        return self._version
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    # 以下存取方法讓其他儲存方式 (例如記憶體映射檔案) 共用同一套搜尋邏輯
+
+    def _posting(self, gram: str):
+        """含有此 n-gram 的項目編號"""
+        return self._postings.get(gram, ())
+
+    def _entry_size(self, index: int) -> int:
+        """項目的 n-gram 數量"""
+        return self._sizes[index]
+
+    def _name(self, index: int) -> str:
+        return self.names[index]
+
+    def _gram_count(self) -> int:
+        return len(self._postings)
+
+    def search(self, query: str, k: int = 5, min_score: float = 0.3) -> List[Tuple[str, float]]:
+        """
+        搜尋最相似的名稱
+
+        Args:
+            query: 查詢文字 (例如 Azure 標籤)
+            k: 回傳候選數量
+            min_score: 最低相似度 (0~1)
+
+        Returns:
+            [(名稱, 相似度), ...]，依相似度由高到低排序，同分時以資料順序為準
+        """
+        key = (query.lower(), k, min_score)
+        with self._lock:
+            self.queries += 1
+            cached = self._memo.get(key)
+            if cached is not None:
+                self.memo_hits += 1
+                self._memo.move_to_end(key)
+                return list(cached)
+
+        if self._store is not None:
+            cached = self._store.get(self.version(), key)
+            if cached is not None:
+                with self._lock:
+                    self.store_hits += 1
+                    self._remember(key, cached)
+                return list(cached)
+
+        query_grams = ngrams(query)
+        query_size = len(query_grams)
+        min_shared = max(1, math.ceil(min_score * query_size))
+
+        # 只取最少見的 n-gram 產生候選 (索引中沒有的 n-gram 排最前面，不產生候選)
+        postings = sorted((self._posting(gram) for gram in query_grams), key=len)
+        prefix_size = query_size - min_shared + 1
+        shared_counts = Counter()
+        for posting in postings[:prefix_size]:
+            shared_counts.update(posting)
+        candidates = set(shared_counts)
+
+        # 其餘較常見的 n-gram 只用來補足候選的共享數量，不再產生新的候選
+        for posting in postings[prefix_size:]:
+            shared_counts.update(candidates.intersection(posting))
+
+        scored = []
+        for index in candidates:
+            shared = shared_counts[index]
+            if shared < min_shared:
+                continue
+            score = shared / (query_size + self._entry_size(index) - shared)
+            if score >= min_score:
+                scored.append((score, -index))
+
+        result = tuple((self._name(-negative), score) for score, negative in heapq.nlargest(k, scored))
+
+        with self._lock:
+            self._remember(key, result)
+        if self._store is not None:
+            self._store.set(self.version(), key, result)
+        return list(result)
+
+    def _remember(self, key: Tuple[str, int, float], result: Tuple[Tuple[str, float], ...]):
+        """放入記憶體 LRU (呼叫者須持有鎖)"""
+        self._memo[key] = result
+        if len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+
+    def best(self, query: str, min_score: float = 0.3):
+        """
+        最相似的單一名稱
+
+        Returns:
+            (名稱, 相似度)，沒有達到門檻的候選時回傳 None
+        """
+        candidates = self.search(query, 1, min_score)
+        return candidates[0] if candidates else None
+
+    def get_statistics(self) -> Dict:
+        """獲取統計資訊"""
+        return {
+            'entries': len(self),
+            'ngrams': self._gram_count(),
+            'queries': self.queries,
+            'memo_hits': self.memo_hits,
+            'store_hits': self.store_hits,
+            'memo_hit_ratio': self.memo_hits / self.queries if self.queries else 0.0
+        }
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+抓取器共用的 HTTP 回應磁碟快取
+以請求方法、網址與正規化後的參數/表單內容為鍵，壓縮後存放在 SQLite 檔案中 (多個行程可共用)；
+每個資料來源有各自的有效時間，過期後以 ETag / Last-Modified 條件式請求確認，
+未變更 (304) 時直接使用快取內容，重新執行抓取器不需再次下載相同頁面
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import logging
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from rate_limiter import RateLimitedAdapter, RetryPolicy, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# 不影響回應內容的參數 (API 金鑰與 ASP.NET 頁面狀態)，不列入快取鍵
+IGNORED_PARAMS = frozenset({'api_key', '__VIEWSTATE', '__VIEWSTATEGENERATOR', '__EVENTVALIDATION'})
+
+# 解壓縮後儲存的內容不再需要的標頭
+_DROPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+# 預設有效時間 (秒)
+DEFAULT_TTL = 86400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    source TEXT,
+    url TEXT,
+    status INTEGER,
+    headers TEXT,
+    body BLOB,
+    stored_at REAL,
+    etag TEXT,
+    last_modified TEXT
+)
+"""
+
+def _normalize_pairs(pairs: Iterable[Tuple[str, str]], ignored: Iterable[str]) -> str:
+    return urlencode(sorted((name, value) for name, value in pairs if name not in ignored))
+
+def cache_key(method: str, url: str, body=None, content_type: str = '',
+              ignored: Iterable[str] = IGNORED_PARAMS) -> str:
+    """
+    計算請求的快取鍵
+
+    網址參數與表單欄位依名稱排序，JSON 內容以排序後的鍵序列化，並略過 ignored 中的欄位。
+
+    Args:
+        method: 請求方法
+        url: 完整網址 (含查詢參數)
+        body: 請求內容
+        content_type: 請求的 Content-Type
+        ignored: 不列入快取鍵的參數名稱
+
+    Returns:
+        SHA-256 十六進位字串
+    """
+    ignored = frozenset(ignored)
+    parts = urlsplit(url)
+    query = _normalize_pairs(parse_qsl(parts.query, keep_blank_values=True), ignored)
+    normalized_url = urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', query, ''))
+
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', errors='replace')
+    body = body or ''
+    if body and 'json' in content_type:
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':'))
+        except ValueError:
+            pass
+    elif body and 'x-www-form-urlencoded' in content_type:
+        body = _normalize_pairs(parse_qsl(body, keep_blank_values=True), ignored)
+
+    return hashlib.sha256('\n'.join((method.upper(), normalized_url, body)).encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """SQLite 回應快取 (內容以 zlib 壓縮)"""
+
+    def __init__(self, directory: str, filename: str = 'http_cache.sqlite'):
+        """
+        初始化快取
+
+        Args:
+            directory: 快取資料夾 (不存在時建立)
+            filename: 資料庫檔名
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, filename)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(_SCHEMA)
+
+        # 統計資訊
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.stored = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        """讀取快取項目，沒有時回傳 None"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT url, status, headers, body, stored_at, etag, last_modified FROM responses WHERE key = ?',
+                (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        url, status, headers, body, stored_at, etag, last_modified = row
+        return {
+            'url': url,
+            'status': status,
+            'headers': json.loads(headers),
+            'body': zlib.decompress(body),
+            'stored_at': stored_at,
+            'etag': etag,
+            'last_modified': last_modified
+        }
+
+    def put(self, key: str, source: str, response: requests.Response):
+        """儲存回應 (內容為已解壓縮的 response.content)"""
+        headers = {name: value for name, value in response.headers.items() if name.lower() not in _DROPPED_HEADERS}
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, source, response.url, response.status_code, json.dumps(headers),
+                 zlib.compress(response.content), time.time(),
+                 response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            )
+            self.stored += 1
+
+    def record(self, outcome: str):
+        """
+        記錄一次查詢結果 (配接器可能由多個執行緒同時使用)
+
+        Args:
+            outcome: 'hits'、'misses' 或 'revalidated'
+        """
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def touch(self, key: str, response: requests.Response):
+        """304 回應後更新儲存時間與驗證標頭"""
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE responses SET stored_at = ?, etag = COALESCE(?, etag), '
+                'last_modified = COALESCE(?, last_modified) WHERE key = ?',
+                (time.time(), response.headers.get('ETag'), response.headers.get('Last-Modified'), key)
+            )
+
+    def clear(self, source: Optional[str] = None):
+        """清除快取 (指定 source 時只清除該來源)"""
+        with self._lock, self._db:
+            if source is None:
+                self._db.execute('DELETE FROM responses')
+            else:
+                self._db.execute('DELETE FROM responses WHERE source = ?', (source,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def get_statistics(self) -> Dict:
+        """獲取統計資訊"""
+        entries = len(self)
+        with self._lock:
+            hits, misses, revalidated, stored = self.hits, self.misses, self.revalidated, self.stored
+        requests_count = hits + misses + revalidated
+        return {
+            'path': self.path,
+            'entries': entries,
+            'hits': hits,
+            'misses': misses,
+            'revalidated': revalidated,
+            'stored': stored,
+            'hit_ratio': (hits + revalidated) / requests_count if requests_count else 0.0
+        }
+
+class CachingAdapter(RateLimitedAdapter):
+    """先查詢回應快取的連線配接器 (未命中或需要確認時才經過速率限制發送請求)"""
+
+    def __init__(self, cache: ResponseCache, source: str, ttl: float = DEFAULT_TTL,
+                 limiter: Optional[TokenBucket] = None, policy: Optional[RetryPolicy] = None,
+                 methods: Iterable[str] = ('GET', 'POST'), **kwargs):
+        """
+        Args:
+            cache: 回應快取
+            source: 資料來源名稱 (例如 USDA、FDA)
+            ttl: 快取有效秒數，過期後以條件式請求確認
+            limiter: 速率限制器
+            policy: 重試策略
+            methods: 要快取的請求方法 (這些抓取器的 POST 都是查詢)
+        """
+        self.cache = cache
+        self.source = source
+        self.ttl = ttl
+        self.methods = frozenset(method.upper() for method in methods)
+        super().__init__(limiter, policy, **kwargs)
+
+    def send(self, request, **kwargs):
+        if request.method not in self.methods or 'no-store' in request.headers.get('Cache-Control', ''):
+            return super().send(request, **kwargs)
+
+        key = cache_key(request.method, request.url, request.body, request.headers.get('Content-Type', ''))
+        entry = self.cache.get(key)
+        if entry is not None and time.time() - entry['stored_at'] < self.ttl:
+            self.cache.record('hits')
+            return self._cached_response(request, entry)
+
+        if entry is not None:
+            if entry['etag']:
+                request.headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                request.headers['If-Modified-Since'] = entry['last_modified']
+
+        response = super().send(request, **kwargs)
+
+        if entry is not None and response.status_code == 304:
+            self.cache.record('revalidated')
+            self.cache.touch(key, response)
+            response.close()
+            return self._cached_response(request, entry)
+
+        self.cache.record('misses')
+        if response.status_code == 200 and 'no-store' not in response.headers.get('Cache-Control', ''):
+            self.cache.put(key, self.source, response)
+        return response
+
+    def _cached_response(self, request, entry: Dict) -> requests.Response:
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response._content = entry['body']
+        response.url = entry['url']
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.reason = 'OK'
+        response.request = request
+        response.connection = self
+        response.from_cache = True
+        return response
+
+# 同一行程中相同資料夾的快取共用同一個物件
+_caches: Dict[str, ResponseCache] = {}
+_caches_lock = threading.Lock()
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    依環境變數 HTTP_CACHE_DIR 取得共用的回應快取
+
+    Returns:
+        共用的快取，未設定資料夾時回傳 None
+    """
+    directory = os.getenv('HTTP_CACHE_DIR')
+    if not directory:
+        return None
+
+    directory = os.path.abspath(directory)
+    with _caches_lock:
+        cache = _caches.get(directory)
+        if cache is None:
+            cache = ResponseCache(directory)
+            _caches[directory] = cache
+        return cache
+
+def install_http_cache(session: requests.Session, source: str, limiter: Optional[TokenBucket] = None,
+                       policy: Optional[RetryPolicy] = None,
+                       cache: Optional[ResponseCache] = None) -> Optional[RateLimitedAdapter]:
+    """
+    將回應快取、速率限制與重試掛載到 requests.Session
+
+    未指定 cache 且未設定 HTTP_CACHE_DIR 時只掛載速率限制 (同 install_rate_limiter)，
+    此時若也沒有指定 limiter 與 policy 則不掛載任何配接器，Session 維持原本的行為；
+    有快取但沒有指定 policy 時不重試，只多了快取。有效時間讀取 <SOURCE>_CACHE_TTL (秒，預設一天)。
+
+    Args:
+        session: 要掛載的 Session
+        source: 資料來源名稱，例如 USDA、FDA
+        limiter: 速率限制器
+        policy: 重試策略
+        cache: 回應快取 (預設依 HTTP_CACHE_DIR 決定)
+
+    Returns:
+        掛載的配接器，沒有掛載時回傳 None
+    """
+    cache = cache if cache is not None else get_response_cache()
+    if cache is None:
+        if limiter is None and policy is None:
+            return None
+        adapter = RateLimitedAdapter(limiter, policy)
+    else:
+        ttl = float(os.getenv(f'{source.upper()}_CACHE_TTL', DEFAULT_TTL))
+        adapter = CachingAdapter(cache, source.upper(), ttl, limiter, policy or RetryPolicy(max_retries=0))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return adapter
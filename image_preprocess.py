@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+上傳前影像前處理
+限制長邊尺寸並調整 JPEG 品質以符合位元組預算，減少上傳到 Azure 的資料量
+"""
+
+import io
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+import logging
+
+import numpy as np
+import cv2
+import requests
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class PreprocessSettings:
+    """影像前處理設定"""
+    max_edge: int = 1024                        # 長邊最大像素 (0 表示不縮小)
+    target_bytes: int = 200 * 1024              # JPEG 目標大小
+    min_quality: int = 50
+    max_quality: int = 90
+    max_download_bytes: int = 10 * 1024 * 1024  # 網址下載上限
+
+    @classmethod
+    def from_env(cls) -> 'PreprocessSettings':
+        """從環境變數讀取設定"""
+        return cls(
+            max_edge=int(os.getenv('IMAGE_MAX_EDGE', cls.max_edge)),
+            target_bytes=int(os.getenv('IMAGE_TARGET_BYTES', cls.target_bytes)),
+            min_quality=int(os.getenv('IMAGE_MIN_QUALITY', cls.min_quality)),
+            max_quality=int(os.getenv('IMAGE_MAX_QUALITY', cls.max_quality)),
+            max_download_bytes=int(os.getenv('IMAGE_MAX_DOWNLOAD_BYTES', cls.max_download_bytes))
+        )
+
+def _scaled_size(width: int, height: int, max_edge: int) -> Tuple[int, int]:
+    """計算長邊不超過 max_edge 的尺寸"""
+    long_edge = max(width, height)
+    if max_edge <= 0 or long_edge <= max_edge:
+        return width, height
+    scale = max_edge / long_edge
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def _encode_with_budget(encode, settings: PreprocessSettings) -> bytes:
+    """
+    找出不超過目標大小的最高 JPEG 品質
+
+    先以最高品質編碼，多數已縮小的影像一次就符合預算；超過時才以二分搜尋較低的品質。
+
+    Args:
+        encode: 接受品質參數並回傳 JPEG 位元組的函數
+        settings: 前處理設定
+
+    Returns:
+        JPEG 位元組 (最低品質仍超過預算時回傳最低品質的結果)
+    """
+    data = encode(settings.max_quality)
+    if len(data) <= settings.target_bytes or settings.max_quality <= settings.min_quality:
+        return data
+
+    low, high = settings.min_quality, settings.max_quality - 1
+    best = None
+    lowest = None  # 最低品質的結果 (已編碼過就不再重新編碼)
+
+    while low <= high:
+        quality = (low + high) // 2
+        data = encode(quality)
+        if len(data) <= settings.target_bytes:
+            best = data
+            low = quality + 1
+        else:
+            high = quality - 1
+            if quality == settings.min_quality:
+                lowest = data
+
+    if best is not None:
+        return best
+    return lowest if lowest is not None else encode(settings.min_quality)
+
+def encode_frame(frame: np.ndarray, settings: Optional[PreprocessSettings] = None) -> bytes:
+    """
+    將影像幀縮小並編碼成符合位元組預算的 JPEG
+
+    Args:
+        frame: 影像幀 (BGR numpy array)
+        settings: 前處理設定
+
+    Returns:
+        JPEG 位元組
+    """
+    settings = settings or PreprocessSettings.from_env()
+
+    height, width = frame.shape[:2]
+    new_size = _scaled_size(width, height, settings.max_edge)
+    if new_size != (width, height):
+        frame = cv2.resize(frame, new_size, interpolation=cv2.INTER_AREA)
+
+    def encode(quality: int) -> bytes:
+        success, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        if not success:
+            raise ValueError("影像編碼失敗")
+        return buffer.tobytes()
+
+    return _encode_with_budget(encode, settings)
+
+def prepare_image_bytes(image_data: bytes, settings: Optional[PreprocessSettings] = None) -> bytes:
+    """
+    縮小並重新編碼影像檔案內容
+
+    已經夠小的影像原樣回傳；無法解碼的資料也原樣回傳，交由 API 回報錯誤。
+
+    Args:
+        image_data: 原始影像位元組
+        settings: 前處理設定
+
+    Returns:
+        要上傳的影像位元組
+    """
+    settings = settings or PreprocessSettings.from_env()
+
+    try:
+        image = Image.open(io.BytesIO(image_data))
+        width, height = image.size
+        if (max(width, height) <= settings.max_edge or settings.max_edge <= 0) \
+                and len(image_data) <= settings.target_bytes \
+                and image.format in ('JPEG', 'PNG'):
+            return image_data
+
+        # JPEG 可在解碼時直接以 1/2、1/4、1/8 縮小，省下完整解碼的時間與記憶體
+        target_size = _scaled_size(width, height, settings.max_edge)
+        if image.format == 'JPEG':
+            image.draft('RGB', target_size)
+
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if settings.max_edge > 0:
+            image.thumbnail((settings.max_edge, settings.max_edge), Image.LANCZOS)
+    except Exception as e:
+        logger.debug(f"影像前處理略過，使用原始資料: {e}")
+        return image_data
+
+    def encode(quality: int) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=quality, optimize=True)
+        return buffer.getvalue()
+
+    prepared = _encode_with_budget(encode, settings)
+
+    # 重新編碼反而變大時保留原始資料
+    if len(prepared) >= len(image_data):
+        return image_data
+
+    logger.debug(f"影像前處理: {len(image_data)} -> {len(prepared)} bytes")
+    return prepared
+
+def download_image(url: str, max_bytes: Optional[int] = None, timeout: float = 15.0,
+                   session: Optional[requests.Session] = None) -> bytes:
+    """
+    以串流方式下載影像，超過大小上限時中止
+
+    Args:
+        url: 影像網址
+        max_bytes: 下載大小上限 (預設依 IMAGE_MAX_DOWNLOAD_BYTES 環境變數)
+        timeout: 逾時秒數
+        session: 要使用的 requests.Session
+
+    Returns:
+        影像位元組
+
+    Raises:
+        ValueError: 影像超過大小上限
+        requests.exceptions.RequestException: 下載失敗
+    """
+    if max_bytes is None:
+        max_bytes = PreprocessSettings.from_env().max_download_bytes
+
+    getter = session.get if session is not None else requests.get
+    with getter(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            raise ValueError(f"影像過大 ({int(content_length)} bytes)，上限為 {max_bytes} bytes")
+
+        chunks = []
+        received = 0
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            received += len(chunk)
+            if received > max_bytes:
+                raise ValueError(f"影像超過大小上限 {max_bytes} bytes")
+            chunks.append(chunk)
+
+    return b''.join(chunks)
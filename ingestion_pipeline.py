@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+多階段串流影像處理管線
+解碼 → 縮小 → 編碼 → 上傳 → 結果處理，每個階段有各自的有限佇列與工作者數量，
+讓 CPU 工作與網路等待重疊進行，並回報每個階段的背壓狀況
+"""
+
+import io
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+import logging
+
+import numpy as np
+import cv2
+from PIL import Image, ImageOps
+
+from image_preprocess import PreprocessSettings, encode_frame
+
+logger = logging.getLogger(__name__)
+
+# 佇列結束標記
+_STOP = object()
+
+# 等待佇列時檢查是否已取消的間隔 (秒)
+_POLL_INTERVAL = 0.1
+
+@dataclass
+class PipelineItem:
+    """在管線中流動的項目"""
+    index: int
+    source: Any
+    value: Any = None
+    error: Optional[Exception] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+
+def decode_image(source: Any, max_edge: int = 0) -> np.ndarray:
+    """
+    將影像來源解碼成 BGR 影像幀
+
+    JPEG 使用 PIL draft 模式直接以縮小的解析度解碼。
+
+    Args:
+        source: 檔案路徑、影像位元組或已解碼的影像幀
+        max_edge: 目標長邊像素 (0 表示完整解析度)
+
+    Returns:
+        BGR numpy array
+    """
+    if isinstance(source, np.ndarray):
+        return source
+
+    if isinstance(source, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(source))
+    else:
+        image = Image.open(source)
+
+    with image:
+        if image.format == 'JPEG' and max_edge > 0:
+            image.draft('RGB', (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+
+def resize_frame(frame: np.ndarray, max_edge: int) -> np.ndarray:
+    """將影像幀的長邊縮小到 max_edge 以內"""
+    height, width = frame.shape[:2]
+    long_edge = max(width, height)
+    if max_edge <= 0 or long_edge <= max_edge:
+        return frame
+    scale = max_edge / long_edge
+    return cv2.resize(frame, (max(1, round(width * scale)), max(1, round(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+def preprocess_source(source: Any, max_edge: int, settings: PreprocessSettings) -> bytes:
+    """
+    解碼、縮小並編碼成上傳用的 JPEG (在行程池中一次完成)
+
+    行程之間只傳遞來源 (路徑或位元組) 與編碼結果，不需要 pickle 完整的影像幀。
+    """
+    return encode_frame(resize_frame(decode_image(source, max_edge), max_edge), settings)
+
+def _put(target: queue.Queue, item: Any, cancel: threading.Event) -> bool:
+    """放入佇列，取消時放棄並回傳 False (佇列已滿時不會永遠阻塞)"""
+    while not cancel.is_set():
+        try:
+            target.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _get(source: queue.Queue, cancel: threading.Event) -> Any:
+    """從佇列取出，取消時回傳 None"""
+    while not cancel.is_set():
+        try:
+            return source.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            pass
+    return None
+
+def _drain(pending: queue.Queue):
+    """清空佇列，讓阻塞在放入的執行緒可以離開"""
+    while True:
+        try:
+            pending.get_nowait()
+        except queue.Empty:
+            return
+
+class _StageStats:
+    """單一階段的統計資訊"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.errors = 0
+        self.busy = 0.0      # 實際處理時間
+        self.blocked = 0.0   # 下游佇列已滿，等待放入的時間 (背壓)
+        self.starved = 0.0   # 上游沒有資料，等待取出的時間
+        self.max_queue = 0
+
+class PipelineStage:
+    """管線階段"""
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1,
+                 queue_size: int = 32, use_process: bool = False):
+        """
+        初始化階段
+
+        Args:
+            name: 階段名稱
+            func: 處理函數 (use_process 時必須可被 pickle)
+            workers: 同時處理的數量
+            queue_size: 輸入佇列上限
+            use_process: 是否在行程池中執行 (適合受 GIL 限制的 CPU 工作)
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.use_process = use_process
+
+class IngestionPipeline:
+    """以 FoodDetector / EnhancedFoodDetector 為核心的多階段處理管線"""
+
+    def __init__(self, detector, preprocess_settings: Optional[PreprocessSettings] = None,
+                 decode_workers: int = 2, resize_workers: int = 2, encode_workers: int = 2,
+                 upload_workers: int = 16, postprocess_workers: int = 2,
+                 queue_size: int = 32, use_processes: bool = False):
+        """
+        初始化管線
+
+        Args:
+            detector: FoodDetector 或 EnhancedFoodDetector
+            preprocess_settings: 縮小與編碼設定 (預設使用偵測器的設定)
+            decode_workers: 解碼工作者數量
+            resize_workers: 縮小工作者數量
+            encode_workers: 編碼工作者數量
+            upload_workers: 同時上傳的請求數量
+            postprocess_workers: 結果處理工作者數量
+            queue_size: 每個階段的輸入佇列上限
+            use_processes: 解碼/縮小/編碼是否使用行程池 (預設使用執行緒，OpenCV 會釋放 GIL)；
+                使用行程池時三個階段合併成單一 prepare 階段，工作者數量為三者總和 (最多 CPU 數量)
+        """
+        self.detector = detector
+        self.settings = preprocess_settings or getattr(detector, 'preprocess_settings', None) or PreprocessSettings.from_env()
+        self.use_processes = use_processes
+
+        max_edge = self.settings.max_edge
+        if use_processes:
+            # 行程間只傳遞來源與 JPEG 位元組，避免每個階段都 pickle 完整影像幀
+            cpu_workers = min(decode_workers + resize_workers + encode_workers, os.cpu_count() or 1)
+            cpu_stages = [
+                PipelineStage('prepare', _Partial(preprocess_source, max_edge=max_edge, settings=self.settings),
+                              cpu_workers, queue_size, use_process=True)
+            ]
+        else:
+            cpu_stages = [
+                PipelineStage('decode', _Partial(decode_image, max_edge=max_edge), decode_workers, queue_size),
+                PipelineStage('resize', _Partial(resize_frame, max_edge=max_edge), resize_workers, queue_size),
+                PipelineStage('encode', _Partial(encode_frame, settings=self.settings), encode_workers, queue_size)
+            ]
+        self.stages = cpu_stages + [
+            PipelineStage('upload', detector._analyze_image_data, upload_workers, queue_size),
+            PipelineStage('postprocess', self._postprocess, postprocess_workers, queue_size)
+        ]
+
+        self._stats: Dict[str, _StageStats] = {}
+        self._source_blocked = 0.0
+        self._feed_error: Optional[BaseException] = None
+        self._elapsed = 0.0
+
+    def _postprocess(self, analysis_result: Dict):
+        """將 API 結果轉換成偵測結果 (食物比對、營養計算)"""
+        result = self.detector._process_analysis_result(analysis_result)
+        result.success = True
+        return result
+
+    def _failed_result(self, error: Exception):
+        """建立失敗的偵測結果"""
+        from food_detection import FoodDetectionResult
+        from enhanced_food_detection import EnhancedFoodDetector, EnhancedFoodDetectionResult
+
+        result = EnhancedFoodDetectionResult() if isinstance(self.detector, EnhancedFoodDetector) else FoodDetectionResult()
+        result.error_message = str(error)
+        return result
+
+    def stream(self, sources: Iterable[Any]) -> Iterator[PipelineItem]:
+        """
+        處理影像來源，依完成順序逐一產出結果
+
+        Args:
+            sources: 檔案路徑、影像位元組或影像幀
+
+        Yields:
+            處理完成的項目 (value 為偵測結果，失敗時 error 不為 None)
+
+        Raises:
+            讀取 sources 時發生的例外 (已放入管線的項目先處理完)
+        """
+        self._stats = {stage.name: _StageStats() for stage in self.stages}
+        self._source_blocked = 0.0
+        self._feed_error = None
+        start = time.perf_counter()
+
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        output = queue.Queue()
+        cancel = threading.Event()
+        # 行程數量等於行程池階段的工作者總數 (每個工作者同時只等待一個工作)
+        process_workers = sum(stage.workers for stage in self.stages if stage.use_process)
+        executor = ProcessPoolExecutor(max_workers=process_workers) if process_workers else None
+
+        remaining = {stage.name: stage.workers for stage in self.stages}
+        remaining_lock = threading.Lock()
+        threads = []
+
+        for position, stage in enumerate(self.stages):
+            inbox = queues[position]
+            is_last = position == len(self.stages) - 1
+            outbox = output if is_last else queues[position + 1]
+            downstream_workers = 1 if is_last else self.stages[position + 1].workers
+
+            for _ in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(stage, inbox, outbox, downstream_workers, remaining, remaining_lock, executor, cancel),
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        feeder = threading.Thread(target=self._feed, args=(sources, queues[0], self.stages[0].workers, cancel),
+                                  daemon=True)
+        feeder.start()
+
+        finished = False
+        try:
+            while True:
+                item = output.get()
+                if item is _STOP:
+                    finished = True
+                    break
+                if item.error is not None:
+                    item.value = self._failed_result(item.error)
+                yield item
+            if self._feed_error is not None:
+                raise self._feed_error
+        finally:
+            if finished:
+                feeder.join()
+                for thread in threads:
+                    thread.join()
+            else:
+                # 呼叫者提前停止讀取：通知所有執行緒停止並清空佇列，阻塞在放入的執行緒才能離開
+                # (不等待進行中的上傳，工作者為 daemon 執行緒)
+                cancel.set()
+                for pending in queues + [output]:
+                    _drain(pending)
+            if executor is not None:
+                executor.shutdown(wait=finished, cancel_futures=not finished)
+            self._elapsed = time.perf_counter() - start
+
+    def process(self, sources: Iterable[Any]) -> List[Any]:
+        """
+        處理所有影像來源，結果順序與輸入相同
+
+        Returns:
+            偵測結果列表
+        """
+        items = sorted(self.stream(sources), key=lambda item: item.index)
+        return [item.value for item in items]
+
+    def _feed(self, sources: Iterable[Any], inbox: queue.Queue, workers: int, cancel: threading.Event):
+        """把影像來源放入第一個佇列"""
+        try:
+            for index, source in enumerate(sources):
+                start = time.perf_counter()
+                if not _put(inbox, PipelineItem(index=index, source=source, value=source), cancel):
+                    return
+                self._source_blocked += time.perf_counter() - start
+        except BaseException as e:
+            # 由 stream() 重新拋出
+            logger.error(f"讀取影像來源失敗: {e}")
+            self._feed_error = e
+        finally:
+            # 來源出錯時也要通知工作者結束，否則管線會一直等待
+            for _ in range(workers):
+                _put(inbox, _STOP, cancel)
+
+    def _work(self, stage: PipelineStage, inbox: queue.Queue, outbox: queue.Queue, downstream_workers: int,
+              remaining: Dict[str, int], remaining_lock: threading.Lock, executor, cancel: threading.Event):
+        """階段工作者"""
+        stats = self._stats[stage.name]
+
+        while True:
+            wait_start = time.perf_counter()
+            depth = inbox.qsize()
+            item = _get(inbox, cancel)
+            waited = time.perf_counter() - wait_start
+            if item is None:
+                return
+
+            if item is _STOP:
+                # 最後一個結束的工作者負責通知下游
+                with remaining_lock:
+                    remaining[stage.name] -= 1
+                    last = remaining[stage.name] == 0
+                if last:
+                    for _ in range(downstream_workers):
+                        _put(outbox, _STOP, cancel)
+                return
+
+            busy = 0.0
+            failed = 0
+            handled = item.error is None  # 前面階段已失敗的項目直接傳遞
+            if handled:
+                busy_start = time.perf_counter()
+                try:
+                    if executor is not None and stage.use_process:
+                        item.value = executor.submit(stage.func, item.value).result()
+                    else:
+                        item.value = stage.func(item.value)
+                except Exception as e:
+                    item.error = e
+                    failed = 1
+                    logger.error(f"管線階段 {stage.name} 處理第 {item.index} 項失敗: {e}")
+                busy = time.perf_counter() - busy_start
+                item.timings[stage.name] = busy
+
+            put_start = time.perf_counter()
+            if not _put(outbox, item, cancel):
+                return
+            blocked = time.perf_counter() - put_start
+
+            with stats.lock:
+                stats.processed += handled
+                stats.errors += failed
+                stats.busy += busy
+                stats.blocked += blocked
+                stats.starved += waited
+                stats.max_queue = max(stats.max_queue, depth)
+
+    def get_statistics(self) -> Dict:
+        """
+        獲取各階段統計資訊
+
+        utilization 為處理時間佔 (總時間 × 工作者數) 的比例，最高者即瓶頸階段；
+        blocked_seconds 大表示下游跟不上 (背壓)，starved_seconds 大表示上游供應不足。
+        """
+        elapsed = self._elapsed
+        stages = {}
+        for stage in self.stages:
+            stats = self._stats.get(stage.name)
+            if stats is None:
+                continue
+            stages[stage.name] = {
+                'workers': stage.workers,
+                'processed': stats.processed,
+                'errors': stats.errors,
+                'busy_seconds': stats.busy,
+                'blocked_seconds': stats.blocked,
+                'starved_seconds': stats.starved,
+                'max_queue': stats.max_queue,
+                'queue_size': stage.queue_size,
+                'utilization': stats.busy / (elapsed * stage.workers) if elapsed > 0 else 0.0
+            }
+
+        bottleneck = max(stages, key=lambda name: stages[name]['utilization']) if stages else None
+        return {
+            'elapsed_seconds': elapsed,
+            'source_blocked_seconds': self._source_blocked,
+            'bottleneck': bottleneck,
+            'stages': stages
+        }
+
+class _Partial:
+    """可被 pickle 的 functools.partial 替代 (只綁定關鍵字參數)"""
+
+    def __init__(self, func: Callable, **kwargs):
+        self.func = func
+        self.kwargs = kwargs
+
+    def __call__(self, value):
+        return self.func(value, **self.kwargs)
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description='多階段串流食物影像處理管線')
+    parser.add_argument('input', help='影像目錄或 glob 模式')
+    parser.add_argument('--enhanced', action='store_true', help='使用增強版偵測器 (FDA 資料庫比對)')
+    parser.add_argument('--fda-db', default='fda_nutrition_db.json', help='FDA 營養資料庫')
+    parser.add_argument('--upload-workers', type=int, default=16, help='同時上傳數量')
+    parser.add_argument('--cpu-workers', type=int, default=2, help='解碼/縮小/編碼的工作者數量')
+    parser.add_argument('--queue-size', type=int, default=32, help='每個階段的佇列上限')
+    parser.add_argument('--processes', action='store_true', help='CPU 階段合併並使用行程池')
+
+    args = parser.parse_args()
+
+    from cli import collect_images
+    images = collect_images(args.input)
+    if not images:
+        print(f"❌ 找不到影像: {args.input}")
+        sys.exit(1)
+
+    if args.enhanced:
+        from enhanced_food_detection import EnhancedFoodDetector
+        detector = EnhancedFoodDetector(args.fda_db)
+    else:
+        from food_detection import FoodDetector
+        detector = FoodDetector()
+
+    pipeline = IngestionPipeline(
+        detector,
+        decode_workers=args.cpu_workers,
+        resize_workers=args.cpu_workers,
+        encode_workers=args.cpu_workers,
+        upload_workers=args.upload_workers,
+        queue_size=args.queue_size,
+        use_processes=args.processes
+    )
+
+    succeeded = 0
+    for item in pipeline.stream(images):
+        status = '✅' if item.error is None else '❌'
+        succeeded += item.error is None
+        foods = ', '.join(item.value.foods_detected) if item.error is None else item.value.error_message
+        print(f"{status} {item.source}: {foods}")
+
+    stats = pipeline.get_statistics()
+    print("\n" + "="*50)
+    print("📊 管線統計")
+    print("="*50)
+    print(f"  成功: {succeeded}/{len(images)}  總耗時: {stats['elapsed_seconds']:.1f} 秒")
+    print(f"  吞吐量: {len(images) / stats['elapsed_seconds']:.2f} 張/秒" if stats['elapsed_seconds'] else "")
+    for name, stage in stats['stages'].items():
+        print(f"  {name:<12} 工作者 {stage['workers']:>2}  使用率 {stage['utilization']*100:5.1f}%  "
+              f"背壓 {stage['blocked_seconds']:.2f}s  等待 {stage['starved_seconds']:.2f}s  最大佇列 {stage['max_queue']}")
+    print(f"  瓶頸階段: {stats['bottleneck']}")
+
+if __name__ == '__main__':
+    main()
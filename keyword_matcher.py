@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+多關鍵字比對 (Aho-Corasick)
+將所有關鍵字編譯成一個自動機，單次掃描文字即可找出每個命中的關鍵字及其分類，
+可同時處理中文與英文，用於找出所有命中的分類 (matched_labels)；
+只需判斷是否命中或取第一個分類時，可提早結束的逐一子字串搜尋 (在 C 中執行) 較快，
+關鍵字很少時也仍使用子字串搜尋
+"""
+
+import threading
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Any, Dict, Hashable, Iterable, List, Set, Tuple
+
+# 關鍵字數量不超過此值時 matched_labels 逐一做子字串搜尋 (短標籤上約 30 個關鍵字以下較快)
+SUBSTRING_SCAN_LIMIT = 24
+
+class KeywordMatcher:
+    """Aho-Corasick 多關鍵字比對器"""
+
+    def __init__(self, patterns: Iterable[Tuple[str, Hashable]], memo_size: int = 4096):
+        """
+        建立自動機
+
+        Args:
+            patterns: (關鍵字, 分類) 列表；順序即優先順序，越前面越優先
+            memo_size: 記住最近比對過的文字數量 (影像標籤大量重複，最近最少使用者先移除)
+        """
+        self.keywords: List[str] = []
+        self.labels: List[Hashable] = []
+        self.memo_size = memo_size
+        self._memo: 'OrderedDict[str, Tuple[int, ...]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        # 每個狀態的轉移表、失敗連結與輸出 (命中的關鍵字索引)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[int, ...]] = [()]
+
+        for keyword, label in patterns:
+            if not keyword:
+                continue
+            index = len(self.keywords)
+            self.keywords.append(keyword)
+            self.labels.append(label)
+            self._insert(keyword, index)
+
+        self._build_failure_links()
+        self._build_transitions()
+        self._substring_scan = len(self.keywords) <= SUBSTRING_SCAN_LIMIT
+
+    def _insert(self, keyword: str, index: int):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state] = self._output[state] + (index,)
+
+    def _build_failure_links(self):
+        """以廣度優先建立失敗連結，並合併後綴狀態的輸出"""
+        self._order: List[int] = []
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self._goto[state].items():
+                pending.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                if self._output[self._fail[next_state]]:
+                    self._output[next_state] = tuple(sorted(self._output[next_state] + self._output[self._fail[next_state]]))
+            self._order.append(state)
+
+    def _build_transitions(self):
+        """
+        將失敗連結展開成確定性轉移表，掃描時每個字元只需一次查表
+
+        只保存通往非根狀態的轉移，查不到即回到根狀態。
+        """
+        self._delta: List[Dict[str, int]] = [dict() for _ in self._goto]
+        self._delta[0] = dict(self._goto[0])
+        for state in self._order:
+            transitions = dict(self._delta[self._fail[state]])
+            transitions.update(self._goto[state])
+            self._delta[state] = transitions
+
+    def iter_matches(self, text: str):
+        """
+        逐一產出命中的關鍵字
+
+        Yields:
+            (結束位置, 關鍵字索引)
+        """
+        delta = self._delta
+        output = self._output
+        state = 0
+
+        for position, char in enumerate(text):
+            state = delta[state].get(char, 0)
+            for index in output[state]:
+                yield position, index
+
+    def _hits(self, text: str) -> Tuple[int, ...]:
+        """文字中命中的關鍵字索引 (由小到大，不重複)"""
+        if self._substring_scan:
+            # 子字串搜尋已經比查詢記憶快，不需要記住結果
+            return tuple(index for index, keyword in enumerate(self.keywords) if keyword in text)
+
+        with self._lock:
+            hits = self._memo.get(text)
+            if hits is not None:
+                self._memo.move_to_end(text)
+                return hits
+
+        delta = self._delta
+        output = self._output
+        state = 0
+        found = set()
+        for char in text:
+            state = delta[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+
+        hits = tuple(sorted(found))
+        with self._lock:
+            self._memo[text] = hits
+            if len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return hits
+
+    def find_all(self, text: str) -> List[Tuple[int, int, str, Hashable]]:
+        """
+        找出所有命中的關鍵字
+
+        Returns:
+            (起始位置, 結束位置, 關鍵字, 分類) 列表
+        """
+        return [
+            (end - len(self.keywords[index]) + 1, end + 1, self.keywords[index], self.labels[index])
+            for end, index in self.iter_matches(text)
+        ]
+
+    def matched_labels(self, text: str) -> Set[Hashable]:
+        """文字中出現的所有分類"""
+        return {self.labels[index] for index in self._hits(text)}
+
+    def contains_any(self, text: str) -> bool:
+        """文字中是否包含任一關鍵字 (找到即停止，子字串搜尋比自動機快)"""
+        return any(keyword in text for keyword in self.keywords)
+
+    def first_label(self, text: str, default: Any = None) -> Any:
+        """
+        回傳優先順序最高的命中分類
+
+        依序檢查每個關鍵字、回傳第一個出現在文字中的關鍵字分類 (找到即停止)。
+
+        Args:
+            text: 要比對的文字
+            default: 沒有命中時的回傳值
+        """
+        for keyword, label in zip(self.keywords, self.labels):
+            if keyword in text:
+                return label
+        return default
+
+@lru_cache(maxsize=None)
+def get_matcher(patterns: Tuple[Tuple[str, Hashable], ...]) -> KeywordMatcher:
+    """
+    取得編譯好的比對器 (相同關鍵字組合在同一個行程中只編譯一次)
+
+    Args:
+        patterns: (關鍵字, 分類) 的 tuple
+
+    Returns:
+        比對器
+    """
+    return KeywordMatcher(patterns)
+
+def keyword_matcher(keywords: Iterable[str], label: Hashable = True) -> KeywordMatcher:
+    """以同一個分類建立關鍵字比對器"""
+    return get_matcher(tuple((keyword, label) for keyword in keywords))
+
+def category_matcher(categories: Dict[str, Iterable[str]]) -> KeywordMatcher:
+    """
+    由 {分類: [關鍵字, ...]} 建立比對器，分類順序即優先順序
+    """
+    return get_matcher(tuple(
+        (keyword, category) for category, keywords in categories.items() for keyword in keywords
+    ))
+
+def mapping_matcher(mapping: Dict[str, Hashable]) -> KeywordMatcher:
+    """
+    由 {關鍵字: 分類} 建立比對器，關鍵字順序即優先順序
+    """
+    return get_matcher(tuple(mapping.items()))
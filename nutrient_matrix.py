@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+欄位式營養素矩陣
+將 FDA 食品營養成分資料庫的完整營養素 (不只五大營養素) 依固定欄位與單位正規化成
+float32 矩陣 (食品 × 營養素)，提供向量化查詢，例如：
+- 某分類中每大卡蛋白質最高的前 k 種食品
+- 鈉含量低於指定毫克數的所有食品
+- 營養組成最接近的食品
+"""
+
+import re
+import json
+import warnings
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class NutrientColumn:
+    """矩陣欄位定義"""
+    key: str
+    unit: str
+    aliases: Tuple[str, ...]
+
+# 固定欄位 (順序即矩陣欄位順序；新增欄位請加在最後，讓舊檔案仍可讀取)
+NUTRIENT_SCHEMA: Tuple[NutrientColumn, ...] = (
+    NutrientColumn('energy', 'kcal', ('熱量', '修正熱量', '能量')),
+    NutrientColumn('water', 'g', ('水分',)),
+    NutrientColumn('protein', 'g', ('粗蛋白', '蛋白質')),
+    NutrientColumn('fat', 'g', ('粗脂肪', '脂肪', '總脂肪')),
+    NutrientColumn('saturated_fat', 'g', ('飽和脂肪', '飽和脂肪酸總量')),
+    NutrientColumn('carbs', 'g', ('碳水化合物', '總碳水化合物')),
+    NutrientColumn('fiber', 'g', ('膳食纖維',)),
+    NutrientColumn('sugar', 'g', ('糖質總量', '糖')),
+    NutrientColumn('cholesterol', 'mg', ('膽固醇',)),
+    NutrientColumn('sodium', 'mg', ('鈉',)),
+    NutrientColumn('potassium', 'mg', ('鉀',)),
+    NutrientColumn('calcium', 'mg', ('鈣',)),
+    NutrientColumn('magnesium', 'mg', ('鎂',)),
+    NutrientColumn('iron', 'mg', ('鐵',)),
+    NutrientColumn('zinc', 'mg', ('鋅',)),
+    NutrientColumn('phosphorus', 'mg', ('磷',)),
+    NutrientColumn('vitamin_a', 'ug', ('維生素A總量', '維生素A', '視網醇當量')),
+    NutrientColumn('vitamin_b1', 'mg', ('維生素B1',)),
+    NutrientColumn('vitamin_b2', 'mg', ('維生素B2',)),
+    NutrientColumn('vitamin_b6', 'mg', ('維生素B6',)),
+    NutrientColumn('vitamin_b12', 'ug', ('維生素B12',)),
+    NutrientColumn('folate', 'ug', ('葉酸',)),
+    NutrientColumn('vitamin_c', 'mg', ('維生素C',)),
+    NutrientColumn('vitamin_e', 'mg', ('維生素E總量', '維生素E', 'α-維生素E當量')),
+)
+
+# 單位換算成基準單位 (質量以克、能量以大卡)
+_MASS_UNITS = {'g': 1.0, 'mg': 1e-3, 'ug': 1e-6, 'µg': 1e-6, 'μg': 1e-6, 'mcg': 1e-6}
+_ENERGY_UNITS = {'kcal': 1.0, 'cal': 1e-3, 'kj': 1 / 4.184}
+
+_ALIASES = {alias: index for index, column in enumerate(NUTRIENT_SCHEMA) for alias in column.aliases}
+_UNIT_IN_NAME = re.compile(r'\s*[\(（]\s*([^\)）]*)\s*[\)）]\s*')
+
+def _unit_factor(unit: str) -> Optional[float]:
+    """基準單位的倍率"""
+    unit = unit.strip().lower()
+    if unit in _MASS_UNITS:
+        return _MASS_UNITS[unit]
+    return _ENERGY_UNITS.get(unit)
+
+def convert_unit(value: float, unit: Optional[str], target: str) -> Optional[float]:
+    """
+    換算單位
+
+    Args:
+        value: 數值
+        unit: 原單位 (None 表示已是目標單位)
+        target: 目標單位
+
+    Returns:
+        換算後的數值，單位無法換算時回傳 None
+    """
+    if not unit or unit.strip().lower() == target:
+        return value
+    source_factor = _unit_factor(unit)
+    target_factor = _unit_factor(target)
+    if source_factor is None or target_factor is None:
+        return None
+    if (unit.strip().lower() in _MASS_UNITS) != (target in _MASS_UNITS):
+        return None
+    return value * source_factor / target_factor
+
+def resolve_nutrient(name: str) -> Tuple[Optional[int], Optional[str]]:
+    """
+    將 FDA 營養成分名稱對應到矩陣欄位
+
+    名稱中括號內的文字視為單位，例如「鈉(mg)」。
+
+    Returns:
+        (欄位索引, 名稱中的單位)，無對應欄位時索引為 None
+    """
+    unit = None
+    match = _UNIT_IN_NAME.search(name)
+    if match:
+        unit = match.group(1) or None
+        name = _UNIT_IN_NAME.sub('', name)
+    return _ALIASES.get(name.strip()), unit
+
+class NutrientMatrix:
+    """食品 × 營養素的 float32 矩陣 (缺值為 NaN)"""
+
+    def __init__(self, names: Sequence[str], categories: Sequence[str], values: np.ndarray,
+                 schema: Sequence[NutrientColumn] = NUTRIENT_SCHEMA):
+        """
+        建立矩陣
+
+        Args:
+            names: 食品名稱
+            categories: 食品分類
+            values: (食品數, 欄位數) 數值
+            schema: 欄位定義
+        """
+        self.names = list(names)
+        self.categories = np.asarray(list(categories), dtype=object)
+        self.values = np.ascontiguousarray(values, dtype=np.float32)
+        self.schema = tuple(schema)
+        self._columns = {column.key: index for index, column in enumerate(self.schema)}
+        self._rows = {name: index for index, name in enumerate(self.names)}
+        self._statistics = None
+        self._standardized = None
+
+        if self.values.shape != (len(self.names), len(self.schema)):
+            raise ValueError(f"矩陣大小 {self.values.shape} 與食品數/欄位數不符")
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def from_fda_foods(cls, foods: Iterable[Dict]) -> 'NutrientMatrix':
+        """
+        由 FDANutritionScraper.scrape_food_details 的結果建立
+
+        營養成分依 NUTRIENT_SCHEMA 對應欄位並換算單位；
+        沒有單位資訊的數值視為已是欄位單位 (TFND 每 100 克含量的慣用單位)。
+        """
+        names, categories, rows = [], [], []
+        seen = set()
+        skipped = set()
+
+        for food in foods:
+            name = food.get('樣品名稱', '').lower()
+            if not name or name in seen:
+                continue
+            detail = food.get('詳細資訊', {})
+            nutrition = detail.get('營養成分', {})
+            units = detail.get('營養成分單位', {})
+
+            row = np.full(len(NUTRIENT_SCHEMA), np.nan, dtype=np.float32)
+            for nutrient, value in nutrition.items():
+                index, name_unit = resolve_nutrient(nutrient)
+                if index is None or not isinstance(value, (int, float)):
+                    continue
+                converted = convert_unit(float(value), units.get(nutrient) or name_unit, NUTRIENT_SCHEMA[index].unit)
+                if converted is None:
+                    skipped.add((nutrient, units.get(nutrient) or name_unit))
+                    continue
+                row[index] = converted
+
+            seen.add(name)
+            names.append(name)
+            categories.append(food.get('分類') or detail.get('食品分類', ''))
+            rows.append(row)
+
+        if skipped:
+            logger.warning(f"無法換算單位的營養成分: {sorted(skipped)}")
+
+        values = np.vstack(rows) if rows else np.empty((0, len(NUTRIENT_SCHEMA)), dtype=np.float32)
+        return cls(names, categories, values)
+
+    @classmethod
+    def from_registry(cls, registry) -> 'NutrientMatrix':
+        """由 NutritionRegistry 建立 (只有熱量與五大營養素)"""
+        columns = {'energy': 'calories', 'protein': 'protein', 'carbs': 'carbs', 'fat': 'fat', 'fiber': 'fiber'}
+        records = list(registry.values())
+        values = np.full((len(records), len(NUTRIENT_SCHEMA)), np.nan, dtype=np.float32)
+        for key, field in columns.items():
+            index = next(i for i, column in enumerate(NUTRIENT_SCHEMA) if column.key == key)
+            values[:, index] = [getattr(record, field) for record in records]
+        return cls([record.name for record in records], [record.category for record in records], values)
+
+    def save(self, path: str):
+        """儲存為 .npz 檔案"""
+        np.savez(
+            path,
+            values=self.values,
+            names=np.array(self.names, dtype=str),
+            categories=np.array(self.categories, dtype=str),
+            schema=np.array(json.dumps([[column.key, column.unit] for column in self.schema]))
+        )
+
+    @classmethod
+    def load(cls, path: str) -> 'NutrientMatrix':
+        """
+        載入 .npz 檔案，欄位依目前的 NUTRIENT_SCHEMA 重新排列 (舊檔案缺少的欄位為 NaN)
+
+        Raises:
+            ValueError: 欄位單位與目前定義不同
+        """
+        with np.load(path, allow_pickle=False) as data:
+            stored = json.loads(str(data['schema']))
+            stored_values = data['values']
+            names = data['names'].tolist()
+            categories = data['categories'].tolist()
+
+        values = np.full((len(names), len(NUTRIENT_SCHEMA)), np.nan, dtype=np.float32)
+        positions = {key: (position, unit) for position, (key, unit) in enumerate(stored)}
+        for index, column in enumerate(NUTRIENT_SCHEMA):
+            if column.key in positions:
+                position, unit = positions[column.key]
+                if unit != column.unit:
+                    raise ValueError(f"欄位 {column.key} 的單位不符: {unit} != {column.unit}")
+                values[:, index] = stored_values[:, position]
+        return cls(names, categories, values)
+
+    def column(self, nutrient: str) -> np.ndarray:
+        """
+        取得單一營養素欄位 (唯讀檢視，不複製)
+
+        Raises:
+            KeyError: 未定義的營養素
+        """
+        if nutrient not in self._columns:
+            raise KeyError(f"未定義的營養素: {nutrient}")
+        view = self.values[:, self._columns[nutrient]]
+        view.flags.writeable = False
+        return view
+
+    def _category_mask(self, category: Optional[str]) -> np.ndarray:
+        if category is None:
+            return np.ones(len(self.names), dtype=bool)
+        return self.categories == category
+
+    def top_k(self, nutrient: str, k: int = 10, per: Optional[str] = None,
+              category: Optional[str] = None, ascending: bool = False) -> List[Tuple[str, float]]:
+        """
+        依營養素含量 (或比例) 排序的前 k 種食品
+
+        Args:
+            nutrient: 營養素，例如 'protein'
+            k: 數量
+            per: 分母營養素，例如 'energy' 表示每大卡含量
+            category: 只考慮此分類
+            ascending: True 表示由低到高
+
+        Returns:
+            [(食品名稱, 數值), ...]
+        """
+        scores = self.column(nutrient).astype(np.float64)
+        if per is not None:
+            denominator = self.column(per)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scores = np.where(denominator > 0, scores / denominator, np.nan)
+
+        candidates = np.flatnonzero(np.isfinite(scores) & self._category_mask(category))
+        if not len(candidates) or k <= 0:
+            return []
+
+        keys = scores[candidates] if ascending else -scores[candidates]
+        if k < len(candidates):
+            selected = np.argpartition(keys, k - 1)[:k]
+            candidates, keys = candidates[selected], keys[selected]
+        order = np.lexsort((candidates, keys))
+        return [(self.names[i], float(scores[i])) for i in candidates[order]]
+
+    def where(self, maximum: Optional[Dict[str, float]] = None, minimum: Optional[Dict[str, float]] = None,
+              category: Optional[str] = None) -> List[str]:
+        """
+        篩選符合條件的食品 (缺值的食品不符合條件)
+
+        Args:
+            maximum: 上限，例如 {'sodium': 140} 表示每 100 克鈉不超過 140 毫克
+            minimum: 下限
+            category: 只考慮此分類
+
+        Returns:
+            食品名稱列表 (資料順序)
+        """
+        mask = self._category_mask(category)
+        for nutrient, limit in (maximum or {}).items():
+            mask &= self.column(nutrient) <= limit
+        for nutrient, limit in (minimum or {}).items():
+            mask &= self.column(nutrient) >= limit
+        return [self.names[i] for i in np.flatnonzero(mask)]
+
+    def _scale(self, values: np.ndarray) -> np.ndarray:
+        """以欄位平均與標準差標準化，缺值以平均 (0) 代替"""
+        if self._statistics is None:
+            with warnings.catch_warnings():
+                # 整欄缺值時 nanmean 會發出警告，該欄直接視為 0
+                warnings.simplefilter('ignore', RuntimeWarning)
+                mean = np.nanmean(self.values, axis=0)
+                std = np.nanstd(self.values, axis=0)
+            self._statistics = (np.nan_to_num(mean), np.where(np.isfinite(std) & (std > 0), std, 1.0))
+        mean, std = self._statistics
+        return np.nan_to_num((values - mean) / std, nan=0.0).astype(np.float32)
+
+    def _standardize(self) -> np.ndarray:
+        if self._standardized is None:
+            self._standardized = self._scale(self.values)
+        return self._standardized
+
+    def nearest(self, food: Union[str, Dict[str, float]], k: int = 5,
+                nutrients: Optional[Sequence[str]] = None) -> List[Tuple[str, float]]:
+        """
+        營養組成最接近的食品 (標準化後的歐氏距離)
+
+        Args:
+            food: 食品名稱，或 {營養素: 數值} 描述的目標組成
+            k: 數量
+            nutrients: 比較的營養素 (預設全部欄位)
+
+        Returns:
+            [(食品名稱, 距離), ...]，由近到遠，不含查詢的食品本身
+        """
+        standardized = self._standardize()
+        columns = [self._columns[nutrient] for nutrient in nutrients] if nutrients else list(range(len(self.schema)))
+
+        exclude = None
+        if isinstance(food, str):
+            exclude = self._rows[food.lower()]
+            target = standardized[exclude, columns]
+        else:
+            raw = np.full(len(self.schema), np.nan, dtype=np.float32)
+            for nutrient, value in food.items():
+                raw[self._columns[nutrient]] = value
+            target = self._scale(raw)[columns]
+
+        distances = np.sqrt(((standardized[:, columns] - target) ** 2).sum(axis=1))
+        if exclude is not None:
+            distances[exclude] = np.inf
+
+        count = min(k, int(np.isfinite(distances).sum()))
+        if count <= 0:
+            return []
+        candidates = np.argpartition(distances, count - 1)[:count]
+        order = np.lexsort((candidates, distances[candidates]))
+        return [(self.names[i], float(distances[i])) for i in candidates[order]]
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+批次營養彙總與健康評分
+一次以 NumPy 計算多餐的營養總量、三大營養素熱量比例與健康評分，
+並提供以使用者與日/週分組的彙總，取代逐餐以字典與 if 判斷計算
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 營養總量欄位 (與 nutrition_info 的鍵相同)
+TOTAL_FIELDS = ('total_calories', 'protein', 'carbohydrates', 'fat', 'fiber')
+CALORIES, PROTEIN, CARBS, FAT, FIBER = range(len(TOTAL_FIELDS))
+
+# 三大營養素每克熱量
+_KCAL_PER_GRAM = np.array([4.0, 4.0, 9.0])
+
+def health_scores(totals: np.ndarray, vitamin_counts: Optional[np.ndarray] = None,
+                  fda_counts: Optional[np.ndarray] = None, local_counts: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    計算健康評分 (0-100)
+
+    規則與各偵測器的 _calculate_health_score 相同；提供維生素種類數時加上維生素分數，
+    提供資料來源匹配數時加上資料來源分數 (增強版評分)。
+
+    Args:
+        totals: (餐數, 5) 營養總量，欄位順序同 TOTAL_FIELDS
+        vitamin_counts: 每餐的維生素種類數
+        fda_counts: 每餐的 FDA 資料庫匹配數
+        local_counts: 每餐的本地資料庫匹配數
+
+    Returns:
+        (餐數,) 整數評分
+    """
+    totals = np.asarray(totals, dtype=np.float64).reshape(-1, len(TOTAL_FIELDS))
+    calories, protein, carbs, fat, fiber = totals.T
+
+    score = np.full(len(totals), 50, dtype=np.int64)
+    score += np.select([(calories >= 200) & (calories <= 800), calories < 200], [10, 5], -10)
+    score += np.select([protein >= 15, protein >= 10], [10, 5], 0)
+    score += np.select([carbs <= 50, carbs <= 80], [10, 5], 0)
+    score += np.select([fat <= 20, fat <= 30], [10, 5], 0)
+    score += np.select([fiber >= 5, fiber >= 3], [10, 5], 0)
+
+    if vitamin_counts is not None:
+        vitamin_counts = np.asarray(vitamin_counts)
+        score += np.select([vitamin_counts >= 3, vitamin_counts >= 1], [5, 2], 0)
+    if fda_counts is not None:
+        score += np.where(np.asarray(fda_counts) > 0, 3, 0)
+    if local_counts is not None:
+        score += np.where(np.asarray(local_counts) > 0, 2, 0)
+
+    return np.clip(score, 0, 100)
+
+def macro_ratios(totals: np.ndarray) -> np.ndarray:
+    """
+    蛋白質、碳水化合物、脂肪占三者熱量的比例
+
+    Returns:
+        (餐數, 3) 比例，沒有三大營養素的餐為 0
+    """
+    totals = np.asarray(totals, dtype=np.float64).reshape(-1, len(TOTAL_FIELDS))
+    energy = totals[:, [PROTEIN, CARBS, FAT]] * _KCAL_PER_GRAM
+    total_energy = energy.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total_energy > 0, energy / total_energy, 0.0)
+
+@dataclass
+class BatchNutrition:
+    """多餐的營養計算結果 (各陣列第一維為餐)"""
+    totals: np.ndarray
+    vitamin_counts: np.ndarray
+    health_scores: np.ndarray
+    macro_ratios: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.totals)
+
+    def nutrition_info(self, index: int) -> Dict:
+        """單餐結果轉換為 nutrition_info 字典格式"""
+        info = {field: float(value) for field, value in zip(TOTAL_FIELDS, self.totals[index])}
+        info['health_score'] = int(self.health_scores[index])
+        info['macro_ratios'] = dict(zip(('protein', 'carbohydrates', 'fat'), self.macro_ratios[index].tolist()))
+        return info
+
+def _nutrition_info_of(result: Any) -> Dict:
+    """取得偵測結果 (字典或結果物件) 中的 nutrition_info"""
+    if isinstance(result, dict):
+        return result.get('nutrition_info', result)
+    return getattr(result, 'nutrition_info', {}) or {}
+
+def score_results(results: Iterable[Any], enhanced: bool = False) -> BatchNutrition:
+    """
+    批次評分已儲存的偵測結果
+
+    Args:
+        results: 偵測結果 (FoodRecognition 的結果字典、FoodDetectionResult 或 EnhancedFoodDetectionResult)，
+                 或直接是 nutrition_info 字典
+        enhanced: 是否加上資料來源分數 (與增強版偵測器相同)
+
+    Returns:
+        批次計算結果
+    """
+    infos = [_nutrition_info_of(result) for result in results]
+    totals = np.array([[info.get(field, 0) or 0 for field in TOTAL_FIELDS] for info in infos],
+                      dtype=np.float64).reshape(-1, len(TOTAL_FIELDS))
+    vitamin_counts = np.array([len(set(info.get('vitamins', []))) for info in infos], dtype=np.int64)
+
+    fda_counts = local_counts = None
+    if enhanced:
+        fda_counts = np.array([info.get('sources', {}).get('fda', 0) for info in infos])
+        local_counts = np.array([info.get('sources', {}).get('local', 0) for info in infos])
+
+    return BatchNutrition(
+        totals=totals,
+        vitamin_counts=vitamin_counts,
+        health_scores=health_scores(totals, vitamin_counts, fda_counts, local_counts),
+        macro_ratios=macro_ratios(totals)
+    )
+
+MealItem = Union[str, Tuple[str, float]]
+
+def aggregate_meals(meals: Sequence[Sequence[MealItem]], registry) -> BatchNutrition:
+    """
+    由食品清單與份量批次計算營養
+
+    Args:
+        meals: 每餐的食品清單，項目為食品名稱或 (食品名稱, 份量倍數)
+        registry: 營養資料庫 (NutritionRegistry)，以 lookup 查詢食品
+
+    Returns:
+        批次計算結果 (查不到的食品不計入)
+    """
+    table: List[Tuple[float, ...]] = []
+    vitamin_rows: List[List[int]] = []
+    row_of: Dict[str, int] = {}
+    vitamin_columns: Dict[str, int] = {}
+
+    meal_ids, rows, portions = [], [], []
+    for meal_id, meal in enumerate(meals):
+        for item in meal:
+            name, portion = (item, 1.0) if isinstance(item, str) else item
+            row = row_of.get(name)
+            if row is None:
+                record = registry.lookup(name)
+                if record is None:
+                    row_of[name] = row = -1
+                else:
+                    row = len(table)
+                    table.append((record.calories, record.protein, record.carbs, record.fat, record.fiber))
+                    vitamin_rows.append([vitamin_columns.setdefault(vitamin, len(vitamin_columns))
+                                         for vitamin in record.vitamins])
+                    row_of[name] = row
+            if row >= 0:
+                meal_ids.append(meal_id)
+                rows.append(row)
+                portions.append(portion)
+
+    meal_count = len(meals)
+    meal_ids = np.asarray(meal_ids, dtype=np.int64)
+    rows = np.asarray(rows, dtype=np.int64)
+    nutrients = np.asarray(table, dtype=np.float64).reshape(-1, len(TOTAL_FIELDS))[rows] * np.asarray(portions)[:, None]
+
+    totals = np.column_stack([
+        np.bincount(meal_ids, weights=nutrients[:, column], minlength=meal_count)
+        for column in range(len(TOTAL_FIELDS))
+    ]) if meal_count else np.zeros((0, len(TOTAL_FIELDS)))
+
+    # 每種維生素在各餐是否出現 (食品 × 維生素的 0/1 矩陣依餐加總後 > 0)
+    presence = np.zeros((len(table), len(vitamin_columns)))
+    for row, vitamins in enumerate(vitamin_rows):
+        presence[row, vitamins] = 1.0
+    vitamin_counts = sum(
+        (np.bincount(meal_ids, weights=presence[rows, column], minlength=meal_count) > 0).astype(np.int64)
+        for column in range(len(vitamin_columns))
+    ) if len(vitamin_columns) else np.zeros(meal_count, dtype=np.int64)
+
+    return BatchNutrition(
+        totals=totals,
+        vitamin_counts=vitamin_counts,
+        health_scores=health_scores(totals, vitamin_counts),
+        macro_ratios=macro_ratios(totals)
+    )
+
+@dataclass
+class Rollup:
+    """分組彙總結果 (各陣列第一維為組)"""
+    users: np.ndarray
+    periods: np.ndarray
+    meals: np.ndarray
+    totals: np.ndarray
+    mean_health_score: np.ndarray
+
+    def to_records(self) -> List[Dict]:
+        """轉換為字典列表"""
+        records = []
+        for index in range(len(self.meals)):
+            record = {'user': self.users[index].item(), 'period': str(self.periods[index]),
+                      'meals': int(self.meals[index]),
+                      'mean_health_score': float(self.mean_health_score[index])}
+            record.update({field: float(value) for field, value in zip(TOTAL_FIELDS, self.totals[index])})
+            records.append(record)
+        return records
+
+def _period_start(timestamps: np.ndarray, period: str) -> np.ndarray:
+    days = np.asarray(timestamps, dtype='datetime64[D]')
+    if period == 'day':
+        return days
+    if period == 'week':
+        # 1970-01-01 是星期四，換算成以星期一開始的週
+        return days - ((days.astype(np.int64) + 3) % 7).astype('timedelta64[D]')
+    raise ValueError(f"不支援的彙總週期: {period} (可用 day、week)")
+
+def rollup(batch: BatchNutrition, timestamps: Sequence, users: Optional[Sequence] = None,
+           period: str = 'day') -> Rollup:
+    """
+    以使用者與日/週分組彙總
+
+    Args:
+        batch: 批次計算結果
+        timestamps: 每餐的時間 (datetime、ISO 字串或 datetime64)
+        users: 每餐的使用者 (None 表示同一位使用者)
+        period: 'day' 或 'week' (週以星期一開始)
+
+    Returns:
+        依 (使用者, 週期起始日) 排序的彙總結果
+    """
+    periods = _period_start(np.asarray(timestamps, dtype='datetime64[s]'), period)
+    users = np.asarray(users if users is not None else [''] * len(batch))
+
+    user_keys, user_ids = np.unique(users, return_inverse=True)
+    period_keys, period_ids = np.unique(periods, return_inverse=True)
+    group_keys, groups = np.unique(user_ids.ravel() * len(period_keys) + period_ids.ravel(), return_inverse=True)
+    groups = groups.ravel()
+    group_count = len(group_keys)
+
+    meals = np.bincount(groups, minlength=group_count)
+    totals = np.column_stack([
+        np.bincount(groups, weights=batch.totals[:, column], minlength=group_count)
+        for column in range(len(TOTAL_FIELDS))
+    ]) if group_count else np.zeros((0, len(TOTAL_FIELDS)))
+    score_sums = np.bincount(groups, weights=batch.health_scores, minlength=group_count)
+
+    return Rollup(
+        users=user_keys[group_keys // len(period_keys)] if group_count else user_keys[:0],
+        periods=period_keys[group_keys % len(period_keys)] if group_count else period_keys[:0],
+        meals=meals,
+        totals=totals,
+        mean_health_score=score_sums / np.maximum(meals, 1)
+    )
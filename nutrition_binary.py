@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+預先編譯的二進位營養資料庫
+將 FDA/USDA 的 JSON 資料檔編譯成含字串表、數值欄位、名稱查詢索引與 n-gram 搜尋索引的版本化檔案；
+啟動時以 mmap 開啟，不需解析 JSON，載入時間與資料量無關，多個工作行程共用作業系統的頁面快取
+
+檔案格式 (little endian，所有區段對齊 8 位元組):
+    標頭    magic(8) 版本(u32) 項目數(u32) n-gram 數(u32) 保留(u32)
+    區段表  9 個 (位移 u64, 長度 u64)
+    STRING_OFFSETS  u32[項目數 * 6 + 1]  每個項目 6 個字串欄位在字串資料中的位移
+    STRING_DATA     UTF-8 字串資料
+    NUMBERS         f64[5][項目數]       熱量、蛋白質、碳水化合物、脂肪、纖維 (欄位式)
+    NAME_ORDER      u32[項目數]          依名稱 (UTF-8 位元組) 排序的項目編號，供二分搜尋
+    GRAM_OFFSETS    u32[n-gram 數 + 1]
+    GRAM_DATA       依 UTF-8 位元組排序的 n-gram
+    POSTING_OFFSETS u32[n-gram 數 + 1]
+    POSTINGS        u32[...]             每個 n-gram 的項目編號 (遞增)
+    GRAM_COUNTS     u32[項目數]          每個項目名稱的 n-gram 數 (計算相似度用)
+"""
+
+import os
+import sys
+import glob
+import json
+import mmap
+import struct
+import argparse
+import threading
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import logging
+
+from fuzzy_index import TrigramIndex, ngrams
+from nutrition_registry import NutritionRecord, NutritionRegistry, parse_nutrition_data
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'NUTRIDB\x00'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<8sIIII')
+_SECTION = struct.Struct('<QQ')
+_SECTION_NAMES = (
+    'string_offsets', 'string_data', 'numbers', 'name_order',
+    'gram_offsets', 'gram_data', 'posting_offsets', 'postings', 'gram_counts'
+)
+_STRING_FIELDS = ('name', 'category', 'source', 'original_name', 'vitamins', 'minerals')
+_NUMBER_FIELDS = ('calories', 'protein', 'carbs', 'fat', 'fiber')
+_LIST_SEPARATOR = '\x1f'
+
+def _u32(values: Iterable[int]) -> bytes:
+    data = array('I', values)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data.tobytes()
+
+def _f64(values: Iterable[float]) -> bytes:
+    data = array('d', values)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data.tobytes()
+
+def _string_table(strings: Sequence[bytes]) -> Tuple[bytes, bytes]:
+    """回傳 (位移表, 字串資料)"""
+    offsets = [0]
+    for value in strings:
+        offsets.append(offsets[-1] + len(value))
+    return _u32(offsets), b''.join(strings)
+
+def compile_registry(registry: NutritionRegistry, path: str):
+    """
+    將營養資料庫編譯成二進位檔案
+
+    先寫入暫存檔再取代，讓正在使用舊檔案的行程不受影響。
+
+    Args:
+        registry: 營養資料庫
+        path: 輸出檔案路徑
+    """
+    records = list(registry.values())
+    count = len(records)
+
+    strings = []
+    for record in records:
+        strings.extend(value.encode('utf-8') for value in (
+            record.name, record.category, record.source, record.original_name,
+            _LIST_SEPARATOR.join(record.vitamins), _LIST_SEPARATOR.join(record.minerals)
+        ))
+    string_offsets, string_data = _string_table(strings)
+
+    numbers = b''.join(_f64(getattr(record, field) for record in records) for field in _NUMBER_FIELDS)
+
+    encoded_names = [record.name.encode('utf-8') for record in records]
+    name_order = _u32(sorted(range(count), key=encoded_names.__getitem__))
+
+    postings: Dict[bytes, List[int]] = {}
+    gram_counts = []
+    for index, record in enumerate(records):
+        grams = ngrams(record.name)
+        gram_counts.append(len(grams))
+        for gram in grams:
+            postings.setdefault(gram.encode('utf-8'), []).append(index)
+    grams = sorted(postings)
+    gram_offsets, gram_data = _string_table(grams)
+    posting_offsets = [0]
+    for gram in grams:
+        posting_offsets.append(posting_offsets[-1] + len(postings[gram]))
+    posting_data = _u32(index for gram in grams for index in postings[gram])
+
+    sections = [
+        string_offsets, string_data, numbers, name_order,
+        gram_offsets, gram_data, _u32(posting_offsets), posting_data, _u32(gram_counts)
+    ]
+
+    position = _HEADER.size + _SECTION.size * len(sections)
+    directory = []
+    for section in sections:
+        position += -position % 8
+        directory.append((position, len(section)))
+        position += len(section)
+
+    temp_path = f"{path}.tmp{os.getpid()}"
+    with open(temp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, count, len(grams), 0))
+        for offset, length in directory:
+            f.write(_SECTION.pack(offset, length))
+        for (offset, _), section in zip(directory, sections):
+            f.write(b'\x00' * (offset - f.tell()))
+            f.write(section)
+    os.replace(temp_path, path)
+
+    logger.info(f"已編譯營養資料庫 {path}: {count} 種食品，{len(grams)} 個 n-gram")
+
+def is_compiled_database(path: str) -> bool:
+    """檔案是否為編譯後的二進位營養資料庫"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+class _MappedIndex(TrigramIndex):
+    """直接讀取映射檔案中 n-gram 倒排串列的搜尋索引"""
+
+    def __init__(self, database: 'MappedNutritionDB', memo_size: int = 4096):
+        self._database = database
+        self._init_memo(memo_size)
+
+    def __len__(self) -> int:
+        return len(self._database)
+
+    def _posting(self, gram: str):
+        database = self._database
+        position = database._find(gram.encode('utf-8'), database._gram_count, database._gram)
+        if position is None:
+            return ()
+        offsets = database._posting_offsets
+        return database._postings[offsets[position]:offsets[position + 1]]
+
+    def _entry_size(self, index: int) -> int:
+        return self._database._gram_counts[index]
+
+    def _name(self, index: int) -> str:
+        return self._database._string(index, 0)
+
+    def _gram_count(self) -> int:
+        return self._database._gram_count
+
+class MappedNutritionDB(NutritionRegistry):
+    """以 mmap 開啟的唯讀營養資料庫 (介面與 NutritionRegistry 相同)"""
+
+    def __init__(self, path: str):
+        """
+        開啟編譯後的營養資料庫
+
+        Args:
+            path: 檔案路徑
+
+        Raises:
+            ValueError: 檔案格式或版本不符
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, gram_count, _ = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"不是營養資料庫檔案: {path}")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"不支援的營養資料庫版本 {version} (需要 {FORMAT_VERSION})，請重新編譯")
+        if sys.byteorder != 'little':
+            raise ValueError("目前只支援 little endian 平台")
+
+        self._count = count
+        self._gram_count = gram_count
+
+        view = memoryview(self._mmap)
+        sections = {}
+        for number, name in enumerate(_SECTION_NAMES):
+            offset, length = _SECTION.unpack_from(self._mmap, _HEADER.size + number * _SECTION.size)
+            sections[name] = view[offset:offset + length]
+
+        self._string_offsets = sections['string_offsets'].cast('I')
+        self._string_data = sections['string_data']
+        self._numbers = sections['numbers'].cast('d')
+        self._name_order = sections['name_order'].cast('I')
+        self._gram_offsets = sections['gram_offsets'].cast('I')
+        self._gram_data = sections['gram_data']
+        self._posting_offsets = sections['posting_offsets'].cast('I')
+        self._postings = sections['postings'].cast('I')
+        self._gram_counts = sections['gram_counts'].cast('I')
+
+        self._index: Optional[TrigramIndex] = None
+        self._index_lock = threading.Lock()
+
+    def _string_bytes(self, index: int, field: int) -> bytes:
+        slot = index * len(_STRING_FIELDS) + field
+        return self._string_data[self._string_offsets[slot]:self._string_offsets[slot + 1]].tobytes()
+
+    def _string(self, index: int, field: int) -> str:
+        return self._string_bytes(index, field).decode('utf-8')
+
+    def _gram(self, position: int) -> bytes:
+        return self._gram_data[self._gram_offsets[position]:self._gram_offsets[position + 1]].tobytes()
+
+    def _sorted_name(self, position: int) -> bytes:
+        return self._string_bytes(self._name_order[position], 0)
+
+    @staticmethod
+    def _find(key: bytes, size: int, item) -> Optional[int]:
+        """在已排序的區段中二分搜尋，回傳位置"""
+        low, high = 0, size
+        while low < high:
+            middle = (low + high) // 2
+            if item(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < size and item(low) == key else None
+
+    def _record(self, index: int) -> NutritionRecord:
+        count = self._count
+        numbers = [self._numbers[column * count + index] for column in range(len(_NUMBER_FIELDS))]
+        name, category, source, original_name, vitamins, minerals = (
+            self._string(index, field) for field in range(len(_STRING_FIELDS))
+        )
+        return NutritionRecord(
+            name, *numbers,
+            vitamins=tuple(vitamins.split(_LIST_SEPARATOR)) if vitamins else (),
+            minerals=tuple(minerals.split(_LIST_SEPARATOR)) if minerals else (),
+            source=source, category=category, original_name=original_name
+        )
+
+    def __getitem__(self, name: str) -> NutritionRecord:
+        position = self._find(name.encode('utf-8'), self._count, self._sorted_name)
+        if position is None:
+            raise KeyError(name)
+        return self._record(self._name_order[position])
+
+    def __contains__(self, name) -> bool:
+        return isinstance(name, str) and self._find(name.encode('utf-8'), self._count, self._sorted_name) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(self._count):
+            yield self._string(index, 0)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def lookup(self, food: str) -> Optional[NutritionRecord]:
+        food_lower = food.lower()
+        if food_lower in self:
+            return self[food_lower]
+        for index in range(self._count):
+            if self._string(index, 0) in food_lower:
+                return self._record(index)
+        return None
+
+    def values(self) -> List[NutritionRecord]:
+        return [self._record(index) for index in range(self._count)]
+
+    def search_index(self) -> TrigramIndex:
+        """直接使用檔案中預先建立的 n-gram 索引"""
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    self._index = _MappedIndex(self)
+        return self._index
+
+def find_database(directory: str = '.') -> Optional[str]:
+    """
+    尋找營養資料庫檔案
+
+    優先使用 NUTRITION_DB_PATH 環境變數，否則使用編譯檔 (*.ndb) 與 fda_nutrition_db_*.json 中最新的檔案
+    (抓取器只輸出 JSON，舊的編譯檔不應蓋過新抓取的資料；修改時間相同時使用編譯檔)。
+
+    Returns:
+        檔案路徑，找不到時回傳 None
+    """
+    configured = os.getenv('NUTRITION_DB_PATH')
+    if configured:
+        return configured if os.path.exists(configured) else None
+
+    candidates = [(os.path.getmtime(path), priority, path)
+                  for priority, pattern in enumerate(('fda_nutrition_db_*.json', '*.ndb'))
+                  for path in glob.glob(os.path.join(directory, pattern))]
+    return max(candidates)[2] if candidates else None
+
+def build_database(sources: Iterable[str], output: str) -> NutritionRegistry:
+    """
+    由 FDA/USDA JSON 資料檔編譯二進位營養資料庫
+
+    Args:
+        sources: JSON 檔案路徑 (同名食品以先出現者為準)
+        output: 輸出檔案路徑
+
+    Returns:
+        編譯的營養資料庫內容
+    """
+    records = []
+    for source in sources:
+        with open(source, 'r', encoding='utf-8') as f:
+            records.extend(parse_nutrition_data(json.load(f)))
+    registry = NutritionRegistry(records)
+    compile_registry(registry, output)
+    return registry
+
+def main():
+    """命令列介面: 編譯營養資料庫"""
+    parser = argparse.ArgumentParser(description='將 FDA/USDA JSON 營養資料編譯成二進位資料庫')
+    parser.add_argument('sources', nargs='+', help='FDA 營養資料庫或 USDA 食物 JSON 檔案')
+    parser.add_argument('-o', '--output', default='nutrition.ndb', help='輸出檔案')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    registry = build_database(args.sources, args.output)
+    print(f"✅ 已編譯 {len(registry)} 種食品到 {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+共用的唯讀營養資料庫
+內建食品營養表在每個行程中只載入一次，所有偵測器與執行緒共用同一份，
+並可由 FDA (convert_to_nutrition_db 輸出) 與 USDA (save_to_json 輸出) 資料檔擴充
+"""
+
+import os
+import json
+import threading
+from dataclasses import dataclass, asdict, fields
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+import logging
+
+from fuzzy_index import TrigramIndex
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class NutritionRecord:
+    """單一食品的營養資訊 (每份)"""
+    name: str
+    calories: float
+    protein: float = 0.0
+    carbs: float = 0.0
+    fat: float = 0.0
+    fiber: float = 0.0
+    vitamins: Tuple[str, ...] = ()
+    minerals: Tuple[str, ...] = ()
+    source: str = 'local'
+    category: str = ''
+    original_name: str = ''
+
+    def __getitem__(self, key: str) -> Any:
+        """相容原本以字典存取營養資訊的寫法，例如 nutrition['calories']"""
+        if key not in _FIELD_NAMES:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in _FIELD_NAMES
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default) if key in _FIELD_NAMES else default
+
+    def to_dict(self) -> Dict:
+        """轉換為一般字典 (例如輸出 JSON)"""
+        data = asdict(self)
+        data['vitamins'] = list(self.vitamins)
+        data['minerals'] = list(self.minerals)
+        return data
+
+    @classmethod
+    def from_dict(cls, name: str, data: Dict, source: str = 'local') -> 'NutritionRecord':
+        """
+        由營養資料庫格式的字典建立
+
+        Args:
+            name: 食品名稱 (小寫)
+            data: {'calories', 'protein', 'carbs', 'fat', 'fiber', 'vitamins', 'minerals', ...}
+            source: 資料來源
+        """
+        return cls(
+            name=name,
+            calories=_to_float(data.get('calories')),
+            protein=_to_float(data.get('protein')),
+            carbs=_to_float(data.get('carbs')),
+            fat=_to_float(data.get('fat')),
+            fiber=_to_float(data.get('fiber')),
+            vitamins=tuple(data.get('vitamins') or ()),
+            minerals=tuple(data.get('minerals') or ()),
+            source=data.get('source') or source,
+            category=data.get('category') or '',
+            original_name=data.get('original_name') or ''
+        )
+
+_FIELD_NAMES = frozenset(field.name for field in fields(NutritionRecord))
+
+def _to_float(value: Any) -> float:
+    """FDA 資料中的數值可能是字串，無法轉換時視為 0"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+class NutritionRegistry(Mapping):
+    """唯讀的 {食品名稱: NutritionRecord} 對照表"""
+
+    def __init__(self, records: Iterable[NutritionRecord] = ()):
+        table = {}
+        for record in records:
+            # 先出現的優先 (內建資料不會被外部資料檔覆蓋)
+            table.setdefault(record.name, record)
+        self._records = MappingProxyType(table)
+        self._index: Optional[TrigramIndex] = None
+        self._index_lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> NutritionRecord:
+        return self._records[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def lookup(self, food: str) -> Optional[NutritionRecord]:
+        """
+        查詢食品營養資訊
+
+        先完全比對名稱，再依資料順序找第一個名稱出現在食品名稱中的項目。
+
+        Args:
+            food: 食品名稱
+
+        Returns:
+            營養資訊，找不到時回傳 None
+        """
+        food_lower = food.lower()
+        record = self._records.get(food_lower)
+        if record is not None:
+            return record
+        for name, record in self._records.items():
+            if name in food_lower:
+                return record
+        return None
+
+    def search_index(self) -> TrigramIndex:
+        """模糊搜尋索引 (第一次使用時建立，之後與此對照表共用)"""
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    self._index = TrigramIndex(self._records)
+        return self._index
+
+    def search(self, food: str, k: int = 5, min_score: float = 0.3) -> List[Tuple[NutritionRecord, float]]:
+        """
+        依名稱相似度搜尋
+
+        Args:
+            food: 食品名稱
+            k: 回傳候選數量
+            min_score: 最低相似度
+
+        Returns:
+            [(營養資訊, 相似度), ...]，相似度由高到低
+        """
+        return [(self[name], score) for name, score in self.search_index().search(food, k, min_score)]
+
+    def extended(self, records: Iterable[NutritionRecord]) -> 'NutritionRegistry':
+        """回傳加入額外資料後的新對照表 (本身不變)"""
+        return NutritionRegistry(list(self.values()) + list(records))
+
+# 內建營養表: (名稱, 熱量, 蛋白質, 碳水化合物, 脂肪, 纖維, 維生素)
+_BUILTIN_FOODS = (
+    ('apple', 95, 0.5, 25, 0.3, 4, ('C', 'K')),
+    ('banana', 105, 1.3, 27, 0.4, 3, ('B6', 'C')),
+    ('rice', 130, 2.7, 28, 0.3, 0.4, ('B1', 'B3')),
+    ('chicken', 165, 31, 0, 3.6, 0, ('B6', 'B12')),
+    ('salad', 20, 2, 4, 0.2, 2, ('A', 'C', 'K')),
+    ('pizza', 266, 11, 33, 10, 2, ('B1', 'B2')),
+    ('soup', 50, 3, 8, 1, 2, ('A', 'C')),
+    ('bread', 79, 3, 15, 1, 1, ('B1', 'B2')),
+    ('fish', 100, 20, 0, 2, 0, ('D', 'B12')),
+    ('vegetable', 25, 2, 5, 0.2, 3, ('A', 'C')),
+    ('beef', 250, 26, 0, 15, 0, ('B12', 'B6')),
+    ('pork', 242, 27, 0, 14, 0, ('B1', 'B6')),
+    ('shrimp', 85, 18, 0, 1, 0, ('B12', 'D')),
+    ('salmon', 208, 25, 0, 12, 0, ('D', 'B12')),
+    ('carrot', 41, 0.9, 10, 0.2, 2.8, ('A', 'K')),
+    ('broccoli', 34, 2.8, 7, 0.4, 2.6, ('C', 'K')),
+    ('tomato', 22, 1.1, 5, 0.2, 1.2, ('C', 'K')),
+    ('lettuce', 15, 1.4, 3, 0.1, 1.3, ('A', 'K')),
+    ('onion', 40, 1.1, 9, 0.1, 1.7, ('C', 'B6')),
+    ('potato', 77, 2, 17, 0.1, 2.2, ('C', 'B6')),
+    ('corn', 86, 3.2, 19, 1.2, 2.7, ('B1', 'B5')),
+    ('egg', 78, 6.3, 0.6, 5.3, 0, ('D', 'B12')),
+    ('cheese', 113, 7, 0.4, 9, 0, ('A', 'B12')),
+    ('milk', 42, 3.4, 5, 1, 0, ('D', 'B12')),
+    ('coffee', 2, 0.3, 0, 0, 0, ('B3',)),
+    ('tea', 1, 0, 0, 0, 0, ('C',)),
+    ('orange', 62, 1.2, 15, 0.2, 3.1, ('C', 'B9')),
+    ('grape', 62, 0.6, 16, 0.2, 0.9, ('C', 'K')),
+    ('strawberry', 32, 0.7, 8, 0.3, 2, ('C', 'B9')),
+    ('watermelon', 30, 0.6, 8, 0.2, 0.4, ('A', 'C')),
+    ('noodle', 138, 5, 25, 2, 1, ('B1', 'B2')),
+    ('pasta', 131, 5, 25, 1, 1, ('B1', 'B2')),
+    ('hamburger', 295, 12, 30, 12, 2, ('B12', 'B6')),
+    ('sandwich', 250, 15, 30, 8, 3, ('B1', 'B2')),
+    ('sushi', 150, 6, 30, 0.5, 0.5, ('B12', 'D')),
+    ('ramen', 200, 8, 35, 3, 2, ('B1', 'B2')),
+    ('curry', 180, 8, 25, 6, 3, ('A', 'C')),
+    ('steak', 271, 26, 0, 18, 0, ('B12', 'B6')),
+    ('seafood', 100, 20, 0, 2, 0, ('D', 'B12')),
+    ('dessert', 300, 4, 45, 12, 1, ('A',)),
+    ('cake', 257, 3, 45, 8, 1, ('A',)),
+    ('ice cream', 207, 3.5, 24, 11, 0, ('A',)),
+    ('chocolate', 546, 4.9, 61, 31, 7, ('B2',)),
+)
+
+def builtin_records() -> Tuple[NutritionRecord, ...]:
+    """內建營養表"""
+    return tuple(
+        NutritionRecord(name, calories, protein, carbs, fat, fiber, vitamins)
+        for name, calories, protein, carbs, fat, fiber, vitamins in _BUILTIN_FOODS
+    )
+
+def parse_nutrition_data(data: Any) -> Tuple[NutritionRecord, ...]:
+    """
+    解析營養資料檔內容
+
+    支援兩種格式:
+    - FDA 營養資料庫 {食品名稱: {'calories': ..., ...}} (FDANutritionScraper.convert_to_nutrition_db)
+    - USDA {'metadata': ..., 'foods': [{'food_name', 'energy_kcal', ...}]} (save_to_json)
+
+    Returns:
+        營養資訊列表
+    """
+    if isinstance(data, dict) and isinstance(data.get('foods'), list):
+        records = []
+        for food in data['foods']:
+            name = (food.get('food_name') or '').lower()
+            if not name:
+                continue
+            records.append(NutritionRecord(
+                name=name,
+                calories=_to_float(food.get('energy_kcal')),
+                protein=_to_float(food.get('protein_g')),
+                carbs=_to_float(food.get('carbohydrate_g')),
+                fat=_to_float(food.get('fat_g')),
+                fiber=_to_float(food.get('fiber_g')),
+                source='USDA',
+                category=food.get('category') or '',
+                original_name=food.get('food_name') or ''
+            ))
+        return tuple(records)
+
+    if isinstance(data, dict):
+        return tuple(
+            NutritionRecord.from_dict(name.lower(), nutrition, source='FDA_TW')
+            for name, nutrition in data.items()
+            if name and isinstance(nutrition, dict)
+        )
+
+    raise ValueError("無法辨識的營養資料格式")
+
+_file_cache: Dict[Tuple[str, float], NutritionRegistry] = {}
+_file_lock = threading.Lock()
+
+def load_nutrition_file(path: str) -> NutritionRegistry:
+    """
+    載入營養資料檔 (相同檔案在行程中只解析一次，檔案更新後重新載入)
+
+    編譯後的二進位資料庫 (nutrition_binary) 以 mmap 開啟，不需解析。
+
+    Args:
+        path: JSON 或編譯後的資料庫檔案路徑
+
+    Returns:
+        唯讀對照表
+    """
+    path = os.path.abspath(path)
+    key = (path, os.path.getmtime(path))
+
+    with _file_lock:
+        registry = _file_cache.get(key)
+        if registry is None:
+            from nutrition_binary import MappedNutritionDB, is_compiled_database
+            if is_compiled_database(path):
+                registry = MappedNutritionDB(path)
+            else:
+                with open(path, 'r', encoding='utf-8') as f:
+                    registry = NutritionRegistry(parse_nutrition_data(json.load(f)))
+            # 檔案更新後不再保留舊版本
+            for stale in [cached for cached in _file_cache if cached[0] == path]:
+                del _file_cache[stale]
+            _file_cache[key] = registry
+            logger.info(f"載入營養資料檔 {path}: {len(registry)} 種食品")
+        return registry
+
+_registry: Optional[NutritionRegistry] = None
+_registry_lock = threading.Lock()
+
+def get_registry() -> NutritionRegistry:
+    """
+    取得行程共用的營養資料庫 (第一次呼叫時才載入)
+
+    內建營養表之外，會依序加入 NUTRITION_DB_FILES 環境變數
+    (以 os.pathsep 分隔的 FDA/USDA 資料檔) 中的資料；同名食品以先出現者為準。
+
+    Returns:
+        唯讀對照表
+    """
+    global _registry
+    if _registry is not None:
+        return _registry
+
+    with _registry_lock:
+        if _registry is None:
+            registry = NutritionRegistry(builtin_records())
+            for path in filter(None, os.getenv('NUTRITION_DB_FILES', '').split(os.pathsep)):
+                try:
+                    registry = registry.extended(load_nutrition_file(path).values())
+                except (OSError, ValueError) as e:
+                    logger.error(f"載入營養資料檔失敗 {path}: {e}")
+            _registry = registry
+        return _registry
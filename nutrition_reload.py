@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+可熱更新的營養資料庫
+在背景執行緒載入新的資料檔並建立搜尋索引，完成後以單一參照替換不可變的快照；
+偵測執行緒每次只讀取一次目前的快照，不需加鎖，也不會看到建立到一半的索引
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+import logging
+
+from nutrition_registry import NutritionRegistry, load_nutrition_file
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class DatabaseSnapshot:
+    """某一版本的營養資料庫 (建立後不再修改)"""
+    registry: NutritionRegistry
+    generation: int = 0
+    path: Optional[str] = None
+    signature: Optional[Tuple[int, int]] = None  # 載入時檔案的 (修改時間, 大小)
+    loaded_at: float = 0.0
+    load_seconds: float = 0.0
+
+def _file_signature(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+class ReloadableDatabase:
+    """可在執行中重新載入的營養資料庫"""
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        初始化資料庫
+
+        Args:
+            path: 資料檔路徑；為目錄時使用 nutrition_binary.find_database 找到的最新資料檔
+        """
+        self.path = path
+        self._snapshot = DatabaseSnapshot(NutritionRegistry())
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='nutrition-reload')
+        self._pending: Optional[Future] = None
+        self._lock = threading.Lock()
+        self._watch_stop: Optional[threading.Event] = None
+
+        # 統計資訊
+        self.reloads = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def snapshot(self) -> DatabaseSnapshot:
+        """目前的快照 (同一次偵測應只讀取一次)"""
+        return self._snapshot
+
+    @property
+    def registry(self) -> NutritionRegistry:
+        return self._snapshot.registry
+
+    @property
+    def generation(self) -> int:
+        return self._snapshot.generation
+
+    def resolve_path(self) -> Optional[str]:
+        """目前要載入的資料檔"""
+        if self.path and os.path.isdir(self.path):
+            from nutrition_binary import find_database
+            return find_database(self.path)
+        return self.path
+
+    def reload(self, path: Optional[str] = None) -> Future:
+        """
+        在背景重新載入資料庫
+
+        載入中再次呼叫時回傳同一個 Future (不重複載入)；載入失敗時保留原本的快照。
+
+        Args:
+            path: 新的資料檔或目錄 (None 表示沿用目前設定)
+
+        Returns:
+            完成時結果為新快照的 Future
+        """
+        with self._lock:
+            if path is not None:
+                self.path = path
+            if self._pending is not None and not self._pending.done():
+                return self._pending
+            self._pending = self._executor.submit(self._load)
+            return self._pending
+
+    def _load(self) -> DatabaseSnapshot:
+        path = self.resolve_path()
+        started = time.perf_counter()
+        try:
+            if not path:
+                raise FileNotFoundError(f"找不到營養資料庫: {self.path}")
+            signature = _file_signature(path)
+            registry = load_nutrition_file(path)
+            # 替換前建立好搜尋索引，偵測執行緒不會等待索引建立
+            registry.search_index()
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            logger.error(f"重新載入營養資料庫失敗，繼續使用第 {self.generation} 版: {e}")
+            raise
+
+        snapshot = DatabaseSnapshot(
+            registry=registry,
+            generation=self._snapshot.generation + 1,
+            path=os.path.abspath(path),
+            signature=signature,
+            loaded_at=time.time(),
+            load_seconds=time.perf_counter() - started
+        )
+        # 單一參照替換，讀取端不需加鎖
+        self._snapshot = snapshot
+        self.reloads += 1
+        self.last_error = None
+        logger.info(f"營養資料庫更新為第 {snapshot.generation} 版: {len(registry)} 種食品 "
+                    f"({path}，{snapshot.load_seconds * 1000:.1f}ms)")
+        return snapshot
+
+    def changed(self) -> bool:
+        """資料檔 (或目錄中最新的資料檔) 是否與目前快照不同"""
+        path = self.resolve_path()
+        if not path:
+            return False
+        signature = _file_signature(path)
+        if signature is None:
+            return False
+        snapshot = self._snapshot
+        return os.path.abspath(path) != snapshot.path or signature != snapshot.signature
+
+    def check(self) -> Optional[Future]:
+        """資料檔有更新時在背景重新載入，否則回傳 None"""
+        return self.reload() if self.changed() else None
+
+    def start_watching(self, interval: float = 5.0):
+        """
+        定期檢查資料檔是否更新
+
+        Args:
+            interval: 檢查間隔 (秒)
+        """
+        self.stop_watching()
+        stop = self._watch_stop = threading.Event()
+
+        def watch():
+            while not stop.wait(interval):
+                try:
+                    self.check()
+                except Exception as e:
+                    logger.warning(f"檢查營養資料庫更新失敗: {e}")
+
+        threading.Thread(target=watch, name='nutrition-watch', daemon=True).start()
+
+    def stop_watching(self):
+        """停止檢查資料檔"""
+        if self._watch_stop is not None:
+            self._watch_stop.set()
+            self._watch_stop = None
+
+    def get_statistics(self) -> Dict:
+        """獲取統計資訊"""
+        snapshot = self._snapshot
+        return {
+            'generation': snapshot.generation,
+            'path': snapshot.path,
+            'foods': len(snapshot.registry),
+            'loaded_at': snapshot.loaded_at,
+            'reload_seconds': snapshot.load_seconds,
+            'reloads': self.reloads,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'watching': self._watch_stop is not None
+        }
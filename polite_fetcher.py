@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+依主機限制的並行抓取
+同一主機的同時請求數有上限，請求間隔依觀察到的回應時間與錯誤率調整
+(出錯時加倍、回應變慢時拉長、正常時逐步縮短)；結果依輸入順序輸出，
+同時只保留有限數量的進行中請求，處理大量網址時記憶體用量固定
+"""
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple, TypeVar
+from urllib.parse import urlsplit
+import logging
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+class HostPoliteness:
+    """單一主機的並行上限與自適應請求間隔"""
+
+    def __init__(self, max_concurrency: int = 4, min_delay: float = 0.5, max_delay: float = 30.0,
+                 slow_factor: float = 2.0, smoothing: float = 0.3):
+        """
+        Args:
+            max_concurrency: 同時請求數上限
+            min_delay: 兩次請求開始之間的最短間隔 (秒)
+            max_delay: 間隔上限 (秒)
+            slow_factor: 平均回應時間超過最快回應時間幾倍時視為伺服器變慢
+            smoothing: 回應時間與錯誤率的指數移動平均係數
+        """
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.slow_factor = slow_factor
+        self.smoothing = smoothing
+
+        self.interval = min_delay
+        self.latency: Optional[float] = None
+        self.fastest: Optional[float] = None
+        self.error_rate = 0.0
+
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+        # 統計資訊
+        self.requests = 0
+        self.errors = 0
+
+    def acquire(self):
+        """取得請求名額並等待到下一個可開始的時間"""
+        self._slots.acquire()
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def release(self, latency: float, ok: bool):
+        """
+        歸還名額並依本次結果調整間隔
+
+        Args:
+            latency: 本次請求耗時 (秒)
+            ok: 是否成功
+        """
+        with self._lock:
+            self.requests += 1
+            alpha = self.smoothing
+            self.latency = latency if self.latency is None else alpha * latency + (1 - alpha) * self.latency
+            self.fastest = latency if self.fastest is None else min(self.fastest, latency)
+            self.error_rate = alpha * (0.0 if ok else 1.0) + (1 - alpha) * self.error_rate
+
+            if not ok:
+                self.errors += 1
+                self.interval = min(self.max_delay, max(self.interval * 2, self.min_delay, 0.1))
+                # 出錯後立即生效，已排隊的請求也延後
+                self._next_start = max(self._next_start, time.monotonic() + self.interval)
+            elif self.latency > self.fastest * self.slow_factor:
+                self.interval = min(self.max_delay, max(self.interval * 1.25, 0.05))
+            else:
+                self.interval = max(self.min_delay, self.interval * 0.9)
+        self._slots.release()
+
+    def get_statistics(self) -> Dict:
+        """獲取統計資訊"""
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'error_rate': self.error_rate,
+            'latency': self.latency,
+            'interval': self.interval
+        }
+
+class PoliteFetcher:
+    """依主機限制並行數與間隔的抓取器 (結果依輸入順序輸出)"""
+
+    def __init__(self, fetch: Callable[[str], R], max_per_host: int = 4, max_workers: int = 8,
+                 min_delay: float = 0.5, max_delay: float = 30.0):
+        """
+        初始化抓取器
+
+        Args:
+            fetch: 抓取並解析單一網址的函數，失敗時拋出例外
+            max_per_host: 每個主機的同時請求數上限
+            max_workers: 所有主機合計的執行緒數
+            min_delay: 同一主機兩次請求開始之間的最短間隔 (秒)
+            max_delay: 間隔上限 (秒)
+        """
+        self.fetch_one = fetch
+        self.max_per_host = max(1, max_per_host)
+        self.max_workers = max(1, max_workers)
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+        self._hosts: Dict[str, HostPoliteness] = {}
+        self._hosts_lock = threading.Lock()
+
+        # 統計資訊
+        self.failures = 0
+
+    def host(self, url: str) -> HostPoliteness:
+        """取得網址所屬主機的狀態"""
+        name = urlsplit(url).netloc.lower()
+        with self._hosts_lock:
+            state = self._hosts.get(name)
+            if state is None:
+                state = HostPoliteness(self.max_per_host, self.min_delay, self.max_delay)
+                self._hosts[name] = state
+            return state
+
+    def _run(self, url: str) -> Optional[R]:
+        host = self.host(url)
+        host.acquire()
+        started = time.monotonic()
+        ok = False
+        try:
+            result = self.fetch_one(url)
+            ok = True
+            return result
+        except requests.exceptions.RequestException as e:
+            # 連線錯誤、逾時與重試後仍為 429/5xx 的回應，拉長這個主機的請求間隔
+            self.failures += 1
+            logger.error(f"抓取失敗 ({url}): {e}")
+            return None
+        except Exception as e:
+            # 解析失敗與伺服器狀態無關，不影響請求間隔
+            ok = True
+            self.failures += 1
+            logger.error(f"處理失敗 ({url}): {e}")
+            return None
+        finally:
+            host.release(time.monotonic() - started, ok)
+
+    def fetch(self, items: Iterable[T], url: Callable[[T], str] = str) -> Iterator[Tuple[T, Optional[R]]]:
+        """
+        並行抓取並依輸入順序產生結果
+
+        Args:
+            items: 要抓取的項目 (可為串流)
+            url: 取得項目網址的函數
+
+        Yields:
+            (項目, fetch 的結果)，請求失敗時結果為 None
+        """
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='polite-fetch')
+        pending = deque()
+        iterator = iter(items)
+        exhausted = False
+        try:
+            while True:
+                # 進行中的請求數保持在執行緒數的兩倍以內
+                while not exhausted and len(pending) < self.max_workers * 2:
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.append((item, executor.submit(self._run, url(item))))
+                if not pending:
+                    return
+                item, future = pending.popleft()
+                yield item, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def get_statistics(self) -> Dict:
+        """獲取統計資訊"""
+        with self._hosts_lock:
+            hosts = {name: state.get_statistics() for name, state in self._hosts.items()}
+        return {
+            'failures': self.failures,
+            'hosts': hosts
+        }
@@ -5,12 +5,14 @@
 """
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import json
 import time
 import csv
 from datetime import datetime
 import re
+from aspnet_paging import AspNetPager
+from http_cache import install_http_cache
 
 def get_food_calories_simple():
     """簡單版本的食物熱量提取"""
@@ -31,52 +33,27 @@ def get_food_calories_simple():
         'Accept-Language': 'zh-TW,zh;q=0.9,en;q=0.8',
     })
     
+    # 設定 HTTP_CACHE_DIR 時，重新執行會直接使用快取的回應 (未設定時不掛載任何配接器)
+    install_http_cache(session, 'FDA')
+    
     all_foods = []
     
     try:
         print("📋 正在抓取食物資料...")
         
-        # 獲取主頁面
-        params = {'nodeID': '178'}
-        response = session.get(base_url, params=params)
-        response.raise_for_status()
-        response.encoding = 'utf-8'
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # 提取 ViewState 參數
-        viewstate = soup.find('input', {'name': '__VIEWSTATE'})
-        viewstategenerator = soup.find('input', {'name': '__VIEWSTATEGENERATOR'})
-        eventvalidation = soup.find('input', {'name': '__EVENTVALIDATION'})
-        
-        viewstate_value = viewstate.get('value', '') if viewstate else ''
-        viewstategenerator_value = viewstategenerator.get('value', '') if viewstategenerator else ''
-        eventvalidation_value = eventvalidation.get('value', '') if eventvalidation else ''
+        # 主頁面只下載一次，之後每頁沿用上一個回應的 ViewState
+        pager = AspNetPager(session, base_url, params={'nodeID': '178'})
+        query = {
+            'ctl00$ContentPlaceHolder1$DropDownList1': '',
+            'ctl00$ContentPlaceHolder1$TextBox1': ''
+        }
         
         # 搜尋所有食物（前5頁）
         for page in range(1, 6):
             print(f"  正在處理第 {page} 頁...")
             
-            search_data = {
-                '__VIEWSTATE': viewstate_value,
-                '__VIEWSTATEGENERATOR': viewstategenerator_value,
-                '__EVENTVALIDATION': eventvalidation_value,
-                '__EVENTTARGET': '',
-                '__EVENTARGUMENT': '',
-                'ctl00$ContentPlaceHolder1$DropDownList1': '',
-                'ctl00$ContentPlaceHolder1$TextBox1': '',
-                'ctl00$ContentPlaceHolder1$Button1': '查詢'
-            }
-            
-            if page > 1:
-                search_data['__EVENTTARGET'] = 'ctl00$ContentPlaceHolder1$GridView1'
-                search_data['__EVENTARGUMENT'] = f'Page${page}'
-            
-            response = session.post(base_url, data=search_data, params={'nodeID': '178'})
-            response.raise_for_status()
-            response.encoding = 'utf-8'
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
+            html = pager.fetch_page(page, query)
+            soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('table', id='ctl00_ContentPlaceHolder1_GridView1'))
             
             # 解析表格
             table = soup.find('table', {'id': 'ctl00_ContentPlaceHolder1_GridView1'})
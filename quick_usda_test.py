@@ -9,6 +9,16 @@ import json
 import time
 from typing import List, Dict, Optional
 from dataclasses import dataclass
+from keyword_matcher import category_matcher
+
+# 簡單的食物分類 (分類順序即優先順序)
+QUICK_CATEGORIES = {
+    'fruits': ['apple', 'banana', 'orange', 'grape'],
+    'proteins': ['chicken', 'beef', 'pork', 'fish'],
+    'grains': ['rice', 'bread', 'pasta'],
+    'dairy': ['milk', 'cheese', 'yogurt']
+}
+QUICK_CATEGORY_MATCHER = category_matcher(QUICK_CATEGORIES)
 
 @dataclass
 class QuickUSDAFood:
@@ -182,18 +192,7 @@ class QuickUSDATester:
     
     def categorize_food(self, food_name: str) -> str:
         """簡單的食物分類"""
-        food_name_lower = food_name.lower()
-        
-        if any(word in food_name_lower for word in ['apple', 'banana', 'orange', 'grape']):
-            return 'fruits'
-        elif any(word in food_name_lower for word in ['chicken', 'beef', 'pork', 'fish']):
-            return 'proteins'
-        elif any(word in food_name_lower for word in ['rice', 'bread', 'pasta']):
-            return 'grains'
-        elif any(word in food_name_lower for word in ['milk', 'cheese', 'yogurt']):
-            return 'dairy'
-        else:
-            return 'other'
+        return QUICK_CATEGORY_MATCHER.first_label(food_name.lower(), 'other')
     
     def run_quick_test(self):
         """執行快速測試"""
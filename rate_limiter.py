@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+跨執行緒/跨行程共用的請求速率限制與重試
+以 token bucket 控制請求速率，狀態存放在加鎖的檔案中，讓多個行程共用同一份配額；
+遇到 429/5xx 時以帶隨機抖動的指數退避重試，並遵守 Retry-After 標頭
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+@contextmanager
+def _locked_file(path: str):
+    """開啟並獨占鎖定狀態檔案"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        yield fd
+    finally:
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+class TokenBucket:
+    """Token bucket 速率限制器"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, state_path: Optional[str] = None):
+        """
+        初始化速率限制器
+
+        Args:
+            rate: 每秒補充的 token 數 (即每秒請求數上限)
+            capacity: 最大突發請求數 (預設為 max(1, rate))
+            state_path: 狀態檔案路徑，多個行程指定同一個檔案即共用配額 (None 表示只在行程內共用)
+        """
+        if rate <= 0:
+            raise ValueError("rate 必須大於 0")
+
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.state_path = state_path
+
+        self._lock = threading.Lock()
+        self._state = {'tokens': self.capacity, 'updated': time.time(), 'blocked_until': 0.0}
+
+        # 統計資訊
+        self.acquired = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+
+    @contextmanager
+    def _transaction(self):
+        """在鎖內讀取並寫回狀態"""
+        with self._lock:
+            if self.state_path is None:
+                yield self._state
+                return
+
+            with _locked_file(self.state_path) as fd:
+                raw = os.read(fd, 4096)
+                try:
+                    state = json.loads(raw.decode('utf-8')) if raw else None
+                except ValueError:
+                    state = None
+                if not state:
+                    state = {'tokens': self.capacity, 'updated': time.time(), 'blocked_until': 0.0}
+
+                yield state
+
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, json.dumps(state).encode('utf-8'))
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """
+        預扣 token 並回傳需要等待的秒數 (不會睡眠)
+
+        token 不足時允許餘額為負，後續呼叫者會依序排在後面等待，
+        因此多個執行緒/行程之間不需要反覆輪詢。
+
+        Args:
+            tokens: 需要的 token 數
+
+        Returns:
+            呼叫者發送請求前應等待的秒數
+        """
+        now = time.time()
+        with self._transaction() as state:
+            elapsed = max(0.0, now - state['updated'])
+            state['tokens'] = min(self.capacity, state['tokens'] + elapsed * self.rate) - tokens
+            state['updated'] = now
+
+            wait = -state['tokens'] / self.rate if state['tokens'] < 0 else 0.0
+            wait = max(wait, state['blocked_until'] - now)
+
+        self.acquired += 1
+        self.total_wait += wait
+        return wait
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """
+        取得 token，必要時睡眠等待
+
+        Returns:
+            實際等待的秒數
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def penalize(self, delay: float):
+        """
+        伺服器回報限流 (429) 時，讓所有共用此限制器的呼叫者暫停
+
+        Args:
+            delay: 暫停秒數
+        """
+        until = time.time() + delay
+        with self._transaction() as state:
+            state['blocked_until'] = max(state['blocked_until'], until)
+        self.throttled += 1
+
+    def get_statistics(self) -> Dict:
+        """獲取統計資訊"""
+        return {
+            'acquired': self.acquired,
+            'throttled': self.throttled,
+            'total_wait': self.total_wait,
+            'average_wait': self.total_wait / self.acquired if self.acquired else 0.0
+        }
+
+@dataclass
+class RetryPolicy:
+    """重試策略"""
+    max_retries: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 60.0
+    retry_statuses: Tuple[int, ...] = (429, 500, 502, 503, 504)
+
+    def compute_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        計算第 attempt 次重試前的等待秒數
+
+        使用 full jitter 指數退避；伺服器提供 Retry-After 時以其為下限。
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    解析 Retry-After 標頭 (秒數或 HTTP 日期)
+
+    Returns:
+        等待秒數，無法解析時回傳 None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def _should_retry(response, policy: RetryPolicy) -> bool:
+    return getattr(response, 'status_code', None) in policy.retry_statuses
+
+def _retry_delay(response, attempt: int, policy: RetryPolicy, limiter: Optional[TokenBucket]) -> float:
+    """計算重試等待時間，429 時通知限制器讓其他呼叫者一起退避"""
+    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+    delay = policy.compute_delay(attempt, retry_after)
+    if response.status_code == 429 and limiter is not None:
+        limiter.penalize(delay)
+    logger.warning(f"HTTP {response.status_code}，{delay:.1f} 秒後重試 ({attempt + 1}/{policy.max_retries})")
+    return delay
+
+_RETRYABLE_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+def send_with_retry(send: Callable[[], Any], limiter: Optional[TokenBucket] = None,
+                    policy: Optional[RetryPolicy] = None):
+    """
+    經過速率限制發送請求，失敗時依重試策略重試
+
+    Args:
+        send: 發送一次請求並回傳回應的函數
+        limiter: 速率限制器 (None 表示不限速)
+        policy: 重試策略
+
+    Returns:
+        最後一次的回應 (重試用盡時回傳最後的錯誤回應)
+    """
+    policy = policy or RetryPolicy()
+
+    for attempt in range(policy.max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+
+        try:
+            response = send()
+        except _RETRYABLE_ERRORS as e:
+            if attempt >= policy.max_retries:
+                raise
+            delay = policy.compute_delay(attempt)
+            logger.warning(f"連線失敗，{delay:.1f} 秒後重試 ({attempt + 1}/{policy.max_retries}): {e}")
+            time.sleep(delay)
+            continue
+
+        if attempt < policy.max_retries and _should_retry(response, policy):
+            delay = _retry_delay(response, attempt, policy, limiter)
+            close = getattr(response, 'close', None)
+            if close is not None:
+                close()
+            time.sleep(delay)
+            continue
+
+        return response
+
+async def async_send_with_retry(send: Callable[[], Awaitable[Any]], limiter: Optional[TokenBucket] = None,
+                                policy: Optional[RetryPolicy] = None):
+    """send_with_retry 的非同步版本"""
+    policy = policy or RetryPolicy()
+    # 跨行程共用的限制器需要鎖定狀態檔案，改在執行緒中執行，不阻塞事件迴圈
+    shared = limiter is not None and limiter.state_path is not None
+
+    for attempt in range(policy.max_retries + 1):
+        if limiter is not None:
+            wait = await asyncio.to_thread(limiter.reserve) if shared else limiter.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        try:
+            response = await send()
+        except _RETRYABLE_ERRORS as e:
+            if attempt >= policy.max_retries:
+                raise
+            delay = policy.compute_delay(attempt)
+            logger.warning(f"連線失敗，{delay:.1f} 秒後重試 ({attempt + 1}/{policy.max_retries}): {e}")
+            await asyncio.sleep(delay)
+            continue
+
+        if attempt < policy.max_retries and _should_retry(response, policy):
+            if shared:
+                delay = await asyncio.to_thread(_retry_delay, response, attempt, policy, limiter)
+            else:
+                delay = _retry_delay(response, attempt, policy, limiter)
+            await asyncio.sleep(delay)
+            continue
+
+        return response
+
+class RateLimitedAdapter(HTTPAdapter):
+    """套用速率限制與重試的 requests 連線配接器"""
+
+    def __init__(self, limiter: Optional[TokenBucket] = None, policy: Optional[RetryPolicy] = None, **kwargs):
+        self.limiter = limiter
+        self.policy = policy or RetryPolicy()
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        return send_with_retry(lambda: super(RateLimitedAdapter, self).send(request, **kwargs),
+                               self.limiter, self.policy)
+
+    def with_policy(self, policy: RetryPolicy) -> 'RateLimitedAdapter':
+        """設定相同 (共用連線池、限制器與快取) 但使用另一個重試策略的配接器"""
+        adapter = object.__new__(type(self))
+        adapter.__dict__.update(self.__dict__)
+        adapter.policy = policy
+        return adapter
+
+def install_rate_limiter(session: requests.Session, limiter: Optional[TokenBucket] = None,
+                         policy: Optional[RetryPolicy] = None) -> RateLimitedAdapter:
+    """
+    將速率限制與重試掛載到 requests.Session
+
+    Returns:
+        掛載的配接器
+    """
+    adapter = RateLimitedAdapter(limiter, policy)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return adapter
+
+# 同一行程中相同名稱的限制器共用同一個物件
+_limiters: Dict[str, TokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(name: str) -> Optional[TokenBucket]:
+    """
+    依環境變數取得具名的共用限制器
+
+    讀取 <NAME>_RATE_LIMIT (每秒請求數) 與 <NAME>_RATE_BURST，
+    狀態檔案放在 RATE_LIMIT_STATE_DIR (預設為系統暫存目錄)，讓多個行程共用配額。
+
+    Args:
+        name: 限制器名稱，例如 AZURE_VISION、USDA、FDA
+
+    Returns:
+        共用的限制器，未設定速率時回傳 None
+    """
+    key = name.upper()
+    rate = os.getenv(f'{key}_RATE_LIMIT')
+    if not rate or float(rate) <= 0:
+        return None
+
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            burst = os.getenv(f'{key}_RATE_BURST')
+            state_dir = os.getenv('RATE_LIMIT_STATE_DIR') or tempfile.gettempdir()
+            limiter = TokenBucket(
+                rate=float(rate),
+                capacity=float(burst) if burst else None,
+                state_path=os.path.join(state_dir, f'rate_limit_{key.lower()}.json')
+            )
+            _limiters[key] = limiter
+        return limiter
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+飲食建議規則引擎
+每種食品只分類一次，得到食物類別位元遮罩；建議規則以位元運算判斷，
+並使用已計算好的營養資訊，輸出依食品組合快取 (即時串流中同一盤食物會重複出現數百次)
+"""
+
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from keyword_matcher import category_matcher
+
+# 食物類別位元
+PROTEIN = 1 << 0
+VEGETABLES = 1 << 1
+FRUITS = 1 << 2
+GRAINS = 1 << 3
+DAIRY = 1 << 4
+
+# 缺少各類別時的建議 (依輸出順序)
+GROUP_RECOMMENDATIONS: Tuple[Tuple[int, str], ...] = (
+    (PROTEIN, "建議添加蛋白質來源，如雞肉、魚肉、蛋類或豆類"),
+    (VEGETABLES, "建議添加蔬菜以增加纖維和維生素攝取"),
+    (FRUITS, "建議添加水果以補充維生素和礦物質"),
+    (GRAINS, "建議添加全穀類以提供能量和纖維"),
+    (DAIRY, "建議添加乳製品以補充鈣質和蛋白質"),
+)
+
+# 基本版各類別關鍵字
+BASIC_GROUP_KEYWORDS: Dict[int, Tuple[str, ...]] = {
+    PROTEIN: ('chicken', 'beef', 'fish', 'pork', 'meat', 'egg', 'cheese'),
+    VEGETABLES: ('vegetable', 'salad', 'carrot', 'broccoli', 'tomato', 'lettuce', 'onion'),
+    FRUITS: ('apple', 'banana', 'orange', 'grape', 'strawberry', 'watermelon', 'fruit'),
+    GRAINS: ('rice', 'bread', 'pasta', 'noodle'),
+    DAIRY: ('milk', 'cheese', 'yogurt'),
+}
+
+# 增強版另外加入中文關鍵字
+ENHANCED_GROUP_KEYWORDS: Dict[int, Tuple[str, ...]] = {
+    PROTEIN: BASIC_GROUP_KEYWORDS[PROTEIN] + ('肉', '魚', '蛋'),
+    VEGETABLES: BASIC_GROUP_KEYWORDS[VEGETABLES] + ('菜', '胡蘿蔔', '花椰菜', '番茄', '生菜', '洋蔥'),
+    FRUITS: BASIC_GROUP_KEYWORDS[FRUITS] + ('蘋果', '香蕉', '橘子', '葡萄', '草莓', '西瓜'),
+    GRAINS: BASIC_GROUP_KEYWORDS[GRAINS] + ('米', '麵', '飯', '麵包'),
+    DAIRY: BASIC_GROUP_KEYWORDS[DAIRY] + ('奶', '起司', '優格'),
+}
+
+# 食物種類與熱量的建議門檻
+MIN_FOOD_VARIETY = 3
+LOW_CALORIES = 200
+HIGH_CALORIES = 800
+
+BALANCED_MEAL = "這是一頓營養均衡的餐點！"
+
+def calorie_band(total_calories: float) -> int:
+    """熱量區間：-1 偏低、0 適中、1 偏高"""
+    if total_calories < LOW_CALORIES:
+        return -1
+    if total_calories > HIGH_CALORIES:
+        return 1
+    return 0
+
+class RecommendationEngine:
+    """以食物類別位元遮罩產生飲食建議"""
+
+    def __init__(self, group_keywords: Dict[int, Iterable[str]], memo_size: int = 1024):
+        """
+        初始化規則引擎
+
+        Args:
+            group_keywords: {類別位元: [關鍵字, ...]}
+            memo_size: 快取的食品組合數量 (最近最少使用者先移除)
+        """
+        self.matcher = category_matcher({group: tuple(keywords) for group, keywords in group_keywords.items()})
+        self.memo_size = memo_size
+        self._masks: Dict[str, int] = {}
+        self._memo: 'OrderedDict[tuple, Tuple[str, ...]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        # 統計資訊
+        self.requests = 0
+        self.memo_hits = 0
+
+    def food_mask(self, food: str) -> int:
+        """單一食品的類別位元遮罩 (每種食品只分類一次)"""
+        mask = self._masks.get(food)
+        if mask is None:
+            mask = 0
+            for group in self.matcher.matched_labels(food.lower()):
+                mask |= group
+            if len(self._masks) >= self.memo_size * 8:
+                self._masks.clear()
+            self._masks[food] = mask
+        return mask
+
+    def meal_mask(self, foods: Iterable[str]) -> int:
+        """整餐的類別位元遮罩"""
+        mask = 0
+        for food in foods:
+            mask |= self.food_mask(food)
+        return mask
+
+    def recommend(self, foods: Sequence[str], nutrition_info: Dict, extra: Sequence[str] = ()) -> List[str]:
+        """
+        產生飲食建議
+
+        Args:
+            foods: 檢測到的食物列表
+            nutrition_info: 已計算好的營養資訊 (使用 total_calories)
+            extra: 附加在類別建議之後的建議 (例如資料來源匹配結果)
+
+        Returns:
+            建議列表
+        """
+        band = calorie_band(nutrition_info.get('total_calories', 0) or 0)
+        key = (frozenset(foods), len(foods), band, tuple(extra))
+
+        with self._lock:
+            self.requests += 1
+            cached = self._memo.get(key)
+            if cached is not None:
+                self.memo_hits += 1
+                self._memo.move_to_end(key)
+                return list(cached)
+
+        result = tuple(self._evaluate(self.meal_mask(key[0]), len(foods), band, extra))
+
+        with self._lock:
+            self._memo[key] = result
+            if len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return list(result)
+
+    def _evaluate(self, mask: int, food_count: int, band: int, extra: Sequence[str]) -> List[str]:
+        recommendations = [message for group, message in GROUP_RECOMMENDATIONS if not mask & group]
+        recommendations.extend(extra)
+
+        if food_count < MIN_FOOD_VARIETY:
+            recommendations.append("建議增加食物種類以獲得均衡營養")
+
+        if band < 0:
+            recommendations.append("這餐的熱量較低，建議適量增加食物份量")
+        elif band > 0:
+            recommendations.append("這餐的熱量較高，建議適量減少食物份量")
+
+        if not recommendations:
+            recommendations.append(BALANCED_MEAL)
+        return recommendations
+
+    def clear(self):
+        """清除快取"""
+        with self._lock:
+            self._memo.clear()
+            self._masks.clear()
+
+    def get_statistics(self) -> Dict:
+        """獲取統計資訊"""
+        return {
+            'cached_meals': len(self._memo),
+            'classified_foods': len(self._masks),
+            'requests': self.requests,
+            'memo_hits': self.memo_hits,
+            'memo_hit_ratio': self.memo_hits / self.requests if self.requests else 0.0
+        }
+
+@lru_cache(maxsize=None)
+def get_engine(enhanced: bool = False) -> RecommendationEngine:
+    """
+    取得共用的規則引擎 (同一個行程中的偵測器共用分類結果與快取)
+
+    Args:
+        enhanced: 是否使用含中文關鍵字的增強版類別
+    """
+    return RecommendationEngine(ENHANCED_GROUP_KEYWORDS if enhanced else BASIC_GROUP_KEYWORDS)
@@ -8,6 +8,8 @@ import os
 import sys
 import time
 from datetime import datetime
+from nutrition_binary import build_database
+from nutrient_matrix import NutrientMatrix
 
 def main():
     """主函數"""
@@ -120,10 +122,19 @@ def main():
             
             if nutrition_db:
                 nutrition_json = f"fda_nutrition_db_{timestamp}.json"
-                scraper.save_to_json(nutrition_json, nutrition_db)
+                scraper.save_to_json(nutrition_db, nutrition_json)
                 print(f"💾 營養資料庫已儲存: {nutrition_json}")
+                
+                # 編譯成二進位資料庫 (啟動時以 mmap 載入)
+                build_database([nutrition_json], 'fda_nutrition_db.ndb')
+                print("💾 已編譯二進位營養資料庫: fda_nutrition_db.ndb")
                 print(f"✅ 成功建立營養資料庫，包含 {len(nutrition_db)} 種食品")
             
+            # 完整營養素矩陣 (供飲食規劃的向量化查詢)
+            matrix_file = f"fda_nutrient_matrix_{timestamp}.npz"
+            NutrientMatrix.from_fda_foods(detailed_foods).save(matrix_file)
+            print(f"💾 營養素矩陣已儲存: {matrix_file}")
+            
             # 計算執行時間
             elapsed_time = time.time() - start_time
             print(f"\n⏱️  總執行時間: {elapsed_time:.1f} 秒")
@@ -5,7 +5,7 @@
 """
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import json
 import time
 import csv
@@ -14,11 +14,16 @@ from datetime import datetime
 import logging
 import re
 from typing import List, Dict, Optional
+from aspnet_paging import AspNetPager
+from http_cache import install_http_cache
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 搜尋結果表格 (解析時略過頁面其他部分)
+RESULTS_TABLE = SoupStrainer('table', id='ctl00_ContentPlaceHolder1_GridView1')
+
 class SimpleFoodCaloriesExtractor:
     """簡化版食物熱量提取器"""
     
@@ -36,6 +41,12 @@ class SimpleFoodCaloriesExtractor:
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1',
         })
+        
+        # 設定 HTTP_CACHE_DIR 時，重新執行會直接使用快取的回應 (未設定時不掛載任何配接器)
+        install_http_cache(self.session, 'FDA')
+        
+        # 分頁沿用上一個回應的 ViewState，主頁面每個工作階段只下載一次
+        self.pager = AspNetPager(self.session, self.base_url, params={'nodeID': '178'})
     
     def get_main_page(self) -> Optional[BeautifulSoup]:
         """獲取主頁面"""
@@ -69,34 +80,15 @@ class SimpleFoodCaloriesExtractor:
         return viewstate_data
     
     def search_foods(self, category: str = '', keyword: str = '', page: int = 1) -> List[Dict]:
-        """搜尋食品資料"""
+        """搜尋食品資料 (同一查詢條件的後續頁面只需一次請求)"""
         try:
-            soup = self.get_main_page()
-            if not soup:
-                return []
-            
-            viewstate_data = self.extract_viewstate(soup)
-            
-            search_data = {
-                '__VIEWSTATE': viewstate_data.get('__VIEWSTATE', ''),
-                '__VIEWSTATEGENERATOR': viewstate_data.get('__VIEWSTATEGENERATOR', ''),
-                '__EVENTVALIDATION': viewstate_data.get('__EVENTVALIDATION', ''),
-                '__EVENTTARGET': '',
-                '__EVENTARGUMENT': '',
+            query = {
                 'ctl00$ContentPlaceHolder1$DropDownList1': category,
-                'ctl00$ContentPlaceHolder1$TextBox1': keyword,
-                'ctl00$ContentPlaceHolder1$Button1': '查詢'
+                'ctl00$ContentPlaceHolder1$TextBox1': keyword
             }
+            html = self.pager.fetch_page(page, query)
             
-            if page > 1:
-                search_data['__EVENTTARGET'] = 'ctl00$ContentPlaceHolder1$GridView1'
-                search_data['__EVENTARGUMENT'] = f'Page${page}'
-            
-            response = self.session.post(self.base_url, data=search_data, params={'nodeID': '178'})
-            response.raise_for_status()
-            response.encoding = 'utf-8'
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = BeautifulSoup(html, 'html.parser', parse_only=RESULTS_TABLE)
             return self.parse_search_results(soup)
             
         except Exception as e:
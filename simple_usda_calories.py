@@ -14,6 +14,10 @@ from datetime import datetime
 import logging
 import pandas as pd
 from tqdm import tqdm
+from keyword_matcher import mapping_matcher
+from http_cache import install_http_cache
+from rate_limiter import RetryPolicy, TokenBucket, get_rate_limiter
+from usda_nutrients import extract_nutrients, fetch_foods, needs_details
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
@@ -30,8 +34,14 @@ class SimpleUSDAFood:
 class SimpleUSDACalorieExtractor:
     """簡化USDA熱量提取器"""
     
-    def __init__(self):
-        """初始化提取器"""
+    def __init__(self, rate_limiter: Optional[TokenBucket] = None, retry_policy: Optional[RetryPolicy] = None):
+        """
+        初始化提取器
+        
+        Args:
+            rate_limiter: 跨行程共用的速率限制器 (預設依 USDA_RATE_LIMIT 環境變數決定)
+            retry_policy: 429/5xx 的重試策略
+        """
         self.api_base = "https://api.nal.usda.gov/fdc/v1"
         self.session = requests.Session()
         self.session.headers.update({
@@ -39,9 +49,15 @@ class SimpleUSDACalorieExtractor:
         })
         
         # 設定請求參數
-        self.request_delay = 1.0
+        self.request_delay = 1.0  # 未設定速率限制器時使用
         self.timeout = 30
         
+        # 速率限制與重試 (設定限制器後以配額上限發送請求，取代固定間隔)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else get_rate_limiter('USDA')
+        self.retry_policy = retry_policy or RetryPolicy()
+        # 設定 HTTP_CACHE_DIR 時，重新執行會直接使用快取的回應
+        install_http_cache(self.session, 'USDA', self.rate_limiter, self.retry_policy)
+        
         # 常見食物關鍵字
         self.food_keywords = [
             # 水果類
@@ -121,6 +137,9 @@ class SimpleUSDACalorieExtractor:
             'sauce': 'condiments', 'dressing': 'condiments', 'mayonnaise': 'condiments',
             'ketchup': 'condiments', 'mustard': 'condiments', 'soy sauce': 'condiments'
         }
+        
+        # 分類關鍵字編譯成單一自動機，關鍵字順序即優先順序
+        self.category_matcher = mapping_matcher(self.category_mapping)
     
     def search_foods(self, query: str, page_size: int = 25) -> Optional[Dict]:
         """
@@ -181,9 +200,21 @@ class SimpleUSDACalorieExtractor:
             logger.error(f"獲取食物詳細資訊失敗 (FDC ID: {fdc_id}): {e}")
             return None
     
+    def get_foods_details(self, fdc_ids: List[str]) -> Dict[str, Dict]:
+        """
+        批次獲取多個食物的熱量資料 (POST /foods，每次最多 20 個 ID)
+        
+        Args:
+            fdc_ids: 食物ID列表
+            
+        Returns:
+            {食物ID: 食物詳細資訊}
+        """
+        return fetch_foods(self.session, self.api_base, fdc_ids, 'DEMO_KEY', nutrients=(208,), timeout=self.timeout)
+    
     def extract_energy_value(self, food_details: Dict) -> Optional[float]:
         """
-        從食物詳細資訊中提取熱量值
+        從食物資料中提取熱量值 (搜尋結果或詳細資訊皆可)
         
         Args:
             food_details: 食物詳細資訊
@@ -191,23 +222,7 @@ class SimpleUSDACalorieExtractor:
         Returns:
             熱量值 (kcal)
         """
-        try:
-            if 'foodNutrients' in food_details:
-                for nutrient in food_details['foodNutrients']:
-                    # 營養素ID 208 是能量 (kcal)
-                    if nutrient.get('nutrient', {}).get('id') == 208:
-                        return nutrient.get('amount', 0)
-                    
-                    # 也檢查營養素名稱
-                    nutrient_name = nutrient.get('nutrient', {}).get('name', '').lower()
-                    if 'energy' in nutrient_name or 'calories' in nutrient_name:
-                        return nutrient.get('amount', 0)
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"提取熱量值失敗: {e}")
-            return None
+        return extract_nutrients(food_details).get('energy_kcal')
     
     def categorize_food(self, food_name: str) -> str:
         """
@@ -219,13 +234,7 @@ class SimpleUSDACalorieExtractor:
         Returns:
             食物分類
         """
-        food_name_lower = food_name.lower()
-        
-        for keyword, category in self.category_mapping.items():
-            if keyword in food_name_lower:
-                return category
-        
-        return "other"
+        return self.category_matcher.first_label(food_name.lower(), "other")
     
     def extract_food_calories(self, keyword: str, max_results: int = 5) -> List[SimpleUSDAFood]:
         """
@@ -247,8 +256,15 @@ class SimpleUSDACalorieExtractor:
             if not search_result or 'foods' not in search_result:
                 return foods
             
+            hits = search_result['foods'][:max_results]
+            
+            # 熱量直接取自搜尋結果，缺少時才以一次批次請求取得詳細資訊
+            missing = [str(food_data.get('fdcId', '')) for food_data in hits
+                       if food_data.get('description', '').strip() and needs_details(food_data)]
+            details = self.get_foods_details(missing) if missing else {}
+            
             # 處理搜尋結果
-            for food_data in search_result['foods'][:max_results]:
+            for food_data in hits:
                 try:
                     fdc_id = str(food_data.get('fdcId', ''))
                     food_name = food_data.get('description', '').strip()
@@ -256,12 +272,7 @@ class SimpleUSDACalorieExtractor:
                     if not food_name:
                         continue
                     
-                    # 獲取詳細資訊以提取熱量
-                    food_details = self.get_food_details(fdc_id)
-                    energy_kcal = 0.0
-                    
-                    if food_details:
-                        energy_kcal = self.extract_energy_value(food_details) or 0.0
+                    energy_kcal = self.extract_energy_value(details.get(fdc_id, food_data)) or 0.0
                     
                     # 只保留有熱量資料的食物
                     if energy_kcal > 0:
@@ -280,7 +291,8 @@ class SimpleUSDACalorieExtractor:
                     continue
             
             # 請求間隔
-            time.sleep(self.request_delay)
+            if self.rate_limiter is None:
+                time.sleep(self.request_delay)
             
         except Exception as e:
             logger.error(f"提取關鍵字 {keyword} 失敗: {e}")
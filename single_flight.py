@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+相同請求合併 (single-flight)
+多個執行緒或協程同時分析相同影像時，只有第一個呼叫者實際發送請求，其餘呼叫者等待並共用同一個結果
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+import logging
+
+logger = logging.getLogger(__name__)
+
+class _Call:
+    """進行中的呼叫"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """以鍵值合併同時進行的相同呼叫"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._lock = threading.Lock()
+
+        # 統計資訊
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """
+        執行呼叫，若相同鍵值的呼叫正在進行中則等待其結果
+
+        Args:
+            key: 呼叫鍵值 (例如影像雜湊)
+            func: 實際執行的函數
+
+        Returns:
+            函數結果 (所有等待者取得同一個物件)
+
+        Raises:
+            第一個呼叫者遇到的例外會同樣拋給所有等待者
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            if call.waiters:
+                logger.debug(f"合併了 {call.waiters} 個相同請求")
+            call.done.set()
+
+    async def do_async(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        do 的非同步版本 (合併同一個事件迴圈中的相同呼叫)
+
+        實際呼叫在獨立的 task 中執行，第一個呼叫者與等待者都以 shield 等待，
+        任何一個呼叫者被取消都不會取消共用的呼叫。
+
+        Args:
+            key: 呼叫鍵值
+            func: 回傳協程的函數
+
+        Returns:
+            協程結果
+        """
+        loop = asyncio.get_running_loop()
+        task_key = (id(loop), key)
+
+        with self._lock:
+            task = self._tasks.get(task_key)
+            if task is not None:
+                self.coalesced += 1
+            else:
+                task = asyncio.ensure_future(func())
+                self._tasks[task_key] = task
+                self.executed += 1
+                task.add_done_callback(lambda done: self._finish(task_key, done))
+
+        return await asyncio.shield(task)
+
+    def _finish(self, task_key: Hashable, task: asyncio.Task):
+        """共用的呼叫完成後移除，讓之後的呼叫重新執行"""
+        with self._lock:
+            del self._tasks[task_key]
+        # 所有呼叫者都已取消時避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def get_statistics(self) -> Dict:
+        """獲取統計資訊"""
+        with self._lock:
+            in_flight = len(self._calls) + len(self._tasks)
+        total = self.executed + self.coalesced
+        return {
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'in_flight': in_flight,
+            'coalesced_ratio': self.coalesced / total if total else 0.0
+        }
+
+# 同一個行程中所有辨識器共用，Streamlit 多位使用者與不同物件之間也能合併
+shared_flight = SingleFlight()
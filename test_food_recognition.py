@@ -6,8 +6,34 @@ Azure AI 食物影像辨識 - 測試檔案
 import unittest
 import os
 import tempfile
-from unittest.mock import Mock, patch
+import shutil
+import json
+import random
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
+import argparse
+import asyncio
 from food_recognition import FoodRecognition
+from vision_transport import TransportSettings
+import vision_transport
+from analysis_cache import AnalysisCache
+from cli import collect_images, load_completed, percentile, run_batch
+from frame_dedup import FrameDeduplicator, dhash, hamming_distance
+from food_detection import FoodDetector
+from image_preprocess import PreprocessSettings, _encode_with_budget, download_image, encode_frame, prepare_image_bytes
+from PIL import Image
+from single_flight import SingleFlight
+from keyword_matcher import KeywordMatcher, get_matcher, keyword_matcher
+from ingestion_pipeline import IngestionPipeline
+from fuzzy_index import SearchMemoStore, TrigramIndex, ngrams
+from nutrition_binary import MappedNutritionDB, build_database, compile_registry, find_database
+from nutrition_batch import aggregate_meals, health_scores, rollup, score_results
+from nutrition_registry import NutritionRecord, NutritionRegistry, get_registry, load_nutrition_file
+from recommendation_engine import BASIC_GROUP_KEYWORDS, DAIRY, GRAINS, PROTEIN, RecommendationEngine
+import threading
+import time
+from vision_standin import StandinConfig, VisionStandinServer, LatencyModel, synthesize_analysis
+import io
+import numpy as np
 
 class TestFoodRecognition(unittest.TestCase):
     """食物辨識測試類別"""
@@ -17,6 +43,8 @@ class TestFoodRecognition(unittest.TestCase):
         # 模擬環境變數
         os.environ['AZURE_VISION_ENDPOINT'] = 'https://test.cognitiveservices.azure.com/'
         os.environ['AZURE_VISION_KEY'] = 'test-key'
+        os.environ['AZURE_VISION_WARMUP'] = '0'
+        os.environ['AZURE_VISION_HTTP2'] = '0'
         
         self.recognizer = FoodRecognition()
     
@@ -25,6 +53,31 @@ class TestFoodRecognition(unittest.TestCase):
         self.assertEqual(self.recognizer.endpoint, 'https://test.cognitiveservices.azure.com')
         self.assertEqual(self.recognizer.key, 'test-key')
     
+    def test_shared_transport(self):
+        """測試同一端點共用連線池傳輸層"""
+        other = FoodRecognition()
+        self.assertIs(self.recognizer.transport, other.transport)
+        
+        adapter = self.recognizer.transport._client.get_adapter('https://test.cognitiveservices.azure.com')
+        self.assertEqual(adapter._pool_maxsize, TransportSettings().pool_maxsize)
+    
+    def test_shared_transport_respects_settings(self):
+        """測試設定不同時不共用傳輸層"""
+        settings = TransportSettings(http2=False, warmup=False, pool_maxsize=32)
+        first = vision_transport.get_shared_transport('https://test.cognitiveservices.azure.com/', settings)
+        
+        self.assertIsNot(first, self.recognizer.transport)
+        self.assertEqual(first.settings.pool_maxsize, 32)
+        same = TransportSettings(http2=False, warmup=False, pool_maxsize=32)
+        self.assertIs(vision_transport.get_shared_transport('https://test.cognitiveservices.azure.com', same), first)
+    
+    def test_transport_settings_from_env(self):
+        """測試從環境變數讀取傳輸層設定"""
+        with patch.dict(os.environ, {'AZURE_VISION_POOL_SIZE': '32', 'AZURE_VISION_READ_TIMEOUT': '12'}):
+            settings = TransportSettings.from_env()
+        self.assertEqual(settings.pool_maxsize, 32)
+        self.assertEqual(settings.timeout, (5.0, 12.0))
+    
     def test_missing_environment_variables(self):
         """測試缺少環境變數"""
         # 清除環境變數
@@ -36,7 +89,7 @@ class TestFoodRecognition(unittest.TestCase):
         with self.assertRaises(ValueError):
             FoodRecognition()
     
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_analyze_image_success(self, mock_post):
         """測試成功分析影像"""
         # 模擬 API 回應
@@ -82,7 +135,7 @@ class TestFoodRecognition(unittest.TestCase):
             # 清理測試檔案
             os.unlink(image_path)
     
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_analyze_image_api_error(self, mock_post):
         """測試 API 錯誤處理"""
         # 模擬 API 錯誤
@@ -172,6 +225,1158 @@ class TestFoodRecognition(unittest.TestCase):
         with self.assertRaises(FileNotFoundError):
             self.recognizer.analyze_image("nonexistent_file.jpg")
 
+class TestAnalysisCache(unittest.TestCase):
+    """分析結果快取測試類別"""
+    
+    def setUp(self):
+        """測試前設定"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.temp_dir, 'cache.sqlite3')
+        self.cache = AnalysisCache(self.cache_path, memory_entries=2, disk_entries=3)
+    
+    def tearDown(self):
+        """測試後清理"""
+        self.cache.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def test_key_depends_on_bytes_and_params(self):
+        """測試快取鍵由影像內容與參數決定"""
+        key = AnalysisCache.make_key(b'image', {'language': 'zh'})
+        self.assertEqual(key, AnalysisCache.make_key(b'image', {'language': 'zh'}))
+        self.assertNotEqual(key, AnalysisCache.make_key(b'image2', {'language': 'zh'}))
+        self.assertNotEqual(key, AnalysisCache.make_key(b'image', {'language': 'en'}))
+    
+    def test_memory_and_disk_hits(self):
+        """測試記憶體與磁碟快取命中"""
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', {'tags': [{'name': '蘋果'}]})
+        self.assertEqual(self.cache.get('a'), {'tags': [{'name': '蘋果'}]})
+        
+        # 新的快取物件只能從磁碟讀取
+        reopened = AnalysisCache(self.cache_path)
+        self.assertEqual(reopened.get('a'), {'tags': [{'name': '蘋果'}]})
+        reopened.close()
+        
+        stats = self.cache.get_statistics()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['memory_hits'], 1)
+    
+    def test_eviction(self):
+        """測試超過上限時淘汰舊項目"""
+        for name in ['a', 'b', 'c', 'd']:
+            self.cache.set(name, {'name': name})
+        
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('d'), {'name': 'd'})
+        self.assertGreater(self.cache.get_statistics()['evictions'], 0)
+    
+    def test_ttl_expiry(self):
+        """測試過期項目不會被使用"""
+        cache = AnalysisCache(None, ttl=10)
+        with patch('analysis_cache.time.time', return_value=1000):
+            cache.set('a', {'name': 'a'})
+        with patch('analysis_cache.time.time', return_value=1011):
+            self.assertIsNone(cache.get('a'))
+    
+    @patch('requests.Session.post')
+    def test_recognizer_uses_cache(self, mock_post):
+        """測試相同影像只呼叫一次 API"""
+        os.environ['AZURE_VISION_ENDPOINT'] = 'https://test.cognitiveservices.azure.com/'
+        os.environ['AZURE_VISION_KEY'] = 'test-key'
+        os.environ['AZURE_VISION_WARMUP'] = '0'
+        
+        mock_response = Mock()
+        mock_response.json.return_value = {'tags': [{'name': 'apple', 'confidence': 0.9}]}
+        mock_response.raise_for_status.return_value = None
+        mock_post.return_value = mock_response
+        
+        recognizer = FoodRecognition(cache=self.cache)
+        first = recognizer.analyze_image_from_bytes(b'same image')
+        second = recognizer.analyze_image_from_bytes(b'same image')
+        
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(first['foods_detected'], second['foods_detected'])
+
+class TestBatchCLI(unittest.TestCase):
+    """命令列批次分析測試類別"""
+    
+    def setUp(self):
+        """測試前設定"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.jsonl = os.path.join(self.temp_dir, 'out.jsonl')
+    
+    def tearDown(self):
+        """測試後清理"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def make_images(self, names):
+        """建立影像檔案 (內容不需要是有效影像)"""
+        folder = os.path.join(self.temp_dir, 'photos')
+        paths = []
+        for name in names:
+            path = os.path.join(folder, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'image')
+            paths.append(path)
+        return folder, paths
+    
+    def run_batch(self, folder, recognizer, workers=1):
+        """以模擬的辨識器執行批次分析，回傳輸出檔案中的記錄"""
+        recognizer.single_flight.get_statistics.return_value = {'coalesced': 0}
+        args = argparse.Namespace(image_path=folder, jsonl=self.jsonl, no_cache=True, cache_path=None,
+                                  workers=workers, detailed=False)
+        with patch('cli.FoodRecognition', return_value=recognizer), patch('builtins.print'):
+            run_batch(args)
+        with open(self.jsonl, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+    
+    def test_resume_skips_completed_and_retries_errors(self):
+        """測試重新執行時略過已成功的影像，重試失敗的影像"""
+        folder, paths = self.make_images(['a.jpg', 'b.png', 'c.jpg', 'sub/d.JPEG', 'notes.txt'])
+        images = paths[:4]
+        self.assertEqual(collect_images(folder), sorted(images))
+        with open(self.jsonl, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'image_path': images[0], 'result': {}}) + '\n')
+            f.write(json.dumps({'image_path': images[1], 'error': 'timeout'}) + '\n')
+            f.write('{"image_path": "')  # 中斷時寫到一半的最後一行
+        self.assertEqual(load_completed(self.jsonl), {images[0]})
+        
+        recognizer = MagicMock()
+        recognizer.analyze_image.side_effect = lambda path: {'foods': [os.path.basename(path)]}
+        records = self.run_batch(folder, recognizer)
+        
+        analyzed = sorted(call.args[0] for call in recognizer.analyze_image.call_args_list)
+        self.assertEqual(analyzed, sorted(images[1:]))
+        self.assertEqual(load_completed(self.jsonl), set(images))
+        self.assertEqual(len(records), 5)
+    
+    def test_workers_write_one_record_per_image(self):
+        """測試多個工作者並行分析時每張影像只寫入一筆記錄"""
+        folder, paths = self.make_images([f'{index:02d}.jpg' for index in range(24)])
+        
+        def analyze(path):
+            time.sleep(0.002)
+            if path.endswith('07.jpg'):
+                raise RuntimeError('API 錯誤')
+            return {'foods': []}
+        
+        recognizer = MagicMock()
+        recognizer.analyze_image.side_effect = analyze
+        records = self.run_batch(folder, recognizer, workers=8)
+        
+        self.assertEqual(sorted(record['image_path'] for record in records), sorted(paths))
+        self.assertEqual([record['image_path'] for record in records if 'error' in record], [paths[7]])
+        self.assertTrue(all('latency_ms' in record for record in records))
+    
+    def test_percentile_edge_cases(self):
+        """測試百分位數的空列表、單一元素與最近排名"""
+        self.assertEqual(percentile([], 50), 0.0)
+        for pct in (0, 50, 99, 100):
+            self.assertEqual(percentile([42.0], pct), 42.0)
+        values = [5, 1, 4, 2, 3, 10, 9, 8, 7, 6]
+        self.assertEqual(percentile(values, 50), 5)
+        self.assertEqual(percentile(values, 90), 9)
+        self.assertEqual(percentile(values, 100), 10)
+
+class TestFrameDeduplicator(unittest.TestCase):
+    """近似重複影像幀過濾測試類別"""
+    
+    def setUp(self):
+        """測試前設定"""
+        rng = np.random.default_rng(0)
+        self.frame = rng.integers(0, 255, (120, 160, 3), dtype=np.uint8)
+        self.noisy_frame = np.clip(self.frame.astype(int) + rng.integers(-3, 4, self.frame.shape), 0, 255).astype(np.uint8)
+        self.other_frame = rng.integers(0, 255, (120, 160, 3), dtype=np.uint8)
+    
+    def test_dhash_similarity(self):
+        """測試近似影像幀的雜湊距離較小"""
+        near = hamming_distance(dhash(self.frame), dhash(self.noisy_frame))
+        far = hamming_distance(dhash(self.frame), dhash(self.other_frame))
+        self.assertLessEqual(near, 5)
+        self.assertGreater(far, 10)
+    
+    def test_lookup_and_statistics(self):
+        """測試沿用結果與節省次數統計"""
+        dedup = FrameDeduplicator(threshold=5)
+        frame_hash = dedup.compute_hash(self.frame)
+        self.assertIsNone(dedup.lookup(frame_hash))
+        dedup.remember(frame_hash, 'result')
+        
+        self.assertEqual(dedup.lookup(dedup.compute_hash(self.noisy_frame)), 'result')
+        self.assertIsNone(dedup.lookup(dedup.compute_hash(self.other_frame)))
+        self.assertEqual(dedup.get_statistics()['calls_saved'], 1)
+    
+    @patch('requests.Session.post')
+    def test_detector_skips_duplicate_frames(self, mock_post):
+        """測試偵測器對近似影像幀只呼叫一次 API"""
+        os.environ['AZURE_VISION_ENDPOINT'] = 'https://test.cognitiveservices.azure.com/'
+        os.environ['AZURE_VISION_KEY'] = 'test-key'
+        os.environ['AZURE_VISION_WARMUP'] = '0'
+        
+        mock_response = Mock()
+        mock_response.json.return_value = {'tags': [{'name': 'apple', 'confidence': 0.9}]}
+        mock_response.raise_for_status.return_value = None
+        mock_post.return_value = mock_response
+        
+        detector = FoodDetector(frame_deduplicator=FrameDeduplicator(threshold=5))
+        first = detector.detect_food_from_frame(self.frame)
+        second = detector.detect_food_from_frame(self.noisy_frame)
+        
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertFalse(first.reused)
+        self.assertTrue(second.reused)
+        self.assertEqual(first.foods_detected, second.foods_detected)
+        self.assertEqual(detector.get_dedup_statistics()['calls_saved'], 1)
+        
+        # 修改沿用的結果不影響記住的結果
+        second.foods_detected.append('banana')
+        second.recommendations.clear()
+        third = detector.detect_food_from_frame(self.frame)
+        self.assertEqual(third.foods_detected, first.foods_detected)
+        self.assertEqual(third.recommendations, first.recommendations)
+
+@unittest.skipIf(vision_transport.httpx is None, "需要安裝 httpx")
+class TestAsyncRecognition(unittest.TestCase):
+    """非同步 API 測試類別"""
+    
+    def setUp(self):
+        """測試前設定"""
+        os.environ['AZURE_VISION_ENDPOINT'] = 'https://test.cognitiveservices.azure.com/'
+        os.environ['AZURE_VISION_KEY'] = 'test-key'
+        os.environ['AZURE_VISION_WARMUP'] = '0'
+    
+    def _mock_response(self, tag_name):
+        response = Mock()
+        response.json.return_value = {'tags': [{'name': tag_name, 'confidence': 0.9}]}
+        response.raise_for_status.return_value = None
+        return response
+    
+    def test_analyze_many_async_keeps_order(self):
+        """測試批次非同步分析的結果順序與錯誤處理"""
+        responses = {b'apple': self._mock_response('apple'), b'rice': self._mock_response('rice')}
+        
+        async def fake_post(url, headers, params, data):
+            if data == b'broken':
+                raise vision_transport.requests.exceptions.ConnectionError('boom')
+            await asyncio.sleep(0.01 if data == b'apple' else 0)
+            return responses[data]
+        
+        recognizer = FoodRecognition()
+        with patch.object(vision_transport.AsyncVisionTransport, 'post', AsyncMock(side_effect=fake_post)):
+            results = asyncio.run(recognizer.analyze_many_async([b'apple', b'broken', b'rice'], concurrency=2))
+        
+        self.assertIn('apple', results[0]['foods_detected'])
+        self.assertFalse(results[1]['success'])
+        self.assertIn('rice', results[2]['foods_detected'])
+    
+    def test_async_client_per_event_loop(self):
+        """測試每個事件迴圈使用各自的用戶端，迴圈結束時關閉"""
+        transport = vision_transport.AsyncVisionTransport('https://test.cognitiveservices.azure.com',
+                                                          TransportSettings(http2=False, warmup=False))
+        clients = []
+        
+        async def use():
+            client, _ = await transport._ensure_client()
+            self.assertIs((await transport._ensure_client())[0], client)
+            clients.append(client)
+        
+        asyncio.run(use())
+        asyncio.run(use())
+        
+        self.assertIsNot(clients[0], clients[1])
+        self.assertTrue(all(client.is_closed for client in clients))
+        self.assertEqual(transport._clients, {})
+    
+    def test_detector_frame_async(self):
+        """測試偵測器的非同步影像幀偵測"""
+        detector = FoodDetector(frame_deduplicator=FrameDeduplicator())
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        
+        with patch.object(vision_transport.AsyncVisionTransport, 'post', AsyncMock(return_value=self._mock_response('apple'))) as mock_post:
+            first = asyncio.run(detector.detect_food_from_frame_async(frame))
+            second = asyncio.run(detector.detect_food_from_frame_async(frame))
+        
+        self.assertTrue(first.success)
+        self.assertIn('apple', first.foods_detected)
+        self.assertTrue(second.reused)
+        self.assertEqual(mock_post.await_count, 1)
+
+class TestImagePreprocess(unittest.TestCase):
+    """上傳前影像前處理測試類別"""
+    
+    def setUp(self):
+        """測試前設定"""
+        rng = np.random.default_rng(1)
+        self.frame = rng.integers(0, 255, (1080, 1920, 3), dtype=np.uint8)
+        self.settings = PreprocessSettings(max_edge=640, target_bytes=60 * 1024)
+    
+    def test_encode_frame_downscales_within_budget(self):
+        """測試影像幀縮小且符合位元組預算"""
+        data = encode_frame(self.frame, self.settings)
+        image = Image.open(io.BytesIO(data))
+        
+        self.assertEqual(max(image.size), 640)
+        self.assertEqual(image.size, (640, 360))
+    
+    def test_encode_with_budget_tries_max_quality_first(self):
+        """測試最高品質符合預算時只編碼一次，否則找出符合預算的最高品質"""
+        qualities = []
+        def encode(quality):
+            qualities.append(quality)
+            return bytes(quality * size)
+        
+        size = 1000
+        settings = PreprocessSettings(target_bytes=90 * 1000, min_quality=50, max_quality=90)
+        self.assertEqual(len(_encode_with_budget(encode, settings)), 90 * 1000)
+        self.assertEqual(qualities, [90])
+        
+        qualities.clear()
+        settings.target_bytes = 73 * 1000
+        self.assertEqual(len(_encode_with_budget(encode, settings)), 73 * 1000)
+        
+        # 最低品質仍超過預算時回傳最低品質的結果，不重複編碼
+        qualities.clear()
+        settings.target_bytes = 10
+        self.assertEqual(len(_encode_with_budget(encode, settings)), 50 * 1000)
+        self.assertEqual(qualities.count(50), 1)
+    
+    def test_prepare_image_bytes(self):
+        """測試大型 JPEG 會被縮小，小影像與無法解碼的資料原樣保留"""
+        buffer = io.BytesIO()
+        Image.fromarray(self.frame).save(buffer, format='JPEG', quality=95)
+        original = buffer.getvalue()
+        
+        prepared = prepare_image_bytes(original, self.settings)
+        self.assertLess(len(prepared), len(original))
+        self.assertEqual(max(Image.open(io.BytesIO(prepared)).size), 640)
+        
+        small = encode_frame(self.frame[:100, :100], self.settings)
+        self.assertIs(prepare_image_bytes(small, self.settings), small)
+        self.assertEqual(prepare_image_bytes(b'not an image', self.settings), b'not an image')
+    
+    @patch('requests.get')
+    def test_download_image_size_limit(self, mock_get):
+        """測試串流下載超過上限時中止"""
+        response = Mock()
+        response.headers = {}
+        response.iter_content.return_value = [b'x' * 1024] * 4
+        response.__enter__ = Mock(return_value=response)
+        response.__exit__ = Mock(return_value=False)
+        mock_get.return_value = response
+        
+        self.assertEqual(len(download_image('https://example.com/a.jpg', max_bytes=8192)), 4096)
+        with self.assertRaises(ValueError):
+            download_image('https://example.com/a.jpg', max_bytes=2048)
+        
+        response.headers = {'Content-Length': '999999'}
+        with self.assertRaises(ValueError):
+            download_image('https://example.com/a.jpg', max_bytes=2048)
+
+class TestKeywordMatcher(unittest.TestCase):
+    """多關鍵字比對測試類別"""
+    
+    def test_matches_same_as_substring_scan(self):
+        """測試比對結果與逐一子字串搜尋相同 (含中英文與重疊關鍵字)"""
+        keywords = ['he', 'she', 'his', 'hers', 'ice cream', 'cream', '麵', '拉麵', '牛肉麵', 'a']
+        alphabet = 'hersic am麵拉牛肉'
+        
+        # matched_labels 的自動機與少量關鍵字時的子字串搜尋
+        for limit in (0, len(keywords)):
+            with patch('keyword_matcher.SUBSTRING_SCAN_LIMIT', limit):
+                matcher = KeywordMatcher([(keyword, keyword) for keyword in keywords])
+            rng = random.Random(3)
+            for _ in range(300):
+                text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+                expected = {keyword for keyword in keywords if keyword in text}
+                self.assertEqual(matcher.matched_labels(text), expected, text)
+                self.assertEqual(matcher.contains_any(text), bool(expected))
+                first = next((keyword for keyword in keywords if keyword in text), None)
+                self.assertEqual(matcher.first_label(text), first)
+        
+        self.assertEqual({match[:3] for match in matcher.find_all('ushers')}, {(1, 4, 'she'), (2, 4, 'he'), (2, 6, 'hers')})
+    
+    def test_memo_evicts_least_recent(self):
+        """測試記住的結果以最近最少使用的順序移除"""
+        with patch('keyword_matcher.SUBSTRING_SCAN_LIMIT', 0):
+            matcher = KeywordMatcher([('rice', 1), ('tea', 2)], memo_size=2)
+        
+        for text in ('rice', 'tea', 'rice', 'milk'):
+            matcher.matched_labels(text)
+        
+        self.assertEqual(list(matcher._memo), ['rice', 'milk'])
+    
+    def test_matcher_built_once(self):
+        """測試相同關鍵字組合共用同一個自動機"""
+        self.assertIs(keyword_matcher(['apple', 'rice']), keyword_matcher(['apple', 'rice']))
+        self.assertIs(get_matcher((('a', 1),)), get_matcher((('a', 1),)))
+    
+    def test_identify_food_tags(self):
+        """測試標籤識別維持原本的結果"""
+        os.environ['AZURE_VISION_ENDPOINT'] = 'https://test.cognitiveservices.azure.com/'
+        os.environ['AZURE_VISION_KEY'] = 'test-key'
+        os.environ['AZURE_VISION_WARMUP'] = '0'
+        tags = [{'name': 'Apple Pie'}, {'name': 'table'}, {'name': 'Seafood'}, {'confidence': 0.3}]
+        
+        self.assertEqual(FoodRecognition()._identify_food_tags(tags), ['Apple Pie', 'Seafood'])
+        self.assertEqual(FoodDetector()._identify_food_tags(tags), ['Apple Pie', 'Seafood'])
+
+class TestNutritionRegistry(unittest.TestCase):
+    """共用營養資料庫測試類別"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def test_registry_shared_and_read_only(self):
+        """測試所有偵測器共用同一份唯讀資料"""
+        os.environ['AZURE_VISION_ENDPOINT'] = 'https://test.cognitiveservices.azure.com/'
+        os.environ['AZURE_VISION_KEY'] = 'test-key'
+        os.environ['AZURE_VISION_WARMUP'] = '0'
+        registry = get_registry()
+        
+        self.assertIs(FoodDetector().nutrition_db, registry)
+        self.assertIs(FoodDetector().nutrition_db, registry)
+        with self.assertRaises(TypeError):
+            registry['apple'] = None
+        with self.assertRaises(AttributeError):
+            registry['apple'].calories = 0
+    
+    def test_lookup(self):
+        """測試完全比對優先，其次依資料順序做包含比對"""
+        registry = get_registry()
+        
+        self.assertEqual(registry.lookup('Steak').name, 'steak')
+        self.assertEqual(registry.lookup('fried chicken rice').name, 'rice')
+        self.assertIsNone(registry.lookup('table'))
+        self.assertEqual(registry['apple']['calories'], 95)
+        self.assertEqual(registry['apple'].get('minerals'), ())
+    
+    def test_load_fda_and_usda_files(self):
+        """測試載入 FDA 與 USDA 資料檔，相同檔案只解析一次"""
+        fda_path = os.path.join(self.temp_dir, 'fda_nutrition_db.json')
+        with open(fda_path, 'w', encoding='utf-8') as f:
+            json.dump({'白飯': {'calories': '183', 'protein': 3.1, 'carbs': 41, 'fat': 0.3,
+                               'fiber': 0.6, 'minerals': ['鉀'], 'source': 'FDA_TW'}}, f, ensure_ascii=False)
+        usda_path = os.path.join(self.temp_dir, 'usda_foods.json')
+        with open(usda_path, 'w', encoding='utf-8') as f:
+            json.dump({'foods': [{'food_name': 'Kale, raw', 'energy_kcal': 35.0, 'category': 'vegetables'}]}, f)
+        
+        fda = load_nutrition_file(fda_path)
+        self.assertIs(load_nutrition_file(fda_path), fda)
+        self.assertEqual(fda['白飯'], NutritionRecord('白飯', 183.0, 3.1, 41.0, 0.3, 0.6, minerals=('鉀',), source='FDA_TW'))
+        
+        usda = load_nutrition_file(usda_path)
+        self.assertEqual(usda['kale, raw'].calories, 35.0)
+        self.assertEqual(usda['kale, raw'].source, 'USDA')
+        
+        merged = NutritionRegistry(get_registry().values()).extended(usda.values())
+        self.assertEqual(merged.lookup('kale, raw').calories, 35.0)
+        self.assertEqual(merged['apple'], get_registry()['apple'])
+
+class TestFuzzyIndex(unittest.TestCase):
+    """n-gram 模糊搜尋索引測試類別"""
+    
+    def test_search_matches_brute_force(self):
+        """測試候選過濾後的排序結果與逐一計算相似度相同"""
+        rng = random.Random(5)
+        alphabet = '白飯米粉炒麵湯牛肉雞 rice chken'
+        names = [''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 10))) for _ in range(300)]
+        index = TrigramIndex(names)
+        
+        for _ in range(200):
+            query = ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 8)))
+            query_grams = ngrams(query)
+            scored = sorted(
+                ((len(query_grams & ngrams(name)) / len(query_grams | ngrams(name)), -i) for i, name in enumerate(names)),
+                reverse=True
+            )
+            for min_score in (0.1, 0.3, 0.6):
+                expected = [(names[-i], score) for score, i in scored if score >= min_score][:5]
+                self.assertEqual(index.search(query, 5, min_score), expected, (query, min_score))
+    
+    def test_ranked_and_memoized(self):
+        """測試最相似的項目排在前面，重複查詢直接使用記住的結果"""
+        index = TrigramIndex(['白飯', '炒飯', '牛肉麵', 'rice, white, cooked', 'fried rice'])
+        
+        self.assertEqual(index.best('白飯 (熟)')[0], '白飯')
+        self.assertEqual(index.search('Fried Rice')[0], ('fried rice', 1.0))
+        self.assertIsNone(index.best('table'))
+        index.search('Fried Rice')
+        self.assertEqual(index.get_statistics()['memo_hits'], 1)
+    
+    def test_memo_evicts_least_recent(self):
+        """測試記住的查詢結果以最近最少使用的順序移除"""
+        index = TrigramIndex(['白飯', '炒飯', 'fried rice'], memo_size=2)
+        
+        for query in ('白飯', '炒飯', '白飯', 'rice'):
+            index.search(query)
+        
+        self.assertEqual([key[0] for key in index._memo], ['白飯', 'rice'])
+    
+    def test_memo_persisted_per_database_version(self):
+        """測試查詢結果保存在 SQLite，重新建立索引後直接使用；資料庫內容不同時不使用"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            store = SearchMemoStore(os.path.join(temp_dir, 'memo.sqlite3'))
+            names = ['白飯', '炒飯', 'fried rice']
+            expected = TrigramIndex(names, store=store).search('Fried Rice')
+            
+            index = TrigramIndex(names, store=store)
+            self.assertEqual(index.search('Fried Rice'), expected)
+            self.assertEqual(index.get_statistics()['store_hits'], 1)
+            
+            other = TrigramIndex(names + ['fried rice, brown'], store=store)
+            other.search('Fried Rice')
+            self.assertEqual(other.get_statistics()['store_hits'], 0)
+            store.close()
+        finally:
+            shutil.rmtree(temp_dir)
+    
+    def test_enhanced_detector_fuzzy_match(self):
+        """測試增強版偵測器以相似度匹配 FDA 資料庫"""
+        os.environ['AZURE_VISION_ENDPOINT'] = 'https://test.cognitiveservices.azure.com/'
+        os.environ['AZURE_VISION_KEY'] = 'test-key'
+        os.environ['AZURE_VISION_WARMUP'] = '0'
+        from enhanced_food_detection import EnhancedFoodDetector
+        temp_dir = tempfile.mkdtemp()
+        try:
+            db_path = os.path.join(temp_dir, 'fda_nutrition_db.json')
+            with open(db_path, 'w', encoding='utf-8') as f:
+                json.dump({'米粉': {'calories': 360}, '炒米粉': {'calories': 180}, '白飯': {'calories': 183}}, f, ensure_ascii=False)
+            detector = EnhancedFoodDetector(db_path)
+            
+            matches = detector._match_fda_database(['白飯', '炒米粉 (小份)', 'table'])
+            
+            self.assertEqual([match['fda_match'] for match in matches], ['白飯', '炒米粉'])
+            self.assertEqual(matches[1]['match_type'], 'partial')
+            self.assertEqual(matches[1]['candidates'][0][0], '炒米粉')
+            self.assertLess(matches[1]['confidence'], 1.0)
+            self.assertEqual(detector._match_local_database(['Fried Rice'])[0]['local_match'], 'rice')
+        finally:
+            shutil.rmtree(temp_dir)
+
+class TestNutritionBinary(unittest.TestCase):
+    """二進位營養資料庫測試類別"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def test_round_trip(self):
+        """測試編譯後內容、查詢與搜尋結果和原資料相同"""
+        registry = get_registry().extended([
+            NutritionRecord('白飯', 183, 3.1, 41, 0.3, 0.6, minerals=('鉀', '磷'), source='FDA_TW', category='穀物類'),
+            NutritionRecord('炒米粉', 180, source='FDA_TW')
+        ])
+        path = os.path.join(self.temp_dir, 'nutrition.ndb')
+        compile_registry(registry, path)
+        
+        database = MappedNutritionDB(path)
+        
+        self.assertEqual(len(database), len(registry))
+        self.assertEqual(list(database), list(registry))
+        self.assertEqual(database.values(), list(registry.values()))
+        self.assertEqual(database['白飯'], registry['白飯'])
+        self.assertIn('ice cream', database)
+        self.assertNotIn('白', database)
+        self.assertEqual(database.lookup('Fried Chicken'), registry.lookup('Fried Chicken'))
+        for query in ['白飯 (熟)', 'fried rice', '米粉', 'table']:
+            self.assertEqual(database.search(query), registry.search(query), query)
+    
+    def test_build_and_load(self):
+        """測試由 JSON 編譯並經 load_nutrition_file 以 mmap 開啟"""
+        source = os.path.join(self.temp_dir, 'fda_nutrition_db_1.json')
+        with open(source, 'w', encoding='utf-8') as f:
+            json.dump({'白飯': {'calories': 183}}, f, ensure_ascii=False)
+        output = os.path.join(self.temp_dir, 'fda.ndb')
+        
+        build_database([source], output)
+        
+        self.assertIsInstance(load_nutrition_file(output), MappedNutritionDB)
+        self.assertEqual(load_nutrition_file(output)['白飯'].calories, 183)
+        self.assertEqual(find_database(self.temp_dir), output)
+        
+        # 之後抓取的 JSON 比舊的編譯檔新時使用 JSON
+        newer = os.path.join(self.temp_dir, 'fda_nutrition_db_2.json')
+        with open(newer, 'w', encoding='utf-8') as f:
+            json.dump({'白飯': {'calories': 190}}, f, ensure_ascii=False)
+        os.utime(output, (1000, 1000))
+        self.assertEqual(find_database(self.temp_dir), newer)
+    
+    def test_version_mismatch(self):
+        """測試版本不符時拒絕開啟"""
+        path = os.path.join(self.temp_dir, 'old.ndb')
+        compile_registry(NutritionRegistry(), path)
+        with open(path, 'r+b') as f:
+            f.seek(8)
+            f.write((99).to_bytes(4, 'little'))
+        
+        with self.assertRaises(ValueError):
+            MappedNutritionDB(path)
+
+class TestNutritionReload(unittest.TestCase):
+    """營養資料庫熱更新測試類別"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        os.environ['AZURE_VISION_ENDPOINT'] = 'https://test.cognitiveservices.azure.com/'
+        os.environ['AZURE_VISION_KEY'] = 'test-key'
+        os.environ['AZURE_VISION_WARMUP'] = '0'
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def write_db(self, name, foods, mtime):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({food: {'calories': 100} for food in foods}, f, ensure_ascii=False)
+        os.utime(path, (mtime, mtime))
+        return path
+    
+    def test_reload_swaps_snapshot(self):
+        """測試重新載入後替換快照，偵測期間不中斷"""
+        from enhanced_food_detection import EnhancedFoodDetector
+        path = self.write_db('fda_nutrition_db.json', ['白飯'], 1000)
+        detector = EnhancedFoodDetector(path)
+        self.assertEqual(detector.get_database_status()['generation'], 1)
+        self.assertFalse(detector.fda_database.changed())
+        
+        errors, stop = [], threading.Event()
+        def detect():
+            while not stop.is_set():
+                try:
+                    detector._match_fda_database(['白飯', '滷肉飯'])
+                except Exception as e:
+                    errors.append(e)
+        reader = threading.Thread(target=detect)
+        reader.start()
+        try:
+            self.write_db('fda_nutrition_db.json', ['白飯', '滷肉飯'], 2000)
+            snapshot = detector.fda_database.check().result()
+        finally:
+            stop.set()
+            reader.join()
+        
+        self.assertEqual(errors, [])
+        self.assertEqual(snapshot.generation, 2)
+        self.assertEqual([match['match_type'] for match in detector._match_fda_database(['滷肉飯'])], ['exact'])
+        self.assertIsNone(detector.fda_database.check())
+        self.assertGreater(detector.get_database_status()['reload_seconds'], 0)
+        
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('{broken')
+        with self.assertRaises(ValueError):
+            detector.reload_fda_database().result()
+        self.assertEqual(detector.get_database_status()['generation'], 2)
+        self.assertEqual(detector.get_database_status()['failures'], 1)
+        self.assertIn('滷肉飯', detector.fda_nutrition_db)
+    
+    def test_watch_directory(self):
+        """測試監看目錄時載入最新的資料檔"""
+        from nutrition_reload import ReloadableDatabase
+        self.write_db('fda_nutrition_db_20260101.json', ['白飯'], 1000)
+        database = ReloadableDatabase(self.temp_dir)
+        database.reload().result()
+        
+        newest = self.write_db('fda_nutrition_db_20260201.json', ['白飯', '米粉'], 2000)
+        database.start_watching(0.01)
+        try:
+            deadline = time.time() + 5
+            while database.generation < 2 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            database.stop_watching()
+        
+        self.assertEqual(database.snapshot.path, os.path.abspath(newest))
+        self.assertIn('米粉', database.registry)
+    
+    def wait_for_generation(self, detector, generation):
+        deadline = time.time() + 5
+        while detector.fda_database.generation < generation and time.time() < deadline:
+            time.sleep(0.01)
+    
+    @patch.dict(os.environ, {'NUTRITION_DB_WATCH_INTERVAL': '0.01'})
+    def test_detector_watches_database_directory(self):
+        """測試偵測器監看資料夾，抓取器產生的新資料檔會被載入 (啟動時沒有資料檔也一樣)"""
+        from enhanced_food_detection import EnhancedFoodDetector
+        self.write_db('fda_nutrition_db_20260101_000000.json', ['白飯'], 1000)
+        detector = EnhancedFoodDetector(self.temp_dir)
+        try:
+            self.assertEqual(detector.fda_database.generation, 1)
+            self.write_db('fda_nutrition_db_20260201_000000.json', ['白飯', '米粉'], 2000)
+            self.wait_for_generation(detector, 2)
+            self.assertEqual(detector.fda_database.generation, 2)
+            self.assertIn('米粉', detector.fda_nutrition_db)
+        finally:
+            detector.fda_database.stop_watching()
+        
+        empty_dir = os.path.join(self.temp_dir, 'empty')
+        os.makedirs(empty_dir)
+        detector = EnhancedFoodDetector(empty_dir)
+        try:
+            self.assertEqual(detector.fda_database.generation, 0)
+            self.assertTrue(detector.get_database_status()['watching'])
+            with open(os.path.join(empty_dir, 'fda_nutrition_db_20260301_000000.json'), 'w', encoding='utf-8') as f:
+                json.dump({'米粉': {'calories': 100}}, f, ensure_ascii=False)
+            self.wait_for_generation(detector, 1)
+            self.assertIn('米粉', detector.fda_nutrition_db)
+        finally:
+            detector.fda_database.stop_watching()
+    
+    @patch.dict(os.environ, {'NUTRITION_DB_WATCH_INTERVAL': '0.01'})
+    def test_detector_watches_database_file(self):
+        """測試指定資料檔時監看該檔案，不會改用同資料夾中其他的資料檔"""
+        from enhanced_food_detection import EnhancedFoodDetector
+        path = self.write_db('my_db.json', ['白飯'], 1000)
+        self.write_db('fda_nutrition_db_20260201_000000.json', ['米粉'], 2000)
+        detector = EnhancedFoodDetector(path)
+        try:
+            self.assertEqual(detector.fda_database.snapshot.path, os.path.abspath(path))
+            self.assertIn('白飯', detector.fda_nutrition_db)
+            self.write_db('my_db.json', ['白飯', '滷肉飯'], 3000)
+            self.wait_for_generation(detector, 2)
+            self.assertEqual(detector.fda_database.snapshot.path, os.path.abspath(path))
+            self.assertIn('滷肉飯', detector.fda_nutrition_db)
+            self.assertNotIn('米粉', detector.fda_nutrition_db)
+        finally:
+            detector.fda_database.stop_watching()
+
+class TestNutritionBatch(unittest.TestCase):
+    """批次營養計算測試類別"""
+    
+    @staticmethod
+    def reference_score(calories, protein, carbs, fat, fiber, vitamins=0):
+        """原本逐餐 if 判斷的評分規則"""
+        score = 50
+        score += 10 if 200 <= calories <= 800 else (5 if calories < 200 else -10)
+        score += 10 if protein >= 15 else (5 if protein >= 10 else 0)
+        score += 10 if carbs <= 50 else (5 if carbs <= 80 else 0)
+        score += 10 if fat <= 20 else (5 if fat <= 30 else 0)
+        score += 10 if fiber >= 5 else (5 if fiber >= 3 else 0)
+        score += 5 if vitamins >= 3 else (2 if vitamins >= 1 else 0)
+        return max(0, min(100, score))
+    
+    def test_health_scores_match_reference(self):
+        """測試向量化評分與逐餐規則相同 (含邊界值)"""
+        rng = np.random.default_rng(7)
+        edges = np.array([0, 3, 5, 10, 15, 20, 30, 50, 80, 200, 800, 801])
+        totals = rng.choice(edges, size=(500, 5)).astype(float)
+        vitamins = rng.integers(0, 5, size=500)
+        
+        expected = [self.reference_score(*row, vitamins=count) for row, count in zip(totals.tolist(), vitamins)]
+        self.assertEqual(health_scores(totals, vitamins).tolist(), expected)
+        
+        enhanced = health_scores(totals[:2], vitamins[:2], fda_counts=[1, 0], local_counts=[1, 1])
+        self.assertEqual(enhanced.tolist(), [min(100, expected[0] + 5), min(100, expected[1] + 2)])
+    
+    def test_aggregate_meals_matches_detector(self):
+        """測試批次彙總與 FoodDetector 逐餐計算相同"""
+        os.environ['AZURE_VISION_ENDPOINT'] = 'https://test.cognitiveservices.azure.com/'
+        os.environ['AZURE_VISION_KEY'] = 'test-key'
+        os.environ['AZURE_VISION_WARMUP'] = '0'
+        detector = FoodDetector()
+        registry = get_registry()
+        rng = random.Random(11)
+        names = list(registry) + ['table', 'fried chicken']
+        meals = [[rng.choice(names) for _ in range(rng.randint(0, 6))] for _ in range(200)]
+        
+        batch = aggregate_meals(meals, registry)
+        
+        infos = [detector._generate_nutrition_info(meal) for meal in meals]
+        self.assertEqual(batch.health_scores.tolist(), [detector._calculate_health_score(info) for info in infos])
+        np.testing.assert_allclose(batch.totals, [[info[field] for field in
+                                                   ('total_calories', 'protein', 'carbohydrates', 'fat', 'fiber')] for info in infos])
+        self.assertEqual(score_results(infos).health_scores.tolist(), batch.health_scores.tolist())
+        
+        doubled = aggregate_meals([[('apple', 2.0)]], registry)
+        self.assertEqual(doubled.totals[0, 0], 190)
+        np.testing.assert_allclose(doubled.macro_ratios[0].sum(), 1.0)
+    
+    def test_rollup(self):
+        """測試依使用者與週分組彙總"""
+        batch = aggregate_meals([['apple'], ['rice'], ['banana'], ['apple']], get_registry())
+        timestamps = ['2026-03-01T20:00', '2026-03-02T08:00', '2026-03-08T12:00', '2026-03-02T09:00']
+        
+        weekly = rollup(batch, timestamps, ['amy', 'amy', 'amy', 'bob'], period='week').to_records()
+        
+        self.assertEqual([(r['user'], r['period'], r['meals']) for r in weekly],
+                         [('amy', '2026-02-23', 1), ('amy', '2026-03-02', 2), ('bob', '2026-03-02', 1)])
+        self.assertEqual(weekly[1]['total_calories'], 130 + 105)
+        self.assertEqual(len(rollup(batch, timestamps, period='day').meals), 3)
+
+class TestRecommendationEngine(unittest.TestCase):
+    """飲食建議規則引擎測試類別"""
+    
+    @staticmethod
+    def reference_recommendations(foods, total_calories):
+        """原本以字串搜尋關鍵字的建議規則"""
+        foods_lower = ' '.join(foods).lower()
+        groups = [
+            (['chicken', 'beef', 'fish', 'pork', 'meat', 'egg', 'cheese'], "建議添加蛋白質來源，如雞肉、魚肉、蛋類或豆類"),
+            (['vegetable', 'salad', 'carrot', 'broccoli', 'tomato', 'lettuce', 'onion'], "建議添加蔬菜以增加纖維和維生素攝取"),
+            (['apple', 'banana', 'orange', 'grape', 'strawberry', 'watermelon', 'fruit'], "建議添加水果以補充維生素和礦物質"),
+            (['rice', 'bread', 'pasta', 'noodle'], "建議添加全穀類以提供能量和纖維"),
+            (['milk', 'cheese', 'yogurt'], "建議添加乳製品以補充鈣質和蛋白質"),
+        ]
+        recommendations = [message for keywords, message in groups
+                           if not any(keyword in foods_lower for keyword in keywords)]
+        if len(foods) < 3:
+            recommendations.append("建議增加食物種類以獲得均衡營養")
+        if total_calories < 200:
+            recommendations.append("這餐的熱量較低，建議適量增加食物份量")
+        elif total_calories > 800:
+            recommendations.append("這餐的熱量較高，建議適量減少食物份量")
+        return recommendations or ["這是一頓營養均衡的餐點！"]
+    
+    def setUp(self):
+        os.environ['AZURE_VISION_ENDPOINT'] = 'https://test.cognitiveservices.azure.com/'
+        os.environ['AZURE_VISION_KEY'] = 'test-key'
+        os.environ['AZURE_VISION_WARMUP'] = '0'
+    
+    def test_matches_reference_rules(self):
+        """測試位元遮罩規則與原本的字串搜尋結果相同"""
+        detector = FoodDetector()
+        rng = random.Random(5)
+        names = list(get_registry()) + ['Grilled Chicken', 'Cheese Pizza', 'table', 'fruit salad', 'Yogurt']
+        for _ in range(300):
+            foods = list({rng.choice(names) for _ in range(rng.randint(0, 5))})
+            nutrition_info = detector._generate_nutrition_info(foods)
+            self.assertEqual(detector._generate_recommendations(foods, nutrition_info),
+                             self.reference_recommendations(foods, nutrition_info['total_calories']))
+            self.assertEqual(detector._generate_recommendations(foods), detector._generate_recommendations(foods, nutrition_info))
+    
+    def test_cached_by_food_set(self):
+        """測試相同食品組合直接使用快取"""
+        engine = RecommendationEngine(BASIC_GROUP_KEYWORDS, memo_size=2)
+        first = engine.recommend(['rice', 'chicken'], {'total_calories': 400})
+        first.append('modified')
+        
+        self.assertEqual(engine.recommend(['chicken', 'rice'], {'total_calories': 450}), first[:-1])
+        self.assertEqual(engine.get_statistics()['memo_hits'], 1)
+        self.assertNotEqual(engine.recommend(['chicken', 'rice'], {'total_calories': 900}), first[:-1])
+        self.assertEqual(engine.food_mask('Fried Rice'), GRAINS)
+        self.assertEqual(engine.food_mask('cheese'), PROTEIN | DAIRY)
+        
+        engine.recommend(['apple'], {'total_calories': 95})
+        self.assertEqual(engine.get_statistics()['cached_meals'], 2)
+    
+    def test_enhanced_recommendations(self):
+        """測試增強版加入中文類別與資料來源建議"""
+        from enhanced_food_detection import EnhancedFoodDetector
+        detector = EnhancedFoodDetector('nonexistent.json')
+        fda_matches = [{'detected_food': '白飯', 'fda_match': '白飯'}]
+        
+        recommendations = detector._generate_enhanced_recommendations(
+            ['白飯', '雞肉', '青菜'], fda_matches, [], {'total_calories': 500})
+        
+        self.assertEqual(recommendations, [
+            "建議添加水果以補充維生素和礦物質",
+            "建議添加乳製品以補充鈣質和蛋白質",
+            "✅ 已匹配到 1 種台灣本地食品資料",
+        ])
+        self.assertIn("🍜 檢測到台灣特色食品，營養資訊更準確", detector._generate_enhanced_recommendations(
+            ['米粉'], [{'detected_food': '米粉', 'fda_match': '米粉'}], [], {'total_calories': 500}))
+
+class TestSingleFlight(unittest.TestCase):
+    """相同請求合併測試類別"""
+    
+    def test_concurrent_calls_coalesced(self):
+        """測試同時進行的相同呼叫只執行一次"""
+        flight = SingleFlight()
+        calls = []
+        results = []
+        
+        def slow():
+            calls.append(1)
+            time.sleep(0.1)
+            return {'tags': []}
+        
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', slow))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(flight.get_statistics()['coalesced'], 4)
+        
+        # 呼叫結束後相同鍵值會重新執行
+        flight.do('key', slow)
+        self.assertEqual(len(calls), 2)
+    
+    def test_errors_shared_and_async(self):
+        """測試例外傳給所有等待者，以及非同步合併"""
+        flight = SingleFlight()
+        
+        def failing():
+            raise ValueError('boom')
+        
+        with self.assertRaises(ValueError):
+            flight.do('key', failing)
+        
+        calls = []
+        
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'result'
+        
+        async def run():
+            return await asyncio.gather(*(flight.do_async('key', fetch) for _ in range(3)))
+        
+        self.assertEqual(asyncio.run(run()), ['result'] * 3)
+        self.assertEqual(len(calls), 1)
+    
+    def test_async_leader_cancelled(self):
+        """測試第一個呼叫者被取消時，等待者仍取得結果"""
+        flight = SingleFlight()
+        calls = []
+        
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'result'
+        
+        async def run():
+            leader = asyncio.ensure_future(flight.do_async('key', fetch))
+            await asyncio.sleep(0)
+            waiter = asyncio.ensure_future(flight.do_async('key', fetch))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return await waiter
+        
+        self.assertEqual(asyncio.run(run()), 'result')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.get_statistics()['in_flight'], 0)
+    
+    @patch('requests.Session.post')
+    def test_recognizers_share_one_request(self, mock_post):
+        """測試不同辨識器同時分析相同影像時只發送一個請求"""
+        os.environ['AZURE_VISION_ENDPOINT'] = 'https://test.cognitiveservices.azure.com/'
+        os.environ['AZURE_VISION_KEY'] = 'test-key'
+        os.environ['AZURE_VISION_WARMUP'] = '0'
+        os.environ['AZURE_VISION_HTTP2'] = '0'
+        
+        def slow_post(*args, **kwargs):
+            time.sleep(0.1)
+            response = Mock()
+            response.json.return_value = {'tags': [{'name': 'apple', 'confidence': 0.9}]}
+            response.raise_for_status.return_value = None
+            return response
+        
+        mock_post.side_effect = slow_post
+        recognizer = FoodRecognition(cache=None)
+        detector = FoodDetector(frame_deduplicator=None)
+        recognizer.cache = detector.cache = None
+        results = {}
+        
+        threads = [
+            threading.Thread(target=lambda: results.update(a=recognizer.analyze_image_from_bytes(b'same image'))),
+            threading.Thread(target=lambda: results.update(b=detector._analyze_image_data(b'same image')))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertIn('apple', results['a']['foods_detected'])
+        self.assertEqual(results['b']['tags'][0]['name'], 'apple')
+
+class TestIngestionPipeline(unittest.TestCase):
+    """多階段處理管線測試類別"""
+    
+    def setUp(self):
+        """測試前設定"""
+        os.environ['AZURE_VISION_ENDPOINT'] = 'https://test.cognitiveservices.azure.com/'
+        os.environ['AZURE_VISION_KEY'] = 'test-key'
+        os.environ['AZURE_VISION_WARMUP'] = '0'
+        os.environ['AZURE_VISION_HTTP2'] = '0'
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        """測試後清理"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    @patch('requests.Session.post')
+    def test_pipeline_results_and_statistics(self, mock_post):
+        """測試管線處理不同來源並回報各階段統計"""
+        mock_response = Mock()
+        mock_response.json.return_value = {'tags': [{'name': 'apple', 'confidence': 0.9}]}
+        mock_response.raise_for_status.return_value = None
+        mock_post.return_value = mock_response
+        
+        rng = np.random.default_rng(2)
+        frames = [rng.integers(0, 255, (300, 400, 3), dtype=np.uint8) for _ in range(3)]
+        path = os.path.join(self.temp_dir, 'food.jpg')
+        Image.fromarray(frames[0]).save(path, format='JPEG')
+        buffer = io.BytesIO()
+        Image.fromarray(frames[1]).save(buffer, format='PNG')
+        
+        detector = FoodDetector(cache=None, frame_deduplicator=None,
+                                preprocess_settings=PreprocessSettings(max_edge=200))
+        detector.cache = None
+        pipeline = IngestionPipeline(detector, upload_workers=4, queue_size=2)
+        results = pipeline.process([path, buffer.getvalue(), frames[2], b'broken'])
+        
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(result.success for result in results[:3]))
+        self.assertIn('apple', results[0].foods_detected)
+        self.assertFalse(results[3].success)
+        self.assertTrue(results[3].error_message)
+        
+        uploaded = Image.open(io.BytesIO(mock_post.call_args_list[0][1]['data']))
+        self.assertLessEqual(max(uploaded.size), 200)
+        
+        stats = pipeline.get_statistics()
+        self.assertEqual(stats['stages']['decode']['errors'], 1)
+        self.assertEqual(stats['stages']['upload']['processed'], 3)
+        self.assertIn(stats['bottleneck'], stats['stages'])
+    
+    @patch('requests.Session.post')
+    def test_source_error_raised_from_stream(self, mock_post):
+        """測試影像來源拋出例外時，已放入的項目處理完後由 stream 重新拋出"""
+        mock_response = Mock()
+        mock_response.json.return_value = {'tags': [{'name': 'apple', 'confidence': 0.9}]}
+        mock_response.raise_for_status.return_value = None
+        mock_post.return_value = mock_response
+        
+        def sources():
+            yield np.zeros((50, 50, 3), dtype=np.uint8)
+            raise OSError('來源中斷')
+        
+        detector = FoodDetector(cache=None, frame_deduplicator=None)
+        detector.cache = None
+        pipeline = IngestionPipeline(detector, upload_workers=2, queue_size=2)
+        items = []
+        
+        with self.assertRaisesRegex(OSError, '來源中斷'):
+            for item in pipeline.stream(sources()):
+                items.append(item)
+        self.assertEqual([item.index for item in items], [0])
+    
+    @patch('requests.Session.post')
+    def test_consumer_stops_early(self, mock_post):
+        """測試呼叫者提前停止讀取時，所有管線執行緒都會結束"""
+        mock_response = Mock()
+        mock_response.json.return_value = {'tags': [{'name': 'apple', 'confidence': 0.9}]}
+        mock_response.raise_for_status.return_value = None
+        mock_post.return_value = mock_response
+        
+        detector = FoodDetector(cache=None, frame_deduplicator=None)
+        detector.cache = None
+        pipeline = IngestionPipeline(detector, upload_workers=2, queue_size=1)
+        before = threading.active_count()
+        frame = np.zeros((50, 50, 3), dtype=np.uint8)
+        
+        # 來源沒有結束，工作者只會因為取消而停止
+        stream = pipeline.stream(frame for _ in iter(int, 1))
+        next(stream)
+        stream.close()
+        
+        deadline = time.time() + 5
+        while threading.active_count() > before and time.time() < deadline:
+            time.sleep(0.02)
+        self.assertLessEqual(threading.active_count(), before)
+    
+    @patch('requests.Session.post')
+    def test_process_pool_fuses_cpu_stages(self, mock_post):
+        """測試使用行程池時解碼/縮小/編碼合併成單一階段，行程間只傳遞來源與 JPEG"""
+        mock_response = Mock()
+        mock_response.json.return_value = {'tags': [{'name': 'apple', 'confidence': 0.9}]}
+        mock_response.raise_for_status.return_value = None
+        mock_post.return_value = mock_response
+        
+        path = os.path.join(self.temp_dir, 'food.jpg')
+        Image.fromarray(np.full((300, 400, 3), 128, dtype=np.uint8)).save(path, format='JPEG')
+        detector = FoodDetector(cache=None, frame_deduplicator=None,
+                                preprocess_settings=PreprocessSettings(max_edge=200))
+        detector.cache = None
+        pipeline = IngestionPipeline(detector, decode_workers=1, resize_workers=1, encode_workers=1,
+                                     upload_workers=2, use_processes=True)
+        
+        self.assertEqual([stage.name for stage in pipeline.stages], ['prepare', 'upload', 'postprocess'])
+        results = pipeline.process([path, b'broken'])
+        
+        self.assertIn('apple', results[0].foods_detected)
+        self.assertFalse(results[1].success)
+        uploaded = Image.open(io.BytesIO(mock_post.call_args_list[0][1]['data']))
+        self.assertLessEqual(max(uploaded.size), 200)
+        self.assertEqual(pipeline.get_statistics()['stages']['prepare']['errors'], 1)
+
+class TestVisionStandin(unittest.TestCase):
+    """Azure Vision 替身伺服器測試類別"""
+    
+    def setUp(self):
+        """測試前設定"""
+        self.temp_dir = tempfile.mkdtemp()
+        os.environ['AZURE_VISION_KEY'] = 'test-key'
+        os.environ['AZURE_VISION_WARMUP'] = '0'
+        os.environ['AZURE_VISION_HTTP2'] = '0'
+        self.original_endpoint = os.environ.get('AZURE_VISION_ENDPOINT')
+    
+    def tearDown(self):
+        """測試後清理"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        os.environ['AZURE_VISION_ENDPOINT'] = self.original_endpoint or ''
+    
+    def test_synthetic_is_deterministic(self):
+        """測試相同影像與種子產生相同的合成結果"""
+        self.assertEqual(synthesize_analysis(b'image', 1), synthesize_analysis(b'image', 1))
+        self.assertNotEqual(synthesize_analysis(b'image', 1), synthesize_analysis(b'image', 2))
+        self.assertAlmostEqual(LatencyModel.parse('uniform:20,40').sample(random.Random(0)), 0.03, delta=0.01)
+    
+    def test_draws_independent_of_request_order(self):
+        """測試延遲與錯誤注入只取決於種子、影像與該影像第幾次請求，與執行緒處理順序無關"""
+        def draws(order):
+            server = VisionStandinServer(StandinConfig(seed=3, latency='uniform:0,100', error_rate=0.5))
+            try:
+                return {image: [server.draw(image) for _ in range(3)] for image in order}
+            finally:
+                server._httpd.server_close()
+        
+        first = draws([b'a', b'b', b'c'])
+        self.assertEqual(draws([b'c', b'a', b'b']), first)
+        self.assertNotEqual(first[b'a'][0], first[b'a'][1])
+    
+    def test_recognizer_against_standin(self):
+        """測試辨識器透過 AZURE_VISION_ENDPOINT 使用替身伺服器"""
+        with VisionStandinServer(StandinConfig(seed=7)) as server:
+            os.environ['AZURE_VISION_ENDPOINT'] = server.endpoint
+            result = FoodRecognition().analyze_image_from_bytes(b'plate')
+        
+        expected = [tag['name'] for tag in synthesize_analysis(b'plate', 7)['tags']]
+        self.assertTrue(result['success'])
+        self.assertEqual(result['tags'], expected)
+        self.assertGreater(len(result['foods_detected']), 0)
+    
+    def test_replay_and_error_injection(self):
+        """測試重播錄製檔與注入錯誤後的重試"""
+        config = StandinConfig(mode='replay', fixtures_dir=self.temp_dir, error_rate=1.0, error_statuses=(503,))
+        with VisionStandinServer(config) as server:
+            with open(server.fixture_path(b'plate'), 'w', encoding='utf-8') as f:
+                json.dump({'tags': [{'name': 'rice', 'confidence': 0.9}]}, f)
+            os.environ['AZURE_VISION_ENDPOINT'] = server.endpoint
+            recognizer = FoodRecognition()
+            
+            with patch('rate_limiter.time.sleep'):
+                with self.assertRaises(Exception):
+                    recognizer.analyze_image_from_bytes(b'plate')
+            self.assertEqual(server.stats['errors'], recognizer.transport.retry_policy.max_retries + 1)
+            
+            server.config.error_rate = 0.0
+            self.assertIn('rice', recognizer.analyze_image_from_bytes(b'plate')['foods_detected'])
+            with self.assertRaises(Exception):
+                recognizer.analyze_image_from_bytes(b'unknown')
+
 class TestFoodRecognitionIntegration(unittest.TestCase):
     """整合測試類別"""
     
@@ -0,0 +1,789 @@
+"""
+營養資料抓取器 - 測試檔案
+用於驗證速率限制、重試等抓取基礎功能的正確性
+"""
+
+import unittest
+import os
+import time
+import tempfile
+import shutil
+import threading
+import io
+import json
+import asyncio
+from urllib.parse import parse_qsl
+from unittest.mock import Mock, patch
+import requests
+from rate_limiter import TokenBucket, RetryPolicy, async_send_with_retry, get_rate_limiter, parse_retry_after, send_with_retry
+from http_cache import CachingAdapter, ResponseCache, cache_key, install_http_cache
+from crawl_checkpoint import iter_jsonl, open_jsonl_append
+from aspnet_paging import AspNetPager, extract_hidden_fields
+from polite_fetcher import HostPoliteness, PoliteFetcher
+from usda_food_scraper import USDAScraper
+from simple_usda_calories import SimpleUSDACalorieExtractor
+from quick_usda_test import QuickUSDATester
+from fda_nutrition_scraper import FDANutritionScraper
+from nutrient_matrix import NutrientMatrix
+from bs4 import BeautifulSoup
+import numpy as np
+
+def make_response(status_code, headers=None, payload=None):
+    """建立模擬的 requests 回應"""
+    response = Mock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.json.return_value = payload or {}
+    return response
+
+def http_response(status_code, body, headers=None, url='https://api.nal.usda.gov/fdc/v1/foods/search'):
+    """建立模擬的 HTTP 配接器回應"""
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response._content = body
+    response.raw = io.BytesIO(body)
+    response.url = url
+    return response
+
+class TestRateLimiter(unittest.TestCase):
+    """速率限制與重試測試類別"""
+
+    def setUp(self):
+        """測試前設定"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.temp_dir, 'rate_limit_test.json')
+
+    def tearDown(self):
+        """測試後清理"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_token_bucket_burst_then_wait(self):
+        """測試突發配額用完後需要等待"""
+        bucket = TokenBucket(rate=10, capacity=2)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, delta=0.02)
+        self.assertAlmostEqual(bucket.reserve(), 0.2, delta=0.02)
+
+    def test_state_file_shared_between_instances(self):
+        """測試指定同一個狀態檔案的限制器共用配額 (模擬不同行程)"""
+        first = TokenBucket(rate=5, capacity=1, state_path=self.state_path)
+        second = TokenBucket(rate=5, capacity=1, state_path=self.state_path)
+
+        self.assertEqual(first.reserve(), 0)
+        self.assertAlmostEqual(second.reserve(), 0.2, delta=0.05)
+
+        second.penalize(3)
+        self.assertGreater(first.reserve(), 2.5)
+
+    @patch.dict('rate_limiter._limiters', clear=True)
+    @patch.dict(os.environ, {'TEST_RATE_LIMIT': '5', 'RATE_LIMIT_STATE_DIR': ''})
+    def test_empty_state_dir_uses_temp_dir(self):
+        """測試 RATE_LIMIT_STATE_DIR 為空值時 (config.env.example 的預設) 使用系統暫存目錄"""
+        limiter = get_rate_limiter('test')
+        self.assertEqual(os.path.dirname(limiter.state_path), tempfile.gettempdir())
+
+    def test_parse_retry_after(self):
+        """測試解析 Retry-After 標頭"""
+        self.assertEqual(parse_retry_after('7'), 7.0)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
+        future = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 30))
+        self.assertAlmostEqual(parse_retry_after(future), 30, delta=2)
+
+    @patch('rate_limiter.time.sleep')
+    def test_send_with_retry_honors_retry_after(self, mock_sleep):
+        """測試 429 時依 Retry-After 等待後重試"""
+        responses = [make_response(429, {'Retry-After': '4'}), make_response(503), make_response(200)]
+        send = Mock(side_effect=responses)
+        bucket = TokenBucket(rate=100)
+
+        response = send_with_retry(send, bucket, RetryPolicy(max_retries=3, base_delay=0.1))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(send.call_count, 3)
+        self.assertGreaterEqual(mock_sleep.call_args_list[0][0][0], 4)
+        self.assertEqual(bucket.get_statistics()['throttled'], 1)
+
+    @patch('rate_limiter.time.sleep')
+    def test_send_with_retry_gives_up(self, mock_sleep):
+        """測試重試次數用盡時回傳最後的回應或拋出例外"""
+        send = Mock(return_value=make_response(500))
+        self.assertEqual(send_with_retry(send, policy=RetryPolicy(max_retries=2)).status_code, 500)
+        self.assertEqual(send.call_count, 3)
+
+        send = Mock(side_effect=requests.exceptions.ConnectionError('down'))
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            send_with_retry(send, policy=RetryPolicy(max_retries=1))
+        self.assertEqual(send.call_count, 2)
+
+    def test_async_shared_limiter_runs_in_thread(self):
+        """測試跨行程共用的限制器在執行緒中鎖定狀態檔案，不阻塞事件迴圈"""
+        bucket = TokenBucket(rate=1000, state_path=self.state_path)
+        reserve = bucket.reserve
+        threads = []
+
+        def tracked_reserve(tokens=1.0):
+            threads.append(threading.current_thread())
+            return reserve(tokens)
+
+        bucket.reserve = tracked_reserve
+
+        async def send():
+            return make_response(200)
+
+        self.assertEqual(asyncio.run(async_send_with_retry(send, bucket)).status_code, 200)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+    @patch('rate_limiter.time.sleep')
+    @patch('requests.adapters.HTTPAdapter.send')
+    def test_scraper_retries_throttled_requests(self, mock_send, mock_sleep):
+        """測試 USDA 抓取器透過配接器重試被限流的請求"""
+        mock_send.side_effect = [
+            http_response(429, b'', {'Retry-After': '1'}),
+            http_response(200, b'{"foods": [{"fdcId": 1}]}')
+        ]
+
+        scraper = USDAScraper(rate_limiter=TokenBucket(rate=100))
+        result = scraper.search_foods('apple')
+
+        self.assertEqual(result, {'foods': [{'fdcId': 1}]})
+        self.assertEqual(mock_send.call_count, 2)
+
+class TestHTTPCache(unittest.TestCase):
+    """HTTP 回應快取測試類別"""
+
+    def setUp(self):
+        """測試前設定"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = ResponseCache(self.temp_dir)
+
+    def tearDown(self):
+        """測試後清理"""
+        self.cache._db.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_cache_key_normalization(self):
+        """測試參數順序與頁面狀態欄位不影響快取鍵"""
+        form = 'application/x-www-form-urlencoded'
+        first = cache_key('post', 'https://Example.com/TFND.aspx?b=2&a=1', 'x=1&__VIEWSTATE=abc&y=2', form)
+        second = cache_key('POST', 'https://example.com/TFND.aspx?a=1&b=2', 'y=2&x=1&__VIEWSTATE=xyz', form)
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, cache_key('POST', 'https://example.com/TFND.aspx?a=1&b=2', 'x=1&y=3', form))
+        self.assertNotEqual(first, cache_key('GET', 'https://example.com/TFND.aspx?a=1&b=2', 'x=1&y=2', form))
+
+        self.assertEqual(cache_key('GET', 'https://api.test/foods?query=apple&api_key=A'),
+                         cache_key('GET', 'https://api.test/foods?api_key=B&query=apple'))
+        self.assertEqual(cache_key('POST', 'https://api.test/foods', b'{"b": 1, "a": 2}', 'application/json'),
+                         cache_key('POST', 'https://api.test/foods', '{"a":2,"b":1}', 'application/json'))
+
+    @patch('requests.adapters.HTTPAdapter.send')
+    def test_fresh_entry_skips_upstream(self, mock_send):
+        """測試有效期間內重新執行不發送請求"""
+        mock_send.return_value = http_response(200, b'{"foods": [{"fdcId": 1}]}',
+                                               {'Content-Type': 'application/json'})
+
+        first = USDAScraper(rate_limiter=TokenBucket(rate=100))
+        install_http_cache(first.session, 'USDA', first.rate_limiter, first.retry_policy, cache=self.cache)
+        self.assertEqual(first.search_foods('apple'), {'foods': [{'fdcId': 1}]})
+
+        second = USDAScraper(rate_limiter=TokenBucket(rate=100))
+        install_http_cache(second.session, 'USDA', second.rate_limiter, second.retry_policy, cache=self.cache)
+        self.assertEqual(second.search_foods('apple'), {'foods': [{'fdcId': 1}]})
+
+        self.assertEqual(mock_send.call_count, 1)
+        self.assertEqual(second.rate_limiter.get_statistics()['acquired'], 0)
+        stats = self.cache.get_statistics()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    @patch('requests.adapters.HTTPAdapter.send')
+    def test_stale_entry_revalidated(self, mock_send):
+        """測試過期後以條件式請求確認，304 時使用快取內容"""
+        url = 'https://consumer.fda.gov.tw/Food/TFND.aspx'
+        mock_send.side_effect = [
+            http_response(200, '<html>蘋果</html>'.encode('utf-8'),
+                          {'Content-Type': 'text/html; charset=utf-8', 'ETag': '"v1"'}, url),
+            http_response(304, b'', {'ETag': '"v1"'}, url),
+        ]
+        session = requests.Session()
+        session.mount('https://', CachingAdapter(self.cache, 'FDA', ttl=0))
+
+        self.assertEqual(session.get(url, params={'nodeID': '178'}).text, '<html>蘋果</html>')
+        response = session.get(url, params={'nodeID': '178'})
+
+        self.assertEqual(response.text, '<html>蘋果</html>')
+        self.assertTrue(response.from_cache)
+        self.assertEqual(mock_send.call_args[0][0].headers['If-None-Match'], '"v1"')
+        self.assertEqual(self.cache.get_statistics()['revalidated'], 1)
+
+    def test_install_without_cache_keeps_session(self):
+        """測試未設定快取且未指定限制器與重試時不掛載配接器，有快取時不額外重試"""
+        environment = {key: value for key, value in os.environ.items() if key != 'HTTP_CACHE_DIR'}
+        with patch.dict(os.environ, environment, clear=True):
+            session = requests.Session()
+            original = session.get_adapter('https://consumer.fda.gov.tw')
+            self.assertIsNone(install_http_cache(session, 'FDA'))
+            self.assertIs(session.get_adapter('https://consumer.fda.gov.tw'), original)
+
+        adapter = install_http_cache(requests.Session(), 'FDA', cache=self.cache)
+        self.assertEqual(adapter.policy.max_retries, 0)
+
+    @patch('requests.adapters.HTTPAdapter.send')
+    def test_counters_shared_between_threads(self, mock_send):
+        """測試多個執行緒同時命中快取時統計數字正確"""
+        url = 'https://consumer.fda.gov.tw/Food/Detail.aspx?id=1'
+        mock_send.return_value = http_response(200, b'<html></html>', url=url)
+        session = requests.Session()
+        install_http_cache(session, 'FDA', cache=self.cache)
+        session.get(url)
+
+        def fetch():
+            for _ in range(50):
+                session.get(url)
+
+        threads = [threading.Thread(target=fetch) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = self.cache.get_statistics()
+        self.assertEqual((stats['hits'], stats['misses']), (400, 1))
+
+class TestFoodCategorization(unittest.TestCase):
+    """食物分類測試類別"""
+    
+    def test_category_priority(self):
+        """測試分類優先順序與原本的逐一比對相同"""
+        scraper = USDAScraper()
+        # 'corn' 同時屬於 vegetables 與 grains，先定義的分類優先
+        self.assertEqual(scraper.categorize_food('Corn, sweet'), 'vegetables')
+        self.assertEqual(scraper.categorize_food('Cheese', 'made from milk'), 'dairy')
+        self.assertEqual(scraper.categorize_food('Quinoa'), 'other')
+        
+        extractor = SimpleUSDACalorieExtractor()
+        self.assertEqual(extractor.categorize_food('Pineapple juice'), 'fruits')
+        self.assertEqual(extractor.categorize_food('Soy sauce'), 'condiments')
+        
+        tester = QuickUSDATester()
+        self.assertEqual(tester.categorize_food('Fish and rice'), 'proteins')
+        self.assertEqual(tester.categorize_food('Tofu'), 'other')
+
+def fake_usda_api(method, path, params, body=None):
+    """
+    模擬的 FoodData Central API
+
+    偶數項目的搜尋結果含有營養素，奇數項目需要以 POST /foods 補齊；
+    banana 的批次請求失敗，第 7 項沒有詳細資訊。
+    """
+    if path.endswith('/foods/search'):
+        query = params['query']
+        hits = []
+        for i in range(12):
+            hit = {'fdcId': f'{query}-{i}', 'description': f'{query.title()}, style {i % 4}', 'dataType': 'SR Legacy'}
+            if i % 2 == 0:
+                hit['foodNutrients'] = [
+                    {'nutrientId': 1003, 'nutrientName': 'Protein', 'nutrientNumber': '203', 'unitName': 'G', 'value': i},
+                    {'nutrientId': 1062, 'nutrientName': 'Energy', 'nutrientNumber': '268', 'unitName': 'kJ', 'value': 999},
+                    {'nutrientId': 1008, 'nutrientName': 'Energy', 'nutrientNumber': '208', 'unitName': 'KCAL', 'value': (i % 5) * 40},
+                ]
+            hits.append(hit)
+        return 200, {'foods': hits}
+    if method == 'POST' and path.endswith('/foods'):
+        if any(str(fdc_id).startswith('banana') for fdc_id in body['fdcIds']):
+            return 500, {}
+        return 200, [{'fdcId': fdc_id, 'description': f'{fdc_id} details', 'servingSize': 100, 'servingSizeUnit': 'g',
+                      'foodNutrients': [{'number': '208', 'name': 'Energy', 'amount': (int(fdc_id.rsplit('-', 1)[1]) % 5) * 40,
+                                         'unitName': 'kcal'}]}
+                     for fdc_id in body['fdcIds'] if not fdc_id.endswith('-7')]
+    return 404, {}
+
+def fake_usda_session(session):
+    """以 fake_usda_api 取代 requests.Session 的 get 與 post"""
+    def respond(method):
+        def send(url, params=None, json=None, timeout=None):
+            status, payload = fake_usda_api(method, url, params, json)
+            response = make_response(status, payload=payload)
+            response.json.return_value = payload
+            response.raise_for_status = Mock(side_effect=requests.exceptions.HTTPError() if status >= 400 else None)
+            return response
+        return send
+    return patch.multiple(session, get=Mock(side_effect=respond('GET')), post=Mock(side_effect=respond('POST')))
+
+class TestUSDANutrients(unittest.TestCase):
+    """USDA 營養素解析與批次查詢測試類別"""
+    
+    def test_extract_nutrient_formats(self):
+        """測試搜尋結果、完整與精簡格式的營養素解析"""
+        from usda_nutrients import extract_nutrients, needs_details
+        search_hit = fake_usda_api('GET', '/foods/search', {'query': 'apple'})[1]['foods'][2]
+        self.assertEqual(extract_nutrients(search_hit), {'energy_kcal': 80.0, 'protein_g': 2.0})
+        self.assertTrue(needs_details({'fdcId': 1, 'foodNutrients': []}))
+        
+        full = {'foodNutrients': [{'nutrient': {'id': 1004, 'number': '204', 'name': 'Total lipid (fat)'}, 'amount': 0.2},
+                                  {'nutrient': {'id': 2047, 'number': '957', 'name': 'Energy (Atwater General Factors)',
+                                                'unitName': 'kcal'}, 'amount': 52}]}
+        self.assertEqual(extract_nutrients(full), {'energy_kcal': 52.0, 'fat_g': 0.2})
+        self.assertEqual(extract_nutrients({'foodNutrients': [{'nutrient': {'id': 208}, 'amount': 61}]}), {'energy_kcal': 61.0})
+    
+    def test_search_hits_skip_detail_requests(self):
+        """測試搜尋結果已有熱量時不再查詢，其餘項目一次批次查詢"""
+        scraper = USDAScraper(retry_policy=RetryPolicy(max_retries=0))
+        with fake_usda_session(scraper.session):
+            items = scraper.parse_search_results(fake_usda_api('GET', '/foods/search', {'query': 'rice'})[1]['foods'][:10])
+            self.assertEqual(scraper.session.post.call_count, 1)
+            self.assertEqual(len(scraper.session.post.call_args.kwargs['json']['fdcIds']), 5)
+        
+        self.assertEqual([item.energy_kcal for item in items], [0.0 if i == 7 else (i % 5) * 40 for i in range(10)])
+        self.assertEqual(items[2].protein_g, 2.0)
+        self.assertEqual(items[3].description, 'rice-3 details')
+        
+        extractor = SimpleUSDACalorieExtractor()
+        extractor.request_delay = 0
+        with fake_usda_session(extractor.session):
+            foods = extractor.extract_food_calories('oat', max_results=6)
+            self.assertEqual(extractor.session.get.call_count, 1)
+            self.assertEqual(extractor.session.post.call_count, 1)
+        self.assertEqual([food.fdc_id for food in foods], ['oat-1', 'oat-2', 'oat-3', 'oat-4'])
+
+class TestUSDABulkImport(unittest.TestCase):
+    """USDA CSV 批次匯入測試類別"""
+    
+    def setUp(self):
+        """建立小型的官方 CSV 格式資料"""
+        self.temp_dir = tempfile.mkdtemp()
+        files = {
+            'food.csv': [
+                '"fdc_id","data_type","description","food_category_id","publication_date"',
+                '"171688","sr_legacy_food","Apples, raw, with skin","9","2019-04-01"',
+                '"169756","sr_legacy_food","Rice, white, cooked","20","2019-04-01"',
+                '"2345678","branded_food","APPLE PIE","","2022-01-01"',
+                '"1750340","foundation_food","Apples, fuji, with skin, raw","9","2020-10-30"',
+                '"173944","sr_legacy_food","Water, tap","14","2019-04-01"',
+                '"171689","sr_legacy_food","Apples; raw, with skin","9","2019-04-01"',
+            ],
+            'food_category.csv': [
+                '"id","code","description"',
+                '"9","0900","Fruits and Fruit Juices"',
+                '"14","1400","Beverages"',
+                '"20","2000","Cereal Grains and Pasta"',
+            ],
+            'food_nutrient.csv': [
+                '"id","fdc_id","nutrient_id","amount","data_points"',
+                '"1","171688","1008","52","1"',
+                '"2","171688","1062","218","1"',
+                '"3","171688","1003","0.26","1"',
+                '"4","171688","1005","13.81","1"',
+                '"5","171688","1004","0.17","1"',
+                '"6","171688","1079","2.4","1"',
+                '"7","169756","1008","130","1"',
+                '"8","169756","1003","2.69","1"',
+                '"9","2345678","1008","237","1"',
+                '"10","1750340","2047","64.7","1"',
+                '"11","1750340","2048","62.5","1"',
+                '"12","173944","1003","0","1"',
+                '"13","171689","1008","52","1"',
+                '"14","999999","1008","10","1"',
+            ],
+        }
+        for name, lines in files.items():
+            with open(os.path.join(self.temp_dir, name), 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def test_import_matches_scraper_records(self):
+        """測試分塊匯入後合併營養素，輸出與抓取器相同格式"""
+        from usda_bulk_import import USDABulkImporter
+        from usda_food_scraper import USDAFoodItem
+        importer = USDABulkImporter(self.temp_dir, chunk_size=2)
+        
+        items = importer.import_items()
+        
+        self.assertEqual([item.fdc_id for item in items], ['169756', '171688', '1750340'])
+        self.assertEqual(items[1], USDAFoodItem(
+            fdc_id='171688', food_name='Apples, raw, with skin', energy_kcal=52.0, category='fruits',
+            brand_owner='', data_type='SR Legacy', description='Apples, raw, with skin', ingredients='',
+            protein_g=0.26, carbohydrate_g=13.81, fat_g=0.17, fiber_g=2.4))
+        self.assertEqual(items[0].category, 'grains')
+        self.assertEqual(items[2].energy_kcal, 64.7)
+        self.assertIsNone(items[2].protein_g)
+        self.assertEqual(importer.get_statistics()['nutrient_rows'], 14)
+        
+        branded = USDABulkImporter(self.temp_dir, data_types=['Branded'], chunk_size=3).import_items()
+        self.assertEqual([(item.food_name, item.data_type) for item in branded], [('APPLE PIE', 'Branded')])
+        
+        output = os.path.join(self.temp_dir, 'usda_foods.json')
+        importer.scraper.save_to_json(items, output)
+        from nutrition_registry import load_nutrition_file
+        self.assertEqual(load_nutrition_file(output).lookup('Apples, raw, with skin').fiber, 2.4)
+
+class TestAsyncUSDACrawler(unittest.TestCase):
+    """USDA 非同步抓取測試類別"""
+    
+    def test_matches_sync_scraper(self):
+        """測試非同步抓取結果與同步抓取相同並逐筆寫入檔案"""
+        import httpx
+        from usda_async_crawler import AsyncUSDACrawler, load_jsonl
+        categories = {'fruits': ['apple', 'banana', 'grape'], 'grains': ['rice', 'apple', 'oat']}
+        
+        scraper = USDAScraper(retry_policy=RetryPolicy(max_retries=0))
+        scraper.rate_limiter = None
+        scraper.request_delay = 0
+        scraper.food_categories = categories
+        with fake_usda_session(scraper.session):
+            expected = scraper.scrape_all_categories(max_items_per_category=9)
+        
+        def handler(request):
+            body = json.loads(request.content) if request.content else None
+            status, payload = fake_usda_api(request.method, request.url.path, dict(request.url.params), body)
+            return httpx.Response(status, json=payload)
+        
+        temp_dir = tempfile.mkdtemp()
+        try:
+            output = os.path.join(temp_dir, 'usda_foods.jsonl')
+            crawler = AsyncUSDACrawler(scraper, concurrency=4, rate_limiter=TokenBucket(rate=1e6, capacity=1e6),
+                                       retry_policy=RetryPolicy(max_retries=0), transport=httpx.MockTransport(handler))
+            foods = crawler.run(output, max_items_per_category=9)
+            
+            self.assertEqual(len(expected), 10)
+            self.assertEqual(foods, expected)
+            self.assertEqual(load_jsonl(output), expected)
+            self.assertEqual(crawler.get_statistics()['written'], len(expected))
+            self.assertGreater(crawler.get_statistics()['failures'], 0)
+        finally:
+            shutil.rmtree(temp_dir)
+    
+    def test_keywords_started_lazily(self):
+        """測試關鍵字依序啟動，達到 max_items 後不再搜尋剩下的關鍵字"""
+        import httpx
+        from usda_async_crawler import AsyncUSDACrawler
+        searched = []
+        
+        def handler(request):
+            if request.url.path.endswith('/foods/search'):
+                searched.append(request.url.params['query'])
+            body = json.loads(request.content) if request.content else None
+            status, payload = fake_usda_api(request.method, request.url.path, dict(request.url.params), body)
+            return httpx.Response(status, json=payload)
+        
+        scraper = USDAScraper(retry_policy=RetryPolicy(max_retries=0))
+        scraper.rate_limiter = None
+        crawler = AsyncUSDACrawler(scraper, concurrency=4, rate_limiter=TokenBucket(rate=1e6, capacity=1e6),
+                                   retry_policy=RetryPolicy(max_retries=0), transport=httpx.MockTransport(handler),
+                                   keyword_window=2)
+        
+        async def crawl(max_items):
+            searched.clear()
+            crawler._semaphore = asyncio.Semaphore(crawler.concurrency)
+            async with httpx.AsyncClient(transport=crawler.transport) as client:
+                crawler._client = client
+                return await crawler._crawl_category('fruits', ['apple', 'grape', 'oat', 'rice', 'pear'], max_items)
+        
+        self.assertEqual(len(asyncio.run(crawl(5))), 5)
+        self.assertEqual(searched, ['apple'])
+        
+        # 需要的項目較多時最多同時搜尋 keyword_window 個關鍵字
+        self.assertEqual(len(asyncio.run(crawl(15))), 15)
+        self.assertEqual(searched, ['apple', 'grape', 'oat'])
+
+class TestNutrientMatrix(unittest.TestCase):
+    """營養素矩陣測試類別"""
+    
+    def setUp(self):
+        def food(name, category, nutrition, units=None):
+            return {'樣品名稱': name, '分類': category,
+                    '詳細資訊': {'營養成分': nutrition, '營養成分單位': units or {}}}
+        
+        self.foods = [
+            food('雞胸肉', '肉類', {'熱量': 117, '粗蛋白': 24.2, '粗脂肪': 1.9, '鈉': 45}),
+            food('豬五花', '肉類', {'熱量': 368, '粗蛋白': 14.5, '粗脂肪': 34.0, '鈉(mg)': 52}),
+            food('豆腐', '豆類', {'熱量': 88, '粗蛋白': 8.5, '粗脂肪': 5.1, '鈉': 0.01}, {'鈉': 'g'}),
+            food('白飯', '穀物類', {'熱量': 765, '粗蛋白': 3.1, '粗脂肪': 0.3, '鈉': 1}, {'熱量': 'kJ'}),
+            food('鹹蛋', '蛋類', {'熱量': 185, '粗蛋白': 13.0, '粗脂肪': 13.9, '鈉': 1500, '維生素A': 'N/A'}),
+        ]
+        self.matrix = NutrientMatrix.from_fda_foods(self.foods)
+    
+    def test_unit_normalization(self):
+        """測試欄位對應與單位換算"""
+        self.assertEqual(self.matrix.values.dtype, np.float32)
+        sodium = dict(zip(self.matrix.names, self.matrix.column('sodium')))
+        self.assertAlmostEqual(sodium['豬五花'], 52)
+        self.assertAlmostEqual(sodium['豆腐'], 10, places=3)
+        self.assertAlmostEqual(dict(zip(self.matrix.names, self.matrix.column('energy')))['白飯'], 182.8, places=1)
+        self.assertTrue(np.isnan(self.matrix.column('vitamin_a')).all())
+    
+    def test_queries(self):
+        """測試排序、篩選與相似食品查詢"""
+        top = self.matrix.top_k('protein', 2, per='energy')
+        self.assertEqual([name for name, _ in top], ['雞胸肉', '豆腐'])
+        self.assertAlmostEqual(top[0][1], 24.2 / 117, places=5)
+        self.assertEqual(self.matrix.top_k('protein', 5, category='肉類'), [('雞胸肉', 24.200000762939453), ('豬五花', 14.5)])
+        
+        self.assertEqual(self.matrix.where(maximum={'sodium': 50}), ['雞胸肉', '豆腐', '白飯'])
+        self.assertEqual(self.matrix.where(maximum={'sodium': 50}, minimum={'protein': 5}), ['雞胸肉', '豆腐'])
+        
+        self.assertEqual(self.matrix.nearest('雞胸肉', 1, nutrients=['protein', 'fat'])[0][0], '鹹蛋')
+        self.assertEqual(self.matrix.nearest({'protein': 25, 'fat': 2}, 1, nutrients=['protein', 'fat'])[0][0], '雞胸肉')
+    
+    def test_save_and_load(self):
+        """測試儲存與載入後內容相同"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'matrix.npz')
+            self.matrix.save(path)
+            loaded = NutrientMatrix.load(path)
+            
+            self.assertEqual(loaded.names, self.matrix.names)
+            self.assertEqual(list(loaded.categories), list(self.matrix.categories))
+            np.testing.assert_array_equal(loaded.values, self.matrix.values)
+        finally:
+            shutil.rmtree(temp_dir)
+    
+    def test_extract_units(self):
+        """測試抓取器保留營養成分單位"""
+        soup = BeautifulSoup('<table><tr><td>鈉</td><td>45 mg</td></tr><tr><td>熱量</td><td>117kcal</td></tr>'
+                             '<tr><td>水分</td><td>70.1</td></tr></table>', 'html.parser')
+        scraper = FDANutritionScraper()
+        
+        self.assertEqual(scraper.extract_nutrition_units(soup), {'鈉': 'mg', '熱量': 'kcal'})
+        self.assertEqual(scraper.extract_nutrition_data(soup), {'鈉': 45.0, '熱量': 117.0, '水分': 70.1})
+
+class FakeTFNDServer:
+    """模擬 TFND 頁面：每個回應發出新的 ViewState，只接受最新發出的狀態"""
+    
+    def __init__(self):
+        self.issued = 0
+        self.calls = []
+        self.expire_next = False
+    
+    def page(self, rows=''):
+        self.issued += 1
+        return (
+            f'<form><input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="vs{self.issued}" />'
+            f'<input type="hidden" name="__EVENTVALIDATION" value="ev{self.issued}&amp;x" />'
+            f'<table id="ctl00_ContentPlaceHolder1_GridView1"><tr><th>編號</th></tr>{rows}</table></form>'
+        )
+    
+    def request(self, method, url, params=None, data=None, headers=None, timeout=None):
+        self.calls.append((method, dict(data or {})))
+        if method == 'GET':
+            return http_response(200, self.page().encode('utf-8'), url=url)
+        if self.expire_next or data['__VIEWSTATE'] != f'vs{self.issued}':
+            self.expire_next = False
+            return http_response(500, b'Validation of viewstate MAC failed', url=url)
+        
+        page = 1 if data.get('ctl00$ContentPlaceHolder1$Button1') else int(data['__EVENTARGUMENT'].split('$')[1])
+        rows = (f'<tr><td>P{page}</td><td><a href="Detail.aspx?id={page}">食品{page}</a></td>'
+                f'<td></td><td></td><td></td></tr>')
+        return http_response(200, self.page(rows).encode('utf-8'), url=url)
+
+class TestAspNetPaging(unittest.TestCase):
+    """ASP.NET 分頁 ViewState 沿用測試類別"""
+    
+    def setUp(self):
+        """測試前設定"""
+        self.server = FakeTFNDServer()
+        self.session = Mock()
+        self.session.request.side_effect = self.server.request
+    
+    def test_extract_hidden_fields(self):
+        """測試以正規表示式擷取隱藏欄位"""
+        html = ('<input value=\'abc+/=\' type="hidden" name=\'__VIEWSTATE\'>'
+                '<input data-name="x" name="__EVENTVALIDATION" value="a&amp;b">'
+                '<input name="ctl00$TextBox1" value="">')
+        self.assertEqual(extract_hidden_fields(html), {'__VIEWSTATE': 'abc+/=', '__EVENTVALIDATION': 'a&b'})
+    
+    def test_state_chained_between_pages(self):
+        """測試主頁面只下載一次，每頁沿用上一個回應的狀態"""
+        pager = AspNetPager(self.session, 'https://consumer.fda.gov.tw/Food/TFND.aspx', {'nodeID': '178'})
+        
+        for page in range(1, 4):
+            self.assertIn(f'P{page}', pager.fetch_page(page))
+        
+        self.assertEqual([method for method, _ in self.server.calls], ['GET', 'POST', 'POST', 'POST'])
+        last = self.server.calls[-1][1]
+        self.assertEqual((last['__VIEWSTATE'], last['__EVENTVALIDATION']), ('vs3', 'ev3&x'))
+        self.assertEqual(last['__EVENTARGUMENT'], 'Page$3')
+        self.assertNotIn('ctl00$ContentPlaceHolder1$Button1', last)
+    
+    def test_recovers_from_expired_state(self):
+        """測試伺服器拒絕狀態時重新下載主頁面並重新查詢"""
+        pager = AspNetPager(self.session, 'https://consumer.fda.gov.tw/Food/TFND.aspx')
+        pager.fetch_page(1)
+        self.server.expire_next = True
+        
+        self.assertIn('P2', pager.fetch_page(2))
+        self.assertEqual([method for method, _ in self.server.calls], ['GET', 'POST', 'POST', 'GET', 'POST', 'POST'])
+        self.assertEqual(pager.get_statistics(), {'requests': 6, 'recoveries': 1})
+    
+    @patch('rate_limiter.time.sleep')
+    @patch('requests.adapters.HTTPAdapter.send')
+    def test_cached_pages_do_not_replace_state(self, mock_send, mock_sleep):
+        """測試安裝快取時，主頁面與重新開始的請求不使用快取，postback 的 500 不重試"""
+        def send(request, **kwargs):
+            data = dict(parse_qsl(request.body)) if request.body else None
+            return self.server.request(request.method, request.url, data=data)
+        mock_send.side_effect = send
+        temp_dir = tempfile.mkdtemp()
+        try:
+            cache = ResponseCache(temp_dir)
+            url = 'https://consumer.fda.gov.tw/Food/TFND.aspx'
+            first = requests.Session()
+            install_http_cache(first, 'FDA', policy=RetryPolicy(max_retries=3), cache=cache)
+            AspNetPager(first, url).fetch_page(2)
+            
+            # 新的工作階段：第 1、2 頁由快取取得，第 3 頁沿用主頁面的狀態
+            second = requests.Session()
+            install_http_cache(second, 'FDA', policy=RetryPolicy(max_retries=3), cache=cache)
+            pager = AspNetPager(second, url)
+            self.server.calls.clear()
+            for page in range(1, 4):
+                self.assertIn(f'P{page}', pager.fetch_page(page))
+            self.assertEqual([method for method, _ in self.server.calls], ['GET', 'POST'])
+            
+            # 狀態失效時不重試同一個 postback，重新開始的請求都不經過快取
+            self.server.calls.clear()
+            self.server.expire_next = True
+            self.assertIn('P4', pager.fetch_page(4))
+            self.assertEqual([method for method, _ in self.server.calls], ['POST', 'GET', 'POST', 'POST'])
+            self.assertEqual(pager.recoveries, 1)
+            mock_sleep.assert_not_called()
+        finally:
+            shutil.rmtree(temp_dir)
+    
+    def test_scraper_pages_with_one_request(self):
+        """測試 FDA 抓取器的後續頁面只需一次請求"""
+        scraper = FDANutritionScraper(rate_limiter=TokenBucket(rate=1000))
+        scraper.pager.session = self.session
+        
+        pages = [scraper.search_foods(page=page) for page in range(1, 4)]
+        
+        self.assertEqual([foods[0]['整合編號'] for foods in pages], ['P1', 'P2', 'P3'])
+        self.assertEqual(pages[1][0]['詳細頁面URL'], 'https://consumer.fda.gov.tw/Food/Detail.aspx?id=2')
+        self.assertEqual(len(self.server.calls), 4)
+
+class TestPoliteFetcher(unittest.TestCase):
+    """依主機限制的並行抓取測試類別"""
+    
+    def test_ordered_output_and_host_cap(self):
+        """測試結果依輸入順序輸出，且同一主機的同時請求數不超過上限"""
+        lock = threading.Lock()
+        active = {}
+        peak = {}
+        
+        def fetch(url):
+            host = url.split('/')[2]
+            with lock:
+                active[host] = active.get(host, 0) + 1
+                peak[host] = max(peak.get(host, 0), active[host])
+            time.sleep(0.02 if url.endswith('0') else 0.005)
+            with lock:
+                active[host] -= 1
+            return url.upper()
+        
+        urls = [f'https://{host}/item{i}' for i in range(10) for host in ('a.test', 'b.test')]
+        fetcher = PoliteFetcher(fetch, max_per_host=2, max_workers=6, min_delay=0.0)
+        
+        results = list(fetcher.fetch(urls))
+        
+        self.assertEqual([item for item, _ in results], urls)
+        self.assertEqual([result for _, result in results], [url.upper() for url in urls])
+        self.assertEqual(max(peak.values()), 2)
+        self.assertEqual(set(fetcher.get_statistics()['hosts']), {'a.test', 'b.test'})
+    
+    def test_failures_slow_down_host(self):
+        """測試請求失敗時拉長間隔，成功後逐步縮短"""
+        host = HostPoliteness(max_concurrency=1, min_delay=0.5, max_delay=4.0)
+        for _ in range(4):
+            host._slots.acquire()
+            host.release(0.1, ok=False)
+        self.assertEqual(host.interval, 4.0)
+        self.assertGreater(host.error_rate, 0.7)
+        
+        host._slots.acquire()
+        host.release(0.1, ok=True)
+        self.assertAlmostEqual(host.interval, 3.6)
+    
+    def test_failed_request_yields_none(self):
+        """測試請求失敗的項目結果為 None，不影響其他項目"""
+        def fetch(url):
+            if url.endswith('2'):
+                raise requests.exceptions.HTTPError('429 Too Many Requests')
+            return len(url)
+        
+        fetcher = PoliteFetcher(fetch, min_delay=0.0)
+        results = [result for _, result in fetcher.fetch(['https://x.test/1', 'https://x.test/2', 'https://x.test/3'])]
+        
+        self.assertEqual(results, [16, None, 16])
+        self.assertEqual(fetcher.get_statistics()['hosts']['x.test']['errors'], 1)
+
+class TestFDACrawlCheckpoint(unittest.TestCase):
+    """FDA 抓取檢查點與續傳測試類別"""
+    
+    def setUp(self):
+        """測試前設定"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.temp_dir, 'fda_crawl')
+        self.pages = {
+            1: [{'整合編號': 'A01', '樣品名稱': '白米', '詳細頁面URL': 'https://fda.test/A01'},
+                {'整合編號': 'A02', '樣品名稱': '糙米', '詳細頁面URL': 'https://fda.test/A02'}],
+            2: [{'整合編號': 'B01', '樣品名稱': '雞蛋', '詳細頁面URL': 'https://fda.test/B01'}],
+        }
+    
+    def tearDown(self):
+        """測試後清理"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def make_scraper(self, failing_url=None):
+        """建立模擬網站的抓取器 (failing_url 模擬抓取中斷)"""
+        scraper = FDANutritionScraper(rate_limiter=TokenBucket(rate=1000))
+        scraper.search_foods = Mock(side_effect=lambda page=1, **kwargs: [dict(food) for food in self.pages.get(page, [])])
+        
+        def fetch_food_detail(url):
+            if url == failing_url:
+                raise KeyboardInterrupt
+            return {'營養成分': {'熱量': 100.0}}
+        
+        scraper.fetch_food_detail = Mock(side_effect=fetch_food_detail)
+        return scraper
+    
+    def test_resume_after_interruption(self):
+        """測試中斷後從檢查點繼續，不重複抓取也不重複寫入"""
+        first = self.make_scraper(failing_url='https://fda.test/B01')
+        fetched = []
+        with self.assertRaises(KeyboardInterrupt):
+            for food in first.crawl(self.prefix, max_pages=5):
+                fetched.append(food['整合編號'])
+        self.assertEqual(fetched, ['A01', 'A02'])
+        
+        second = self.make_scraper()
+        resumed = [food['整合編號'] for food in second.crawl(self.prefix, max_pages=5)]
+        
+        self.assertEqual(resumed, ['B01'])
+        self.assertEqual([call.kwargs['page'] for call in second.search_foods.call_args_list], [3])
+        self.assertEqual(second.fetch_food_detail.call_count, 1)
+        details = [food['整合編號'] for food in iter_jsonl(f"{self.prefix}_details.jsonl")]
+        self.assertEqual(details, ['A01', 'A02', 'B01'])
+        self.assertEqual(len(list(iter_jsonl(f"{self.prefix}_foods.jsonl"))), 3)
+        
+        with open(f"{self.prefix}_checkpoint.json", encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        self.assertEqual((checkpoint['last_page'], checkpoint['done']), (2, ['A01', 'A02', 'B01']))
+    
+    def test_partial_line_truncated(self):
+        """測試寫到一半的最後一行在續寫前被移除"""
+        path = os.path.join(self.temp_dir, 'partial.jsonl')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('{"整合編號": "A01"}\n{"整合編')
+        
+        with open_jsonl_append(path) as f:
+            f.write('{"整合編號": "A02"}\n')
+        
+        self.assertEqual([food['整合編號'] for food in iter_jsonl(path)], ['A01', 'A02'])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
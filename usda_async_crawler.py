@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+USDA FoodData Central 非同步抓取器
+以 asyncio 同時進行搜尋與詳細資訊請求 (搜尋結果缺少熱量時立即批次查詢)，
+同時數量可設定，請求速率不超過 API 金鑰的每小時配額；
+結果依原本 USDAScraper 的順序逐筆寫入 JSONL 檔案，內容與同步抓取相同
+"""
+
+import os
+import json
+import math
+import asyncio
+import argparse
+from collections import deque
+from dataclasses import asdict
+from datetime import datetime
+from typing import Dict, List, Optional
+import logging
+
+import requests
+
+from rate_limiter import RetryPolicy, TokenBucket, async_send_with_retry
+from usda_food_scraper import USDAFoodItem, USDAScraper
+from usda_nutrients import MAX_IDS_PER_REQUEST, foods_request_body, index_foods, needs_details
+
+# 非同步 HTTP 為選用功能，需要安裝 httpx
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# api.data.gov 每小時請求配額 (DEMO_KEY 與一般金鑰)
+DEMO_KEY_HOURLY_QUOTA = 30
+API_KEY_HOURLY_QUOTA = 1000
+
+# 與 USDAScraper.scrape_category 相同的搜尋設定
+SEARCH_PAGE_SIZE = 25
+HITS_PER_KEYWORD = 10
+
+def quota_limiter(hourly_quota: int, burst: int = 1) -> TokenBucket:
+    """
+    依每小時配額建立速率限制器
+
+    Args:
+        hourly_quota: 每小時請求數上限
+        burst: 最大突發請求數
+    """
+    return TokenBucket(rate=hourly_quota / 3600.0, capacity=max(1, min(burst, hourly_quota)))
+
+def food_to_dict(food: USDAFoodItem) -> Dict:
+    """食物項目轉換為 USDAScraper.save_to_json 的欄位格式"""
+    return asdict(food)
+
+def load_jsonl(path: str) -> List[USDAFoodItem]:
+    """
+    讀取抓取結果
+
+    Args:
+        path: JSONL 檔案路徑
+
+    Returns:
+        食物項目列表
+    """
+    foods = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                foods.append(USDAFoodItem(**json.loads(line)))
+    return foods
+
+class AsyncUSDACrawler:
+    """USDA FoodData Central 非同步抓取器"""
+
+    def __init__(self, scraper: Optional[USDAScraper] = None, concurrency: int = 8,
+                 hourly_quota: Optional[int] = None, rate_limiter: Optional[TokenBucket] = None,
+                 retry_policy: Optional[RetryPolicy] = None, transport=None, keyword_window: int = 4):
+        """
+        初始化抓取器
+
+        Args:
+            scraper: 提供分類、請求參數與解析邏輯的同步抓取器
+            concurrency: 最大同時請求數
+            hourly_quota: 每小時請求數上限 (預設依 USDA_HOURLY_QUOTA 或金鑰種類決定)
+            rate_limiter: 速率限制器 (預設使用 USDA_RATE_LIMIT 共用限制器，否則依每小時配額建立)
+            retry_policy: 429/5xx 的重試策略
+            transport: httpx 傳輸層 (測試時替換)
+            keyword_window: 每個分類最多同時搜尋的關鍵字數量
+        """
+        if httpx is None:
+            raise ImportError("非同步抓取需要安裝 httpx: pip install httpx")
+
+        self.scraper = scraper or USDAScraper()
+        self.concurrency = max(1, concurrency)
+
+        if hourly_quota is None:
+            default_quota = DEMO_KEY_HOURLY_QUOTA if self.scraper.api_key == 'DEMO_KEY' else API_KEY_HOURLY_QUOTA
+            hourly_quota = int(os.getenv('USDA_HOURLY_QUOTA', default_quota))
+        self.hourly_quota = hourly_quota
+
+        if rate_limiter is None:
+            rate_limiter = self.scraper.rate_limiter or quota_limiter(hourly_quota, self.concurrency)
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or self.scraper.retry_policy
+        self.transport = transport
+        self.keyword_window = max(1, keyword_window)
+
+        # httpx.AsyncClient 與 asyncio.Semaphore 都綁定事件迴圈，於 crawl 時建立
+        self._client = None
+        self._semaphore = None
+
+        # 統計資訊
+        self.requests = 0
+        self.failures = 0
+        self.written = 0
+
+    async def _request_json(self, url: str, params: Dict, body: Optional[Dict] = None):
+        """發送 GET (或有請求內容時 POST) 請求，失敗時記錄錯誤並回傳 None (與同步版相同)"""
+        async def send():
+            # 重試等待期間不佔用同時請求的名額
+            async with self._semaphore:
+                self.requests += 1
+                try:
+                    if body is not None:
+                        return await self._client.post(url, params=params, json=body, timeout=self.scraper.timeout)
+                    return await self._client.get(url, params=params, timeout=self.scraper.timeout)
+                except httpx.HTTPError as e:
+                    raise requests.exceptions.ConnectionError(str(e))
+
+        try:
+            response = await async_send_with_retry(send, self.rate_limiter, self.retry_policy)
+            response.raise_for_status()
+            return response.json()
+        except (requests.exceptions.RequestException, httpx.HTTPError, ValueError) as e:
+            self.failures += 1
+            logger.error(f"請求失敗 ({url}): {e}")
+            return None
+
+    async def search_foods(self, query: str, page_size: int = SEARCH_PAGE_SIZE, page_number: int = 1) -> Optional[Dict]:
+        """非同步搜尋食物"""
+        return await self._request_json(f"{self.scraper.api_base}/foods/search",
+                                    self.scraper.search_params(query, page_size, page_number))
+
+    async def get_food_details(self, fdc_id: str) -> Optional[Dict]:
+        """非同步獲取食物詳細資訊"""
+        return await self._request_json(f"{self.scraper.api_base}/food/{fdc_id}", self.scraper.detail_params())
+
+    async def get_foods_details(self, fdc_ids: List[str]) -> Dict[str, Dict]:
+        """非同步批次獲取多個食物的詳細資訊 (POST /foods，各批次同時進行)"""
+        url = f"{self.scraper.api_base}/foods"
+        params = {'api_key': self.scraper.api_key}
+        batches = [fdc_ids[start:start + MAX_IDS_PER_REQUEST] for start in range(0, len(fdc_ids), MAX_IDS_PER_REQUEST)]
+        details: Dict[str, Dict] = {}
+        for payload in await asyncio.gather(*(self._request_json(url, params, foods_request_body(batch)) for batch in batches)):
+            details.update(index_foods(payload))
+        return details
+
+    async def _crawl_keyword(self, keyword: str) -> List[USDAFoodItem]:
+        """搜尋關鍵字，缺少熱量的結果以批次請求補齊，回傳有熱量的項目 (依搜尋順序)"""
+        search_result = await self.search_foods(keyword)
+        if not search_result or 'foods' not in search_result:
+            return []
+
+        hits = search_result['foods'][:HITS_PER_KEYWORD]
+        missing = [str(hit.get('fdcId', '')) for hit in hits if needs_details(hit)]
+        details = await self.get_foods_details(missing) if missing else {}
+
+        items = []
+        for hit in hits:
+            item = self.scraper.build_food_item(hit, details.get(str(hit.get('fdcId', ''))))
+            if item and item.energy_kcal > 0:
+                items.append(item)
+        return items
+
+    async def _crawl_category(self, category_name: str, keywords: List[str], max_items: int) -> List[USDAFoodItem]:
+        """
+        抓取分類 (依關鍵字順序組合結果)
+
+        關鍵字依序啟動，同時進行的數量依還需要的項目數估計 (每個關鍵字最多 HITS_PER_KEYWORD 個)，
+        且不超過 keyword_window；與 USDAScraper.scrape_category 相同，達到 max_items 後不再啟動新的關鍵字，
+        不會為用不到的搜尋消耗速率限制的配額。
+        """
+        remaining = iter(keywords)
+        pending = deque()
+        category_foods: List[USDAFoodItem] = []
+        try:
+            while len(category_foods) < max_items:
+                needed = max_items - len(category_foods)
+                window = min(self.keyword_window, math.ceil(needed / HITS_PER_KEYWORD))
+                while len(pending) < window:
+                    keyword = next(remaining, None)
+                    if keyword is None:
+                        break
+                    pending.append((keyword, asyncio.ensure_future(self._crawl_keyword(keyword))))
+                if not pending:
+                    break
+
+                keyword, task = pending.popleft()
+                try:
+                    items = await task
+                except Exception as e:
+                    logger.error(f"抓取關鍵字 {keyword} 失敗: {e}")
+                    continue
+                for item in items:
+                    item.category = category_name
+                    category_foods.append(item)
+                    if len(category_foods) >= max_items:
+                        break
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+        logger.info(f"{category_name} 分類抓取完成，共 {len(category_foods)} 個項目")
+        return category_foods
+
+    async def crawl(self, output_path: str, max_items_per_category: int = 50,
+                    categories: Optional[Dict[str, List[str]]] = None) -> List[USDAFoodItem]:
+        """
+        抓取所有分類並逐筆寫入 JSONL
+
+        所有分類同時進行；結果依分類順序去重後寫入，與 USDAScraper.scrape_all_categories 相同。
+
+        Args:
+            output_path: JSONL 輸出檔案
+            max_items_per_category: 每個分類的最大項目數量
+            categories: {分類: [關鍵字, ...]} (預設使用抓取器的分類)
+
+        Returns:
+            所有食物項目列表 (已去重)
+        """
+        categories = categories or self.scraper.food_categories
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+
+        async with httpx.AsyncClient(headers=dict(self.scraper.session.headers), limits=limits,
+                                     transport=self.transport) as client:
+            self._client = client
+            tasks = [asyncio.ensure_future(self._crawl_category(name, keywords, max_items_per_category))
+                     for name, keywords in categories.items()]
+
+            unique_foods: List[USDAFoodItem] = []
+            seen: set = set()
+            try:
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    for name, task in zip(categories, tasks):
+                        try:
+                            category_foods = await task
+                        except Exception as e:
+                            logger.error(f"抓取分類 {name} 失敗: {e}")
+                            continue
+                        for food in category_foods:
+                            normalized = self.scraper.normalize_name(food.food_name)
+                            if normalized in seen:
+                                continue
+                            seen.add(normalized)
+                            unique_foods.append(food)
+                            f.write(json.dumps(food_to_dict(food), ensure_ascii=False) + '\n')
+                            self.written += 1
+                        f.flush()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                self._client = None
+
+        logger.info(f"所有分類抓取完成，共 {len(unique_foods)} 個唯一項目，已寫入 {output_path}")
+        return unique_foods
+
+    def run(self, output_path: str, max_items_per_category: int = 50) -> List[USDAFoodItem]:
+        """同步介面: 執行 crawl"""
+        return asyncio.run(self.crawl(output_path, max_items_per_category))
+
+    def get_statistics(self) -> Dict:
+        """獲取統計資訊"""
+        stats = {
+            'requests': self.requests,
+            'failures': self.failures,
+            'written': self.written,
+            'concurrency': self.concurrency,
+            'hourly_quota': self.hourly_quota
+        }
+        if self.rate_limiter is not None:
+            stats['rate_limiter'] = self.rate_limiter.get_statistics()
+        return stats
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description='以非同步請求抓取 USDA FoodData Central 食物資料')
+    parser.add_argument('-o', '--output', default=None, help='JSONL 輸出檔案 (預設 usda_foods_<時間>.jsonl)')
+    parser.add_argument('--max-items', type=int, default=30, help='每個分類的最大項目數量')
+    parser.add_argument('--concurrency', type=int, default=8, help='最大同時請求數')
+    parser.add_argument('--hourly-quota', type=int, default=None, help='每小時請求數上限')
+    parser.add_argument('--json', action='store_true', help='另外輸出與 usda_food_scraper.py 相同格式的 JSON 檔')
+
+    args = parser.parse_args()
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output = args.output or f"usda_foods_{timestamp}.jsonl"
+
+    crawler = AsyncUSDACrawler(concurrency=args.concurrency, hourly_quota=args.hourly_quota)
+    print(f"🍽️ 非同步抓取 USDA 食物資料 (同時 {crawler.concurrency} 個請求，每小時上限 {crawler.hourly_quota} 次)")
+
+    try:
+        foods = crawler.run(output, args.max_items)
+    except KeyboardInterrupt:
+        print(f"\n⏹️ 抓取被使用者中斷，已寫入 {crawler.written} 筆至 {output}")
+        return
+
+    stats = crawler.get_statistics()
+    print(f"✅ 抓取完成: {len(foods)} 種食物，{stats['requests']} 次請求，{stats['failures']} 次失敗")
+    print(f"  JSONL檔案: {output}")
+
+    if args.json:
+        json_filename = os.path.splitext(output)[0] + '.json'
+        crawler.scraper.save_to_json(foods, json_filename)
+        print(f"  JSON檔案: {json_filename}")
+
+if __name__ == "__main__":
+    main()
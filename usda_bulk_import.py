@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+USDA FoodData Central 批次資料匯入
+讀取官方下載的 CSV 資料 (food.csv、food_nutrient.csv、food_category.csv)，
+以分塊方式串流處理 (記憶體用量只與食物數量有關)，依 fdc_id 合併熱量與三大營養素，
+輸出與 USDAScraper.save_to_csv / save_to_json 相同的 USDAFoodItem 資料
+"""
+
+import os
+import argparse
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import logging
+
+import numpy as np
+import pandas as pd
+
+from usda_food_scraper import USDAFoodItem, USDAScraper
+from usda_nutrients import NUTRIENT_FIELDS, NUTRIENT_IDS
+
+logger = logging.getLogger(__name__)
+
+# CSV 的 data_type 對應 API 的 dataType
+DATA_TYPES = {
+    'foundation_food': 'Foundation',
+    'sr_legacy_food': 'SR Legacy',
+    'survey_fndds_food': 'Survey (FNDDS)',
+    'branded_food': 'Branded',
+}
+
+# 預設與 USDAScraper 搜尋相同的資料類型
+DEFAULT_DATA_TYPES = ('Foundation', 'SR Legacy', 'Survey (FNDDS)')
+
+# 每個營養素編號在暫存矩陣中的欄位
+_NUMBERS = tuple(number for numbers in NUTRIENT_FIELDS.values() for number in numbers)
+_COLUMN_OF_ID = {nutrient_id: _NUMBERS.index(number) for nutrient_id, number in NUTRIENT_IDS.items()}
+
+class USDABulkImporter:
+    """USDA FoodData Central CSV 匯入器"""
+
+    def __init__(self, directory: str, data_types: Iterable[str] = DEFAULT_DATA_TYPES,
+                 chunk_size: int = 500_000, scraper: Optional[USDAScraper] = None):
+        """
+        初始化匯入器
+
+        Args:
+            directory: 解壓縮後的 CSV 資料夾
+            data_types: 要匯入的資料類型 (API 名稱，例如 'SR Legacy')
+            chunk_size: 每次讀取的列數
+            scraper: 提供食物分類、去重與儲存功能的抓取器
+        """
+        self.directory = directory
+        self.data_types = set(data_types)
+        self.chunk_size = chunk_size
+        self.scraper = scraper or USDAScraper()
+
+        # 統計資訊
+        self.food_rows = 0
+        self.nutrient_rows = 0
+        self.matched_nutrients = 0
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _read(self, name: str, columns: List[str], dtype=str) -> Iterator[pd.DataFrame]:
+        """分塊讀取 CSV (只讀取需要的欄位；文字欄位的空值保留為空字串)"""
+        return pd.read_csv(self._path(name), usecols=lambda column: column in columns,
+                           dtype=dtype, keep_default_na=dtype is not str, chunksize=self.chunk_size)
+
+    def load_categories(self) -> Dict[str, str]:
+        """讀取食物分類 {分類ID: 名稱}"""
+        if not os.path.exists(self._path('food_category.csv')):
+            return {}
+        categories = {}
+        for chunk in self._read('food_category.csv', ['id', 'description']):
+            categories.update(zip(chunk['id'], chunk['description']))
+        return categories
+
+    def load_foods(self) -> pd.DataFrame:
+        """
+        讀取符合資料類型的食物
+
+        Returns:
+            依 fdc_id 排序的 DataFrame (fdc_id、description、data_type、food_category)
+        """
+        categories = self.load_categories()
+        wanted = {name for name, data_type in DATA_TYPES.items() if data_type in self.data_types}
+
+        frames = []
+        for chunk in self._read('food.csv', ['fdc_id', 'data_type', 'description', 'food_category_id']):
+            self.food_rows += len(chunk)
+            chunk = chunk[chunk['data_type'].isin(wanted)]
+            if len(chunk):
+                frames.append(chunk)
+
+        columns = ['fdc_id', 'data_type', 'description', 'food_category_id']
+        foods = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+        if 'food_category_id' not in foods:
+            foods['food_category_id'] = ''
+        foods['fdc_id'] = foods['fdc_id'].astype(np.int64)
+        foods['data_type'] = foods['data_type'].map(DATA_TYPES)
+        foods['food_category'] = foods['food_category_id'].map(categories).fillna('')
+        return foods.sort_values('fdc_id', kind='stable').reset_index(drop=True)
+
+    def load_branded(self, fdc_ids: np.ndarray) -> Dict[int, Tuple[str, str, Optional[float], Optional[str]]]:
+        """讀取品牌食品的品牌、成分與份量 {fdc_id: (品牌, 成分, 份量, 單位)}"""
+        if 'Branded' not in self.data_types or not os.path.exists(self._path('branded_food.csv')):
+            return {}
+        branded = {}
+        columns = ['fdc_id', 'brand_owner', 'ingredients', 'serving_size', 'serving_size_unit']
+        for chunk in self._read('branded_food.csv', columns):
+            chunk = chunk[np.isin(chunk['fdc_id'].astype(np.int64), fdc_ids)]
+            for row in chunk.itertuples(index=False):
+                serving_size = getattr(row, 'serving_size', '')
+                branded[int(row.fdc_id)] = (
+                    getattr(row, 'brand_owner', ''),
+                    getattr(row, 'ingredients', ''),
+                    float(serving_size) if serving_size else None,
+                    getattr(row, 'serving_size_unit', '') or None
+                )
+        return branded
+
+    def load_nutrients(self, fdc_ids: np.ndarray) -> np.ndarray:
+        """
+        串流讀取 food_nutrient.csv，取出需要的營養素
+
+        Args:
+            fdc_ids: 已排序的 fdc_id
+
+        Returns:
+            (食物數, 營養素編號數) 矩陣，沒有資料為 NaN；欄位順序同 NUTRIENT_FIELDS 展開後的編號
+        """
+        values = np.full((len(fdc_ids), len(_NUMBERS)), np.nan)
+        if not len(fdc_ids):
+            return values
+
+        # 營養素 ID 對應暫存矩陣欄位的查詢表 (-1 表示不需要)
+        lookup = np.full(max(_COLUMN_OF_ID) + 1, -1, dtype=np.int64)
+        for nutrient_id, column in _COLUMN_OF_ID.items():
+            lookup[nutrient_id] = column
+
+        dtype = {'fdc_id': np.int64, 'nutrient_id': np.int64, 'amount': np.float64}
+        for chunk in self._read('food_nutrient.csv', ['fdc_id', 'nutrient_id', 'amount'], dtype):
+            self.nutrient_rows += len(chunk)
+            nutrient_ids = chunk['nutrient_id'].to_numpy()
+            columns = np.full(len(nutrient_ids), -1, dtype=np.int64)
+            in_range = (nutrient_ids >= 0) & (nutrient_ids < len(lookup))
+            columns[in_range] = lookup[nutrient_ids[in_range]]
+            keep = columns >= 0
+            if not keep.any():
+                continue
+
+            ids = chunk['fdc_id'].to_numpy()[keep]
+            positions = np.searchsorted(fdc_ids, ids)
+            found = positions < len(fdc_ids)
+            found[found] = fdc_ids[positions[found]] == ids[found]
+
+            amounts = chunk['amount'].to_numpy()[keep]
+            values[positions[found], columns[keep][found]] = amounts[found]
+            self.matched_nutrients += int(found.sum())
+
+        return values
+
+    def iter_items(self, require_energy: bool = True) -> Iterator[USDAFoodItem]:
+        """
+        逐一產生食物項目 (依 fdc_id 排序)
+
+        Args:
+            require_energy: 只保留有熱量資料的食物 (與 USDAScraper 相同)
+        """
+        foods = self.load_foods()
+        fdc_ids = foods['fdc_id'].to_numpy()
+        values = self.load_nutrients(fdc_ids)
+        branded = self.load_branded(fdc_ids)
+
+        # 每個欄位依序取第一個有資料的營養素編號
+        fields = {}
+        for field, numbers in NUTRIENT_FIELDS.items():
+            column = np.full(len(fdc_ids), np.nan)
+            for number in reversed(numbers):
+                candidate = values[:, _NUMBERS.index(number)]
+                column = np.where(np.isnan(candidate), column, candidate)
+            fields[field] = column
+
+        for index, row in enumerate(foods.itertuples(index=False)):
+            energy = fields['energy_kcal'][index]
+            if require_energy and not energy > 0:
+                continue
+
+            food_name = row.description.strip()
+            brand_owner, ingredients, serving_size, serving_unit = branded.get(int(row.fdc_id), ('', '', None, None))
+            macros = {field: None if np.isnan(fields[field][index]) else float(fields[field][index])
+                      for field in ('protein_g', 'carbohydrate_g', 'fat_g', 'fiber_g')}
+
+            yield USDAFoodItem(
+                fdc_id=str(row.fdc_id),
+                food_name=food_name,
+                energy_kcal=0.0 if np.isnan(energy) else float(energy),
+                category=self.scraper.categorize_food(food_name, row.food_category),
+                brand_owner=brand_owner,
+                data_type=row.data_type,
+                description=food_name,
+                ingredients=ingredients,
+                serving_size=serving_size,
+                serving_unit=serving_unit,
+                **macros
+            )
+
+    def import_items(self, require_energy: bool = True, deduplicate: bool = True) -> List[USDAFoodItem]:
+        """
+        匯入所有食物項目
+
+        Args:
+            require_energy: 只保留有熱量資料的食物
+            deduplicate: 以 USDAScraper.remove_duplicates 移除同名食物
+
+        Returns:
+            食物項目列表
+        """
+        items = list(self.iter_items(require_energy))
+        if deduplicate:
+            items = self.scraper.remove_duplicates(items)
+        logger.info(f"匯入完成: 讀取 {self.food_rows} 種食物、{self.nutrient_rows} 筆營養素，"
+                    f"輸出 {len(items)} 個項目")
+        return items
+
+    def get_statistics(self) -> Dict:
+        """獲取統計資訊"""
+        return {
+            'food_rows': self.food_rows,
+            'nutrient_rows': self.nutrient_rows,
+            'matched_nutrients': self.matched_nutrients
+        }
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description='匯入 USDA FoodData Central 官方 CSV 資料')
+    parser.add_argument('directory', help='解壓縮後的 CSV 資料夾 (含 food.csv、food_nutrient.csv)')
+    parser.add_argument('--data-type', action='append', choices=sorted(DATA_TYPES.values()),
+                        help='要匯入的資料類型 (可重複指定，預設 Foundation、SR Legacy、Survey (FNDDS))')
+    parser.add_argument('--chunk-size', type=int, default=500_000, help='每次讀取的列數')
+    parser.add_argument('--keep-duplicates', action='store_true', help='保留同名食物')
+    parser.add_argument('-o', '--output', default=None, help='輸出檔名前綴 (預設 usda_foods_<時間>)')
+
+    args = parser.parse_args()
+
+    importer = USDABulkImporter(args.directory, args.data_type or DEFAULT_DATA_TYPES, args.chunk_size)
+    print(f"📥 匯入 USDA 資料: {args.directory}")
+    foods = importer.import_items(deduplicate=not args.keep_duplicates)
+
+    prefix = args.output or f"usda_foods_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    importer.scraper.save_to_csv(foods, f"{prefix}.csv")
+    importer.scraper.save_to_json(foods, f"{prefix}.json")
+
+    stats = importer.get_statistics()
+    print(f"✅ 匯入完成: {len(foods)} 種食物 (讀取 {stats['nutrient_rows']} 筆營養素)")
+    print(f"  CSV檔案: {prefix}.csv")
+    print(f"  JSON檔案: {prefix}.json")
+
+if __name__ == "__main__":
+    main()
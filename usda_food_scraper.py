@@ -16,6 +16,10 @@ import logging
 from urllib.parse import urljoin, urlparse
 import pandas as pd
 from tqdm import tqdm
+from keyword_matcher import category_matcher
+from http_cache import install_http_cache
+from rate_limiter import RetryPolicy, TokenBucket, get_rate_limiter
+from usda_nutrients import extract_nutrients, fetch_foods, needs_details
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
@@ -34,24 +38,41 @@ class USDAFoodItem:
     ingredients: Optional[str] = None
     serving_size: Optional[float] = None
     serving_unit: Optional[str] = None
+    protein_g: Optional[float] = None
+    carbohydrate_g: Optional[float] = None
+    fat_g: Optional[float] = None
+    fiber_g: Optional[float] = None
 
 class USDAScraper:
     """USDA FoodData Central 抓取器"""
     
-    def __init__(self):
-        """初始化抓取器"""
+    def __init__(self, rate_limiter: Optional[TokenBucket] = None, retry_policy: Optional[RetryPolicy] = None):
+        """
+        初始化抓取器
+        
+        Args:
+            rate_limiter: 跨行程共用的速率限制器 (預設依 USDA_RATE_LIMIT 環境變數決定)
+            retry_policy: 429/5xx 的重試策略 (預設重試 max_retries 次)
+        """
         self.base_url = "https://fdc.nal.usda.gov"
         self.api_base = "https://api.nal.usda.gov/fdc/v1"
+        self.api_key = os.getenv('USDA_API_KEY') or 'DEMO_KEY'  # 未設定時使用演示API金鑰
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         })
         
         # 設定請求參數
-        self.request_delay = 1.0  # 請求間隔
+        self.request_delay = 1.0  # 請求間隔 (未設定速率限制器時使用)
         self.max_retries = 3
         self.timeout = 30
         
+        # 速率限制與重試 (設定限制器後以配額上限發送請求，取代固定間隔)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else get_rate_limiter('USDA')
+        self.retry_policy = retry_policy or RetryPolicy(max_retries=self.max_retries)
+        # 設定 HTTP_CACHE_DIR 時，重新執行會直接使用快取的回應
+        install_http_cache(self.session, 'USDA', self.rate_limiter, self.retry_policy)
+        
         # 資料儲存
         self.foods_data = []
         self.categories = set()
@@ -69,6 +90,9 @@ class USDAScraper:
             'desserts': ['cake', 'cookie', 'pie', 'ice cream', 'chocolate'],
             'condiments': ['sauce', 'dressing', 'mayonnaise', 'ketchup', 'mustard']
         }
+        
+        # 分類關鍵字編譯成單一自動機，分類順序即優先順序
+        self.category_matcher = category_matcher(self.food_categories)
     
     def search_foods(self, query: str, page_size: int = 50, page_number: int = 1) -> Optional[Dict]:
         """
@@ -84,15 +108,7 @@ class USDAScraper:
         """
         try:
             url = f"{self.api_base}/foods/search"
-            params = {
-                'api_key': 'DEMO_KEY',  # 使用演示API金鑰
-                'query': query,
-                'pageSize': page_size,
-                'pageNumber': page_number,
-                'dataType': ['Foundation', 'SR Legacy', 'Survey (FNDDS)'],
-                'sortBy': 'dataType.keyword',
-                'sortOrder': 'asc'
-            }
+            params = self.search_params(query, page_size, page_number)
             
             response = self.session.get(url, params=params, timeout=self.timeout)
             response.raise_for_status()
@@ -106,6 +122,26 @@ class USDAScraper:
             logger.error(f"解析搜尋結果失敗: {e}")
             return None
     
+    def search_params(self, query: str, page_size: int = 50, page_number: int = 1) -> Dict:
+        """搜尋 API 的查詢參數 (同步與非同步抓取共用)"""
+        return {
+            'api_key': self.api_key,
+            'query': query,
+            'pageSize': page_size,
+            'pageNumber': page_number,
+            'dataType': ['Foundation', 'SR Legacy', 'Survey (FNDDS)'],
+            'sortBy': 'dataType.keyword',
+            'sortOrder': 'asc'
+        }
+    
+    def detail_params(self) -> Dict:
+        """食物詳細資訊 API 的查詢參數"""
+        return {
+            'api_key': self.api_key,
+            'format': 'full',
+            'nutrients': '203,204,205,208,291'  # 蛋白質、脂肪、碳水化合物、熱量、膳食纖維
+        }
+    
     def get_food_details(self, fdc_id: str) -> Optional[Dict]:
         """
         獲取食物詳細資訊
@@ -118,11 +154,7 @@ class USDAScraper:
         """
         try:
             url = f"{self.api_base}/food/{fdc_id}"
-            params = {
-                'api_key': 'DEMO_KEY',
-                'format': 'full',
-                'nutrients': '203,204,205,208'  # 蛋白質、脂肪、碳水化合物、熱量
-            }
+            params = self.detail_params()
             
             response = self.session.get(url, params=params, timeout=self.timeout)
             response.raise_for_status()
@@ -136,9 +168,21 @@ class USDAScraper:
             logger.error(f"解析食物詳細資訊失敗 (FDC ID: {fdc_id}): {e}")
             return None
     
+    def get_foods_details(self, fdc_ids: List[str]) -> Dict[str, Dict]:
+        """
+        批次獲取多個食物的詳細資訊 (POST /foods，每次最多 20 個 ID)
+        
+        Args:
+            fdc_ids: 食物ID列表
+            
+        Returns:
+            {食物ID: 食物詳細資訊}
+        """
+        return fetch_foods(self.session, self.api_base, fdc_ids, self.api_key, timeout=self.timeout)
+    
     def extract_energy_value(self, food_details: Dict) -> Optional[float]:
         """
-        從食物詳細資訊中提取熱量值
+        從食物資料中提取熱量值 (搜尋結果或詳細資訊皆可)
         
         Args:
             food_details: 食物詳細資訊
@@ -146,24 +190,7 @@ class USDAScraper:
         Returns:
             熱量值 (kcal)
         """
-        try:
-            # 查找營養素資訊
-            if 'foodNutrients' in food_details:
-                for nutrient in food_details['foodNutrients']:
-                    # 營養素ID 208 是能量 (kcal)
-                    if nutrient.get('nutrient', {}).get('id') == 208:
-                        return nutrient.get('amount', 0)
-                    
-                    # 也檢查營養素名稱
-                    nutrient_name = nutrient.get('nutrient', {}).get('name', '').lower()
-                    if 'energy' in nutrient_name or 'calories' in nutrient_name:
-                        return nutrient.get('amount', 0)
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"提取熱量值失敗: {e}")
-            return None
+        return extract_nutrients(food_details).get('energy_kcal')
     
     def categorize_food(self, food_name: str, description: str = "") -> str:
         """
@@ -178,12 +205,7 @@ class USDAScraper:
         """
         text = f"{food_name} {description}".lower()
         
-        for category, keywords in self.food_categories.items():
-            for keyword in keywords:
-                if keyword in text:
-                    return category
-        
-        return "other"
+        return self.category_matcher.first_label(text, "other")
     
     def parse_food_item(self, food_data: Dict) -> Optional[USDAFoodItem]:
         """
@@ -192,6 +214,36 @@ class USDAScraper:
         Args:
             food_data: 食物資料字典
             
+        Returns:
+            USDA食物項目物件
+        """
+        return self.parse_search_results([food_data])[0]
+    
+    def parse_search_results(self, foods: List[Dict]) -> List[Optional[USDAFoodItem]]:
+        """
+        解析搜尋結果
+        
+        熱量與三大營養素直接取自搜尋結果；缺少熱量的項目才以一次批次請求取得詳細資訊。
+        
+        Args:
+            foods: 搜尋結果中的食物資料列表
+            
+        Returns:
+            USDA食物項目物件列表 (順序與輸入相同，解析失敗為 None)
+        """
+        missing = [str(food_data.get('fdcId', '')) for food_data in foods if needs_details(food_data)]
+        details = self.get_foods_details(missing) if missing else {}
+        return [self.build_food_item(food_data, details.get(str(food_data.get('fdcId', ''))))
+                for food_data in foods]
+    
+    def build_food_item(self, food_data: Dict, food_details: Optional[Dict] = None) -> Optional[USDAFoodItem]:
+        """
+        由搜尋結果與詳細資訊建立食物項目 (同步與非同步抓取共用)
+        
+        Args:
+            food_data: 搜尋結果中的食物資料
+            food_details: 食物詳細資訊 (搜尋結果已有營養素或取得失敗時為 None)
+            
         Returns:
             USDA食物項目物件
         """
@@ -201,24 +253,20 @@ class USDAScraper:
             brand_owner = food_data.get('brandOwner', '')
             data_type = food_data.get('dataType', 'Foundation')
             
-            # 獲取詳細資訊以提取熱量
-            food_details = self.get_food_details(fdc_id)
-            energy_kcal = 0.0
-            
+            # 搜尋結果已包含營養素，缺少時才使用詳細資訊
+            nutrients = extract_nutrients(food_data)
+            source = food_data
             if food_details:
-                energy_kcal = self.extract_energy_value(food_details) or 0.0
-                
-                # 更新描述
-                description = food_details.get('description', food_name)
-                ingredients = food_details.get('ingredients', '')
-                
-                # 提取份量資訊
-                serving_size = None
-                serving_unit = None
-                if 'servingSize' in food_details:
-                    serving_size = food_details['servingSize']
-                if 'servingSizeUnit' in food_details:
-                    serving_unit = food_details['servingSizeUnit']
+                nutrients.update(extract_nutrients(food_details))
+                source = food_details
+            
+            energy_kcal = nutrients.get('energy_kcal') or 0.0
+            description = source.get('description', food_name)
+            ingredients = source.get('ingredients', '')
+            
+            # 提取份量資訊
+            serving_size = source.get('servingSize')
+            serving_unit = source.get('servingSizeUnit')
             
             # 分類食物
             category = self.categorize_food(food_name, description or '')
@@ -233,7 +281,11 @@ class USDAScraper:
                 description=description,
                 ingredients=ingredients,
                 serving_size=serving_size,
-                serving_unit=serving_unit
+                serving_unit=serving_unit,
+                protein_g=nutrients.get('protein_g'),
+                carbohydrate_g=nutrients.get('carbohydrate_g'),
+                fat_g=nutrients.get('fat_g'),
+                fiber_g=nutrients.get('fiber_g')
             )
             
         except Exception as e:
@@ -266,9 +318,8 @@ class USDAScraper:
                 
                 foods = search_result['foods']
                 
-                for food_data in foods[:10]:  # 每個關鍵字最多取10個結果
-                    food_item = self.parse_food_item(food_data)
-                    
+                # 每個關鍵字最多取10個結果
+                for food_item in self.parse_search_results(foods[:10]):
                     if food_item and food_item.energy_kcal > 0:
                         food_item.category = category_name
                         category_foods.append(food_item)
@@ -277,7 +328,8 @@ class USDAScraper:
                             break
                 
                 # 請求間隔
-                time.sleep(self.request_delay)
+                if self.rate_limiter is None:
+                    time.sleep(self.request_delay)
                 
                 if len(category_foods) >= max_items:
                     break
@@ -309,7 +361,8 @@ class USDAScraper:
                 all_foods.extend(category_foods)
                 
                 # 分類間隔
-                time.sleep(self.request_delay * 2)
+                if self.rate_limiter is None:
+                    time.sleep(self.request_delay * 2)
                 
             except Exception as e:
                 logger.error(f"抓取分類 {category_name} 失敗: {e}")
@@ -335,8 +388,7 @@ class USDAScraper:
         unique_foods = []
         
         for food in foods:
-            # 標準化食物名稱
-            normalized_name = re.sub(r'[^\w\s]', '', food.food_name.lower()).strip()
+            normalized_name = self.normalize_name(food.food_name)
             
             if normalized_name not in seen_names:
                 seen_names.add(normalized_name)
@@ -344,6 +396,11 @@ class USDAScraper:
         
         return unique_foods
     
+    @staticmethod
+    def normalize_name(food_name: str) -> str:
+        """標準化食物名稱 (去重時使用)"""
+        return re.sub(r'[^\w\s]', '', food_name.lower()).strip()
+    
     def save_to_csv(self, foods: List[USDAFoodItem], filename: str = "usda_foods.csv"):
         """
         儲存為CSV檔案
@@ -365,7 +422,11 @@ class USDAScraper:
                     'description': food.description or '',
                     'ingredients': food.ingredients or '',
                     'serving_size': food.serving_size or '',
-                    'serving_unit': food.serving_unit or ''
+                    'serving_unit': food.serving_unit or '',
+                    'protein_g': food.protein_g if food.protein_g is not None else '',
+                    'carbohydrate_g': food.carbohydrate_g if food.carbohydrate_g is not None else '',
+                    'fat_g': food.fat_g if food.fat_g is not None else '',
+                    'fiber_g': food.fiber_g if food.fiber_g is not None else ''
                 })
             
             df = pd.DataFrame(data)
@@ -406,7 +467,11 @@ class USDAScraper:
                     'description': food.description,
                     'ingredients': food.ingredients,
                     'serving_size': food.serving_size,
-                    'serving_unit': food.serving_unit
+                    'serving_unit': food.serving_unit,
+                    'protein_g': food.protein_g,
+                    'carbohydrate_g': food.carbohydrate_g,
+                    'fat_g': food.fat_g,
+                    'fiber_g': food.fiber_g
                 }
                 data['foods'].append(food_dict)
             
@@ -468,8 +533,7 @@ class USDAScraper:
             
             foods = search_result['foods']
             
-            for food_data in foods:
-                food_item = self.parse_food_item(food_data)
+            for food_item in self.parse_search_results(foods):
                 if food_item and food_item.energy_kcal > 0:
                     return food_item
             
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+USDA FoodData Central 營養素解析與批次查詢
+搜尋結果 (/foods/search) 已包含 foodNutrients，直接從中取得熱量與三大營養素；
+缺少資料的項目才以 POST /foods 一次查詢多個 fdcId，取代每個項目一次 /food/{id} 請求
+"""
+
+import json
+from typing import Dict, Iterable, List
+import logging
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# 營養素編號 (nutrientNumber) 對應的欄位；熱量依序使用 208、Atwater 一般係數、Atwater 特定係數
+NUTRIENT_FIELDS = {
+    'energy_kcal': ('208', '957', '958'),
+    'protein_g': ('203',),
+    'fat_g': ('204',),
+    'carbohydrate_g': ('205',),
+    'fiber_g': ('291',),
+}
+
+# 新版營養素 ID (nutrientId) 對應的編號
+NUTRIENT_IDS = {
+    1008: '208', 2047: '957', 2048: '958',
+    1003: '203', 1004: '204', 1005: '205', 1079: '291',
+}
+
+# POST /foods 每次最多查詢的 fdcId 數量
+MAX_IDS_PER_REQUEST = 20
+
+def _nutrient_entry(entry: Dict):
+    """
+    將各種格式的營養素項目轉換為 (編號, 名稱, 單位, 數值)
+
+    支援搜尋結果 {'nutrientId', 'nutrientNumber', 'value'}、
+    完整格式 {'nutrient': {'id', 'number'}, 'amount'} 與精簡格式 {'number', 'amount'}。
+    """
+    nutrient = entry.get('nutrient') or {}
+    number = entry.get('nutrientNumber') or nutrient.get('number') or entry.get('number')
+    if not number:
+        nutrient_id = entry.get('nutrientId', nutrient.get('id'))
+        # 舊版資料的 ID 與編號相同 (例如熱量 208)
+        number = NUTRIENT_IDS.get(nutrient_id, str(nutrient_id) if nutrient_id else None)
+    name = entry.get('nutrientName') or nutrient.get('name') or entry.get('name') or ''
+    unit = entry.get('unitName') or nutrient.get('unitName') or ''
+    value = entry.get('value', entry.get('amount'))
+    return str(number) if number else None, name, unit, value
+
+def extract_nutrients(food: Dict) -> Dict[str, float]:
+    """
+    取得食物的熱量與三大營養素
+
+    Args:
+        food: 搜尋結果中的食物或食物詳細資訊
+
+    Returns:
+        {'energy_kcal': ..., 'protein_g': ..., 'fat_g': ..., 'carbohydrate_g': ..., 'fiber_g': ...}，
+        只包含有資料的欄位
+    """
+    by_number: Dict[str, float] = {}
+    energy_by_name = None
+
+    for entry in food.get('foodNutrients') or []:
+        number, name, unit, value = _nutrient_entry(entry)
+        if value is None:
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            continue
+        if number and number not in by_number:
+            by_number[number] = value
+        # 沒有編號時以名稱判斷熱量 (排除以 kJ 表示的能量)
+        if (energy_by_name is None and unit.lower() != 'kj'
+                and ('energy' in name.lower() or 'calories' in name.lower())):
+            energy_by_name = value
+
+    nutrients = {}
+    for field, numbers in NUTRIENT_FIELDS.items():
+        for number in numbers:
+            if number in by_number:
+                nutrients[field] = by_number[number]
+                break
+    if 'energy_kcal' not in nutrients and energy_by_name is not None:
+        nutrients['energy_kcal'] = energy_by_name
+    return nutrients
+
+def needs_details(food: Dict) -> bool:
+    """搜尋結果是否缺少熱量資料，需要另外查詢詳細資訊"""
+    return 'energy_kcal' not in extract_nutrients(food)
+
+def fetch_foods(session: requests.Session, api_base: str, fdc_ids: Iterable[str], api_key: str,
+                nutrients: Iterable[int] = (203, 204, 205, 208, 291), timeout: float = 30) -> Dict[str, Dict]:
+    """
+    以 POST /foods 批次查詢食物詳細資訊
+
+    Args:
+        session: 已掛載速率限制的 requests.Session
+        api_base: API 網址 (例如 https://api.nal.usda.gov/fdc/v1)
+        fdc_ids: 食物ID
+        api_key: API 金鑰
+        nutrients: 要查詢的營養素編號
+        timeout: 請求逾時秒數
+
+    Returns:
+        {fdcId: 食物詳細資訊}，查詢失敗的項目不包含在內
+    """
+    fdc_ids = list(dict.fromkeys(str(fdc_id) for fdc_id in fdc_ids if fdc_id))
+    details: Dict[str, Dict] = {}
+
+    for start in range(0, len(fdc_ids), MAX_IDS_PER_REQUEST):
+        batch = fdc_ids[start:start + MAX_IDS_PER_REQUEST]
+        try:
+            response = session.post(
+                f"{api_base}/foods",
+                params={'api_key': api_key},
+                json=foods_request_body(batch, nutrients),
+                timeout=timeout
+            )
+            response.raise_for_status()
+            details.update(index_foods(response.json()))
+        except (requests.exceptions.RequestException, json.JSONDecodeError, ValueError) as e:
+            logger.error(f"批次獲取食物詳細資訊失敗 ({len(batch)} 項): {e}")
+
+    return details
+
+def foods_request_body(fdc_ids: List[str], nutrients: Iterable[int] = (203, 204, 205, 208, 291)) -> Dict:
+    """POST /foods 的請求內容"""
+    return {
+        'fdcIds': [int(fdc_id) if str(fdc_id).isdigit() else fdc_id for fdc_id in fdc_ids],
+        'format': 'abridged',
+        'nutrients': list(nutrients)
+    }
+
+def index_foods(payload) -> Dict[str, Dict]:
+    """POST /foods 的回應 (食物列表) 依 fdcId 建立對照表"""
+    return {str(food.get('fdcId')): food for food in payload or [] if isinstance(food, dict)}
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Azure Computer Vision analyze 端點的本機替身伺服器
+模擬 /vision/v3.2/analyze，提供錄製回應重播、依種子產生的合成結果、
+可設定的延遲分布與錯誤率，用於離線且可重現地測量整個流程的吞吐量與尾端延遲
+
+使用方式:
+    python vision_standin.py --port 8765 --latency lognormal:120,0.5 --error-rate 0.02
+    AZURE_VISION_ENDPOINT=http://127.0.0.1:8765 python cli.py images/ --batch
+
+錄製真實回應:
+    python vision_standin.py --mode record --upstream https://xxx.cognitiveservices.azure.com
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+import logging
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+ANALYZE_PATH = '/vision/v3.2/analyze'
+
+# 合成結果使用的標籤 (與辨識類別的關鍵字重疊，才能走完營養分析流程)
+SYNTHETIC_FOODS = [
+    'apple', 'banana', 'orange', 'grape', 'strawberry', 'watermelon',
+    'rice', 'noodle', 'bread', 'pizza', 'hamburger', 'sandwich',
+    'chicken', 'beef', 'pork', 'fish', 'shrimp', 'salmon',
+    'carrot', 'broccoli', 'tomato', 'lettuce', 'salad', 'soup',
+    'cake', 'ice cream', 'chocolate', 'coffee', 'tea', 'milk',
+    'sushi', 'ramen', 'curry', 'pasta', 'steak', 'egg', 'cheese'
+]
+SYNTHETIC_CONTEXT = ['food', 'dish', 'meal', 'table', 'plate', 'indoor', 'tableware']
+
+class LatencyModel:
+    """回應延遲分布"""
+
+    def __init__(self, kind: str = 'fixed', a: float = 0.0, b: float = 0.0):
+        """
+        初始化延遲分布
+
+        Args:
+            kind: fixed、uniform、normal 或 lognormal
+            a: fixed 的毫秒數；uniform 的下限；normal 的平均；lognormal 的中位數 (毫秒)
+            b: uniform 的上限；normal 的標準差；lognormal 的 sigma
+        """
+        if kind not in ('fixed', 'uniform', 'normal', 'lognormal'):
+            raise ValueError(f"不支援的延遲分布: {kind}")
+        self.kind = kind
+        self.a = a
+        self.b = b
+
+    @classmethod
+    def parse(cls, spec: str) -> 'LatencyModel':
+        """
+        解析延遲分布字串，例如 "50"、"fixed:50"、"uniform:20,200"、"normal:100,30"、"lognormal:100,0.6"
+        """
+        if not spec:
+            return cls()
+        kind, _, args = spec.partition(':')
+        if not args:
+            return cls('fixed', float(kind))
+        values = [float(v) for v in args.split(',')]
+        return cls(kind, values[0], values[1] if len(values) > 1 else 0.0)
+
+    def sample(self, rng: random.Random) -> float:
+        """抽樣一次延遲 (秒)"""
+        if self.kind == 'fixed':
+            ms = self.a
+        elif self.kind == 'uniform':
+            ms = rng.uniform(self.a, self.b)
+        elif self.kind == 'normal':
+            ms = rng.gauss(self.a, self.b)
+        else:
+            ms = self.a * math.exp(rng.gauss(0, self.b))
+        return max(0.0, ms) / 1000.0
+
+@dataclass
+class StandinConfig:
+    """替身伺服器設定"""
+    mode: str = 'synthetic'                 # synthetic、replay 或 record
+    fixtures_dir: str = 'vision_fixtures'
+    seed: int = 0
+    latency: str = '0'
+    error_rate: float = 0.0
+    error_statuses: Tuple[int, ...] = (429, 500, 503)
+    upstream: Optional[str] = None          # record 模式的真實 Azure 端點
+    upstream_key: Optional[str] = None
+    api_key: Optional[str] = None           # 設定後只接受此金鑰
+
+def image_digest(image_data: bytes) -> str:
+    """影像內容的 SHA-256，作為錄製檔名"""
+    return hashlib.sha256(image_data).hexdigest()
+
+def synthesize_analysis(image_data: bytes, seed: int = 0) -> Dict:
+    """
+    依影像內容與種子產生確定性的合成分析結果
+
+    相同影像與種子永遠產生相同結果，格式與 analyze v3.2 相同。
+
+    Args:
+        image_data: 影像位元組
+        seed: 隨機種子
+
+    Returns:
+        analyze 回應
+    """
+    digest = image_digest(image_data)
+    rng = random.Random(f"{seed}:{digest}")
+
+    foods = rng.sample(SYNTHETIC_FOODS, rng.randint(1, 4))
+    context = rng.sample(SYNTHETIC_CONTEXT, rng.randint(1, 3))
+    width, height = rng.choice([(640, 480), (1024, 768), (1280, 720), (1920, 1080)])
+
+    tags = [{'name': name, 'confidence': round(rng.uniform(0.55, 0.99), 4)} for name in foods + context]
+    tags.sort(key=lambda tag: tag['confidence'], reverse=True)
+
+    objects = []
+    for name in foods:
+        w = rng.randint(width // 8, width // 2)
+        h = rng.randint(height // 8, height // 2)
+        objects.append({
+            'rectangle': {'x': rng.randint(0, width - w), 'y': rng.randint(0, height - h), 'w': w, 'h': h},
+            'object': name,
+            'confidence': round(rng.uniform(0.5, 0.95), 3)
+        })
+
+    return {
+        'categories': [{'name': 'food_', 'score': round(rng.uniform(0.6, 0.99), 4)}],
+        'tags': tags,
+        'description': {
+            'tags': foods + context,
+            'captions': [{'text': f"a plate of {' and '.join(foods)}", 'confidence': round(rng.uniform(0.4, 0.9), 4)}]
+        },
+        'objects': objects,
+        'requestId': str(uuid.UUID(int=rng.getrandbits(128))),
+        'metadata': {'width': width, 'height': height, 'format': 'Jpeg'},
+        'modelVersion': '2021-05-01'
+    }
+
+class _StandinHandler(BaseHTTPRequestHandler):
+    """analyze 端點請求處理"""
+
+    server_version = 'VisionStandin/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status: int, body: Dict, headers: Optional[Dict] = None):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status: int, code: str, message: str, headers: Optional[Dict] = None):
+        self._send_json(status, {'error': {'code': code, 'message': message}}, headers)
+
+    def do_HEAD(self):
+        # 連線預熱使用 HEAD 請求
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        standin = self.server.standin
+        length = int(self.headers.get('Content-Length') or 0)
+        image_data = self.rfile.read(length)
+
+        if self.path.split('?', 1)[0].rstrip('/') != ANALYZE_PATH:
+            self._send_error(404, 'NotFound', f"Resource not found: {self.path}")
+            return
+
+        key = self.headers.get('Ocp-Apim-Subscription-Key')
+        if not key or (standin.config.api_key and key != standin.config.api_key):
+            self._send_error(401, 'Unauthorized', 'Access denied due to invalid subscription key.')
+            return
+
+        delay, error_status = standin.draw(image_data)
+        if delay > 0:
+            time.sleep(delay)
+
+        if error_status is not None:
+            standin.record_stat('errors')
+            headers = {'Retry-After': '1'} if error_status == 429 else None
+            self._send_error(error_status, 'InjectedError', f"Injected HTTP {error_status}", headers)
+            return
+
+        status, body = standin.analyze(image_data, self.path)
+        self._send_json(status, body)
+
+class VisionStandinServer:
+    """Azure Vision analyze 端點替身伺服器"""
+
+    def __init__(self, config: Optional[StandinConfig] = None, host: str = '127.0.0.1', port: int = 0):
+        """
+        初始化替身伺服器
+
+        Args:
+            config: 伺服器設定
+            host: 監聽位址
+            port: 監聽埠號 (0 表示自動選擇)
+        """
+        self.config = config or StandinConfig()
+        if self.config.mode not in ('synthetic', 'replay', 'record'):
+            raise ValueError(f"不支援的模式: {self.config.mode}")
+        if self.config.mode == 'record' and not self.config.upstream:
+            raise ValueError("record 模式需要設定 upstream 端點")
+
+        self.latency = LatencyModel.parse(self.config.latency)
+
+        # 延遲與錯誤注入依 (種子, 影像, 該影像第幾次請求) 抽樣，與處理執行緒的先後順序無關，整批請求可重現
+        self._attempts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._upstream = requests.Session() if self.config.mode == 'record' else None
+
+        self.stats = {'requests': 0, 'errors': 0, 'replayed': 0, 'synthesized': 0, 'recorded': 0, 'missing': 0}
+
+        self._httpd = ThreadingHTTPServer((host, port), _StandinHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.standin = self
+        self._thread = None
+
+    @property
+    def endpoint(self) -> str:
+        """可設定到 AZURE_VISION_ENDPOINT 的網址"""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def draw(self, image_data: bytes = b'') -> Tuple[float, Optional[int]]:
+        """
+        抽樣本次請求的延遲與注入的錯誤狀態碼
+
+        同一張影像的重試依序取得不同的抽樣結果 (注入錯誤後重試可能成功)。
+        """
+        digest = image_digest(image_data)
+        with self._lock:
+            self.stats['requests'] += 1
+            attempt = self._attempts.get(digest, 0)
+            self._attempts[digest] = attempt + 1
+
+        rng = random.Random(f"{self.config.seed}:{digest}:{attempt}")
+        delay = self.latency.sample(rng)
+        error_status = None
+        if self.config.error_rate > 0 and rng.random() < self.config.error_rate:
+            error_status = rng.choice(self.config.error_statuses)
+        return delay, error_status
+
+    def record_stat(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def fixture_path(self, image_data: bytes) -> str:
+        """影像對應的錄製檔路徑"""
+        return os.path.join(self.config.fixtures_dir, f"{image_digest(image_data)}.json")
+
+    def analyze(self, image_data: bytes, path: str) -> Tuple[int, Dict]:
+        """
+        依模式產生 analyze 回應
+
+        Returns:
+            (HTTP 狀態碼, 回應內容)
+        """
+        if self.config.mode == 'synthetic':
+            self.record_stat('synthesized')
+            return 200, synthesize_analysis(image_data, self.config.seed)
+
+        fixture_path = self.fixture_path(image_data)
+
+        if self.config.mode == 'replay':
+            if not os.path.exists(fixture_path):
+                self.record_stat('missing')
+                return 404, {'error': {'code': 'FixtureNotFound', 'message': f"No recording for {os.path.basename(fixture_path)}"}}
+            with open(fixture_path, 'r', encoding='utf-8') as f:
+                self.record_stat('replayed')
+                return 200, json.load(f)
+
+        # record 模式：轉送到真實端點並保存成功的回應
+        response = self._upstream.post(
+            self.config.upstream.rstrip('/') + path,
+            headers={'Content-Type': 'application/octet-stream',
+                     'Ocp-Apim-Subscription-Key': self.config.upstream_key or ''},
+            data=image_data,
+            timeout=60
+        )
+        try:
+            body = response.json()
+        except ValueError:
+            body = {'error': {'code': 'UpstreamError', 'message': response.text[:200]}}
+
+        if response.status_code == 200:
+            os.makedirs(self.config.fixtures_dir, exist_ok=True)
+            with open(fixture_path, 'w', encoding='utf-8') as f:
+                json.dump(body, f, ensure_ascii=False, indent=2)
+            self.record_stat('recorded')
+        return response.status_code, body
+
+    def start(self) -> 'VisionStandinServer':
+        """在背景執行緒啟動伺服器"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Azure Vision 替身伺服器已啟動: {self.endpoint} ({self.config.mode})")
+        return self
+
+    def serve_forever(self):
+        """在目前執行緒執行伺服器"""
+        self._httpd.serve_forever()
+
+    def stop(self):
+        """停止伺服器"""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description='Azure Vision analyze 端點替身伺服器')
+    parser.add_argument('--host', default='127.0.0.1', help='監聽位址')
+    parser.add_argument('--port', type=int, default=8765, help='監聽埠號')
+    parser.add_argument('--mode', choices=['synthetic', 'replay', 'record'], default='synthetic', help='回應模式')
+    parser.add_argument('--fixtures', default='vision_fixtures', help='錄製檔目錄')
+    parser.add_argument('--seed', type=int, default=0, help='隨機種子')
+    parser.add_argument('--latency', default='0',
+                        help='延遲分布 (毫秒)，例如 50、uniform:20,200、normal:100,30、lognormal:100,0.6')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='注入錯誤的機率 (0~1)')
+    parser.add_argument('--error-status', default='429,500,503', help='注入的錯誤狀態碼 (逗號分隔)')
+    parser.add_argument('--upstream', default=os.getenv('AZURE_VISION_UPSTREAM'), help='record 模式的真實 Azure 端點')
+    parser.add_argument('--upstream-key', default=os.getenv('AZURE_VISION_UPSTREAM_KEY'), help='record 模式的真實 API 金鑰')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    config = StandinConfig(
+        mode=args.mode,
+        fixtures_dir=args.fixtures,
+        seed=args.seed,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_statuses=tuple(int(s) for s in args.error_status.split(',') if s),
+        upstream=args.upstream,
+        upstream_key=args.upstream_key
+    )
+
+    server = VisionStandinServer(config, args.host, args.port)
+    print(f"🚀 Azure Vision 替身伺服器: {server.endpoint} ({config.mode})")
+    print(f"   設定 AZURE_VISION_ENDPOINT={server.endpoint} 即可使用")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n📊 請求統計: {server.stats}")
+    finally:
+        server._httpd.server_close()
+
+if __name__ == '__main__':
+    main()
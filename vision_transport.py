@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Azure Computer Vision 共用 HTTP 傳輸層
+提供連線池、keep-alive 與連線預熱，供所有食物辨識類別共用
+"""
+
+import os
+import asyncio
+import threading
+from dataclasses import astuple, dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limiter import RetryPolicy, TokenBucket, async_send_with_retry, get_rate_limiter, send_with_retry
+
+# HTTP/2 與非同步 API 為選用功能，需要安裝 httpx[http2]
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = httpx is not None
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class TransportSettings:
+    """傳輸層設定"""
+    pool_connections: int = 4
+    pool_maxsize: int = 16
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    http2: bool = True
+    warmup: bool = True
+    max_concurrency: int = 8
+    max_retries: int = 3
+
+    @classmethod
+    def from_env(cls) -> 'TransportSettings':
+        """從環境變數讀取設定"""
+        return cls(
+            pool_connections=int(os.getenv('AZURE_VISION_POOL_CONNECTIONS', cls.pool_connections)),
+            pool_maxsize=int(os.getenv('AZURE_VISION_POOL_SIZE', cls.pool_maxsize)),
+            connect_timeout=float(os.getenv('AZURE_VISION_CONNECT_TIMEOUT', cls.connect_timeout)),
+            read_timeout=float(os.getenv('AZURE_VISION_READ_TIMEOUT', cls.read_timeout)),
+            http2=os.getenv('AZURE_VISION_HTTP2', '1') not in ('0', 'false', 'False'),
+            warmup=os.getenv('AZURE_VISION_WARMUP', '1') not in ('0', 'false', 'False'),
+            max_concurrency=int(os.getenv('AZURE_VISION_MAX_CONCURRENCY', cls.max_concurrency)),
+            max_retries=int(os.getenv('AZURE_VISION_MAX_RETRIES', cls.max_retries))
+        )
+
+    @property
+    def timeout(self) -> Tuple[float, float]:
+        """requests 使用的 (連線, 讀取) 逾時"""
+        return (self.connect_timeout, self.read_timeout)
+
+    @property
+    def retry_policy(self) -> RetryPolicy:
+        """429/5xx 與連線錯誤的重試策略"""
+        return RetryPolicy(max_retries=self.max_retries)
+
+class _HTTPXResponse:
+    """將 httpx 回應包裝成與 requests 相容的介面"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.content
+
+    def raise_for_status(self):
+        try:
+            self._response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            raise requests.exceptions.HTTPError(str(e), response=self)
+
+    def json(self):
+        return self._response.json()
+
+class VisionTransport:
+    """共用的 Azure Vision HTTP 傳輸層"""
+
+    def __init__(self, endpoint: str, settings: Optional[TransportSettings] = None,
+                 rate_limiter: Optional[TokenBucket] = None):
+        """
+        初始化傳輸層
+
+        Args:
+            endpoint: Azure Vision 端點 (不含結尾斜線)
+            settings: 傳輸層設定
+            rate_limiter: 速率限制器 (預設依 AZURE_VISION_RATE_LIMIT 環境變數決定)
+        """
+        self.endpoint = endpoint.rstrip('/')
+        self.settings = settings or TransportSettings.from_env()
+        self.uses_http2 = bool(self.settings.http2 and HTTP2_AVAILABLE)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else get_rate_limiter('AZURE_VISION')
+        self.retry_policy = self.settings.retry_policy
+
+        if self.uses_http2:
+            # HTTP/2 在單一連線上多工多個請求
+            self._client = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=self.settings.pool_maxsize,
+                    max_keepalive_connections=self.settings.pool_maxsize
+                ),
+                timeout=httpx.Timeout(self.settings.read_timeout, connect=self.settings.connect_timeout)
+            )
+        else:
+            self._client = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=self.settings.pool_connections,
+                pool_maxsize=self.settings.pool_maxsize,
+                pool_block=False
+            )
+            self._client.mount('https://', adapter)
+            self._client.mount('http://', adapter)
+            self._client.headers.update({'Connection': 'keep-alive'})
+
+        self._warmed = threading.Event()
+        if self.settings.warmup:
+            self.warm_up()
+
+    def warm_up(self, wait: bool = False):
+        """
+        預先建立到端點的 TCP/TLS 連線，避免第一個影像幀付出握手延遲
+
+        Args:
+            wait: 是否等待預熱完成
+        """
+        thread = threading.Thread(target=self._warm_up, daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+
+    def _warm_up(self):
+        """預熱連線 (背景執行，失敗不影響後續請求)"""
+        try:
+            # 任何回應狀態都代表連線已建立並放回連線池
+            if self.uses_http2:
+                self._client.head(self.endpoint)
+            else:
+                self._client.head(self.endpoint, timeout=self.settings.timeout)
+            logger.debug(f"Azure Vision 連線預熱完成: {self.endpoint}")
+        except Exception as e:
+            logger.debug(f"Azure Vision 連線預熱失敗: {e}")
+        finally:
+            self._warmed.set()
+
+    def post(self, url: str, headers: Dict, params: Dict, data: bytes,
+             rate_limiter: Optional[TokenBucket] = None):
+        """
+        透過連線池發送 POST 請求 (經過速率限制，429/5xx 時自動重試)
+
+        Args:
+            url: 請求網址
+            headers: 請求標頭
+            params: 查詢參數
+            data: 請求內容
+            rate_limiter: 本次請求使用的速率限制器 (預設使用傳輸層的限制器)
+
+        Returns:
+            與 requests.Response 相容的回應物件
+        """
+        limiter = rate_limiter if rate_limiter is not None else self.rate_limiter
+        return send_with_retry(lambda: self._send(url, headers, params, data), limiter, self.retry_policy)
+
+    def _send(self, url: str, headers: Dict, params: Dict, data: bytes):
+        """發送一次 POST 請求"""
+        if not self.uses_http2:
+            return self._client.post(url, headers=headers, params=params, data=data,
+                                     timeout=self.settings.timeout)
+
+        try:
+            response = self._client.post(url, headers=headers, params=params, content=data)
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(str(e))
+        return _HTTPXResponse(response)
+
+    def close(self):
+        """關閉連線池"""
+        self._client.close()
+
+class AsyncVisionTransport:
+    """非同步 Azure Vision HTTP 傳輸層 (以 semaphore 限制同時進行的請求數)"""
+
+    def __init__(self, endpoint: str, settings: Optional[TransportSettings] = None,
+                 rate_limiter: Optional[TokenBucket] = None):
+        """
+        初始化非同步傳輸層
+
+        Args:
+            endpoint: Azure Vision 端點 (不含結尾斜線)
+            settings: 傳輸層設定
+            rate_limiter: 速率限制器 (預設依 AZURE_VISION_RATE_LIMIT 環境變數決定)
+        """
+        if httpx is None:
+            raise ImportError("非同步 API 需要安裝 httpx: pip install httpx[http2]")
+
+        self.endpoint = endpoint.rstrip('/')
+        self.settings = settings or TransportSettings.from_env()
+        self.uses_http2 = bool(self.settings.http2 and HTTP2_AVAILABLE)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else get_rate_limiter('AZURE_VISION')
+        self.retry_policy = self.settings.retry_policy
+
+        # httpx.AsyncClient 與 asyncio.Semaphore 都綁定事件迴圈，因此每個事件迴圈各自建立
+        self._clients: Dict[asyncio.AbstractEventLoop, Tuple[Any, asyncio.Semaphore, Any]] = {}
+        self._clients_lock = threading.Lock()
+
+    async def _close_with_loop(self, loop: asyncio.AbstractEventLoop, client):
+        """
+        事件迴圈結束時關閉用戶端
+
+        以暫停中的非同步產生器實作：asyncio.run 結束前會關閉所有未完成的非同步產生器，
+        finally 因此在用戶端所屬的事件迴圈上執行 (迴圈關閉後就無法再關閉連線)。
+        """
+        try:
+            yield
+        finally:
+            with self._clients_lock:
+                entry = self._clients.get(loop)
+                if entry is not None and entry[0] is client:
+                    del self._clients[loop]
+            await client.aclose()
+
+    async def _ensure_client(self) -> Tuple[Any, asyncio.Semaphore]:
+        """取得目前事件迴圈的用戶端與同時請求數限制"""
+        loop = asyncio.get_running_loop()
+        entry = self._clients.get(loop)
+        if entry is not None:
+            return entry[0], entry[1]
+
+        client = httpx.AsyncClient(
+            http2=self.uses_http2,
+            limits=httpx.Limits(
+                max_connections=self.settings.pool_maxsize,
+                max_keepalive_connections=self.settings.pool_maxsize
+            ),
+            timeout=httpx.Timeout(self.settings.read_timeout, connect=self.settings.connect_timeout)
+        )
+        semaphore = asyncio.Semaphore(self.settings.max_concurrency)
+        closer = self._close_with_loop(loop, client)
+        await closer.asend(None)
+
+        with self._clients_lock:
+            # 沒有經過 asyncio.run 就關閉的事件迴圈無法再關閉連線，只移除參照
+            for stale in [other for other in self._clients if other.is_closed()]:
+                logger.debug("事件迴圈已關閉，捨棄其 Azure Vision 用戶端")
+                del self._clients[stale]
+            self._clients[loop] = (client, semaphore, closer)
+        return client, semaphore
+
+    async def post(self, url: str, headers: Dict, params: Dict, data: bytes):
+        """
+        非同步發送 POST 請求
+
+        Args:
+            url: 請求網址
+            headers: 請求標頭
+            params: 查詢參數
+            data: 請求內容
+
+        Returns:
+            與 requests.Response 相容的回應物件
+        """
+        client, semaphore = await self._ensure_client()
+
+        async def send():
+            # 重試等待期間不佔用同時請求的名額
+            async with semaphore:
+                try:
+                    response = await client.post(url, headers=headers, params=params, content=data)
+                except httpx.HTTPError as e:
+                    raise requests.exceptions.ConnectionError(str(e))
+            return _HTTPXResponse(response)
+
+        return await async_send_with_retry(send, self.rate_limiter, self.retry_policy)
+
+    async def aclose(self):
+        """關閉目前事件迴圈的連線池"""
+        entry = self._clients.get(asyncio.get_running_loop())
+        if entry is not None:
+            await entry[2].aclose()
+
+async def run_bounded(func: Callable[[Any], Awaitable[Any]], items: Iterable[Any], concurrency: int) -> List[Any]:
+    """
+    以有限的同時數量對每個項目執行協程，結果順序與輸入一致
+
+    Args:
+        func: 接受單一項目的協程函數
+        items: 項目列表
+        concurrency: 最大同時執行數量
+
+    Returns:
+        結果列表
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(item):
+        async with semaphore:
+            return await func(item)
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+# 相同端點與設定在同一個行程中共用一個傳輸層
+_shared_transports: Dict[Tuple, VisionTransport] = {}
+_shared_lock = threading.Lock()
+
+def get_shared_transport(endpoint: str, settings: Optional[TransportSettings] = None) -> VisionTransport:
+    """
+    取得指定端點的共用傳輸層
+
+    Args:
+        endpoint: Azure Vision 端點
+        settings: 傳輸層設定 (預設依環境變數決定)；設定不同時使用另一個傳輸層
+
+    Returns:
+        共用的傳輸層物件
+    """
+    endpoint = endpoint.rstrip('/')
+    settings = settings or TransportSettings.from_env()
+    key = (endpoint, astuple(settings))
+    with _shared_lock:
+        transport = _shared_transports.get(key)
+        if transport is None:
+            transport = VisionTransport(endpoint, settings)
+            _shared_transports[key] = transport
+        return transport
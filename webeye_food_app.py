@@ -447,7 +447,8 @@ class WebEyeFoodApp:
                 self.update_detection_display(result)
                 
                 # 更新狀態
-                self.update_status(f"偵測完成: {len(result.foods_detected)} 種食物")
+                saved = self.food_detector.get_dedup_statistics()['calls_saved']
+                self.update_status(f"偵測完成: {len(result.foods_detected)} 種食物 (已節省 {saved} 次 API 呼叫)")
             
         except Exception as e:
             logger.error(f"食物偵測失敗: {e}")